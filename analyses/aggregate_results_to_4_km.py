@@ -1,290 +1,353 @@
 '''
 This script creates maps of model outputs at roughly 10km resolution (0.1x0.1 degrees), where each output pixel
 represents the total value in the pixel (not the density) (hence, the aggregated results).
-It iterates through all the model outputs that are supplied.
-First, it rewindows the model output, pixel area tile, and tcd tile into 400x400 (0.1x0.1 degree) windows, instead of the native
-40000x1 pixel windows.
-Then it calculates the per pixel value for each model output pixel and sums those values within each 0.1x0.1 degree
-aggregated pixel.
+It reads all the model outputs of a tile with the pixel area, tcd, gain and mangrove tiles in their native
+40000x1 pixel windows, calculates the per pixel value for each model output pixel and sums those values within each
+aggregated pixel at every requested resolution.
+The sums are kept as histograms over tree cover density bins, which are saved for each tile, so maps at other
+tcd thresholds are made from the histograms without reading the tiles again.
 It converts cumulative carbon gain to CO2 gain per year, converts cumulative CO2 flux to CO2 flux per year, and
 converts cumulative gross CO2 emissions to gross CO2 emissions per year.
-The user has to supply a tcd threshold for which forest pixels to include in the results.
+The user has to supply one or more tcd thresholds for which forest pixels to include in the results.
 '''
 
 import numpy as np
+import math
+import glob
+from functools import reduce
 from subprocess import Popen, PIPE, STDOUT, check_call
 import os
 import rasterio
 from rasterio.transform import from_origin
+from rasterio.windows import Window
 import datetime
 import sys
 sys.path.append('../')
 import constants_and_names as cn
 import universal_util as uu
 
-# Converts the 10x10 degree Hansen tiles that are in windows of 40000x1 pixels to windows of 400x400 pixels,
-# which is the resolution of the output tiles. This will allow the 30x30 m pixels in each window to be summed.
-def rewindow(tile, no_upload):
+# Name of an aggregation resolution in file names. 0.04x0.04 degrees keeps the name it has always had (0_4deg).
+def aggreg_resolution_name(resolution):
 
-    # start time
-    start = datetime.datetime.now()
+    if resolution == 0.04:
+        return '0_4deg'
 
-    uu.print_log("Rewindowing {} to 200x200 pixel windows (0.04 degree x 0.04 degree)...". format(tile))
+    return '{:g}deg'.format(resolution).replace('.', '_')
 
-    # Extracts the tile id, tile type, and bounding box for the tile
-    tile_id = uu.get_tile_id(tile)
-    tile_type = uu.get_tile_type(tile)
-    xmin, ymin, xmax, ymax = uu.coords(tile_id)
 
-    # Raster name for 400x400 pixel tiles (intermediate output)
-    input_rewindow = '{0}_{1}_rewindow.tif'.format(tile_id, tile_type)
-    area_tile = '{0}_{1}.tif'.format(cn.pattern_pixel_area, tile_id)
-    pixel_area_rewindow = '{0}_{1}_rewindow.tif'.format(cn.pattern_pixel_area, tile_id)
-    tcd_tile = '{0}_{1}.tif'.format(cn.pattern_tcd, tile_id)
-    tcd_rewindow = '{0}_{1}_rewindow.tif'.format(cn.pattern_tcd, tile_id)
-    gain_tile = '{0}_{1}.tif'.format(cn.pattern_gain, tile_id)
-    gain_rewindow = '{0}_{1}_rewindow.tif'.format(cn.pattern_gain, tile_id)
-    mangrove_tile = '{0}_{1}.tif'.format(tile_id, cn.pattern_mangrove_biomass_2000)
-    mangrove_tile_rewindow = '{0}_{1}_rewindow.tif'.format(tile_id, cn.pattern_mangrove_biomass_2000)
-
-    # Only rewindows the necessary files if they haven't already been processed (just in case
-    # this was run on the spot machine before)
-
-    if not os.path.exists(input_rewindow):
-        uu.print_log("Model output for {} not rewindowed. Rewindowing...".format(tile_id))
-
-        # Converts the tile of interest to the 400x400 pixel windows
-        cmd = ['gdalwarp', '-co', 'COMPRESS=LZW', '-overwrite',
-               '-te', str(xmin), str(ymin), str(xmax), str(ymax), '-tap',
-               '-tr', str(cn.Hansen_res), str(cn.Hansen_res),
-               '-co', 'TILED=YES', '-co', 'BLOCKXSIZE=160', '-co', 'BLOCKYSIZE=160',
-               tile, input_rewindow]
-        uu.log_subprocess_output_full(cmd)
-
-    if not os.path.exists(tcd_rewindow):
-        uu.print_log("Canopy cover for {} not rewindowed. Rewindowing...".format(tile_id))
-
-        # Converts the tcd tile to the 400x400 pixel windows
-        cmd = ['gdalwarp', '-co', 'COMPRESS=LZW', '-overwrite', '-dstnodata', '0',
-               '-te', str(xmin), str(ymin), str(xmax), str(ymax), '-tap',
-               '-tr', str(cn.Hansen_res), str(cn.Hansen_res),
-               '-co', 'TILED=YES', '-co', 'BLOCKXSIZE=160', '-co', 'BLOCKYSIZE=160',
-               tcd_tile, tcd_rewindow]
-        uu.log_subprocess_output_full(cmd)
+# Number of 0.00025x0.00025 degree pixels along each side of an aggregated pixel at a resolution
+def aggreg_cell_pixels(resolution):
 
-    else:
+    return int(round(resolution / cn.Hansen_res))
 
-        uu.print_log("Canopy cover for {} already rewindowed.".format(tile_id))
 
-    if not os.path.exists(pixel_area_rewindow):
-        uu.print_log("Pixel area for {} not rewindowed. Rewindowing...".format(tile_id))
+# Converts the sums of the per pixel values of a model output to the units of its aggregated map
+def convert_aggregated_sums(sum_array, tile_type):
 
-        # Converts the pixel area tile to the 400x400 pixel windows
-        cmd = ['gdalwarp', '-co', 'COMPRESS=LZW', '-overwrite', '-dstnodata', '0',
-               '-te', str(xmin), str(ymin), str(xmax), str(ymax), '-tap',
-               '-tr', str(cn.Hansen_res), str(cn.Hansen_res),
-               '-co', 'TILED=YES', '-co', 'BLOCKXSIZE=160', '-co', 'BLOCKYSIZE=160',
-               area_tile, pixel_area_rewindow]
-        uu.log_subprocess_output_full(cmd)
+    # Converts the annual carbon gain values annual gain in megatonnes and makes negative (because removals are negative)
+    if cn.pattern_annual_gain_AGC_all_types in tile_type:
+        sum_array = sum_array / cn.tonnes_to_megatonnes * -1
 
-    else:
+    # Converts the cumulative CO2 gain values to annualized CO2 in megatonnes and makes negative (because removals are negative)
+    if cn.pattern_cumul_gain_AGCO2_BGCO2_all_types in tile_type:
+        sum_array = sum_array / cn.loss_years / cn.tonnes_to_megatonnes * -1
 
-        uu.print_log("Pixel area for {} already rewindowed.".format(tile_id))
+    # # Converts the cumulative gross emissions CO2 only values to annualized gross emissions CO2e in megatonnes
+    # if cn.pattern_gross_emis_co2_only_all_drivers_biomass_soil in tile_type:
+    #     sum_array = sum_array / cn.loss_years / cn.tonnes_to_megatonnes
+    #
+    # # Converts the cumulative gross emissions non-CO2 values to annualized gross emissions CO2e in megatonnes
+    # if cn.pattern_gross_emis_non_co2_all_drivers_biomass_soil in tile_type:
+    #     sum_array = sum_array / cn.loss_years / cn.tonnes_to_megatonnes
 
-    if not os.path.exists(gain_rewindow):
-        uu.print_log("Hansen gain for {} not rewindowed. Rewindowing...".format(tile_id))
+    # Converts the cumulative gross emissions all gases CO2e values to annualized gross emissions CO2e in megatonnes
+    if cn.pattern_gross_emis_all_gases_all_drivers_biomass_soil in tile_type:
+        sum_array = sum_array / cn.loss_years / cn.tonnes_to_megatonnes
 
-        # Converts the pixel area tile to the 400x400 pixel windows
-        cmd = ['gdalwarp', '-co', 'COMPRESS=LZW', '-overwrite', '-dstnodata', '0',
-               '-te', str(xmin), str(ymin), str(xmax), str(ymax), '-tap',
-               '-tr', str(cn.Hansen_res), str(cn.Hansen_res),
-               '-co', 'TILED=YES', '-co', 'BLOCKXSIZE=160', '-co', 'BLOCKYSIZE=160',
-               gain_tile, gain_rewindow]
-        uu.log_subprocess_output_full(cmd)
+    # Converts the cumulative net flux CO2 values to annualized net flux CO2 in megatonnes
+    if cn.pattern_net_flux in tile_type:
+        sum_array = sum_array / cn.loss_years / cn.tonnes_to_megatonnes
 
-    else:
+    return sum_array
 
-        uu.print_log("Hansen gain for {} already rewindowed.".format(tile_id))
 
-    if os.path.exists(mangrove_tile):
-        uu.print_log("Mangrove for {} not rewindowed. Rewindowing...".format(tile_id))
+# Number of classes in the tree cover density histograms of the aggregated pixels:
+# one class for each tree cover density bin (pixels at or below the lowest bin edge and pixels above each bin edge)
+# plus one class for pixels that are always counted as forest because they have gain or mangrove.
+def tcd_histogram_classes():
 
-        if not os.path.exists(mangrove_tile_rewindow):
+    return len(cn.aggreg_tcd_bins) + 2
 
-            # Converts the pixel area tile to the 400x400 pixel windows
-            cmd = ['gdalwarp', '-co', 'COMPRESS=LZW', '-overwrite', '-dstnodata', '0',
-                   '-te', str(xmin), str(ymin), str(xmax), str(ymax), '-tap',
-                   '-tr', str(cn.Hansen_res), str(cn.Hansen_res),
-                   '-co', 'TILED=YES', '-co', 'BLOCKXSIZE=160', '-co', 'BLOCKYSIZE=160',
-                   mangrove_tile, mangrove_tile_rewindow]
-            uu.log_subprocess_output_full(cmd)
 
-        else:
+# Where the tree cover density histogram of the sums of a model output tile is saved
+def tcd_histogram_file(tile_id, pattern):
 
-            uu.print_log("Mangrove tile for {} already rewindowed.".format(tile_id))
-    else:
+    return os.path.join(cn.tile_sidecar_dir, '{0}_{1}.tcd_hist.npz'.format(tile_id, pattern))
 
-        uu.print_log("No mangrove tile found for {}".format(tile_id))
 
-    # Prints information about the tile that was just processed
-    uu.end_of_fx_summary(start, tile_id, '{}_rewindow'.format(tile_type), no_upload)
+# Tree cover density histogram of the sums of a model output tile, or None if it hasn't been made,
+# any of its inputs have changed since it was made, it was made with different tree cover density bins,
+# or its grid doesn't fit evenly into the aggregated pixels of all the resolutions
+def read_tcd_histogram(tile_id, pattern, inputs, cells):
+
+    hist_file = tcd_histogram_file(tile_id, pattern)
+
+    if not os.path.exists(hist_file):
+        return None, None
+
+    hist_time = os.path.getmtime(hist_file)
+    if any(os.path.getmtime(tile) > hist_time for tile in inputs if os.path.exists(tile)):
+        return None, None
+
+    with np.load(hist_file) as cached:
+        tcd_bins = cached['tcd_bins']
+        base_cell = int(cached['base_cell'])
+
+        if list(tcd_bins) != list(cn.aggreg_tcd_bins) or any(cell % base_cell != 0 for cell in cells):
+            return None, None
+
+        return cached['sums'], base_cell
 
 
-# Converts the existing (per ha) values to per pixel values (e.g., emissions/ha to emissions/pixel)
-# and sums those values in each 400x400 pixel window.
-# The sum for each 400x400 pixel window is stored in a 2D array, which is then converted back into a raster at
-# 0.1x0.1 degree resolution (approximately 10m in the tropics).
-# Each pixel in that raster is the sum of the 30m pixels converted to value/pixel (instead of value/ha).
-# The 0.1x0.1 degree tile is output.
-def aggregate(tile, thresh, sensit_type, no_upload):
+# Saves the tree cover density histogram of the sums of a model output tile.
+# Saved under a temporary name and then renamed so that histograms are never read while they're half-written.
+def write_tcd_histogram(tile_id, pattern, hist, base_cell):
+
+    os.makedirs(cn.tile_sidecar_dir, exist_ok=True)
+
+    hist_file = tcd_histogram_file(tile_id, pattern)
+    temp_file = '{}.tmp.npz'.format(hist_file[:-len('.npz')])
+    np.savez_compressed(temp_file, sums=hist, tcd_bins=np.array(cn.aggreg_tcd_bins), base_cell=base_cell)
+    os.replace(temp_file, hist_file)
+
+
+# Sums of the classes of a tree cover density histogram that are included at a tree cover density threshold.
+# Above 0, pixels with tree cover density above the threshold plus the pixels with gain or mangrove are included.
+# At 0, all pixels are included. Other thresholds must be one of the bins in cn.aggreg_tcd_bins.
+def threshold_tcd_histogram(hist, thresh):
+
+    if thresh == 0:
+        return hist.sum(axis=2)
+
+    if thresh not in cn.aggreg_tcd_bins:
+        raise ValueError('Tree cover density threshold {0} is not 0 or one of the tree cover density bins {1}'.format(thresh, cn.aggreg_tcd_bins))
+
+    first_class = cn.aggreg_tcd_bins.index(thresh) + 1
+
+    return hist[:, :, first_class:].sum(axis=2)
+
+
+# Converts the existing (per ha) values of all the model outputs of a tile to per pixel values
+# (e.g., emissions/ha to emissions/pixel) and sums those values in each aggregated pixel at every requested resolution
+# and tree cover density threshold.
+# The tiles are read in their native 40000x1 pixel strips, a batch of rows at a time. The pixel area, tcd, gain
+# and mangrove tiles are read once for all the outputs, rather than once for each output.
+# The batches are summed straight into a grid of the largest cell that fits evenly into the aggregated pixels of
+# all the resolutions (e.g., 0.01x0.01 degrees for 0.04, 0.1, 0.25 and 1 degree), and each resolution is summed from
+# that grid, so no rewindowed copies of the tiles are needed and every resolution comes from the same accumulation.
+# Each cell of the grid holds a histogram of its sums over tree cover density bins (plus gain/mangrove),
+# so each threshold is just a sum over the bins above it. The histograms are saved for each tile, so aggregating
+# at another threshold (or another resolution that fits the grid) doesn't read the tiles again.
+# Each pixel in the outputs is the sum of the 30m pixels converted to value/pixel (instead of value/ha).
+# A tile is output for each model output, resolution and threshold.
+def aggregate(tile_id, patterns, threshs, sensit_type, resolutions, no_upload):
 
     # start time
     start = datetime.datetime.now()
 
-    # Extracts the tile id, tile type, and bounding box for the tile
-    tile_id = uu.get_tile_id(tile)
-    tile_type = uu.get_tile_type(tile)
+    # Extracts the bounding box for the tile
     xmin, ymin, xmax, ymax = uu.coords(tile_id)
 
     # Name of inputs
-    focal_tile_rewindow = '{0}_{1}_rewindow.tif'.format(tile_id, tile_type)
-    pixel_area_rewindow = '{0}_{1}_rewindow.tif'.format(cn.pattern_pixel_area, tile_id)
-    tcd_rewindow = '{0}_{1}_rewindow.tif'.format(cn.pattern_tcd, tile_id)
-    gain_rewindow = '{0}_{1}_rewindow.tif'.format(cn.pattern_gain, tile_id)
-    mangrove_rewindow = '{0}_{1}_rewindow.tif'.format(tile_id, cn.pattern_mangrove_biomass_2000)
+    pixel_area = '{0}_{1}.tif'.format(cn.pattern_pixel_area, tile_id)
+    tcd = '{0}_{1}.tif'.format(cn.pattern_tcd, tile_id)
+    gain = '{0}_{1}.tif'.format(cn.pattern_gain, tile_id)
+    mangrove = '{0}_{1}.tif'.format(tile_id, cn.pattern_mangrove_biomass_2000)
+
+    # Number of 30m pixels along each side of an aggregated pixel at each resolution
+    cells = [aggreg_cell_pixels(resolution) for resolution in resolutions]
+
+    # Uses the saved histograms of the model outputs that have them and lists the model outputs that need them made
+    hists = {}
+    focal_tiles = {}
+    for pattern in patterns:
+        focal_tile = '{0}_{1}.tif'.format(tile_id, pattern)
+        if not os.path.exists(focal_tile):
+            uu.print_log("    No {0} tile found for {1}".format(pattern, tile_id))
+            continue
+
+        hist, hist_cell = read_tcd_histogram(tile_id, pattern, [focal_tile, pixel_area, tcd, gain, mangrove], cells)
+        if hist is not None:
+            uu.print_log("    Using saved tree cover density histogram for {0} {1}".format(tile_id, pattern))
+            hists[pattern] = (hist, hist_cell)
+        else:
+            focal_tiles[pattern] = focal_tile
 
-    # Opens input tiles for rasterio
-    in_src = rasterio.open(focal_tile_rewindow)
-    pixel_area_src = rasterio.open(pixel_area_rewindow)
-    tcd_src = rasterio.open(tcd_rewindow)
-    gain_src = rasterio.open(gain_rewindow)
+    if not hists and not focal_tiles:
+        uu.print_log("  No model outputs to aggregate for {}. Skipping tile.".format(tile_id))
+        return
 
-    try:
-        mangrove_src = rasterio.open(mangrove_rewindow)
-        uu.print_log("    Mangrove tile found for {}".format(tile_id))
-    except:
-        uu.print_log("    No mangrove tile found for {}".format(tile_id))
+    if focal_tiles:
 
-    uu.print_log("  Converting {} to per-pixel values...".format(tile))
+        uu.print_log("  Converting {0} outputs for {1} to per-pixel values...".format(len(focal_tiles), tile_id))
 
-    # Grabs the windows of the tile (stripes) in order to iterate over the entire tif without running out of memory
-    windows = in_src.block_windows(1)
+        # Opens input tiles for rasterio
+        focal_srcs = {pattern: rasterio.open(focal_tile) for pattern, focal_tile in focal_tiles.items()}
+        pixel_area_src = rasterio.open(pixel_area)
+        tcd_src = rasterio.open(tcd)
+        gain_src = rasterio.open(gain)
 
-    #2D array in which the 0.05x0.05 deg aggregated sums will be stored
-    sum_array = np.zeros([250,250], 'float32')
+        mangrove_src = uu.open_optional_input(mangrove, tile_id)
 
-    out_raster = "{0}_{1}_0_4deg.tif".format(tile_id, tile_type)
+        # Cell of the grid that all resolutions are summed from
+        base_cell = reduce(math.gcd, cells)
 
-    # Iterates across the windows (400x400 30m pixels) of the input tile
-    for idx, window in windows:
+        height = pixel_area_src.height
+        width = pixel_area_src.width
+        base_rows = height // base_cell
+        base_cols = width // base_cell
 
-        # Creates windows for each input tile
-        in_window = in_src.read(1, window=window)
-        pixel_area_window = pixel_area_src.read(1, window=window)
-        tcd_window = tcd_src.read(1, window=window)
-        gain_window = gain_src.read(1, window=window)
+        # Tree cover density histogram class of each tree cover density value and of the pixels with gain or mangrove
+        n_classes = tcd_histogram_classes()
+        tcd_classes = np.searchsorted(cn.aggreg_tcd_bins, np.arange(256), side='left').astype('int64')
+        forest_class = n_classes - 1
 
-        try:
-            mangrove_window = mangrove_src.read(1, window=window)
-        except:
-            mangrove_window = np.zeros((window.height, window.width), dtype='uint8')
+        # Grid cell of each column of the strips, as the first histogram entry of that cell
+        col_offsets = (np.arange(base_cols * base_cell) // base_cell) * n_classes
 
-        # Applies the tree cover density threshold to the 30x30m pixels
-        if thresh > 0:
+        # 3D arrays in which the histograms of the sums for each output will be stored
+        sum_arrays = {pattern: np.zeros([base_rows, base_cols, n_classes], 'float64') for pattern in focal_srcs}
 
-            # QCed this line before publication and then again afterwards in response to question from Lena Schulte-Uebbing at Wageningen Uni.
-            in_window = np.where((tcd_window > thresh) | (gain_window == 1) | (mangrove_window != 0), in_window, 0)
+        # Input strips and per-pixel values are read and calculated in the same buffers for every strip
+        window_buffers = uu.new_window_buffers()
 
-        # Calculates the per-pixel value from the input tile value (/ha to /pixel)
-        per_pixel_value = in_window * pixel_area_window / cn.m2_per_ha
+        # Iterates across the rows of the grid, reading the strips of 30m pixels in each
+        for base_row in range(base_rows):
 
-        # Sums the pixels to create a total value for the 0.1x0.1 deg pixel
-        non_zero_pixel_sum = np.sum(per_pixel_value)
+            window = Window(0, base_row * base_cell, base_cols * base_cell, base_cell)
 
-        # Stores the resulting value in the array
-        sum_array[idx[0], idx[1]] = non_zero_pixel_sum
+            # Creates windows for the inputs that all the outputs use
+            pixel_area_window = uu.read_window(pixel_area_src, window, window_buffers)
+            tcd_window = uu.read_window(tcd_src, window, window_buffers)
+            gain_window = uu.read_window(gain_src, window, window_buffers)
 
-    # Converts the annual carbon gain values annual gain in megatonnes and makes negative (because removals are negative)
-    if cn.pattern_annual_gain_AGC_all_types in tile_type:
-        sum_array = sum_array / cn.tonnes_to_megatonnes * -1
+            # Histogram class of each pixel. Pixels with gain or mangrove are included at every threshold.
+            # QCed this condition before publication and then again afterwards in response to question from Lena Schulte-Uebbing at Wageningen Uni.
+            # Without a mangrove tile, only gain pixels are included at every threshold.
+            forest_window = gain_window == 1
+            if mangrove_src is not None:
+                forest_window |= uu.read_window(mangrove_src, window, window_buffers) != 0
+            class_window = np.where(forest_window, forest_class, tcd_classes[tcd_window])
 
-    # Converts the cumulative CO2 gain values to annualized CO2 in megatonnes and makes negative (because removals are negative)
-    if cn.pattern_cumul_gain_AGCO2_BGCO2_all_types in tile_type:
-        sum_array = sum_array / cn.loss_years / cn.tonnes_to_megatonnes * -1
+            # Histogram entry (grid cell and class) of each pixel
+            entry_window = (class_window + col_offsets).ravel()
 
-    # # Converts the cumulative gross emissions CO2 only values to annualized gross emissions CO2e in megatonnes
-    # if cn.pattern_gross_emis_co2_only_all_drivers_biomass_soil in tile_type:
-    #     sum_array = sum_array / cn.loss_years / cn.tonnes_to_megatonnes
-    #
-    # # Converts the cumulative gross emissions non-CO2 values to annualized gross emissions CO2e in megatonnes
-    # if cn.pattern_gross_emis_non_co2_all_drivers_biomass_soil in tile_type:
-    #     sum_array = sum_array / cn.loss_years / cn.tonnes_to_megatonnes
+            for pattern, in_src in focal_srcs.items():
 
-    # Converts the cumulative gross emissions all gases CO2e values to annualized gross emissions CO2e in megatonnes
-    if cn.pattern_gross_emis_all_gases_all_drivers_biomass_soil in tile_type:
-        sum_array = sum_array / cn.loss_years / cn.tonnes_to_megatonnes
+                in_window = uu.read_window(in_src, window, window_buffers)
 
-    # Converts the cumulative net flux CO2 values to annualized net flux CO2 in megatonnes
-    if cn.pattern_net_flux in tile_type:
-        sum_array = sum_array / cn.loss_years / cn.tonnes_to_megatonnes
+                # Calculates the per-pixel value from the input tile value (/ha to /pixel)
+                per_pixel_value = uu.window_buffer(window_buffers, 'per_pixel_value', window, np.result_type(in_window, pixel_area_window))
+                uu.evaluate_expression('value * area / m2_per_ha', out=per_pixel_value, value=in_window,
+                                       area=pixel_area_window, m2_per_ha=cn.m2_per_ha)
+
+                # Sums the pixels in each class of each cell of the row
+                sum_arrays[pattern][base_row] = np.bincount(entry_window, weights=per_pixel_value.ravel(),
+                                                            minlength=base_cols * n_classes).reshape(base_cols, n_classes)
+
+        for src in list(focal_srcs.values()) + [pixel_area_src, tcd_src, gain_src, mangrove_src]:
+            if src is not None:
+                src.close()
+
+        for pattern, hist in sum_arrays.items():
+            write_tcd_histogram(tile_id, pattern, hist, base_cell)
+            hists[pattern] = (hist, base_cell)
+
+    uu.print_log("  Creating aggregated tiles for {}...".format(tile_id))
 
-    uu.print_log("  Creating aggregated tile for {}...".format(tile))
-
-    # Converts array to the same output type as the raster that is created below
-    sum_array = np.float32(sum_array)
-
-    # Creates a tile at 0.04x0.04 degree resolution (approximately 10x10 km in the tropics) where the values are
-    # from the 2D array created by rasterio above
-    # https://gis.stackexchange.com/questions/279953/numpy-array-to-gtiff-using-rasterio-without-source-raster
-    with rasterio.open(out_raster, 'w',
-                                driver='GTiff', compress='lzw', nodata='0', dtype='float32', count=1,
-                                height=250, width=250,
-                                crs='EPSG:4326', transform=from_origin(xmin,ymax,0.04,0.04)) as aggregated:
-        aggregated.write(sum_array, 1)
-        ### I don't know why, but update_tags() is adding the tags to the raster but not saving them.
-        ### That is, the tags are printed but not showing up when I do gdalinfo on the raster.
-        ### Instead, I'm using gdal_edit
-        # print(aggregated)
-        # aggregated.update_tags(a="1")
-        # print(aggregated.tags())
-        # uu.add_rasterio_tags(aggregated, sensit_type)
-        # print(aggregated.tags())
-        # if cn.pattern_annual_gain_AGC_all_types in tile_type:
-        #     aggregated.update_tags(units='Mg aboveground carbon/pixel, where pixels are 0.04x0.04 degrees)',
-        #                     source='per hectare version of the same model output, aggregated from 0.00025x0.00025 degree pixels',
-        #                     extent='Global',
-        #                     treecover_density_threshold='{0} (only model pixels with canopy cover > {0} are included in aggregation'.format(thresh))
-        # if cn.pattern_cumul_gain_AGCO2_BGCO2_all_types:
-        #     aggregated.update_tags(units='Mg CO2/yr/pixel, where pixels are 0.04x0.04 degrees)',
-        #                     source='per hectare version of the same model output, aggregated from 0.00025x0.00025 degree pixels',
-        #                     extent='Global',
-        #                     treecover_density_threshold='{0} (only model pixels with canopy cover > {0} are included in aggregation'.format(thresh))
-        # # if cn.pattern_gross_emis_co2_only_all_drivers_biomass_soil in tile_type:
-        # #     aggregated.update_tags(units='Mg CO2e/yr/pixel, where pixels are 0.04x0.04 degrees)',
-        # #                     source='per hectare version of the same model output, aggregated from 0.00025x0.00025 degree pixels',
-        # #                     extent='Global', gases_included='CO2 only',
-        # #                     treecover_density_threshold = '{0} (only model pixels with canopy cover > {0} are included in aggregation'.format(thresh))
-        # # if cn.pattern_gross_emis_non_co2_all_drivers_biomass_soil in tile_type:
-        # #     aggregated.update_tags(units='Mg CO2e/yr/pixel, where pixels are 0.04x0.04 degrees)',
-        # #                     source='per hectare version of the same model output, aggregated from 0.00025x0.00025 degree pixels',
-        # #                     extent='Global', gases_included='CH4, N20',
-        # #                     treecover_density_threshold='{0} (only model pixels with canopy cover > {0} are included in aggregation'.format(thresh))
-        # if cn.pattern_gross_emis_all_gases_all_drivers_biomass_soil in tile_type:
-        #     aggregated.update_tags(units='Mg CO2e/yr/pixel, where pixels are 0.04x0.04 degrees)',
-        #                     source='per hectare version of the same model output, aggregated from 0.00025x0.00025 degree pixels',
-        #                     extent='Global',
-        #                     treecover_density_threshold='{0} (only model pixels with canopy cover > {0} are included in aggregation'.format(thresh))
-        # if cn.pattern_net_flux in tile_type:
-        #     aggregated.update_tags(units='Mg CO2e/yr/pixel, where pixels are 0.04x0.04 degrees)',
-        #                     scale='Negative values are net sinks. Positive values are net sources.',
-        #                     source='per hectare version of the same model output, aggregated from 0.00025x0.00025 degree pixels',
-        #                     extent='Global',
-        #                     treecover_density_threshold='{0} (only model pixels with canopy cover > {0} are included in aggregation'.format(thresh))
-        # print(aggregated.tags())
-        # aggregated.close()
+    for pattern, (hist, hist_cell) in hists.items():
+
+        for thresh in threshs:
+
+            # Sums of the pixels that are included at this threshold
+            sum_array = threshold_tcd_histogram(hist, thresh)
+            base_rows, base_cols = sum_array.shape
+
+            for resolution, cell in zip(resolutions, cells):
+
+                # Sums the cells of the grid into the aggregated pixels of this resolution
+                factor = cell // hist_cell
+                out_rows = base_rows // factor
+                out_cols = base_cols // factor
+                out_array = sum_array[:out_rows * factor, :out_cols * factor].reshape(out_rows, factor, out_cols, factor).sum(axis=(1, 3))
+
+                # Converts array to the same output type as the raster that is created below
+                out_array = np.float32(convert_aggregated_sums(out_array, pattern))
+
+                out_raster = '{0}_{1}_tcd{2}_{3}.tif'.format(tile_id, pattern, thresh, aggreg_resolution_name(resolution))
+
+                # Creates a tile at the aggregated resolution where the values are from the 2D array created above.
+                # https://gis.stackexchange.com/questions/279953/numpy-array-to-gtiff-using-rasterio-without-source-raster
+                # Metadata tags are added to the global map with gdal_edit, since update_tags() didn't save them here.
+                with rasterio.open(out_raster, 'w',
+                                   driver='GTiff', compress='lzw', nodata='0', dtype='float32', count=1,
+                                   height=out_rows, width=out_cols,
+                                   crs='EPSG:4326', transform=from_origin(xmin, ymax, resolution, resolution)) as aggregated:
+                    aggregated.write(out_array, 1)
 
     # Prints information about the tile that was just processed
-    uu.end_of_fx_summary(start, tile_id, '{}_0_4deg'.format(tile_type), no_upload)
+    uu.end_of_fx_summary(start, tile_id, '{0}_tcd{1}_{2}'.format(patterns[0], threshs[0], aggreg_resolution_name(resolutions[0])), no_upload)
+
+
+# Combines the aggregated tiles of a model output at one resolution and threshold into a global map, tags it and uploads it
+def mosaic_aggregated_tiles(download_pattern_name, pattern, thresh, sensit_type, resolution, output_dir, no_upload):
+
+    resolution_name = aggreg_resolution_name(resolution)
+
+    # Makes a vrt of all the aggregated 10x10 tiles
+    out_vrt = "{0}_tcd{1}_{2}.vrt".format(pattern, thresh, resolution_name)
+    os.system('gdalbuildvrt -tr {0} {0} {1} *{2}_tcd{3}_{4}.tif'.format(resolution, out_vrt, pattern, thresh, resolution_name))
+
+    # Creates the output name for the global map
+    out_pattern = uu.name_aggregated_output(download_pattern_name, thresh, sensit_type, resolution_name)
+    uu.print_log(out_pattern)
+
+    # Produces a single raster of all the 10x10 tiles
+    cmd = ['gdalwarp', '-t_srs', "EPSG:4326", '-overwrite', '-dstnodata', '0', '-co', 'COMPRESS=LZW',
+           '-tr', str(resolution), str(resolution),
+           out_vrt, '{}.tif'.format(out_pattern)]
+    uu.log_subprocess_output_full(cmd)
+
+    # Adds metadata tags to output rasters
+    tags = uu.universal_metadata_tags(sensit_type)
+
+    # Units are different for annual removal factor, so metadata has to reflect that
+    if 'annual_removal_factor' in out_pattern:
+        tags.update(units='Mg aboveground carbon/yr/pixel, where pixels are {0}x{0} degrees'.format(resolution),
+                    source='per hectare version of the same model output, aggregated from 0.00025x0.00025 degree pixels',
+                    extent='Global',
+                    scale='negative values are removals',
+                    treecover_density_threshold='{0} (only model pixels with canopy cover > {0} are included in aggregation'.format(thresh))
+
+    else:
+        tags.update(units='Mg CO2e/yr/pixel, where pixels are {0}x{0} degrees'.format(resolution),
+                    source='per hectare version of the same model output, aggregated from 0.00025x0.00025 degree pixels',
+                    extent='Global',
+                    treecover_density_threshold='{0} (only model pixels with canopy cover > {0} are included in aggregation'.format(thresh))
+
+    uu.print_log("Adding metadata tags to", '{0}.tif'.format(out_pattern))
+    uu.set_metadata_tags('{0}.tif'.format(out_pattern), tags)
+
+    # If no_upload flag is not activated, output is uploaded
+    if not no_upload:
+
+        uu.print_log("Tiles processed. Uploading to s3 now...")
+        uu.upload_final_set(output_dir, out_pattern)
+
+    # Cleans up the folder
+    os.remove(out_vrt)
+    for tile in glob.glob('*{0}_tcd{1}_{2}.tif'.format(pattern, thresh, resolution_name)):
+        os.remove(tile)
 
 
 # Calculates the percent difference between the standard model's net flux output
@@ -13,7 +13,6 @@ Forest extent is: ((TCD2000>30 AND WHRC AGB2000>0) OR Hansen gain=1 OR mangrove
 The WHRC AGB2000 and pre-2000 plantations conditions were set in mp_model_extent.py, so they don't show up here.
 '''
 
-import numpy as np
 from subprocess import Popen, PIPE, STDOUT, check_call
 import os
 import rasterio
@@ -53,15 +52,14 @@ def create_supplementary_outputs(tile_id, input_pattern, output_patterns, sensit
     # Grabs the windows of the tile (stripes) so we can iterate over the entire tif without running out of memory
     windows = in_src.block_windows(1)
 
+    # Number of pixels in the model extent in each row. The per hectare full extent tiles are only in the model extent.
+    model_extent_row_counts = uu.model_extent_row_counts(tile_id, sensit_type, in_src.height)
+
     pixel_area_src = rasterio.open(pixel_area)
     tcd_src = rasterio.open(tcd)
     gain_src = rasterio.open(gain)
 
-    try:
-        mangrove_src = rasterio.open(mangrove)
-        uu.print_log("    Mangrove tile found for {}".format(tile_id))
-    except:
-        uu.print_log("    No mangrove tile found for {}".format(tile_id))
+    mangrove_src = uu.open_optional_input(mangrove, tile_id)
 
     uu.print_log("  Creating outputs for {}...".format(focal_tile))
 
@@ -113,29 +111,40 @@ def create_supplementary_outputs(tile_id, input_pattern, output_patterns, sensit
             scale='Negative values are net sinks. Positive values are net sources.')
 
 
+    # Input and output windows are calculated in the same buffers for every window
+    window_buffers = uu.new_window_buffers()
+
     # Iterates across the windows of the input tiles
     for idx, window in windows:
 
-        # Creates windows for each input tile
-        in_window = in_src.read(1, window=window)
-        pixel_area_window = pixel_area_src.read(1, window=window)
-        tcd_window = tcd_src.read(1, window=window)
-        gain_window = gain_src.read(1, window=window)
+        # Windows without any pixels in the model extent are left as nodata in the outputs
+        if not uu.window_has_data(model_extent_row_counts, window):
+            continue
 
-        try:
-            mangrove_window = mangrove_src.read(1, window=window)
-        except:
-            mangrove_window = np.zeros((window.height, window.width), dtype='uint8')
+        # Creates windows for each input tile
+        in_window = uu.read_window(in_src, window, window_buffers)
+        pixel_area_window = uu.read_window(pixel_area_src, window, window_buffers)
+        tcd_window = uu.read_window(tcd_src, window, window_buffers)
+        gain_window = uu.read_window(gain_src, window, window_buffers)
 
         # Output window for per pixel full extent raster
-        dst_window_per_pixel_full_extent = in_window * pixel_area_window / cn.m2_per_ha
+        dst_window_per_pixel_full_extent = uu.window_buffer(window_buffers, 'per_pixel_full_extent', window, in_window.dtype)
+        uu.evaluate_expression('value * area / m2_per_ha', out=dst_window_per_pixel_full_extent, value=in_window,
+                               area=pixel_area_window, m2_per_ha=cn.m2_per_ha)
 
         # Output window for per hectare forest extent raster
         # QCed this line before publication and then again afterwards in response to question from Lena Schulte-Uebbing at Wageningen Uni.
-        dst_window_per_hectare_forest_extent = np.where((tcd_window > cn.canopy_threshold) | (gain_window == 1) | (mangrove_window != 0), in_window, 0)
+        # Without a mangrove tile, there are no mangrove pixels to add to the forest extent.
+        forest_extent = (tcd_window > cn.canopy_threshold) | (gain_window == 1)
+        if mangrove_src is not None:
+            forest_extent |= uu.read_window(mangrove_src, window, window_buffers) != 0
+        dst_window_per_hectare_forest_extent = uu.window_buffer(window_buffers, 'per_hectare_forest_extent', window, in_window.dtype, fill=0)
+        uu.evaluate_expression('value', out=dst_window_per_hectare_forest_extent, where=forest_extent, value=in_window)
 
         # Output window for per pixel forest extent raster
-        dst_window_per_pixel_forest_extent = dst_window_per_hectare_forest_extent * pixel_area_window / cn.m2_per_ha
+        dst_window_per_pixel_forest_extent = uu.window_buffer(window_buffers, 'per_pixel_forest_extent', window, in_window.dtype, fill=0)
+        uu.evaluate_expression('value * area / m2_per_ha', out=dst_window_per_pixel_forest_extent, where=forest_extent,
+                               value=in_window, area=pixel_area_window, m2_per_ha=cn.m2_per_ha)
 
         # Writes arrays to output raster
         per_pixel_full_extent_dst.write_band(1, dst_window_per_pixel_full_extent, window=window)
@@ -2,20 +2,20 @@
 This script creates maps of model outputs at roughly 10km resolution (0.1x0.1 degrees), where each output pixel
 represents the total value in the pixel (not the density) (hence, the aggregated results).
 This is currently only set up for gross emissions from biomass+soil and net flux from biomass+soil.
-It iterates through all the model outputs that are supplied.
-First, it rewindows the model output, pixel area tile, and tcd tile into 400x400 (0.1x0.1 degree) windows, instead of the native
-40000x1 pixel windows.
-Then it calculates the per pixel value for each model output pixel and sums those values within each 0.1x0.1 degree
-aggregated pixel.
+It reads all the model outputs that are supplied for a tile together in their native 40000x1 pixel windows,
+so the pixel area, tcd, gain and mangrove tiles are read only once per tile.
+It calculates the per pixel value for each model output pixel and sums those values within each aggregated pixel
+at every requested resolution (0.04x0.04 degrees by default; e.g., -res 0.04,0.1,0.25,1 for a resolution pyramid).
 It converts cumulative carbon gain to CO2 gain per year, converts cumulative CO2 flux to CO2 flux per year, and
 converts cumulative gross CO2 emissions to gross CO2 emissions per year.
 For sensitivity analysis runs, it only processes outputs which actually have a sensitivity analysis version.
-The user has to supply a tcd threshold for which forest pixels to include in the results.
+The user has to supply one or more tcd thresholds for which forest pixels to include in the results (e.g., -tcd 10,30,50).
+The sums are kept in histograms over the tcd bins in cn.aggreg_tcd_bins, so every threshold comes from one pass over
+the tiles, and the histograms are saved so later runs at other thresholds don't read the tiles again.
 sample command: python mp_aggregate_results_to_4_km.py -tcd 30 -t no_shifting_ag -sagg s3://gfw2-data/climate/carbon_model/0_4deg_output_aggregation/biomass_soil/standard/20200901/net_flux_Mt_CO2e_biomass_soil_per_year_tcd30_0_4deg_modelv1_2_0_std_20200901.tif
 '''
 
 
-import multiprocessing
 from subprocess import Popen, PIPE, STDOUT, check_call
 from functools import partial
 import datetime
@@ -29,10 +29,15 @@ import universal_util as uu
 sys.path.append(os.path.join(cn.docker_app,'analyses'))
 import aggregate_results_to_4_km
 
-def mp_aggregate_results_to_4_km(sensit_type, thresh, tile_id_list, std_net_flux = None, run_date = None, no_upload = None):
+def mp_aggregate_results_to_4_km(sensit_type, thresh, tile_id_list, std_net_flux = None, run_date = None, no_upload = None,
+                                 resolutions = None):
 
     os.chdir(cn.docker_base_dir)
 
+    # The resolutions to aggregate to. Defaults to the standard 0.04x0.04 degree aggregation.
+    if resolutions is None:
+        resolutions = cn.aggreg_resolutions
+
     # If a full model run is specified, the correct set of tiles for the particular script is listed
     if tile_id_list == 'all':
         # List of tiles to run in the model
@@ -50,9 +55,15 @@ def mp_aggregate_results_to_4_km(sensit_type, thresh, tile_id_list, std_net_flux
              cn.net_flux_dir: [cn.pattern_net_flux]
              }
 
-    # Checks whether the canopy cover argument is valid
-    if thresh < 0 or thresh > 99:
-        uu.exception_log(no_upload, 'Invalid tcd. Please provide an integer between 0 and 99.')
+    # One or more tcd thresholds can be aggregated to, since they all come from the same tree cover density histograms
+    threshs = thresh if isinstance(thresh, list) else [thresh]
+
+    # Checks whether the canopy cover arguments are valid
+    for thresh in threshs:
+        if thresh < 0 or thresh > 99:
+            uu.exception_log(no_upload, 'Invalid tcd. Please provide an integer between 0 and 99.')
+        if thresh != 0 and thresh not in cn.aggreg_tcd_bins:
+            uu.exception_log(no_upload, 'Invalid tcd {0}. Please provide 0 or one of the tree cover density bins {1}.'.format(thresh, cn.aggreg_tcd_bins))
 
 
     if uu.check_aws_creds():
@@ -81,6 +92,18 @@ def mp_aggregate_results_to_4_km(sensit_type, thresh, tile_id_list, std_net_flux
         output_dir_list = uu.replace_output_dir_date(output_dir_list, run_date)
 
 
+    # Checks whether the aggregation resolutions are valid: each must be a whole number of 30m pixels that fits evenly into a tile
+    for resolution in resolutions:
+        cell = aggregate_results_to_4_km.aggreg_cell_pixels(resolution)
+        if (abs(cell * cn.Hansen_res - resolution) > 1e-9) or (cn.tile_width % cell != 0):
+            uu.exception_log(no_upload, 'Invalid aggregation resolution {}. It must divide a 10x10 degree tile into whole 0.00025 degree pixels.'.format(resolution))
+
+    uu.print_log("Aggregating to resolutions (degrees):", resolutions)
+
+    # The model outputs to aggregate (download pattern and tile pattern on the spot machine) and their tiles
+    aggregate_patterns = []
+    aggregate_tile_ids = set()
+
     # Iterates through the types of tiles to be processed
     for dir, download_pattern in list(download_dict.items()):
 
@@ -121,113 +144,35 @@ def mp_aggregate_results_to_4_km(sensit_type, thresh, tile_id_list, std_net_flux
         # tile_list = ['00N_070W_cumul_gain_AGCO2_BGCO2_t_ha_all_forest_types_2001_15_biomass_swap.tif']  # test tiles
 
         uu.print_log("There are {0} tiles to process for pattern {1}".format(str(len(tile_list)), download_pattern) + "\n")
-        uu.print_log("Processing:", dir, "; ", pattern)
-
-        # Converts the 10x10 degree Hansen tiles that are in windows of 40000x1 pixels to windows of 400x400 pixels,
-        # which is the resolution of the output tiles. This will allow the 30x30 m pixels in each window to be summed.
-        # For multiprocessor use. count/2 used about 400 GB of memory on an r4.16xlarge machine, so that was okay.
-        if cn.count == 96:
-            if sensit_type == 'biomass_swap':
-                processes = 12  # 12 processors = XXX GB peak
-            else:
-                processes = 16  # 12 processors = 140 GB peak; 16 = XXX GB peak; 20 = >750 GB (maxed out)
-        else:
-            processes = 8
-        uu.print_log('Rewindow max processors=', processes)
-        pool = multiprocessing.Pool(processes)
-        pool.map(partial(aggregate_results_to_4_km.rewindow, no_upload=no_upload), tile_list)
-        # Added these in response to error12: Cannot allocate memory error.
-        # This fix was mentioned here: of https://stackoverflow.com/questions/26717120/python-cannot-allocate-memory-using-multiprocessing-pool
-        # Could also try this: https://stackoverflow.com/questions/42584525/python-multiprocessing-debugging-oserror-errno-12-cannot-allocate-memory
-        pool.close()
-        pool.join()
-
-        # # For single processor use
-        # for tile in tile_list:
-        #
-        #     aggregate_results_to_4_km.rewindow(til, no_upload)
-
-        # Converts the existing (per ha) values to per pixel values (e.g., emissions/ha to emissions/pixel)
-        # and sums those values in each 400x400 pixel window.
-        # The sum for each 400x400 pixel window is stored in a 2D array, which is then converted back into a raster at
-        # 0.1x0.1 degree resolution (approximately 10m in the tropics).
-        # Each pixel in that raster is the sum of the 30m pixels converted to value/pixel (instead of value/ha).
-        # The 0.1x0.1 degree tile is output.
-        # For multiprocessor use. This used about 450 GB of memory with count/2, it's okay on an r4.16xlarge
-        if cn.count == 96:
-            if sensit_type == 'biomass_swap':
-                processes = 10  # 10 processors = XXX GB peak
-            else:
-                processes = 12  # 16 processors = 180 GB peak; 16 = XXX GB peak; 20 = >750 GB (maxed out)
-        else:
-            processes = 8
-        uu.print_log('Conversion to per pixel and aggregate max processors=', processes)
-        pool = multiprocessing.Pool(processes)
-        pool.map(partial(aggregate_results_to_4_km.aggregate, thresh=thresh, sensit_type=sensit_type,
-                         no_upload=no_upload), tile_list)
-        pool.close()
-        pool.join()
-
-        # # For single processor use
-        # for tile in tile_list:
-        #
-        #     aggregate_results_to_4_km.aggregate(tile, thresh, sensit_type, no_upload)
-
-        # Makes a vrt of all the output 10x10 tiles (10 km resolution)
-        out_vrt = "{}_0_4deg.vrt".format(pattern)
-        os.system('gdalbuildvrt -tr 0.04 0.04 {0} *{1}_0_4deg*.tif'.format(out_vrt, pattern))
-
-        # Creates the output name for the 10km map
-        out_pattern = uu.name_aggregated_output(download_pattern_name, thresh, sensit_type)
-        uu.print_log(out_pattern)
-
-        # Produces a single raster of all the 10x10 tiles (0.4 degree resolution)
-        cmd = ['gdalwarp', '-t_srs', "EPSG:4326", '-overwrite', '-dstnodata', '0', '-co', 'COMPRESS=LZW',
-               '-tr', '0.04', '0.04',
-               out_vrt, '{}.tif'.format(out_pattern)]
-        uu.log_subprocess_output_full(cmd)
-
-
-        # Adds metadata tags to output rasters
-        uu.add_universal_metadata_tags('{0}.tif'.format(out_pattern), sensit_type)
-
-        # Units are different for annual removal factor, so metadata has to reflect that
-        if 'annual_removal_factor' in out_pattern:
-            cmd = ['gdal_edit.py',
-                   '-mo', 'units=Mg aboveground carbon/yr/pixel, where pixels are 0.04x0.04 degrees',
-                   '-mo', 'source=per hectare version of the same model output, aggregated from 0.00025x0.00025 degree pixels',
-                   '-mo', 'extent=Global',
-                   '-mo', 'scale=negative values are removals',
-                   '-mo', 'treecover_density_threshold={0} (only model pixels with canopy cover > {0} are included in aggregation'.format(thresh),
-                   '{0}.tif'.format(out_pattern)]
-            uu.log_subprocess_output_full(cmd)
-
-        else:
-            cmd = ['gdal_edit.py',
-                   '-mo', 'units=Mg CO2e/yr/pixel, where pixels are 0.04x0.04 degrees',
-                   '-mo', 'source=per hectare version of the same model output, aggregated from 0.00025x0.00025 degree pixels',
-                   '-mo', 'extent=Global',
-                   '-mo', 'treecover_density_threshold={0} (only model pixels with canopy cover > {0} are included in aggregation'.format(thresh),
-                   '{0}.tif'.format(out_pattern)]
-            uu.log_subprocess_output_full(cmd)
 
+        aggregate_patterns.append((download_pattern_name, pattern))
+        aggregate_tile_ids.update(uu.get_tile_id(tile_name) for tile_name in tile_list)
 
-        # If no_upload flag is not activated, output is uploaded
-        if not no_upload:
+    uu.print_log("Processing:", [pattern for download_pattern_name, pattern in aggregate_patterns])
 
-            uu.print_log("Tiles processed. Uploading to s3 now...")
-            uu.upload_final_set(output_dir_list[0], out_pattern)
+    # Converts the existing (per ha) values of all the outputs to per pixel values (e.g., emissions/ha to emissions/pixel)
+    # and sums those values in each aggregated pixel at every resolution in one pass over each tile.
+    # The tiles are read in their native 40000x1 pixel windows and the pixel area, tcd, gain and mangrove tiles are
+    # read once per tile for all the outputs.
+    # Each pixel in the aggregated tiles is the sum of the 30m pixels converted to value/pixel (instead of value/ha).
+    # Tiles are admitted into the pool as long as their recorded peak memory fits in the machine's memory budget
+    uu.memory_aware_map(partial(aggregate_results_to_4_km.aggregate,
+                                patterns=[pattern for download_pattern_name, pattern in aggregate_patterns],
+                                threshs=threshs, sensit_type=sensit_type, resolutions=resolutions, no_upload=no_upload),
+                        sorted(aggregate_tile_ids), 'aggregate')
 
-        # Cleans up the folder before starting on the next raster type
-        vrtList = glob.glob('*vrt')
-        for vrt in vrtList:
-            os.remove(vrt)
+    # # For single processor use
+    # for tile_id in sorted(aggregate_tile_ids):
+    #
+    #     aggregate_results_to_4_km.aggregate(tile_id, [pattern for download_pattern_name, pattern in aggregate_patterns],
+    #                                         threshs, sensit_type, resolutions, no_upload)
 
-        for tile_name in tile_list:
-            tile_id = uu.get_tile_id(tile_name)
-            # os.remove('{0}_{1}.tif'.format(tile_id, pattern))
-            os.remove('{0}_{1}_rewindow.tif'.format(tile_id, pattern))
-            os.remove('{0}_{1}_0_4deg.tif'.format(tile_id, pattern))
+    # Produces a global raster of each output at each resolution and threshold from the aggregated 10x10 tiles
+    for download_pattern_name, pattern in aggregate_patterns:
+        for thresh in threshs:
+            for resolution in resolutions:
+                aggregate_results_to_4_km.mosaic_aggregated_tiles(download_pattern_name, pattern, thresh, sensit_type,
+                                                                  resolution, output_dir_list[0], no_upload)
 
 
     # Compares the net flux from the standard model and the sensitivity analysis in two ways.
@@ -251,7 +196,7 @@ def mp_aggregate_results_to_4_km(sensit_type, thresh, tile_id_list, std_net_flux
 
             try:
                 # Identifies the sensitivity model net flux map
-                sensit_aggreg_flux = glob.glob('net_flux_Mt_CO2e_*{}*'.format(sensit_type))[0]
+                sensit_aggreg_flux = glob.glob('net_flux_Mt_CO2e_*tcd{0}_{1}_{2}*'.format(threshs[0], cn.pattern_aggreg, sensit_type))[0]
 
                 uu.print_log("Standard model net flux:", std_aggreg_flux)
                 uu.print_log("Sensitivity model net flux:", sensit_aggreg_flux)
@@ -286,18 +231,22 @@ if __name__ == '__main__':
     parser.add_argument('--tile_id_list', '-l', required=True,
                         help='List of tile ids to use in the model. Should be of form 00N_110E or 00N_110E,00N_120E or all.')
     parser.add_argument('--tcd-threshold', '-tcd', required=True,
-                        help='Tree cover density threshold above which pixels will be included in the aggregation.')
+                        help='Tree cover density threshold(s) above which pixels will be included in the aggregation. Should be of form 30 or 10,30,50.')
     parser.add_argument('--std-net-flux-aggreg', '-sagg', required=False,
                         help='The s3 standard model net flux aggregated tif, for comparison with the sensitivity analysis map')
+    parser.add_argument('--resolutions', '-res', required=False,
+                        help='Resolutions (degrees) to aggregate to. Should be of form 0.04 or 0.04,0.1,0.25,1. Defaults to 0.04.')
     parser.add_argument('--no-upload', '-nu', action='store_true',
                        help='Disables uploading of outputs to s3')
     args = parser.parse_args()
     sensit_type = args.model_type
     tile_id_list = args.tile_id_list
     std_net_flux = args.std_net_flux_aggreg
-    thresh = args.tcd_threshold
-    thresh = int(thresh)
+    thresh = [int(tcd) for tcd in args.tcd_threshold.split(',')]
     no_upload = args.no_upload
+    resolutions = args.resolutions
+    if resolutions is not None:
+        resolutions = [float(resolution) for resolution in resolutions.split(',')]
 
     # Disables upload to s3 if no AWS credentials are found in environment
     if not uu.check_aws_creds():
@@ -313,4 +262,4 @@ if __name__ == '__main__':
     tile_id_list = uu.tile_id_list_check(tile_id_list)
 
     mp_aggregate_results_to_4_km(sensit_type=sensit_type, tile_id_list=tile_id_list, thresh=thresh,
-                                 std_net_flux=std_net_flux, no_upload=no_upload)
\ No newline at end of file
+                                 std_net_flux=std_net_flux, no_upload=no_upload, resolutions=resolutions)
\ No newline at end of file
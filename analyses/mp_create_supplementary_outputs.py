@@ -84,6 +84,8 @@ def mp_create_supplementary_outputs(sensit_type, tile_id_list, run_date = None,
         uu.s3_flexible_download(cn.tcd_dir, cn.pattern_tcd, cn.docker_base_dir, sensit_type, tile_id_list_outer)
         uu.s3_flexible_download(cn.gain_dir, cn.pattern_gain, cn.docker_base_dir, sensit_type, tile_id_list_outer)
         uu.s3_flexible_download(cn.mangrove_biomass_2000_dir, cn.pattern_mangrove_biomass_2000, cn.docker_base_dir, sensit_type, tile_id_list_outer)
+        # Row counts of the model extent tiles-- used for skipping windows without any pixels in the model extent
+        uu.download_row_counts(cn.model_extent_dir, cn.pattern_model_extent, sensit_type, tile_id_list_outer)
 
     uu.print_log("Model outputs to process are:", download_dict)
 
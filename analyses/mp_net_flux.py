@@ -1,7 +1,6 @@
 ### Calculates the net emissions over the study period, with units of Mg CO2e/ha on a pixel-by-pixel basis.
 ### This only uses gross emissions from biomass+soil (doesn't run with gross emissions from soil_only).
 
-import multiprocessing
 import argparse
 import os
 import datetime
@@ -13,7 +12,7 @@ import universal_util as uu
 sys.path.append(os.path.join(cn.docker_app,'analyses'))
 import net_flux
 
-def mp_net_flux(sensit_type, tile_id_list, run_date = None, no_upload = None):
+def mp_net_flux(sensit_type, tile_id_list, run_date = None, no_upload = None, streaming = None):
 
     os.chdir(cn.docker_base_dir)
 
@@ -40,14 +39,19 @@ def mp_net_flux(sensit_type, tile_id_list, run_date = None, no_upload = None):
     output_pattern_list = [cn.pattern_net_flux]
 
 
-    # Downloads input files or entire directories, depending on how many tiles are in the tile_id_list, if AWS credentials are found
-    if uu.check_aws_creds():
+    # Downloads input files or entire directories, depending on how many tiles are in the tile_id_list, if AWS credentials are found.
+    # In streaming mode, each tile's inputs are downloaded just before it is processed instead.
+    if uu.check_aws_creds() and not streaming:
 
         for key, values in download_dict.items():
             dir = key
             pattern = values[0]
             uu.s3_flexible_download(dir, pattern, cn.docker_base_dir, sensit_type, tile_id_list)
 
+    # Only the row counts of the model extent tiles are needed, for skipping windows without any pixels in the model extent
+    if uu.check_aws_creds():
+        uu.download_row_counts(cn.model_extent_dir, cn.pattern_model_extent, sensit_type, tile_id_list)
+
 
     # If the model run isn't the standard one, the output directory and file names are changed
     if sensit_type != 'std':
@@ -63,18 +67,16 @@ def mp_net_flux(sensit_type, tile_id_list, run_date = None, no_upload = None):
 
     # Creates a single filename pattern to pass to the multiprocessor call
     pattern = output_pattern_list[0]
-    if cn.count == 96:
-        if sensit_type == 'biomass_swap':
-            processes = 32 # 32 processors = XXX GB peak
-        else:
-            processes = 40   # 38 = 690 GB peak; 40 = 715 GB peak
-    else:
-        processes = 9
-    uu.print_log('Net flux max processors=', processes)
-    pool = multiprocessing.Pool(processes)
-    pool.map(partial(net_flux.net_calc, pattern=pattern, sensit_type=sensit_type, no_upload=no_upload), tile_id_list)
-    pool.close()
-    pool.join()
+    # In streaming mode, inputs are downloaded, tiles processed and outputs uploaded tile by tile
+    if streaming:
+        uu.streaming_map(partial(net_flux.net_calc, pattern=pattern, sensit_type=sensit_type, no_upload=no_upload),
+                         tile_id_list, 'net_flux', download_dict, output_dir_list, output_pattern_list,
+                         sensit_type, no_upload)
+        return
+
+    # Tiles are admitted into the pool as long as their recorded peak memory fits in the machine's memory budget
+    uu.memory_aware_map(partial(net_flux.net_calc, pattern=pattern, sensit_type=sensit_type, no_upload=no_upload),
+                        tile_id_list, 'net_flux')
 
     # # For single processor use
     # for tile_id in tile_id_list:
@@ -99,11 +101,14 @@ if __name__ == '__main__':
                         help='Date of run. Must be format YYYYMMDD.')
     parser.add_argument('--no-upload', '-nu', action='store_true',
                        help='Disables uploading of outputs to s3')
+    parser.add_argument('--streaming', '-st', action='store_true',
+                        help='Downloads, processes and uploads tiles one at a time instead of in whole-stage batches')
     args = parser.parse_args()
     sensit_type = args.model_type
     tile_id_list = args.tile_id_list
     run_date = args.run_date
     no_upload = args.no_upload
+    streaming = args.streaming
 
     # Disables upload to s3 if no AWS credentials are found in environment
     if not uu.check_aws_creds():
@@ -111,10 +116,12 @@ if __name__ == '__main__':
         uu.print_log("s3 credentials not found. Uploading to s3 disabled.")
 
     # Create the output log
-    uu.initiate_log(tile_id_list=tile_id_list, sensit_type=sensit_type, run_date=run_date, no_upload=no_upload)
+    uu.initiate_log(tile_id_list=tile_id_list, sensit_type=sensit_type, run_date=run_date, no_upload=no_upload,
+                    streaming=streaming)
 
     # Checks whether the sensitivity analysis and tile_id_list arguments are valid
     uu.check_sensit_type(sensit_type)
     tile_id_list = uu.tile_id_list_check(tile_id_list)
 
-    mp_net_flux(sensit_type=sensit_type, tile_id_list=tile_id_list, run_date=run_date, no_upload=no_upload)
\ No newline at end of file
+    mp_net_flux(sensit_type=sensit_type, tile_id_list=tile_id_list, run_date=run_date, no_upload=no_upload,
+                streaming=streaming)
@@ -1,7 +1,6 @@
 ### This script calculates various statistics on all tiles in input folders and saves them to a txt.
 ### Users can input as many folders as they want for calculating statistics on each tile
 
-import multiprocessing
 import tile_statistics
 from subprocess import Popen, PIPE, STDOUT, check_call
 import datetime
@@ -152,8 +151,8 @@ def mp_tile_statistics(sensit_type, tile_id_list):
         pattern = values[0]
         uu.s3_flexible_download(dir, pattern, cn.docker_base_dir, sensit_type, tile_id_list)
 
-        # List of all the tiles on the spot machine to be summarized (excludes pixel area tiles and tiles created by gdal_calc
-        # (in case this script was already run on this spot machine and created output from gdal_calc)
+        # List of all the tiles on the spot machine to be summarized (excludes pixel area tiles and value per pixel tiles
+        # (in case an older version of this script was run on this spot machine and created them with gdal_calc)
         tile_list = uu.tile_list_spot_machine(".", ".tif")
         # from https://stackoverflow.com/questions/12666897/removing-an-item-from-list-matching-a-substring
         tile_list = [i for i in tile_list if not ('hanson_2013' in i or 'value_per_pixel' in i)]
@@ -161,15 +160,10 @@ def mp_tile_statistics(sensit_type, tile_id_list):
         uu.print_log("There are {} tiles to process".format(str(len(tile_list))) + "\n")
 
         # For multiprocessor use.
-        processes=14
-        uu.print_log('Tile statistics max processors=', processes)
-        pool = multiprocessing.Pool(processes)
-        pool.map(partial(tile_statistics.create_tile_statistics, sensit_type=sensit_type, tile_stats_txt=tile_stats_txt), tile_list)
-        # Added these in response to error12: Cannot allocate memory error.
-        # This fix was mentioned here: of https://stackoverflow.com/questions/26717120/python-cannot-allocate-memory-using-multiprocessing-pool
-        # Could also try this: https://stackoverflow.com/questions/42584525/python-multiprocessing-debugging-oserror-errno-12-cannot-allocate-memory
-        pool.close()
-        pool.join()
+        # Tiles are read a batch of rows at a time, so each tile only needs a few windows in memory.
+        # Tiles are admitted into the pool as long as their recorded peak memory fits in the machine's memory budget
+        uu.memory_aware_map(partial(tile_statistics.create_tile_statistics, sensit_type=sensit_type, tile_stats_txt=tile_stats_txt),
+                            tile_list, 'tile_statistics')
 
         # # For single processor use
         # for tile in tile_list:
@@ -183,9 +177,6 @@ def mp_tile_statistics(sensit_type, tile_id_list):
         uu.print_log("Deleting tiles...")
         for tile in tile_list:
             os.remove(tile)
-            tile_short = tile[:-4]
-            outname = '{0}_value_per_pixel.tif'.format(tile_short)
-            os.remove(outname)
             uu.print_log("  {} deleted".format(tile))
 
     uu.print_log("Script complete. All tiles analyzed!")
@@ -2,7 +2,6 @@
 
 import os
 import datetime
-import numpy as np
 import rasterio
 import sys
 sys.path.append('../')
@@ -23,42 +22,35 @@ def net_calc(tile_id, pattern, sensit_type, no_upload):
     # Output net emissions file
     net_flux = '{0}_{1}.tif'.format(tile_id, pattern)
 
-    try:
-        removals_src = rasterio.open(removals_in)
-        # Grabs metadata about the tif, like its location/projection/cellsize
-        kwargs = removals_src.meta
-        # Grabs the windows of the tile (stripes) so we can iterate over the entire tif without running out of memory
-        windows = removals_src.block_windows(1)
-        uu.print_log("   Gross removals tile found for {}".format(removals_in))
-    except:
-        uu.print_log("   No gross removals tile found for {}".format(removals_in))
-
-    try:
-        emissions_src = rasterio.open(emissions_in)
-        # Grabs metadata about the tif, like its location/projection/cellsize
-        kwargs = emissions_src.meta
-        # Grabs the windows of the tile (stripes) so we can iterate over the entire tif without running out of memory
-        windows = emissions_src.block_windows(1)
-        uu.print_log("   Gross emissions tile found for {}".format(emissions_in))
-    except:
-        uu.print_log("   No gross emissions tile found for {}".format(emissions_in))
+    removals_src = uu.open_optional_input(removals_in, tile_id)
+    emissions_src = uu.open_optional_input(emissions_in, tile_id)
 
     # Skips the tile if there is neither a gross emissions nor a gross removals tile.
     # This should only occur for biomass_swap sensitivity analysis, which gets its net flux tile list from
     # the JPL tile list (some tiles of which have neither emissions nor removals), rather than the union of
     # emissions and removals tiles.
-    try:
-        kwargs.update(
-            driver='GTiff',
-            count=1,
-            compress='lzw',
-            nodata=0,
-            dtype='float32'
-        )
-    except:
+    if removals_src is None and emissions_src is None:
         uu.print_log("No gross emissions or gross removals for {}. Skipping tile.".format(tile_id))
         return
 
+    # Grabs metadata about the tif, like its location/projection/cellsize, and the windows of the tile (stripes)
+    # so we can iterate over the entire tif without running out of memory.
+    # Uses the gross emissions tile if it exists and otherwise the gross removals tile.
+    src = emissions_src if emissions_src is not None else removals_src
+    kwargs = src.meta
+    windows = src.block_windows(1)
+
+    kwargs.update(
+        driver='GTiff',
+        count=1,
+        compress='lzw',
+        nodata=0,
+        dtype='float32'
+    )
+
+    # Number of pixels in the model extent in each row. Gross emissions and removals are only in the model extent.
+    model_extent_row_counts = uu.model_extent_row_counts(tile_id, sensit_type, kwargs['height'])
+
     # Opens the output tile, giving it the arguments of the input tiles
     net_flux_dst = rasterio.open(net_flux, 'w', **kwargs)
 
@@ -73,21 +65,28 @@ def net_calc(tile_id, pattern, sensit_type, no_upload):
     net_flux_dst.update_tags(
         scale='Negative values are net sinks. Positive values are net sources.')
 
+    # Input and output windows are calculated in the same buffers for every window
+    window_buffers = uu.new_window_buffers()
+
     # Iterates across the windows (1 pixel strips) of the input tile
     for idx, window in windows:
 
-        # Creates windows for each input tile
-        try:
-            removals_window = removals_src.read(1, window=window).astype('float32')
-        except:
-            removals_window = np.zeros((window.height, window.width)).astype('float32')
-        try:
-            emissions_window = emissions_src.read(1, window=window).astype('float32')
-        except:
-            emissions_window = np.zeros((window.height, window.width)).astype('float32')
+        # Windows without any pixels in the model extent are left as nodata in the output
+        if not uu.window_has_data(model_extent_row_counts, window):
+            continue
+
+        # Creates windows for each input tile. A missing tile is a shared window of 0s.
+        emissions_window = uu.read_window(emissions_src, window, window_buffers, 'float32').astype('float32', copy=False)
+
+        # Without gross removals, net flux is just gross emissions
+        if removals_src is None:
+            dst_data = emissions_window
 
         # Subtracts gain that from loss
-        dst_data = emissions_window - removals_window
+        else:
+            removals_window = uu.read_window(removals_src, window, window_buffers).astype('float32', copy=False)
+            dst_data = uu.window_buffer(window_buffers, 'net_flux', window, 'float32')
+            uu.evaluate_expression('emissions - removals', out=dst_data, emissions=emissions_window, removals=removals_window)
 
         net_flux_dst.write_band(1, dst_data, window=window)
 
@@ -1,13 +1,72 @@
-from osgeo import gdal
 import numpy as np
-from subprocess import Popen, PIPE, STDOUT, check_call
+import math
+import rasterio
+from rasterio.windows import Window
 import datetime
 import sys
 sys.path.append('../')
 import constants_and_names as cn
 import universal_util as uu
 
-# Calculates a range of tile statistics
+# Empty quantile sketch. Values are counted in logarithmic buckets whose width keeps every value in a bucket
+# within cn.tile_stats_quantile_accuracy (relative) of the bucket's representative value, so quantiles
+# from the sketch are within that accuracy of the exact ones. Sketches of different windows or tiles can be merged
+# by adding their bucket counts.
+def quantile_sketch():
+
+    return {'positive': {}, 'negative': {}, 'zero': 0, 'count': 0}
+
+
+# Adds an array of values to a quantile sketch
+def update_quantile_sketch(sketch, values):
+
+    gamma = (1 + cn.tile_stats_quantile_accuracy) / (1 - cn.tile_stats_quantile_accuracy)
+
+    values = values.astype('float64', copy=False)
+    sketch['count'] += values.size
+
+    zero = values == 0
+    sketch['zero'] += int(np.count_nonzero(zero))
+
+    for side, side_values in (('positive', values[values > 0]), ('negative', -values[values < 0])):
+
+        if side_values.size == 0:
+            continue
+
+        # Bucket of each value: the smallest k with value <= gamma^k
+        keys, counts = np.unique(np.ceil(np.log(side_values) / math.log(gamma)).astype('int64'), return_counts=True)
+
+        buckets = sketch[side]
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            buckets[key] = buckets.get(key, 0) + count
+
+
+# Approximate quantile (0-1) of the values in a quantile sketch, at the same position in the sorted values as
+# np.percentile uses. The value is the representative value of the bucket that position falls in.
+def sketch_quantile(sketch, quantile):
+
+    gamma = (1 + cn.tile_stats_quantile_accuracy) / (1 - cn.tile_stats_quantile_accuracy)
+
+    rank = quantile * (sketch['count'] - 1)
+
+    # Buckets in ascending order of their values: negative values (largest magnitude first), zero, positive values
+    buckets = [(-2 * gamma ** key / (gamma + 1), sketch['negative'][key]) for key in sorted(sketch['negative'], reverse=True)]
+    buckets.append((0, sketch['zero']))
+    buckets.extend((2 * gamma ** key / (gamma + 1), sketch['positive'][key]) for key in sorted(sketch['positive']))
+
+    cumulative = 0
+    for value, count in buckets:
+        cumulative += count
+        if cumulative > rank:
+            return value
+
+    return buckets[-1][0]
+
+
+# Calculates a range of tile statistics in one pass over the tile, a batch of rows at a time.
+# Count, mean, min, max and the sum of the values converted from value/ha to value/pixel are exact.
+# The median and percentiles come from a quantile sketch (see quantile_sketch), so the tile is never held in memory
+# and no value/pixel tile is written.
 def create_tile_statistics(tile, sensit_type, tile_stats_txt):
 
     # Extracts the tile id from the full tile name
@@ -18,55 +77,51 @@ def create_tile_statistics(tile, sensit_type, tile_stats_txt):
     # start time
     start = datetime.datetime.now()
 
-    # Source: http://gis.stackexchange.com/questions/90726
-    # Opens raster we're getting statistics on
-    focus_tile = gdal.Open(tile)
-
-    nodata = uu.get_raster_nodata_value(tile)
-    uu.print_log("NoData value =", nodata)
+    # Tile with the area of each pixel in m2, for converting value/hectare to value/pixel
+    area_tile = '{0}_{1}.tif'.format(cn.pattern_pixel_area, tile_id)
 
-    # Turns the raster into a numpy array
-    tile_array = np.array(focus_tile.GetRasterBand(1).ReadAsArray())
+    focus_src = rasterio.open(tile)
+    area_src = rasterio.open(area_tile)
 
-    # Flattens the numpy array to a single dimension
-    tile_array_flat = tile_array.flatten()
+    nodata = focus_src.nodata
+    uu.print_log("NoData value =", nodata)
 
-    # Removes NoData values from the array. NoData are generally either 0 or -9999.
-    tile_array_flat_mask = tile_array_flat[tile_array_flat != nodata]
+    pixel_count = 0
+    value_sum = 0.0
+    value_min = None
+    value_max = None
+    per_pixel_sum = 0.0
+    sketch = quantile_sketch()
 
-    ### For converting value/hectare to value/pixel
-    # Tile with the area of each pixel in m2
-    area_tile = '{0}_{1}.tif'.format(cn.pattern_pixel_area, tile_id)
+    for row in range(0, focus_src.height, cn.tile_stats_window_rows):
 
-    # Output file name
-    tile_short = tile[:-4]
-    outname = '{0}_value_per_pixel.tif'.format(tile_short)
+        window = Window(0, row, focus_src.width, min(cn.tile_stats_window_rows, focus_src.height - row))
 
-    # Equation argument for converting emissions from per hectare to per pixel.
-    # First, multiplies the per hectare emissions by the area of the pixel in m2, then divides by the number of m2 in a hectare.
-    calc = '--calc=A*B/{}'.format(cn.m2_per_ha)
+        tile_window = focus_src.read(1, window=window)
 
-    # Argument for outputting file
-    out = '--outfile={}'.format(outname)
+        # Removes NoData values from the window. NoData are generally either 0 or -9999.
+        tile_window_mask = tile_window[tile_window != nodata]
 
-    uu.print_log("Converting {} from /ha to /pixel...".format(tile))
-    cmd = ['gdal_calc.py', '-A', tile, '-B', area_tile, calc, out, '--NoDataValue=0', '--co', 'COMPRESS=LZW',
-           '--overwrite', '--quiet']
-    uu.log_subprocess_output_full(cmd)
+        if tile_window_mask.size == 0:
+            continue
 
-    uu.print_log("{} converted to /pixel".format(tile))
+        area_window = area_src.read(1, window=window)
 
-    uu.print_log("Converting value/pixel tile {} to numpy array...".format(tile))
-    # Opens raster with value per pixel
-    value_per_pixel = gdal.Open(outname)
+        pixel_count += tile_window_mask.size
+        value_sum += np.sum(tile_window_mask, dtype=np.float64)
+        window_min = np.amin(tile_window_mask)
+        window_max = np.amax(tile_window_mask)
+        value_min = window_min if value_min is None else min(value_min, window_min)
+        value_max = window_max if value_max is None else max(value_max, window_max)
 
-    # Turns the pixel area raster into a numpy array
-    value_per_pixel_array = np.array(value_per_pixel.GetRasterBand(1).ReadAsArray())
+        # Converts the values from per hectare to per pixel: multiplies by the area of the pixel in m2,
+        # then divides by the number of m2 in a hectare
+        per_pixel_sum += np.sum(tile_window_mask * area_window[tile_window != nodata].astype('float64')) / cn.m2_per_ha
 
-    # Flattens the pixel area numpy array to a single dimension
-    value_per_pixel_array_flat = value_per_pixel_array.flatten()
+        update_quantile_sketch(sketch, tile_window_mask)
 
-    uu.print_log("Converted {} to numpy array".format(tile))
+    focus_src.close()
+    area_src.close()
 
     # Empty statistics list
     stats = [None] * 13
@@ -75,9 +130,9 @@ def create_tile_statistics(tile, sensit_type, tile_stats_txt):
     stats[0] = tile_id
     stats[1] = tile[9:-4]
     stats[2] = tile
-    stats[3] = tile_array_flat_mask.size
+    stats[3] = pixel_count
 
-    # If there are no pixels with values in the tile (as determined by the length of the array when NoData values are removed),
+    # If there are no pixels with values in the tile (as determined by the number of pixels that aren't NoData),
     # the statistics are all N/A.
     if stats[3] == 0:
 
@@ -91,18 +146,19 @@ def create_tile_statistics(tile, sensit_type, tile_stats_txt):
         stats[11] = "N/A"
         stats[12] = "N/A"
 
-    # If there are pixels with values in the tile, the following statistics are calculated
+    # If there are pixels with values in the tile, the following statistics are calculated.
+    # Approximate quantiles are kept within the range of the actual values.
     else:
 
-        stats[4] = np.mean(tile_array_flat_mask, dtype=np.float64)
-        stats[5] = np.median(tile_array_flat_mask)
-        stats[6] = np.percentile(tile_array_flat_mask, 10)
-        stats[7] = np.percentile(tile_array_flat_mask, 25)
-        stats[8] = np.percentile(tile_array_flat_mask, 75)
-        stats[9] = np.percentile(tile_array_flat_mask, 90)
-        stats[10] = np.amin(tile_array_flat_mask)
-        stats[11] = np.amax(tile_array_flat_mask)
-        stats[12] = np.sum(value_per_pixel_array_flat)
+        stats[4] = value_sum / pixel_count
+        stats[5] = min(max(sketch_quantile(sketch, 0.5), value_min), value_max)
+        stats[6] = min(max(sketch_quantile(sketch, 0.1), value_min), value_max)
+        stats[7] = min(max(sketch_quantile(sketch, 0.25), value_min), value_max)
+        stats[8] = min(max(sketch_quantile(sketch, 0.75), value_min), value_max)
+        stats[9] = min(max(sketch_quantile(sketch, 0.9), value_min), value_max)
+        stats[10] = value_min
+        stats[11] = value_max
+        stats[12] = per_pixel_sum
 
     stats_no_brackets = ', '.join(map(str, stats))
 
@@ -114,4 +170,5 @@ def create_tile_statistics(tile, sensit_type, tile_stats_txt):
     f.close()
 
     # Prints information about the tile that was just processed
-    uu.end_of_fx_summary(start, tile_id, 'value_per_pixel.tif')
\ No newline at end of file
+    # This script always copies its outputs to s3, so the log is uploaded, too.
+    uu.end_of_fx_summary(start, tile_id, tile[9:-4], False)
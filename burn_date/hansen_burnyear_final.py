@@ -1,9 +1,7 @@
 import os
 import datetime
-import rasterio
 import utilities
 import glob
-from shutil import copyfile
 import numpy as np
 from subprocess import Popen, PIPE, STDOUT, check_call
 import sys
@@ -77,9 +75,11 @@ def hansen_burnyear(tile_id, no_upload):
 
     utilities.array_to_raster_simple(lossyear_burn_array, out_tile_no_tag, loss)
 
-    # Only copies to s3 if the tile has data
+    # Only copies to s3 if the tile has data.
+    # The burn year array is still in memory, so it's checked rather than the tile being read again.
+    # Pixels without a burn year are 0.
     uu.print_log("Checking if {} contains any data...".format(tile_id))
-    empty = uu.check_for_data(out_tile_no_tag)
+    empty = uu.update_tile_stats(uu.new_tile_stats(), lossyear_burn_array, 0)['valid'] == 0
 
     # Checks output for data. There could be burned area but none of it coincides with tree cover loss,
     # so this is the final check for whether there is any data.
@@ -94,70 +94,17 @@ def hansen_burnyear(tile_id, no_upload):
     else:
         uu.print_log("  Data found in {}. Adding metadata tags...".format(tile_id))
 
-        ### Thomas suggested these on 8/19/2020 but they didn't work. The first one wrote the tags but erased all the
-        ### data in the tiles (everything became 0 according to gdalinfo). The second one had some other error.
-        # with rasterio.open(out_tile_no_tag, 'r') as src:
-        #
-        #     profile = src.profile
-        #
-        # with rasterio.open(out_tile_no_tag, 'w', **profile) as dst:
-        #
-        #     dst.update_tags(units='year (2001, 2002, 2003...)',
-        #                     source='MODIS collection 6 burned area',
-        #                     extent='global')
-        #
-        # with rasterio.open(out_tile_no_tag, 'w+') as src:
-        #
-        #     dst.update_tags(units='year (2001, 2002, 2003...)',
-        #                     source='MODIS collection 6 burned area',
-        #                     extent='global')
-
-
-        # All of the below is to add metadata tags to the output burn year masks.
-        # For some reason, just doing what's at https://rasterio.readthedocs.io/en/latest/topics/tags.html
-        # results in the data getting removed.
-        # I found it necessary to copy the desired output and read its windows into a new copy of the file, to which the
-        # metadata tags are added. I'm sure there's an easier way to do this but I couldn't figure out how.
-        # I know it's very convoluted but I really couldn't figure out how to add the tags without erasing the data.
-
-        copyfile(out_tile_no_tag, out_tile)
-
-        with rasterio.open(out_tile_no_tag) as out_tile_no_tag_src:
-
-            # Grabs metadata about the tif, like its location/projection/cellsize
-            kwargs = out_tile_no_tag_src.meta  #### Use profile instead
-
-            # Grabs the windows of the tile (stripes) so we can iterate over the entire tif without running out of memory
-            windows = out_tile_no_tag_src.block_windows(1)
-
-            # Updates kwargs for the output dataset
-            kwargs.update(
-                driver='GTiff',
-                count=1,
-                compress='lzw',
-                nodata=0
-            )
-
-            out_tile_tagged = rasterio.open(out_tile, 'w', **kwargs)
-
-            # Adds metadata tags to the output raster
-            uu.add_rasterio_tags(out_tile_tagged, 'std')
-            out_tile_tagged.update_tags(
-                units='year (2001, 2002, 2003...)')
-            out_tile_tagged.update_tags(
-                source='MODIS collection 6 burned area, https://modis-fire.umd.edu/files/MODIS_C6_BA_User_Guide_1.3.pdf')
-            out_tile_tagged.update_tags(
-                extent='global')
-
-            # Iterates across the windows (1 pixel strips) of the input tile
-            for idx, window in windows:
-                in_window = out_tile_no_tag_src.read(1, window=window)
-
-                # Writes the output window to the output
-                out_tile_tagged.write_band(1, in_window, window=window)
-
-        # Without this, the untagged version is counted and eventually copied to s3 if it has data in it
-        os.remove(out_tile_no_tag)
+        # The tags (and the NoData value) are added to the tile in place, rather than the tile being copied window by
+        # window into a new, tagged tile. rasterio's update_tags() erased the data when tried on the existing tile
+        # (see https://rasterio.readthedocs.io/en/latest/topics/tags.html), but the GDAL bindings don't.
+        tags = uu.model_metadata_tags('std')
+        tags.update(units='year (2001, 2002, 2003...)',
+                    source='MODIS collection 6 burned area, https://modis-fire.umd.edu/files/MODIS_C6_BA_User_Guide_1.3.pdf',
+                    extent='global')
+        uu.set_metadata_tags(out_tile_no_tag, tags, nodata=0)
+
+        # The tagged tile gets the final name, so there's no untagged version left to be counted and copied to s3
+        os.rename(out_tile_no_tag, out_tile)
 
     # Prints information about the tile that was just processed
     uu.end_of_fx_summary(start, tile_id, cn.pattern_burn_year, no_upload)
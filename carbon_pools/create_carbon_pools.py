@@ -38,6 +38,64 @@ def mangrove_pool_ratio_dict(gain_table_simplified, tropical_dry, tropical_wet,
     return mang_x_pool_AGB_ratio
 
 
+# Loss tile that carbon in the emissions year is based on: Brazil's loss in the legal_Amazon_loss sensitivity analysis,
+# Mekong's loss where there is a Mekong-specific loss tile, and Hansen loss otherwise
+def loss_year_tile(tile_id, sensit_type):
+
+    if sensit_type == 'legal_Amazon_loss':
+        return '{}_{}.tif'.format(tile_id, cn.pattern_Brazil_annual_loss_processed)
+    elif os.path.exists('{}_{}.tif'.format(tile_id, cn.pattern_Mekong_loss_processed)):
+        return '{}_{}.tif'.format(tile_id, cn.pattern_Mekong_loss_processed)
+    else:
+        return '{0}_{1}.tif'.format(cn.pattern_loss, tile_id)
+
+
+# Aboveground carbon density in 2000 for one window. Where mangrove biomass is found, it is used. Otherwise, WHRC or JPL AGB is used.
+def calculate_AGC_2000(window_buffers, window, mangrove_biomass_2000_window, natrl_forest_biomass_2000_window):
+
+    has_mangrove = mangrove_biomass_2000_window != 0
+    agc_2000_window = uu.window_buffer(window_buffers, 'AGC_2000', window, 'float32')
+    uu.evaluate_expression('biomass * biomass_to_c', out=agc_2000_window, where=has_mangrove,
+                           biomass=mangrove_biomass_2000_window, biomass_to_c=cn.biomass_to_c_mangrove)
+    uu.evaluate_expression('biomass * biomass_to_c', out=agc_2000_window, where=~has_mangrove,
+                           biomass=natrl_forest_biomass_2000_window, biomass_to_c=cn.biomass_to_c_non_mangrove)
+
+    return agc_2000_window
+
+
+# Aboveground carbon density in the year of loss for one window, from the aboveground carbon density in 2000 and
+# the removals before the loss. Only loss pixels within the model extent have carbon.
+def calculate_AGC_emis_year(window_buffers, window, agc_2000_window, loss_year_window, gain_window,
+                            removal_forest_type_window, annual_gain_AGC_window, cumul_gain_AGCO2_window):
+
+    # Limits the AGC to the model extent
+    agc_2000_model_extent_window = uu.window_buffer(window_buffers, 'AGC_2000_model_extent', window, 'float32', fill=0)
+    uu.evaluate_expression('AGC', out=agc_2000_model_extent_window, where=removal_forest_type_window > 0, AGC=agc_2000_window)
+
+    # Creates a mask based on whether the pixels had loss and gain in them. Loss&gain pixels are 1, all else are 0.
+    # This is used to determine how much post-2000 carbon gain to add to AGC2000 pixels.
+    loss_gain_mask = np.where(loss_year_window == 0, 0, gain_window)
+
+    # Limits output to only pixels that had tree cover loss.
+    # Loss pixels that also have gain pixels are treated differently from loss-only pixels, and each pixel falls
+    # into only one of those categories, so they're written into the same output array.
+    AGC_emis_year_all = uu.window_buffer(window_buffers, 'AGC_emis_year', window, 'float32', fill=0)
+
+    # Calculates AGC in emission year for pixels that don't have gain and loss (excludes loss_gain_mask = 1).
+    # To do this, it adds all the accumulated carbon after 2000 to the carbon in 2000 (all accumulated C is emitted).
+    uu.evaluate_expression('AGC + cumul_gain_AGCO2 / c_to_co2', out=AGC_emis_year_all,
+                           where=(loss_year_window > 0) & (loss_gain_mask != 1),
+                           AGC=agc_2000_model_extent_window, cumul_gain_AGCO2=cumul_gain_AGCO2_window, c_to_co2=cn.c_to_co2)
+
+    # Calculates AGC in emission year for pixels that had loss & gain (excludes loss_gain_mask = 0).
+    # To do this, it adds only the portion of the gain that occurred before the loss year to the carbon in 2000.
+    uu.evaluate_expression('AGC + annual_gain_AGC * (loss_year - 1)', out=AGC_emis_year_all,
+                           where=(loss_year_window > 0) & (loss_gain_mask == 1),
+                           AGC=agc_2000_model_extent_window, annual_gain_AGC=annual_gain_AGC_window, loss_year=loss_year_window)
+
+    return AGC_emis_year_all
+
+
 # Creates aboveground carbon emitted_pools in 2000 and/or the year of loss (loss pixels only)
 def create_AGC(tile_id, sensit_type, carbon_pool_extent, no_upload):
 
@@ -62,55 +120,24 @@ def create_AGC(tile_id, sensit_type, carbon_pool_extent, no_upload):
     uu.print_log("  Reading input files for {}...".format(tile_id))
 
     # Loss tile name depends on the sensitivity analysis
-    if sensit_type == 'legal_Amazon_loss':
-        uu.print_log("    Brazil-specific loss tile found for {}".format(tile_id))
-        loss_year = '{}_{}.tif'.format(tile_id, cn.pattern_Brazil_annual_loss_processed)
-    elif os.path.exists('{}_{}.tif'.format(tile_id, cn.pattern_Mekong_loss_processed)):
-        uu.print_log("    Mekong-specific loss tile found for {}".format(tile_id))
-        loss_year = '{}_{}.tif'.format(tile_id, cn.pattern_Mekong_loss_processed)
-    else:
-        uu.print_log("    Hansen loss tile found for {}".format(tile_id))
-        loss_year = '{0}_{1}.tif'.format(cn.pattern_loss, tile_id)
+    loss_year = loss_year_tile(tile_id, sensit_type)
+    uu.print_log("    Loss tile for {0}: {1}".format(tile_id, loss_year))
 
     # This input is required to exist
     loss_year_src = rasterio.open(loss_year)
 
+    # Loss pixels in each row of the tile. Only rows with loss have carbon in the emissions year.
+    loss_row_counts = None
+    if 'loss' in carbon_pool_extent:
+        loss_row_counts = uu.read_row_counts(loss_year, loss_year_src.height)
+
     # Opens the input tiles if they exist
-    try:
-        annual_gain_AGC_src = rasterio.open(annual_gain_AGC)
-        uu.print_log("    Aboveground removal factor tile found for", tile_id)
-    except:
-        uu.print_log("    No aboveground removal factor tile for", tile_id)
-
-    try:
-        cumul_gain_AGCO2_src = rasterio.open(cumul_gain_AGCO2)
-        uu.print_log("    Gross aboveground removal tile found for", tile_id)
-    except:
-        uu.print_log("    No gross aboveground removal tile for", tile_id)
-
-    try:
-        mangrove_biomass_2000_src = rasterio.open(mangrove_biomass_2000)
-        uu.print_log("    Mangrove tile found for", tile_id)
-    except:
-        uu.print_log("    No mangrove tile for", tile_id)
-
-    try:
-        natrl_forest_biomass_2000_src = rasterio.open(natrl_forest_biomass_2000)
-        uu.print_log("    Biomass found for", tile_id)
-    except:
-        uu.print_log("    No biomass found for", tile_id)
-
-    try:
-        gain_src = rasterio.open(gain)
-        uu.print_log("    Gain tile found for", tile_id)
-    except:
-        uu.print_log("    No gain tile found for", tile_id)
-
-    try:
-        removal_forest_type_src = rasterio.open(removal_forest_type)
-        uu.print_log("    Removal type tile found for", tile_id)
-    except:
-        uu.print_log("    No removal type tile found for", tile_id)
+    annual_gain_AGC_src = uu.open_optional_input(annual_gain_AGC, tile_id)
+    cumul_gain_AGCO2_src = uu.open_optional_input(cumul_gain_AGCO2, tile_id)
+    mangrove_biomass_2000_src = uu.open_optional_input(mangrove_biomass_2000, tile_id)
+    natrl_forest_biomass_2000_src = uu.open_optional_input(natrl_forest_biomass_2000, tile_id)
+    gain_src = uu.open_optional_input(gain, tile_id)
+    removal_forest_type_src = uu.open_optional_input(removal_forest_type, tile_id)
 
 
     # Grabs the windows of a tile to iterate over the entire tif without running out of memory
@@ -162,92 +189,50 @@ def create_AGC(tile_id, sensit_type, carbon_pool_extent, no_upload):
 
     uu.print_log("  Creating aboveground carbon density for {0} using carbon_pool_extent '{1}'...".format(tile_id, carbon_pool_extent))
 
-    # Iterates across the windows (1 pixel strips) of the input tiles
-    for idx, window in windows:
-
-        # Reads the input tiles' windows. For windows from tiles that may not exist, an array of all 0s is created.
-        loss_year_window = loss_year_src.read(1, window=window)
-        try:
-            annual_gain_AGC_window = annual_gain_AGC_src.read(1, window=window)
-        except:
-            annual_gain_AGC_window = np.zeros((window.height, window.width), dtype='float32')
-        try:
-            cumul_gain_AGCO2_window = cumul_gain_AGCO2_src.read(1, window=window)
-        except:
-            cumul_gain_AGCO2_window = np.zeros((window.height, window.width), dtype='float32')
-        try:
-            removal_forest_type_window = removal_forest_type_src.read(1, window=window)
-        except:
-            removal_forest_type_window = np.zeros((window.height, window.width), dtype='uint8')
-        try:
-            gain_window = gain_src.read(1, window=window)
-        except:
-            gain_window = np.zeros((window.height, window.width), dtype='uint8')
-        try:
-            mangrove_biomass_2000_window = mangrove_biomass_2000_src.read(1, window=window)
-        except:
-            mangrove_biomass_2000_window = np.zeros((window.height, window.width), dtype='uint8')
-        try:
-            natrl_forest_biomass_2000_window = natrl_forest_biomass_2000_src.read(1, window=window)
-        except:
-            natrl_forest_biomass_2000_window = np.zeros((window.height, window.width), dtype='uint8')
-
-
-        # Creates aboveground carbon density in 2000. Where mangrove biomass is found, it is used. Otherwise, WHRC or JPL AGB is used.
-        # This is necessary for calculating AGC in emissions year.
-        agc_2000_window = np.where(mangrove_biomass_2000_window != 0,
-                                   mangrove_biomass_2000_window * cn.biomass_to_c_mangrove,
-                                   natrl_forest_biomass_2000_window * cn.biomass_to_c_non_mangrove
-                                   ).astype('float32')
-
-        # Only writes AGC2000 window to raster if user asked for carbon emitted_pools in 2000
-        if '2000' in carbon_pool_extent:
-            dst_AGC_2000.write_band(1, agc_2000_window, window=window)
+    # Input and output windows are calculated in the same buffers for every window
+    window_buffers = uu.new_window_buffers()
+    window_writer = uu.new_window_writer()
 
+    # Windows without loss have no carbon in the emissions year. Unless carbon in 2000 is also being created,
+    # they aren't read or written at all and are left as nodata in the output.
+    if '2000' not in carbon_pool_extent:
+        windows = ((idx, window) for idx, window in windows if uu.window_has_data(loss_row_counts, window))
 
-        # From here on, AGC in the year of emissions is being calculated
-        if 'loss' in carbon_pool_extent:
+    # Iterates across the windows (1 pixel strips) of the input tiles while the next windows' inputs are read
+    for idx, window in uu.prefetch_windows(windows, [loss_year_src, annual_gain_AGC_src, cumul_gain_AGCO2_src,
+                                                     removal_forest_type_src, gain_src, mangrove_biomass_2000_src,
+                                                     natrl_forest_biomass_2000_src], window_buffers):
 
-            # Limits the AGC to the model extent
-            agc_2000_model_extent_window = np.where(removal_forest_type_window > 0, agc_2000_window, 0)
-            # print(agc_2000_model_extent_window[0][0:5])
+        has_loss = uu.window_has_data(loss_row_counts, window)
 
-            # Creates a mask based on whether the pixels had loss and gain in them. Loss&gain pixels are 1, all else are 0.
-            # This is used to determine how much post-2000 carbon gain to add to AGC2000 pixels.
-            loss_gain_mask = np.ma.masked_where(loss_year_window == 0, gain_window).filled(0)
+        # Reads the input tiles' windows into reusable buffers. Windows from tiles that don't exist are a shared array of 0s.
+        loss_year_window = uu.read_window(loss_year_src, window, window_buffers)
+        annual_gain_AGC_window = uu.read_window(annual_gain_AGC_src, window, window_buffers, 'float32')
+        cumul_gain_AGCO2_window = uu.read_window(cumul_gain_AGCO2_src, window, window_buffers, 'float32')
+        removal_forest_type_window = uu.read_window(removal_forest_type_src, window, window_buffers)
+        gain_window = uu.read_window(gain_src, window, window_buffers)
+        mangrove_biomass_2000_window = uu.read_window(mangrove_biomass_2000_src, window, window_buffers)
+        natrl_forest_biomass_2000_window = uu.read_window(natrl_forest_biomass_2000_src, window, window_buffers)
 
-            # Loss pixels that also have gain pixels are treated differently from loss-only pixels.
-            # Calculates AGC in emission year for pixels that don't have gain and loss (excludes loss_gain_mask = 1).
-            # To do this, it adds all the accumulated carbon after 2000 to the carbon in 2000 (all accumulated C is emitted).
-            AGC_emis_year_non_loss_and_gain = agc_2000_model_extent_window + (cumul_gain_AGCO2_window / cn.c_to_co2)
-            # print(AGC_emis_year_non_loss_and_gain[0][0:5])
-            AGC_emis_year_non_loss_and_gain_masked = np.ma.masked_where(loss_gain_mask == 1, AGC_emis_year_non_loss_and_gain).filled(0)
-            # print(AGC_emis_year_non_loss_and_gain_masked[0][0:5])
 
+        # Creates aboveground carbon density in 2000. This is necessary for calculating AGC in emissions year.
+        agc_2000_window = calculate_AGC_2000(window_buffers, window, mangrove_biomass_2000_window, natrl_forest_biomass_2000_window)
 
-            # Calculates AGC in emission year for pixels that had loss & gain (excludes loss_gain_mask = 0).
-            # To do this, it adds only the portion of the gain that occurred before the loss year to the carbon in 2000.
-            gain_before_loss = annual_gain_AGC_window * (loss_year_window - 1)
-            AGC_emis_year_loss_and_gain = agc_2000_model_extent_window + gain_before_loss
-            AGC_emis_year_loss_and_gain_masked = np.ma.masked_where(loss_gain_mask == 0, AGC_emis_year_loss_and_gain).filled(0)
-            # print(AGC_emis_year_loss_and_gain_masked[0][0:5])
+        # Only writes AGC2000 window to raster if user asked for carbon emitted_pools in 2000
+        if '2000' in carbon_pool_extent:
+            uu.write_window_in_background(window_writer, dst_AGC_2000, agc_2000_window, window)
 
-            # Adds the loss year pixels that had loss&gain to those that didn't have loss&gain.
-            # Each pixel falls into only one of those categories.
-            AGC_emis_year_all = AGC_emis_year_non_loss_and_gain_masked + AGC_emis_year_loss_and_gain_masked
-            # print(AGC_emis_year_all[0][0:5])
 
-            # Limits output to only pixels that had tree cover loss.
-            AGC_emis_year_all = np.where(loss_year_window > 0, AGC_emis_year_all, 0)
-            # print(AGC_emis_year_all[0][0:5])
+        # From here on, AGC in the year of emissions is being calculated
+        if ('loss' in carbon_pool_extent) and has_loss:
 
-            # Converts the output to float32 since float64 is an unnecessary level of precision
-            AGC_emis_year_all = AGC_emis_year_all.astype('float32')
-            # print(AGC_emis_year_all[0][0:5])
+            AGC_emis_year_all = calculate_AGC_emis_year(window_buffers, window, agc_2000_window, loss_year_window, gain_window,
+                                                        removal_forest_type_window, annual_gain_AGC_window, cumul_gain_AGCO2_window)
 
             # Writes AGC in emissions year to raster
-            dst_AGC_emis_year.write_band(1, AGC_emis_year_all, window=window)
+            uu.write_window_in_background(window_writer, dst_AGC_emis_year, AGC_emis_year_all, window)
 
+    uu.finish_window_writes(window_writer)
 
 
     # Prints information about the tile that was just processed
@@ -257,6 +242,22 @@ def create_AGC(tile_id, sensit_type, carbon_pool_extent, no_upload):
         uu.end_of_fx_summary(start, tile_id, cn.pattern_AGC_2000, no_upload)
 
 
+# Belowground carbon density for one window of aboveground carbon density (in 2000 or in the year of loss),
+# written into the named window buffer. Mangrove pixels get the mangrove BGB:AGB ratio of their continent-ecozone
+# and all other pixels get the non-mangrove ratio.
+def calculate_BGC(window_buffers, name, window, AGC_window, removal_forest_type_window, mang_BGB_AGB_ratio_window):
+
+    is_mangrove = removal_forest_type_window == cn.mangrove_rank
+
+    # Applies mangrove-specific AGB:BGB ratios by ecozone (ratio applies to AGC:BGC as well)
+    BGC_window = uu.window_buffer(window_buffers, name, window, 'float32')
+    uu.evaluate_expression('AGC * ratio', out=BGC_window, where=is_mangrove, AGC=AGC_window, ratio=mang_BGB_AGB_ratio_window)
+    # Applies non-mangrove AGB:BGB ratio to all non-mangrove pixels, in the same array
+    uu.evaluate_expression('AGC * ratio', out=BGC_window, where=~is_mangrove, AGC=AGC_window, ratio=cn.below_to_above_non_mang)
+
+    return BGC_window
+
+
 # Creates belowground carbon tiles (both in 2000 and loss year)
 def create_BGC(tile_id, mang_BGB_AGB_ratio, carbon_pool_extent, sensit_type, no_upload):
 
@@ -266,6 +267,9 @@ def create_BGC(tile_id, mang_BGB_AGB_ratio, carbon_pool_extent, sensit_type, no_
     removal_forest_type = uu.sensit_tile_rename(sensit_type, tile_id, cn.pattern_removal_forest_type)
     cont_ecozone = uu.sensit_tile_rename(sensit_type, tile_id, cn.pattern_cont_eco_processed)
 
+    # Loss pixels in each row of the tile, if carbon in the emissions year is being created
+    loss_row_counts = None
+
     # For BGC 2000, opens AGC, names the output tile, creates the output tile
     if '2000' in carbon_pool_extent:
         AGC_2000 = uu.sensit_tile_rename(sensit_type, tile_id, cn.pattern_AGC_2000)
@@ -294,6 +298,8 @@ def create_BGC(tile_id, mang_BGB_AGB_ratio, carbon_pool_extent, sensit_type, no_
         kwargs = AGC_emis_year_src.meta
         kwargs.update(driver='GTiff', count=1, compress='lzw', nodata=0)
         windows = AGC_emis_year_src.block_windows(1)
+        # Loss pixels in each row of the tile. Only rows with loss have carbon in the emissions year.
+        loss_row_counts = uu.read_row_counts(loss_year_tile(tile_id, sensit_type), AGC_emis_year_src.height)
         output_pattern_list = [cn.pattern_BGC_emis_year]
         if sensit_type != 'std':
             output_pattern_list = uu.alter_patterns(sensit_type, output_pattern_list)
@@ -312,60 +318,63 @@ def create_BGC(tile_id, mang_BGB_AGB_ratio, carbon_pool_extent, sensit_type, no_
     uu.print_log("  Reading input files for {}...".format(tile_id))
 
     # Opens inputs that are used regardless of whether calculating BGC2000 or BGC in emissions year
-    try:
-        cont_ecozone_src = rasterio.open(cont_ecozone)
-        uu.print_log("    Continent-ecozone tile found for", tile_id)
-    except:
-        uu.print_log("    No Continent-ecozone tile found for", tile_id)
-
-    try:
-        removal_forest_type_src = rasterio.open(removal_forest_type)
-        uu.print_log("    Removal forest type tile found for", tile_id)
-    except:
-        uu.print_log("    No Removal forest type tile found for", tile_id)
+    cont_ecozone_src = uu.open_optional_input(cont_ecozone, tile_id)
+    removal_forest_type_src = uu.open_optional_input(removal_forest_type, tile_id)
 
     uu.print_log("  Creating belowground carbon density for {0} using carbon_pool_extent '{1}'...".format(tile_id, carbon_pool_extent))
 
-    # Iterates across the windows (1 pixel strips) of the input tiles
-    for idx, window in windows:
+    # Lookup array of the mangrove BGB:AGB ratio for each continent-ecozone code.
+    # Codes without a ratio keep their code, as when they were replaced key by key.
+    mang_BGB_AGB_lookup = uu.lookup_table(mang_BGB_AGB_ratio, default=None)
 
-        # Creates windows from inputs that are used regardless of whether calculating BGC2000 or BGC in emissions year
-        try:
-            cont_ecozone_window = cont_ecozone_src.read(1, window=window).astype('float32')
-        except:
-            cont_ecozone_window = np.zeros((window.height, window.width), dtype='float32')
+    # Input and output windows are calculated in the same buffers for every window
+    window_buffers = uu.new_window_buffers()
+    window_writer = uu.new_window_writer()
+
+    # Inputs whose windows are read ahead of the window being calculated
+    input_srcs = [cont_ecozone_src, removal_forest_type_src]
+    if '2000' in carbon_pool_extent:
+        input_srcs.append(AGC_2000_src)
+    if 'loss' in carbon_pool_extent:
+        input_srcs.append(AGC_emis_year_src)
+
+    # Windows without loss have no carbon in the emissions year. Unless carbon in 2000 is also being created,
+    # they aren't read or written at all and are left as nodata in the output.
+    if '2000' not in carbon_pool_extent:
+        windows = ((idx, window) for idx, window in windows if uu.window_has_data(loss_row_counts, window))
+
+    # Iterates across the windows (1 pixel strips) of the input tiles while the next windows' inputs are read
+    for idx, window in uu.prefetch_windows(windows, input_srcs, window_buffers):
 
-        try:
-            removal_forest_type_window = removal_forest_type_src.read(1, window=window)
-        except:
-            removal_forest_type_window = np.zeros((window.height, window.width))
+        has_loss = uu.window_has_data(loss_row_counts, window)
 
-        # Applies the mangrove BGB:AGB ratios (3 different ratios) to the ecozone raster to create a raster of BGB:AGB ratios
-        for key, value in mang_BGB_AGB_ratio.items():
-            cont_ecozone_window[cont_ecozone_window == key] = value
+        # Creates windows from inputs that are used regardless of whether calculating BGC2000 or BGC in emissions year
+        cont_ecozone_window = uu.read_window(cont_ecozone_src, window, window_buffers)
+        removal_forest_type_window = uu.read_window(removal_forest_type_src, window, window_buffers)
+
+        # Applies the mangrove BGB:AGB ratios (3 different ratios) to the ecozone raster to create a raster of BGB:AGB ratios.
+        # The continent-ecozone codes are integers, so they don't need to be converted to floats first.
+        cont_ecozone_window = uu.reclassify(cont_ecozone_window, mang_BGB_AGB_lookup, default=None)
 
         # Calculates BGC2000 from AGC2000
         if '2000' in carbon_pool_extent:
-            AGC_2000_window = AGC_2000_src.read(1, window=window)
+            AGC_2000_window = uu.read_window(AGC_2000_src, window, window_buffers)
 
-            # Applies mangrove-specific AGB:BGB ratios by ecozone (ratio applies to AGC:BGC as well)
-            mangrove_BGC_2000 = np.where(removal_forest_type_window == cn.mangrove_rank, AGC_2000_window * cont_ecozone_window, 0)
-            # Applies non-mangrove AGB:BGB ratio to all non-mangrove pixels
-            non_mangrove_BGC_2000 = np.where(removal_forest_type_window != cn.mangrove_rank, AGC_2000_window * cn.below_to_above_non_mang, 0)
-            # Combines mangrove and non-mangrove pixels
-            BGC_2000_window = mangrove_BGC_2000 + non_mangrove_BGC_2000
+            BGC_2000_window = calculate_BGC(window_buffers, 'BGC_2000', window, AGC_2000_window,
+                                            removal_forest_type_window, cont_ecozone_window)
 
-            dst_BGC_2000.write_band(1, BGC_2000_window, window=window)
+            uu.write_window_in_background(window_writer, dst_BGC_2000, BGC_2000_window, window)
 
         # Calculates BGC in emissions year from AGC in emissions year
-        if 'loss' in carbon_pool_extent:
-            AGC_emis_year_window = AGC_emis_year_src.read(1, window=window)
+        if ('loss' in carbon_pool_extent) and has_loss:
+            AGC_emis_year_window = uu.read_window(AGC_emis_year_src, window, window_buffers)
 
-            mangrove_BGC_emis_year = np.where(removal_forest_type_window == cn.mangrove_rank, AGC_emis_year_window * cont_ecozone_window, 0)
-            non_mangrove_BGC_emis_year = np.where(removal_forest_type_window != cn.mangrove_rank, AGC_emis_year_window * cn.below_to_above_non_mang, 0)
-            BGC_emis_year_window = mangrove_BGC_emis_year + non_mangrove_BGC_emis_year
+            BGC_emis_year_window = calculate_BGC(window_buffers, 'BGC_emis_year', window, AGC_emis_year_window,
+                                                 removal_forest_type_window, cont_ecozone_window)
 
-            dst_BGC_emis_year.write_band(1, BGC_emis_year_window, window=window)
+            uu.write_window_in_background(window_writer, dst_BGC_emis_year, BGC_emis_year_window, window)
+
+    uu.finish_window_writes(window_writer)
 
 
     # Prints information about the tile that was just processed
@@ -375,6 +384,66 @@ def create_BGC(tile_id, mang_BGB_AGB_ratio, carbon_pool_extent, sensit_type, no_
         uu.end_of_fx_summary(start, tile_id, cn.pattern_BGC_2000, no_upload)
 
 
+# Deadwood and litter carbon density in 2000 for one window. Non-mangrove deadwood and litter come from the
+# WHRC or JPL AGB and the ratio cube (see cn.deadwood_litter_AGB_ratios); mangrove deadwood and litter replace them
+# where there is mangrove biomass. Windows of tiles that don't exist are None.
+def calculate_deadwood_litter_2000(window_buffers, window, natrl_forest_biomass_window, bor_tem_trop_window,
+                                   elevation_window, precip_window, mangrove_biomass_2000_window, cont_ecozone_window,
+                                   AGB_ratio_cube, mang_deadwood_AGB_lookup, mang_litter_AGB_lookup):
+
+    # Populates the output raster's windows with 0s so that pixels without
+    # any of the forest types will have 0s.
+    # Starts with deadwood and litter at the extent of AGB2000.
+    # Script later clips to loss extent.
+    deadwood_2000_output = uu.window_buffer(window_buffers, 'deadwood_2000', window, 'float32', fill=0)
+    litter_2000_output = uu.window_buffer(window_buffers, 'litter_2000', window, 'float32', fill=0)
+
+    # This allows the script to bypass the few tiles that have mangrove biomass but not WHRC biomass
+    if natrl_forest_biomass_window is not None:
+
+        # Broad ecozone index (0 = tropical, 1 = boreal or temperate) and elevation and precipitation band indices
+        # of each pixel (see cn.deadwood_litter_AGB_ratios). Missing tiles are a single index for the whole window
+        # rather than a window of them: boreal or temperate for the broad ecozone and, for elevation and precipitation,
+        # the first band (as if they were 0 m or 0 mm).
+        ecozone_index = True
+        if bor_tem_trop_window is not None:
+            ecozone_index = bor_tem_trop_window != 1
+        elevation_band = 0
+        if elevation_window is not None:
+            elevation_band = np.digitize(elevation_window, cn.deadwood_litter_elevation_bands, right=True)
+        precip_band = 0
+        if precip_window is not None:
+            precip_band = np.digitize(precip_window, cn.deadwood_litter_precip_bands, right=True)
+
+        # Gathers the deadwood:AGB and litter:AGB ratios of each pixel from the ratio cube in one indexing step
+        ratios = AGB_ratio_cube[np.asarray(ecozone_index, dtype='uint8'), elevation_band, precip_band]
+
+        deadwood_2000_output = (natrl_forest_biomass_window * ratios[..., 0] * cn.biomass_to_c_non_mangrove).astype('float32')
+        litter_2000_output = (natrl_forest_biomass_window * ratios[..., 1] * cn.biomass_to_c_non_mangrove_litter).astype('float32')
+
+    # Replaces non-mangrove deadwood and litter with special mangrove deadwood and litter values if there is mangrove
+    if mangrove_biomass_2000_window is not None:
+
+        # Applies the mangrove deadwood:AGB and litter:AGB ratios (2 different ratios each) to the ecozone raster
+        # and multiplies the AGB in 2000 by them to get arrays of mangrove deadwood and litter
+        mangrove_deadwood = mangrove_biomass_2000_window * uu.reclassify(cont_ecozone_window, mang_deadwood_AGB_lookup, default=None) * cn.biomass_to_c_mangrove
+        mangrove_litter = mangrove_biomass_2000_window * uu.reclassify(cont_ecozone_window, mang_litter_AGB_lookup, default=None) * cn.biomass_to_c_mangrove
+
+        # Replaces non-mangrove deadwood and litter with mangrove deadwood and litter values
+        deadwood_2000_output = mangrove_deadwood + np.where(mangrove_biomass_2000_window > 0, 0, deadwood_2000_output).astype('float32')
+        litter_2000_output = mangrove_litter + np.where(mangrove_biomass_2000_window > 0, 0, litter_2000_output).astype('float32')
+
+    return deadwood_2000_output, litter_2000_output
+
+
+# Limits one window of a carbon pool in 2000 to the pixels with aboveground carbon in the emissions year.
+# Important to use AGC_emis_year_window extent and not loss years because AGC_emis_year_extent is already
+# clipped to the model extent, whereas some loss pixels are outside the extent of the model.
+def calculate_emis_year_extent(AGC_emis_year_window, pool_2000_window):
+
+    return np.where(AGC_emis_year_window > 0, pool_2000_window, 0).astype('float32')
+
+
 # Creates deadwood and litter carbon tiles (in 2000 and/or in loss year)
 def create_deadwood_litter(tile_id, mang_deadwood_AGB_ratio, mang_litter_AGB_ratio, carbon_pool_extent, sensit_type, no_upload):
 
@@ -393,6 +462,9 @@ def create_deadwood_litter(tile_id, mang_deadwood_AGB_ratio, mang_litter_AGB_rat
         natrl_forest_biomass_2000 = '{0}_{1}.tif'.format(tile_id, cn.pattern_WHRC_biomass_2000_unmasked)
         uu.print_log("Using WHRC biomass tile for {} sensitivity analysis".format(sensit_type))
 
+    # Loss pixels in each row of the tile, if carbon in the emissions year is being created
+    loss_row_counts = None
+
     # For deadwood and litter 2000, opens AGC, names the output tiles, creates the output tiles
     if '2000' in carbon_pool_extent:
         AGC_2000 = uu.sensit_tile_rename(sensit_type, tile_id, cn.pattern_AGC_2000)
@@ -431,6 +503,8 @@ def create_deadwood_litter(tile_id, mang_deadwood_AGB_ratio, mang_litter_AGB_rat
         kwargs = AGC_emis_year_src.meta
         kwargs.update(driver='GTiff', count=1, compress='lzw', nodata=0)
         windows = AGC_emis_year_src.block_windows(1)
+        # Loss pixels in each row of the tile. Only rows with loss have carbon in the emissions year.
+        loss_row_counts = uu.read_row_counts(loss_year_tile(tile_id, sensit_type), AGC_emis_year_src.height)
 
         output_pattern_list = [cn.pattern_deadwood_emis_year_2000, cn.pattern_litter_emis_year_2000]
         if sensit_type != 'std':
@@ -458,219 +532,94 @@ def create_deadwood_litter(tile_id, mang_deadwood_AGB_ratio, mang_litter_AGB_rat
 
     uu.print_log("  Reading input files for {}...".format(tile_id))
 
-    try:
-        precip_src = rasterio.open(precip)
-        uu.print_log("    Precipitation tile found for", tile_id)
-    except:
-        uu.print_log("    No precipitation tile biomass for", tile_id)
-
-    try:
-        elevation_src = rasterio.open(elevation)
-        uu.print_log("    Elevation tile found for", tile_id)
-    except:
-        uu.print_log("    No elevation tile biomass for", tile_id)
-
-    # Opens the mangrove biomass tile if it exists
-    try:
-        bor_tem_trop_src = rasterio.open(bor_tem_trop)
-        uu.print_log("    Boreal/temperate/tropical tile found for", tile_id)
-    except:
-        uu.print_log("    No boreal/temperate/tropical tile biomass for", tile_id)
-
-    # Opens the mangrove biomass tile if it exists
-    try:
-        mangrove_biomass_2000_src = rasterio.open(mangrove_biomass_2000)
-        uu.print_log("    Mangrove biomass found for", tile_id)
-    except:
-        uu.print_log("    No mangrove biomass for", tile_id)
-
-    # Opens the WHRC/JPL biomass tile if it exists
-    try:
-        natrl_forest_biomass_2000_src = rasterio.open(natrl_forest_biomass_2000)
-        uu.print_log("    Biomass found for", tile_id)
-    except:
-        uu.print_log("    No biomass for", tile_id)
-
-    # Opens the continent-ecozone tile if it exists
-    try:
-        cont_ecozone_src = rasterio.open(cont_eco)
-        uu.print_log("    Continent-ecozone tile found for", tile_id)
-    except:
-        uu.print_log("    No Continent-ecozone tile found for", tile_id)
+    # Opens the input tiles if they exist
+    precip_src = uu.open_optional_input(precip, tile_id)
+    elevation_src = uu.open_optional_input(elevation, tile_id)
+    bor_tem_trop_src = uu.open_optional_input(bor_tem_trop, tile_id)
+    mangrove_biomass_2000_src = uu.open_optional_input(mangrove_biomass_2000, tile_id)
+    natrl_forest_biomass_2000_src = uu.open_optional_input(natrl_forest_biomass_2000, tile_id)
+    cont_ecozone_src = uu.open_optional_input(cont_eco, tile_id)
 
     uu.print_log("  Creating deadwood and litter carbon density for {0} using carbon_pool_extent '{1}'...".format(tile_id, carbon_pool_extent))
 
-    # Iterates across the windows (1 pixel strips) of the input tiles
-    for idx, window in windows:
+    # Lookup arrays of the mangrove deadwood:AGB and litter:AGB ratios for each continent-ecozone code.
+    # Codes without a ratio keep their code, as when they were replaced key by key.
+    mang_deadwood_AGB_lookup = uu.lookup_table(mang_deadwood_AGB_ratio, default=None)
+    mang_litter_AGB_lookup = uu.lookup_table(mang_litter_AGB_ratio, default=None)
+
+    # Cube of the non-mangrove deadwood:AGB and litter:AGB ratios by broad ecozone, elevation band and precipitation band
+    AGB_ratio_cube = np.array(cn.deadwood_litter_AGB_ratios, dtype='float64')
+
+    # Input windows and the empty output windows are read and created in the same buffers for every window
+    window_buffers = uu.new_window_buffers()
+    window_writer = uu.new_window_writer()
 
-        # Populates the output raster's windows with 0s so that pixels without
-        # any of the forest types will have 0s.
-        # Starts with deadwood and litter at the extent of AGB2000.
-        # Script later clips to loss extent.
-        deadwood_2000_output = np.zeros((window.height, window.width), dtype='float32')
-        litter_2000_output = np.zeros((window.height, window.width), dtype='float32')
-
-        # Clips deadwood and litter outputs to AGC2000 and AGC in emissions year extents.
-        # # Note that deadwood and litter 2000 should already be at the extent of AGC2000 and not actually need
-        # # clipping to AGC2000; I'm doing that just as a formality. It feels more complete.
-        # try:
-        #     AGC_2000_window = AGC_2000_src.read(1, window=window)
-        # except:
-        #     AGC_2000_window = np.zeros((window.height, window.width), dtype='float32')
-        try:
-            AGC_emis_year_window = AGC_emis_year_src.read(1, window=window)
-        except:
-            AGC_emis_year_window = np.zeros((window.height, window.width), dtype='float32')
-        try:
-            cont_ecozone_window = cont_ecozone_src.read(1, window=window).astype('float32')
-        except:
-            cont_ecozone_window = np.zeros((window.height, window.width), dtype='float32')
-        try:
-            bor_tem_trop_window = bor_tem_trop_src.read(1, window=window)
-        except:
-            bor_tem_trop_window = np.zeros((window.height, window.width))
-        try:
-            precip_window = precip_src.read(1, window=window)
-        except:
-            precip_window = np.zeros((window.height, window.width))
-        try:
-            elevation_window = elevation_src.read(1, window=window)
-        except:
-            elevation_window = np.zeros((window.height, window.width))
-
-        # This allows the script to bypass the few tiles that have mangrove biomass but not WHRC biomass
-        if os.path.exists(natrl_forest_biomass_2000):
-
-            # Reads in the windows of each input file that definitely exist
-            natrl_forest_biomass_window = natrl_forest_biomass_2000_src.read(1, window=window)
-
-            # The deadwood and litter conversions generally come from here: https://cdm.unfccc.int/methodologies/ARmethodologies/tools/ar-am-tool-12-v3.0.pdf, p. 17-18
-            # They depend on the elevation, precipitation, and broad biome category (boreal/temperate/tropical).
-            # For some reason, the masks need to be named different variables for each equation.
-            # If they all have the same name (e.g., elev_mask and condition_mask are reused), then at least the condition_mask_4
-            # equation won't work properly.)
-
-            # Equation for elevation <= 2000, precip <= 1000, bor/temp/trop = 1 (tropical)
-            elev_mask_1 = elevation_window <= 2000
-            precip_mask_1 = precip_window <= 1000
-            ecozone_mask_1 = bor_tem_trop_window == 1
-            condition_mask_1 = elev_mask_1 & precip_mask_1 & ecozone_mask_1
-            agb_masked_1 = np.ma.array(natrl_forest_biomass_window, mask=np.invert(condition_mask_1))
-            deadwood_masked = agb_masked_1 * 0.02 * cn.biomass_to_c_non_mangrove
-            deadwood_2000_output = deadwood_2000_output + deadwood_masked.filled(0)
-            litter_masked = agb_masked_1 * 0.04 * cn.biomass_to_c_non_mangrove_litter
-            litter_2000_output = litter_2000_output + litter_masked.filled(0)
-
-
-            # Equation for elevation <= 2000, 1000 < precip <= 1600, bor/temp/trop = 1 (tropical)
-            elev_mask_2 = elevation_window <= 2000
-            precip_mask_2 = (precip_window > 1000) & (precip_window <= 1600)
-            ecozone_mask_2 = bor_tem_trop_window == 1
-            condition_mask_2 = elev_mask_2 & precip_mask_2 & ecozone_mask_2
-            agb_masked_2 = np.ma.array(natrl_forest_biomass_window, mask=np.invert(condition_mask_2))
-            deadwood_masked = agb_masked_2 * 0.01 * cn.biomass_to_c_non_mangrove
-            deadwood_2000_output = deadwood_2000_output + deadwood_masked.filled(0)
-            litter_masked = agb_masked_2 * 0.01 * cn.biomass_to_c_non_mangrove_litter
-            litter_2000_output = litter_2000_output + litter_masked.filled(0)
-
-            # Equation for elevation <= 2000, precip > 1600, bor/temp/trop = 1 (tropical)
-            elev_mask_3 = elevation_window <= 2000
-            precip_mask_3 = precip_window > 1600
-            ecozone_mask_3 = bor_tem_trop_window == 1
-            condition_mask_3 = elev_mask_3 & precip_mask_3 & ecozone_mask_3
-            agb_masked_3 = np.ma.array(natrl_forest_biomass_window, mask=np.invert(condition_mask_3))
-            deadwood_masked = agb_masked_3 * 0.06 * cn.biomass_to_c_non_mangrove
-            deadwood_2000_output = deadwood_2000_output + deadwood_masked.filled(0)
-            litter_masked = agb_masked_3 * 0.01 * cn.biomass_to_c_non_mangrove_litter
-            litter_2000_output = litter_2000_output + litter_masked.filled(0)
-
-            # Equation for elevation > 2000, precip = any value, bor/temp/trop = 1 (tropical)
-            elev_mask_4 = elevation_window > 2000
-            ecozone_mask_4 = bor_tem_trop_window == 1
-            condition_mask_4 = elev_mask_4 & ecozone_mask_4
-            agb_masked_4 = np.ma.array(natrl_forest_biomass_window, mask=np.invert(condition_mask_4))
-            deadwood_masked = agb_masked_4 * 0.07 * cn.biomass_to_c_non_mangrove
-            deadwood_2000_output = deadwood_2000_output + deadwood_masked.filled(0)
-            litter_masked = agb_masked_4 * 0.01 * cn.biomass_to_c_non_mangrove_litter
-            litter_2000_output = litter_2000_output + litter_masked.filled(0)
-
-            # Equation for elevation = any value, precip = any value, bor/temp/trop = 2 or 3 (boreal or temperate)
-            ecozone_mask_5 = bor_tem_trop_window != 1
-            condition_mask_5 = ecozone_mask_5
-            agb_masked_5 = np.ma.array(natrl_forest_biomass_window, mask=np.invert(condition_mask_5))
-            deadwood_masked = agb_masked_5 * 0.08 * cn.biomass_to_c_non_mangrove
-            deadwood_2000_output = deadwood_2000_output + deadwood_masked.filled(0)
-            litter_masked = agb_masked_5 * 0.04 * cn.biomass_to_c_non_mangrove_litter
-            litter_2000_output = litter_2000_output + litter_masked.filled(0)
-
-            deadwood_2000_output = deadwood_2000_output.astype('float32')
-            litter_2000_output = litter_2000_output.astype('float32')
-
-        # Replaces non-mangrove deadwood and litter with special mangrove deadwood and litter values if there is mangrove
-        if os.path.exists(mangrove_biomass_2000):
-
-            # Reads in the window for mangrove biomass if it exists
-            mangrove_biomass_2000_window = mangrove_biomass_2000_src.read(1, window=window)
-
-            # Applies the mangrove deadwood:AGB ratios (2 different ratios) to the ecozone raster to create a raster of deadwood:AGB ratios
-            for key, value in mang_deadwood_AGB_ratio.items():
-                cont_ecozone_window[cont_ecozone_window == key] = value
-
-            # Multiplies the AGB in the loss year (2000 for deadwood) by the correct mangrove deadwood:AGB ratio to get an array of deadwood
-            mangrove_C_final = mangrove_biomass_2000_window * cont_ecozone_window * cn.biomass_to_c_mangrove
-
-            # Replaces non-mangrove deadwood with mangrove deadwood values
-            deadwood_2000_output = np.ma.masked_where(mangrove_biomass_2000_window > 0, deadwood_2000_output)
-            deadwood_2000_output = deadwood_2000_output.filled(0)
-
-            # Combines the mangrove and non-mangrove deadwood arrays into a single array
-            deadwood_2000_output = mangrove_C_final + deadwood_2000_output
-            deadwood_2000_output.astype('float32')
-
-            # # Masks the deadwood 2000 to the AGC2000 extent. This shouldn't actually change the extent of the deadwood at all.
-            # # Just doing it because it feels more complete.
-            # deadwood_2000_output = np.where(AGC_2000_window > 0, deadwood_2000_output, 0).astype('float32')
-
-
-            # Same as above but for litter
-            try:
-                cont_ecozone_window = cont_ecozone_src.read(1, window=window).astype('float32')
-            except:
-                cont_ecozone_window = np.zeros((window.height, window.width), dtype='float32')
-
-            # Applies the mangrove deadwood:AGB ratios (2 different ratios) to the ecozone raster to create a raster of deadwood:AGB ratios
-            for key, value in mang_litter_AGB_ratio.items():
-                cont_ecozone_window[cont_ecozone_window == key] = value
-
-            mangrove_C_final = mangrove_biomass_2000_window * cont_ecozone_window * cn.biomass_to_c_mangrove
-
-            litter_2000_output = np.ma.masked_where(mangrove_biomass_2000_window > 0, litter_2000_output)
-            litter_2000_output = litter_2000_output.filled(0)
-
-            litter_2000_output = mangrove_C_final + litter_2000_output
-            litter_2000_output.astype('float32')
-
-            # litter_2000_output = np.where(AGC_2000_window > 0, litter_2000_output, 0).astype('float32')
+    # Inputs whose windows are read ahead of the window being calculated. Only the inputs that are used are read.
+    input_srcs = []
+    if natrl_forest_biomass_2000_src is not None:
+        input_srcs.extend([natrl_forest_biomass_2000_src, bor_tem_trop_src, elevation_src, precip_src])
+    if mangrove_biomass_2000_src is not None:
+        input_srcs.extend([mangrove_biomass_2000_src, cont_ecozone_src])
+    if 'loss' in carbon_pool_extent:
+        input_srcs.append(AGC_emis_year_src)
+
+    # Windows without loss have no carbon in the emissions year. Unless carbon in 2000 is also being created,
+    # they aren't read or written at all and are left as nodata in the output.
+    if '2000' not in carbon_pool_extent:
+        windows = ((idx, window) for idx, window in windows if uu.window_has_data(loss_row_counts, window))
+
+    # Iterates across the windows (1 pixel strips) of the input tiles while the next windows' inputs are read
+    for idx, window in uu.prefetch_windows(windows, input_srcs, window_buffers):
+
+        has_loss = uu.window_has_data(loss_row_counts, window)
+
+        # Reads in the windows of the inputs that exist. Inputs that don't exist are None rather than windows of 0s.
+        natrl_forest_biomass_window = None
+        bor_tem_trop_window = None
+        elevation_window = None
+        precip_window = None
+        if natrl_forest_biomass_2000_src is not None:
+            natrl_forest_biomass_window = uu.read_window(natrl_forest_biomass_2000_src, window, window_buffers)
+            if bor_tem_trop_src is not None:
+                bor_tem_trop_window = uu.read_window(bor_tem_trop_src, window, window_buffers)
+            if elevation_src is not None:
+                elevation_window = uu.read_window(elevation_src, window, window_buffers)
+            if precip_src is not None:
+                precip_window = uu.read_window(precip_src, window, window_buffers)
+
+        mangrove_biomass_2000_window = None
+        cont_ecozone_window = None
+        if mangrove_biomass_2000_src is not None:
+            mangrove_biomass_2000_window = uu.read_window(mangrove_biomass_2000_src, window, window_buffers)
+            cont_ecozone_window = uu.read_window(cont_ecozone_src, window, window_buffers)
+
+        deadwood_2000_output, litter_2000_output = calculate_deadwood_litter_2000(
+            window_buffers, window, natrl_forest_biomass_window, bor_tem_trop_window, elevation_window, precip_window,
+            mangrove_biomass_2000_window, cont_ecozone_window, AGB_ratio_cube, mang_deadwood_AGB_lookup, mang_litter_AGB_lookup)
 
         # Only writes deadwood and litter 2000 to rasters if output in 2000 is desired
         if '2000' in carbon_pool_extent:
 
             # Writes deadwood and litter 2000 to rasters
-            dst_deadwood_2000.write_band(1, deadwood_2000_output, window=window)
-            dst_litter_2000.write_band(1, litter_2000_output, window=window)
+            uu.write_window_in_background(window_writer, dst_deadwood_2000, deadwood_2000_output, window)
+            uu.write_window_in_background(window_writer, dst_litter_2000, litter_2000_output, window)
 
 
         # Only if calculating carbon emitted_pools in emissions year are deadwood and litter clipped to AGC emissions year pixels.
         # Important to use AGC_emis_year_window extent and not loss years because AGC_emis_year_extent is already
         # clipped to the model extent, whereas some loss pixels are outside the extent of the model.
-        if 'loss' in carbon_pool_extent:
+        if ('loss' in carbon_pool_extent) and has_loss:
+
+            AGC_emis_year_window = uu.read_window(AGC_emis_year_src, window, window_buffers)
 
-            deadwood_emis_year_output = np.where(AGC_emis_year_window > 0, deadwood_2000_output, 0).astype('float32')
-            litter_emis_year_output = np.where(AGC_emis_year_window > 0, litter_2000_output, 0).astype('float32')
+            deadwood_emis_year_output = calculate_emis_year_extent(AGC_emis_year_window, deadwood_2000_output)
+            litter_emis_year_output = calculate_emis_year_extent(AGC_emis_year_window, litter_2000_output)
 
             # Writes the output window to the output file
-            dst_deadwood_emis_year.write_band(1, deadwood_emis_year_output, window=window)
-            dst_litter_emis_year.write_band(1, litter_emis_year_output, window=window)
+            uu.write_window_in_background(window_writer, dst_deadwood_emis_year, deadwood_emis_year_output, window)
+            uu.write_window_in_background(window_writer, dst_litter_emis_year, litter_emis_year_output, window)
+
+    uu.finish_window_writes(window_writer)
 
 
     # Prints information about the tile that was just processed
@@ -680,6 +629,17 @@ def create_deadwood_litter(tile_id, mang_deadwood_AGB_ratio, mang_litter_AGB_rat
         uu.end_of_fx_summary(start, tile_id, cn.pattern_deadwood_2000, no_upload)
 
 
+# Soil carbon density in the emissions year for one window: soil carbon in 2000 in pixels with AGC in the emissions year
+def calculate_soil_emis_year(AGC_emis_year_window, soil_full_extent_window):
+
+    # Removes AGC pixels that do not have a loss year and fills with 0s
+    soil_output = np.ma.masked_where(AGC_emis_year_window == 0, soil_full_extent_window)
+    soil_output = soil_output.filled(0)
+
+    # Converts the output to uint16 since the soil C density is integers
+    return soil_output.astype('uint16')
+
+
 # Creates soil carbon tiles in loss pixels only
 def create_soil_emis_extent(tile_id, pattern, sensit_type, no_upload):
 
@@ -708,6 +668,9 @@ def create_soil_emis_extent(tile_id, pattern, sensit_type, no_upload):
     # Grabs the windows of the tile (stripes) to iterate over the entire tif without running out of memory
     windows = AGC_emis_year_src.block_windows(1)
 
+    # Loss pixels in each row of the tile. Only rows with loss have soil carbon in the emissions year.
+    loss_row_counts = uu.read_row_counts(loss_year_tile(tile_id, sensit_type), AGC_emis_year_src.height)
+
     # Updates kwargs for the output dataset.
     # Need to update data type to float 32 so that it can handle fractional carbon emitted_pools
     kwargs.update(
@@ -735,16 +698,15 @@ def create_soil_emis_extent(tile_id, pattern, sensit_type, no_upload):
     # Iterates across the windows (1 pixel strips) of the input tiles
     for idx, window in windows:
 
+        # Windows without loss are left as nodata in the output
+        if not uu.window_has_data(loss_row_counts, window):
+            continue
+
         # Reads in the windows of each input file that definitely exist
         AGC_emis_year_window = AGC_emis_year_src.read(1, window=window)
         soil_full_extent_window = soil_full_extent_src.read(1, window=window)
 
-        # Removes AGC pixels that do not have a loss year and fills with 0s
-        soil_output = np.ma.masked_where(AGC_emis_year_window == 0, soil_full_extent_window)
-        soil_output = soil_output.filled(0)
-
-        # Converts the output to uint16 since the soil C density is integers
-        soil_output = soil_output.astype('uint16')
+        soil_output = calculate_soil_emis_year(AGC_emis_year_window, soil_full_extent_window)
 
         # Writes the output window to the output file
         dst_soil_emis_year.write_band(1, soil_output, window=window)
@@ -753,6 +715,18 @@ def create_soil_emis_extent(tile_id, pattern, sensit_type, no_upload):
     uu.end_of_fx_summary(start, tile_id, pattern, no_upload)
 
 
+# Total carbon density for one window of the carbon pools (in 2000 or in the year of loss), written into the named window buffer
+def calculate_total_C(window_buffers, name, window, AGC_window, BGC_window, deadwood_window, litter_window, soil_window):
+
+    # Converts the output to float32 since float64 is an unnecessary level of precision
+    total_C_window = uu.window_buffer(window_buffers, name, window, 'float32')
+    uu.evaluate_expression('AGC + BGC + deadwood + litter + soil', out=total_C_window,
+                           AGC=AGC_window, BGC=BGC_window, deadwood=deadwood_window,
+                           litter=litter_window, soil=soil_window)
+
+    return total_C_window
+
+
 # Creates total carbon tiles (both in 2000 and loss year)
 def create_total_C(tile_id, carbon_pool_extent, sensit_type, no_upload):
 
@@ -773,11 +747,7 @@ def create_total_C(tile_id, carbon_pool_extent, sensit_type, no_upload):
         BGC_2000_src = rasterio.open(BGC_2000)
         deadwood_2000_src = rasterio.open(deadwood_2000)
         litter_2000_src = rasterio.open(litter_2000)
-        try:
-            soil_2000_src = rasterio.open(soil_2000)
-            uu.print_log("   Soil C 2000 tile found for", tile_id)
-        except:
-            uu.print_log("    No soil C 2000 tile found for", tile_id)
+        soil_2000_src = uu.open_optional_input(soil_2000, tile_id)
 
         kwargs = AGC_2000_src.meta
         kwargs.update(driver='GTiff', count=1, compress='lzw', nodata=0)
@@ -807,11 +777,7 @@ def create_total_C(tile_id, carbon_pool_extent, sensit_type, no_upload):
         BGC_emis_year_src = rasterio.open(BGC_emis_year)
         deadwood_emis_year_src = rasterio.open(deadwood_emis_year)
         litter_emis_year_src = rasterio.open(litter_emis_year)
-        try:
-            soil_emis_year_src = rasterio.open(soil_emis_year)
-            uu.print_log("   Soil C emission year tile found for", tile_id)
-        except:
-            uu.print_log("    No soil C emission year tile found for", tile_id)
+        soil_emis_year_src = uu.open_optional_input(soil_emis_year, tile_id)
 
         kwargs = AGC_emis_year_src.meta
         kwargs.update(driver='GTiff', count=1, compress='lzw', nodata=0)
@@ -833,49 +799,55 @@ def create_total_C(tile_id, carbon_pool_extent, sensit_type, no_upload):
 
     uu.print_log("  Creating total carbon density for {0} using carbon_pool_extent '{1}'...".format(tile_id, carbon_pool_extent))
 
-    # Iterates across the windows (1 pixel strips) of the input tiles
-    for idx, window in windows:
+    # Input and output windows are calculated in the same buffers for every window
+    window_buffers = uu.new_window_buffers()
+    window_writer = uu.new_window_writer()
 
-        if '2000' in carbon_pool_extent:
+    # Inputs whose windows are read ahead of the window being calculated
+    input_srcs = []
+    if '2000' in carbon_pool_extent:
+        input_srcs.extend([AGC_2000_src, BGC_2000_src, deadwood_2000_src, litter_2000_src, soil_2000_src])
+    if 'loss' in carbon_pool_extent:
+        input_srcs.extend([AGC_emis_year_src, BGC_emis_year_src, deadwood_emis_year_src, litter_emis_year_src, soil_emis_year_src])
+
+    # Iterates across the windows (1 pixel strips) of the input tiles while the next windows' inputs are read
+    for idx, window in uu.prefetch_windows(windows, input_srcs, window_buffers):
 
-            # Reads in the windows of each input file that definitely exist
-            AGC_2000_window = AGC_2000_src.read(1, window=window)
-            BGC_2000_window = BGC_2000_src.read(1, window=window)
-            deadwood_2000_window = deadwood_2000_src.read(1, window=window)
-            litter_2000_window = litter_2000_src.read(1, window=window)
-            try:
-                soil_2000_window = soil_2000_src.read(1, window=window)
-            except:
-                soil_2000_window = np.zeros((window.height, window.width))
+        if '2000' in carbon_pool_extent:
 
-            total_C_2000_window = AGC_2000_window + BGC_2000_window + deadwood_2000_window + litter_2000_window + soil_2000_window
+            # Reads in the windows of each input file that definitely exist.
+            # A missing soil C tile is read as a shared window of 0s with soil C's data type.
+            AGC_2000_window = uu.read_window(AGC_2000_src, window, window_buffers)
+            BGC_2000_window = uu.read_window(BGC_2000_src, window, window_buffers)
+            deadwood_2000_window = uu.read_window(deadwood_2000_src, window, window_buffers)
+            litter_2000_window = uu.read_window(litter_2000_src, window, window_buffers)
+            soil_2000_window = uu.read_window(soil_2000_src, window, window_buffers, 'uint16')
 
-            # Converts the output to float32 since float64 is an unnecessary level of precision
-            total_C_2000_window = total_C_2000_window.astype('float32')
+            total_C_2000_window = calculate_total_C(window_buffers, 'total_C_2000', window, AGC_2000_window, BGC_2000_window,
+                                                    deadwood_2000_window, litter_2000_window, soil_2000_window)
 
             # Writes the output window to the output file
-            dst_total_C_2000.write_band(1, total_C_2000_window, window=window)
+            uu.write_window_in_background(window_writer, dst_total_C_2000, total_C_2000_window, window)
 
 
         if 'loss' in carbon_pool_extent:
 
-            # Reads in the windows of each input file that definitely exist
-            AGC_emis_year_window = AGC_emis_year_src.read(1, window=window)
-            BGC_emis_year_window = BGC_emis_year_src.read(1, window=window)
-            deadwood_emis_year_window = deadwood_emis_year_src.read(1, window=window)
-            litter_emis_year_window = litter_emis_year_src.read(1, window=window)
-            try:
-                soil_emis_year_window = soil_emis_year_src.read(1, window=window)
-            except:
-                soil_emis_year_window = np.zeros((window.height, window.width))
-
-            total_C_emis_year_window = AGC_emis_year_window + BGC_emis_year_window + deadwood_emis_year_window + litter_emis_year_window + soil_emis_year_window
+            # Reads in the windows of each input file that definitely exist.
+            # A missing soil C tile is read as a shared window of 0s with soil C's data type.
+            AGC_emis_year_window = uu.read_window(AGC_emis_year_src, window, window_buffers)
+            BGC_emis_year_window = uu.read_window(BGC_emis_year_src, window, window_buffers)
+            deadwood_emis_year_window = uu.read_window(deadwood_emis_year_src, window, window_buffers)
+            litter_emis_year_window = uu.read_window(litter_emis_year_src, window, window_buffers)
+            soil_emis_year_window = uu.read_window(soil_emis_year_src, window, window_buffers, 'uint16')
 
-            # Converts the output to float32 since float64 is an unnecessary level of precision
-            total_C_emis_year_window = total_C_emis_year_window.astype('float32')
+            total_C_emis_year_window = calculate_total_C(window_buffers, 'total_C_emis_year', window, AGC_emis_year_window,
+                                                         BGC_emis_year_window, deadwood_emis_year_window,
+                                                         litter_emis_year_window, soil_emis_year_window)
 
             # Writes the output window to the output file
-            dst_total_C_emis_year.write_band(1, total_C_emis_year_window, window=window)
+            uu.write_window_in_background(window_writer, dst_total_C_emis_year, total_C_emis_year_window, window)
+
+    uu.finish_window_writes(window_writer)
 
 
     # Prints information about the tile that was just processed
@@ -20,7 +20,6 @@ This extent argument determines which AGC function is used and how the outputs o
 Carbon emitted_pools in both 2000 and in the year of loss can be created in a single run by using '2000,loss' or 'loss,2000'.
 '''
 
-import multiprocessing
 import pandas as pd
 from subprocess import Popen, PIPE, STDOUT, check_call
 import datetime
@@ -197,24 +196,10 @@ def mp_create_carbon_pools(sensit_type, tile_id_list, carbon_pool_extent, run_da
                                                                                             cn.litter_to_above_subtrop_mang)
 
     uu.print_log("Creating tiles of aboveground carbon in {}".format(carbon_pool_extent))
-    if cn.count == 96:
-        # More processors can be used for loss carbon pools than for 2000 carbon pools
-        if carbon_pool_extent == 'loss':
-            if sensit_type == 'biomass_swap':
-                processes = 16  # 16 processors = XXX GB peak
-            else:
-                processes = 20  # 25 processors > 750 GB peak; 16 = 560 GB peak;
-                # 18 = 570 GB peak; 19 = 620 GB peak; 20 = 690 GB peak (stops at 600, then increases slowly); 21 > 750 GB peak
-        else: # For 2000, or loss & 2000
-            processes = 15  # 12 processors = 490 GB peak (stops around 455, then increases slowly); 15 = XXX GB peak
-    else:
-        processes = 2
-    uu.print_log('AGC loss year max processors=', processes)
-    pool = multiprocessing.Pool(processes)
-    pool.map(partial(create_carbon_pools.create_AGC,
-                     sensit_type=sensit_type, carbon_pool_extent=carbon_pool_extent, no_upload=no_upload), tile_id_list)
-    pool.close()
-    pool.join()
+    # Tiles are admitted into the pool as long as their recorded peak memory fits in the machine's memory budget
+    uu.memory_aware_map(partial(create_carbon_pools.create_AGC, sensit_type=sensit_type,
+                                carbon_pool_extent=carbon_pool_extent, no_upload=no_upload),
+                        tile_id_list, 'carbon_pools_AGC_{}'.format(carbon_pool_extent))
 
     # # For single processor use
     # for tile_id in tile_id_list:
@@ -246,24 +231,10 @@ def mp_create_carbon_pools(sensit_type, tile_id_list, carbon_pool_extent, run_da
 
     uu.print_log("Creating tiles of belowground carbon in {}".format(carbon_pool_extent))
     # Creates a single filename pattern to pass to the multiprocessor call
-    if cn.count == 96:
-        # More processors can be used for loss carbon pools than for 2000 carbon pools
-        if carbon_pool_extent == 'loss':
-            if sensit_type == 'biomass_swap':
-                processes = 30  # 30 processors = XXX GB peak
-            else:
-                processes = 39  # 20 processors = 370 GB peak; 32 = 590 GB peak; 36 = 670 GB peak; 38 = 690 GB peak; 39 = XXX GB peak
-        else: # For 2000, or loss & 2000
-            processes = 30  # 20 processors = 370 GB peak; 25 = 460 GB peak; 30 = XXX GB peak
-    else:
-        processes = 2
-    uu.print_log('BGC max processors=', processes)
-    pool = multiprocessing.Pool(processes)
-    pool.map(partial(create_carbon_pools.create_BGC, mang_BGB_AGB_ratio=mang_BGB_AGB_ratio,
-                     carbon_pool_extent=carbon_pool_extent,
-                     sensit_type=sensit_type, no_upload=no_upload), tile_id_list)
-    pool.close()
-    pool.join()
+    # Tiles are admitted into the pool as long as their recorded peak memory fits in the machine's memory budget
+    uu.memory_aware_map(partial(create_carbon_pools.create_BGC, mang_BGB_AGB_ratio=mang_BGB_AGB_ratio,
+                                carbon_pool_extent=carbon_pool_extent, sensit_type=sensit_type, no_upload=no_upload),
+                        tile_id_list, 'carbon_pools_BGC_{}'.format(carbon_pool_extent))
 
     # # For single processor use
     # for tile_id in tile_id_list:
@@ -301,30 +272,12 @@ def mp_create_carbon_pools(sensit_type, tile_id_list, carbon_pool_extent, run_da
 
 
     uu.print_log("Creating tiles of deadwood and litter carbon in {}".format(carbon_pool_extent))
-    if cn.count == 96:
-        # More processors can be used for loss carbon pools than for 2000 carbon pools
-        if carbon_pool_extent == 'loss':
-            if sensit_type == 'biomass_swap':
-                processes = 10  # 10 processors = XXX GB peak
-            else:
-                processes = 15  # 32 processors = >750 GB peak; 24 > 750 GB peak; 14 = 685 GB peak (stops around 600, then increases very very slowly); 15 = 700 GB peak
-        else: # For 2000, or loss & 2000
-            ### Note: deleted precip, elevation, and WHRC AGB tiles at equatorial latitudes as deadwood and litter were produced.
-            ### There wouldn't have been enough room for all deadwood and litter otherwise.
-            ### For example, when deadwood and litter generation started getting up to around 50N, I deleted
-            ### 00N precip, elevation, and WHRC AGB. I deleted all of those from 30N to 20S.
-            processes = 16  # 7 processors = 320 GB peak; 14 = 620 GB peak; 16 = XXX GB peak
-    else:
-        processes = 2
-    uu.print_log('Deadwood and litter max processors=', processes)
-    pool = multiprocessing.Pool(processes)
-    pool.map(
-        partial(create_carbon_pools.create_deadwood_litter, mang_deadwood_AGB_ratio=mang_deadwood_AGB_ratio,
-                mang_litter_AGB_ratio=mang_litter_AGB_ratio,
-                carbon_pool_extent=carbon_pool_extent,
-                sensit_type=sensit_type, no_upload=no_upload), tile_id_list)
-    pool.close()
-    pool.join()
+    # Tiles are admitted into the pool as long as their recorded peak memory fits in the machine's memory budget
+    uu.memory_aware_map(partial(create_carbon_pools.create_deadwood_litter,
+                                mang_deadwood_AGB_ratio=mang_deadwood_AGB_ratio,
+                                mang_litter_AGB_ratio=mang_litter_AGB_ratio, carbon_pool_extent=carbon_pool_extent,
+                                sensit_type=sensit_type, no_upload=no_upload),
+                        tile_id_list, 'carbon_pools_deadwood_litter_{}'.format(carbon_pool_extent))
 
     # # For single processor use
     # for tile_id in tile_id_list:
@@ -372,23 +325,10 @@ def mp_create_carbon_pools(sensit_type, tile_id_list, carbon_pool_extent, run_da
         else:
             pattern = output_pattern_list[10]
 
-        if cn.count == 96:
-            # More processors can be used for loss carbon pools than for 2000 carbon pools
-            if carbon_pool_extent == 'loss':
-                if sensit_type == 'biomass_swap':
-                    processes = 36  # 36 processors = XXX GB peak
-                else:
-                    processes = 44  # 24 processors = 360 GB peak; 32 = 490 GB peak; 38 = 580 GB peak; 42 = 640 GB peak; 44 = XXX GB peak
-            else: # For 2000, or loss & 2000
-                processes = 12  # 12 processors = XXX GB peak
-        else:
-            processes = 2
-        uu.print_log('Soil carbon loss year max processors=', processes)
-        pool = multiprocessing.Pool(processes)
-        pool.map(partial(create_carbon_pools.create_soil_emis_extent, pattern=pattern,
-                         sensit_type=sensit_type, no_upload=no_upload), tile_id_list)
-        pool.close()
-        pool.join()
+        # Tiles are admitted into the pool as long as their recorded peak memory fits in the machine's memory budget
+        uu.memory_aware_map(partial(create_carbon_pools.create_soil_emis_extent, pattern=pattern,
+                                    sensit_type=sensit_type, no_upload=no_upload),
+                            tile_id_list, 'carbon_pools_soil_emis_year_{}'.format(carbon_pool_extent))
 
         # # For single processor use
         # for tile_id in tile_id_list:
@@ -429,23 +369,10 @@ def mp_create_carbon_pools(sensit_type, tile_id_list, carbon_pool_extent, run_da
 
 
     uu.print_log("Creating tiles of total carbon")
-    if cn.count == 96:
-        # More processors can be used for loss carbon pools than for 2000 carbon pools
-        if carbon_pool_extent == 'loss':
-            if sensit_type == 'biomass_swap':
-                processes = 14  # 14 processors = XXX GB peak
-            else:
-                processes = 19  # 20 processors > 750 GB peak (by just a bit, I think); 15 = 550 GB peak; 18 = 660 GB peak; 19 = XXX GB peak
-        else: # For 2000, or loss & 2000
-            processes = 12  # 12 processors = XXX GB peak
-    else:
-        processes = 2
-    uu.print_log('Total carbon loss year max processors=', processes)
-    pool = multiprocessing.Pool(processes)
-    pool.map(partial(create_carbon_pools.create_total_C, carbon_pool_extent=carbon_pool_extent,
-                     sensit_type=sensit_type, no_upload=no_upload), tile_id_list)
-    pool.close()
-    pool.join()
+    # Tiles are admitted into the pool as long as their recorded peak memory fits in the machine's memory budget
+    uu.memory_aware_map(partial(create_carbon_pools.create_total_C, carbon_pool_extent=carbon_pool_extent,
+                                sensit_type=sensit_type, no_upload=no_upload),
+                        tile_id_list, 'carbon_pools_total_C_{}'.format(carbon_pool_extent))
 
     # # For single processor use
     # for tile_id in tile_id_list:
@@ -28,6 +28,21 @@ biomass_to_c_non_mangrove_litter = 0.37
 # Biomass to carbon ratio for mangroves (IPCC wetlands supplement table 4.2)
 biomass_to_c_mangrove = 0.45
 
+# Deadwood:AGB and litter:AGB ratios for non-mangrove forests, as [deadwood, litter], by broad ecozone
+# (tropical, then boreal or temperate), elevation band and precipitation band.
+# From https://cdm.unfccc.int/methodologies/ARmethodologies/tools/ar-am-tool-12-v3.0.pdf, p. 17-18
+# Elevation bands (m): <=2000, >2000. Precipitation bands (mm): <=1000, 1000-1600, >1600.
+deadwood_litter_elevation_bands = [2000]
+deadwood_litter_precip_bands = [1000, 1600]
+deadwood_litter_AGB_ratios = [
+    # Tropical
+    [[[0.02, 0.04], [0.01, 0.01], [0.06, 0.01]],    # elevation <= 2000
+     [[0.07, 0.01], [0.07, 0.01], [0.07, 0.01]]],   # elevation > 2000 (any precipitation)
+    # Boreal or temperate (any elevation or precipitation)
+    [[[0.08, 0.04], [0.08, 0.04], [0.08, 0.04]],
+     [[0.08, 0.04], [0.08, 0.04], [0.08, 0.04]]]
+]
+
 # Carbon to CO2 ratio
 # Needs the decimal places in order to be cast as a float
 c_to_co2 = 44.0/12.0
@@ -86,6 +101,26 @@ docker_app = '/usr/local/app'
 
 c_emis_compile_dst = '{0}/emissions/cpp_util'.format(docker_app)
 
+# Shared library of the generic gross emissions decision tree, called on in-memory windows instead of running the .exe.
+# When it has been compiled, it is used for the generic gross emissions instead of calc_gross_emissions_generic.exe.
+c_emis_generic_lib = 'libcalc_gross_emissions_generic.so'
+
+# Threads each gross emissions .exe (or the generic shared library) uses for evaluating pixels, and the number of rows
+# it reads, evaluates and writes at a time. The .exe also uses its threads for compressing outputs.
+# 1 and 1 reproduce the original single-threaded row-by-row loop.
+c_emis_threads = 4
+c_emis_block_rows = 64
+
+# Whether gross emissions checks its table of emission factors (looked up per pixel) against the branching
+# def_variables in equations.cpp before processing any tiles
+c_emis_verify_factors = False
+
+# Windows of inputs that windowed stages read ahead of the window being calculated, and the threads that read them.
+# Outputs are written in the background, one thread per output, with at most this many windows waiting to be written.
+window_prefetch_windows = 2
+window_read_threads = 4
+window_write_queue = 16
+
 # Model log
 start = datetime.datetime.now()
 date = datetime.datetime.now()
@@ -93,15 +128,63 @@ date_formatted = date.strftime("%Y_%m_%d__%H_%M_%S")
 model_log_dir = os.path.join(s3_base_dir, 'model_logs/v{}/'.format(version))
 model_log = "flux_model_log_{}.txt".format(date_formatted)
 
+# The log is uploaded to s3 in the background this often (seconds) or after this many new lines, whichever comes first
+log_upload_interval = 60
+log_upload_lines = 1000
+
 
 # Blank created tile list txt
 # Stores the tile names for blank tiles. These tiles will be deleted at the end of the script so that they
 # don't get counted as actual tiles of this type
 blank_tile_txt = "blank_tiles.txt"
 
+# Recorded peak memory (GB) per tile for each model stage, used to decide how many tiles to run at once.
+# It is kept with the tiles so that it carries over between runs on the same volume.
+memory_profile = "stage_peak_memory_profile.json"
+
+# Fraction of the machine's available memory that tiles being processed at the same time can use
+memory_budget_fraction = 0.85
+
+# Percentile of the peak memory measured for a stage's tiles that is expected of its next tiles and recorded for the
+# next run. Until this many tiles have finished, the recorded peak from the last run is expected if it's larger.
+memory_peak_percentile = 95
+memory_peak_min_tiles = 5
+
+# Seconds between checks of whether the next tile's inputs are ready when it is waiting for them
+memory_aware_input_wait = 1
+
+# Local cache of tiles downloaded from s3, keyed by s3 path, ETag and size.
+# It is on the same volume as the tiles so that cached tiles can be hard-linked into the tile folder rather than copied.
+# It is shared by all stages and persists between runs on the same volume.
+tile_cache_dir = os.path.join(docker_base_dir, 'tile_cache')
+tile_cache_manifest = 'tile_cache_manifest.json'
+
+# Maximum size of the tile cache, in GB. Least recently used tiles are evicted beyond this.
+tile_cache_max_gb = 2000
+
+# s3 transfers. Tiles above the multipart threshold are transferred in parallel ranged parts.
+s3_part_threads = 10                # Threads transferring parts of one tile
+s3_concurrent_tiles = 8             # Tiles transferred at the same time
+s3_multipart_mb = 64                # Multipart threshold and part size
+s3_transfer_attempts = 5            # Attempts for each tile, with exponential backoff between them
+
+# Number of tiles ahead whose inputs are downloaded while tiles are being processed in streaming mode
+stream_prefetch_tiles = 4
+
+# Running statistics of the values written to output tiles (number of pixels with data, min, max, etc.), one small
+# file per tile, so that tiles don't have to be read again to find out whether they have any data
+tile_sidecar_dir = os.path.join(docker_base_dir, 'tile_sidecars')
+
+# How long (seconds) a listing of an s3 folder is reused for tile lists, tile counts and checks of whether tiles exist
+s3_inventory_ttl = 900
+
 
 # Tile summary spreadsheets
 tile_stats_pattern = 'tile_stats_model'
+
+# Rows of a tile read at a time for tile statistics, and the relative accuracy of the tile statistics percentiles
+tile_stats_window_rows = 100
+tile_stats_quantile_accuracy = 0.005
 tile_stats_dir = os.path.join(s3_base_dir, 'tile_stats/')
 
 ######
@@ -608,6 +691,14 @@ net_flux_per_pixel_forest_extent_dir = os.path.join(s3_base_dir, 'net_flux_all_f
 ######
 
 pattern_aggreg = '0_4deg_modelv{}'.format(version_filename)
+
+# Resolutions (degrees) that model outputs are aggregated to. All are summed from the same pass over each tile.
+# Each must be a whole number of 0.00025 degree pixels that fits evenly into a 10x10 degree tile (e.g., 0.04, 0.1, 0.25, 1).
+aggreg_resolutions = [0.04]
+
+# Tree cover density bin edges of the histograms that aggregated sums are kept in. Maps can be made at any of
+# these tcd thresholds (or 0) from the saved histograms without reading the tiles again.
+aggreg_tcd_bins = [0, 10, 15, 20, 25, 30, 50, 75]
 pattern_aggreg_sensit_perc_diff = 'net_flux_0_4deg_modelv{}_perc_diff_std'.format(version_filename)
 pattern_aggreg_sensit_sign_change = 'net_flux_0_4deg_modelv{}_sign_change_std'.format(version_filename)
 
@@ -8,6 +8,26 @@ sys.path.append('../')
 import constants_and_names as cn
 import universal_util as uu
 
+
+# Model extent for one window of the input tiles: pixels with (biomass AND tcd) OR mangrove biomass OR Hansen gain,
+# without pre-2000 plantations. For legal_Amazon_loss, only pixels with biomass and PRODES extent are in the model,
+# so mangrove and Hansen gain pixels outside the PRODES 2000 forest extent aren't included.
+def calculate_model_extent(tcd_window, biomass_window, mangrove_window, gain_window, pre_2000_plantations_window, sensit_type):
+
+    # Array of pixels that have both biomass and tree cover density
+    tcd_with_biomass_window = np.where((biomass_window > 0) & (tcd_window > 0), 1, 0)
+
+    # For legal_Amazon_loss sensitivity analysis
+    if sensit_type == 'legal_Amazon_loss':
+        return tcd_with_biomass_window.astype('uint8')
+
+    # Array of pixels with (biomass AND tcd) OR mangrove biomass OR Hansen gain
+    forest_extent = np.where((tcd_with_biomass_window == 1) | (mangrove_window.astype('uint8', copy=False) > 1) | (gain_window == 1), 1, 0)
+
+    # extent now WITHOUT pre-2000 plantations
+    return np.where((forest_extent == 1) & (pre_2000_plantations_window == 0), 1, 0).astype('uint8')
+
+
 def model_extent(tile_id, pattern, sensit_type, no_upload):
 
     # I don't know why, but this needs to be here and not just in mp_model_extent
@@ -60,29 +80,10 @@ def model_extent(tile_id, pattern, sensit_type, no_upload):
         )
 
         # Checks whether each input tile exists
-        try:
-            mangroves_src = rasterio.open(mangrove)
-            uu.print_log("  Mangrove tile found for {}".format(tile_id))
-        except:
-            uu.print_log("  No mangrove tile found for {}".format(tile_id))
-
-        try:
-            gain_src = rasterio.open(gain)
-            uu.print_log("  Gain tile found for {}".format(tile_id))
-        except:
-            uu.print_log("  No gain tile found for {}".format(tile_id))
-
-        try:
-            biomass_src = rasterio.open(biomass)
-            uu.print_log("  Biomass tile found for {}".format(tile_id))
-        except:
-            uu.print_log("  No biomass tile found for {}".format(tile_id))
-
-        try:
-            pre_2000_plantations_src = rasterio.open(pre_2000_plantations)
-            uu.print_log("  Pre-2000 plantation tile found for {}".format(tile_id))
-        except:
-            uu.print_log("  No pre-2000 plantation tile found for {}".format(tile_id))
+        mangroves_src = uu.open_optional_input(mangrove, tile_id)
+        gain_src = uu.open_optional_input(gain, tile_id)
+        biomass_src = uu.open_optional_input(biomass, tile_id)
+        pre_2000_plantations_src = uu.open_optional_input(pre_2000_plantations, tile_id)
 
 
         # Opens the output tile, giving it the metadata of the input tiles
@@ -104,54 +105,43 @@ def model_extent(tile_id, pattern, sensit_type, no_upload):
 
         uu.print_log("  Creating model extent for {}".format(tile_id))
 
+        # Running statistics of the output, so that it doesn't have to be read again to check whether it has data
+        forest_extent_stats = uu.new_tile_stats()
+
+        # Number of pixels in the model extent in each row of the output, so that later stages can skip
+        # windows without any pixels in the model extent without reading their inputs
+        forest_extent_row_counts = np.zeros(tcd_src.height, dtype='int32')
+
+        # Input windows are read into the same buffers for every window
+        window_buffers = uu.new_window_buffers()
+
         # Iterates across the windows (1 pixel strips) of the input tile
         for idx, window in windows:
 
-            # Tries to create a window (array) for each input tile.
-            # If the tile does exist, it creates an array of the values in the window
-            # If the tile does not exist, it creates an array of 0s.
-            try:
-                mangrove_window = mangroves_src.read(1, window=window).astype('uint8')
-            except:
-                mangrove_window = np.zeros((window.height, window.width), dtype=int)
-            try:
-                gain_window = gain_src.read(1, window=window)
-            except:
-                gain_window = np.zeros((window.height, window.width), dtype=int)
-            try:
-                biomass_window = biomass_src.read(1, window=window)
-            except:
-                biomass_window = np.zeros((window.height, window.width), dtype=int)
-            try:
-                tcd_window = tcd_src.read(1, window=window)
-            except:
-                tcd_window = np.zeros((window.height, window.width), dtype=int)
-            try:
-                pre_2000_plantations_window = pre_2000_plantations_src.read(1, window=window)
-            except:
-                pre_2000_plantations_window = np.zeros((window.height, window.width), dtype=int)
-
-            # Array of pixels that have both biomass and tree cover density
-            tcd_with_biomass_window = np.where((biomass_window > 0) & (tcd_window > 0), 1, 0)
-
-            # For all moel types except legal_Amazon_loss sensitivity analysis
-            if sensit_type != 'legal_Amazon_loss':
-
-                # Array of pixels with (biomass AND tcd) OR mangrove biomass OR Hansen gain
-                forest_extent = np.where((tcd_with_biomass_window == 1) | (mangrove_window > 1) | (gain_window == 1), 1, 0)
-
-                # extent now WITHOUT pre-2000 plantations
-                forest_extent = np.where((forest_extent == 1) & (pre_2000_plantations_window == 0), 1, 0).astype('uint8')
-
-            # For legal_Amazon_loss sensitivity analysis
-            else:
-                # Array of pixels with (biomass AND tcd) OR mangrove biomass.
-                # Does not include mangrove or Hansen gain pixels that are outside PRODES 2000 forest extent
-                forest_extent = tcd_with_biomass_window.astype('uint8')
+            # Creates a window (array) for each input tile.
+            # If the tile does exist, it reads the values in the window into the input's buffer.
+            # If the tile does not exist, the window is a shared array of 0s.
+            mangrove_window = uu.read_window(mangroves_src, window, window_buffers)
+            gain_window = uu.read_window(gain_src, window, window_buffers)
+            biomass_window = uu.read_window(biomass_src, window, window_buffers)
+            tcd_window = uu.read_window(tcd_src, window, window_buffers)
+            pre_2000_plantations_window = uu.read_window(pre_2000_plantations_src, window, window_buffers)
 
+            forest_extent = calculate_model_extent(tcd_window, biomass_window, mangrove_window, gain_window,
+                                                   pre_2000_plantations_window, sensit_type)
 
             # Writes the output window to the output
-            dst.write_band(1, forest_extent, window=window)
+            uu.write_window_with_stats(dst, forest_extent, window, forest_extent_stats)
+            forest_extent_row_counts[window.row_off:window.row_off + window.height] += np.count_nonzero(forest_extent, axis=1)
+
+        # Closes the input tiles that exist
+        for src in (mangroves_src, gain_src, biomass_src, pre_2000_plantations_src):
+            if src is not None:
+                src.close()
+
+        # Closes the output and saves its statistics and row counts
+        uu.write_tile_stats(dst, forest_extent_stats)
+        uu.write_row_counts(out_tile, forest_extent_row_counts)
 
 
 
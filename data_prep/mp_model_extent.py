@@ -8,7 +8,6 @@ pixels and mangrove pixels outside of (PRODES extent AND WHRC AGB) are not inclu
 '''
 
 
-import multiprocessing
 from functools import partial
 import pandas as pd
 import datetime
@@ -22,7 +21,7 @@ import universal_util as uu
 sys.path.append(os.path.join(cn.docker_app,'data_prep'))
 import model_extent
 
-def mp_model_extent(sensit_type, tile_id_list, run_date = None, no_upload = None):
+def mp_model_extent(sensit_type, tile_id_list, run_date = None, no_upload = None, streaming = None):
 
     os.chdir(cn.docker_base_dir)
 
@@ -65,8 +64,9 @@ def mp_model_extent(sensit_type, tile_id_list, run_date = None, no_upload = None
     output_pattern_list = [cn.pattern_model_extent]
 
 
-    # Downloads input files or entire directories, depending on how many tiles are in the tile_id_list, if AWS credentials are found
-    if uu.check_aws_creds():
+    # Downloads input files or entire directories, depending on how many tiles are in the tile_id_list, if AWS credentials are found.
+    # In streaming mode, each tile's inputs are downloaded just before it is processed instead.
+    if uu.check_aws_creds() and not streaming:
 
         for key, values in download_dict.items():
             dir = key
@@ -89,42 +89,31 @@ def mp_model_extent(sensit_type, tile_id_list, run_date = None, no_upload = None
     # Creates a single filename pattern to pass to the multiprocessor call
     pattern = output_pattern_list[0]
 
+    # In streaming mode, inputs are downloaded, tiles processed, empty outputs deleted and outputs uploaded tile by tile.
+    # The row counts saved with each model extent tile are uploaded next to it, in both modes, so that later stages
+    # can skip windows outside the model extent without downloading the model extent tiles.
+    if streaming:
+        uu.streaming_map(partial(model_extent.model_extent, pattern=pattern, sensit_type=sensit_type, no_upload=no_upload),
+                         tile_id_list, 'model_extent', download_dict, output_dir_list, output_pattern_list,
+                         sensit_type, no_upload, check_empty=True)
+        return
+
     # This configuration of the multiprocessing call is necessary for passing multiple arguments to the main function
     # It is based on the example here: http://spencerimp.blogspot.com/2015/12/python-multiprocess-with-multiple.html
-    if cn.count == 96:
-        if sensit_type == 'biomass_swap':
-            processes = 38
-        else:
-            processes = 42 # 30 processors = 480 GB peak (sporadic decreases followed by sustained increases);
-            # 36 = 550 GB peak; 40 = 590 GB peak; 42 = XXX GB peak
-    else:
-        processes = 3
-    uu.print_log('Model extent processors=', processes)
-    pool = multiprocessing.Pool(processes)
-    pool.map(partial(model_extent.model_extent, pattern=pattern, sensit_type=sensit_type, no_upload=no_upload), tile_id_list)
-    pool.close()
-    pool.join()
+    # Tiles are admitted into the pool as long as their recorded peak memory fits in the machine's memory budget
+    uu.memory_aware_map(partial(model_extent.model_extent, pattern=pattern, sensit_type=sensit_type, no_upload=no_upload),
+                        tile_id_list, 'model_extent')
 
     # # For single processor use
     # for tile_id in tile_id_list:
     #     model_extent.model_extent(tile_id, pattern, sensit_type, no_upload)
 
+    # Checks the model extent outputs for tiles with no data.
+    # This uses the statistics saved while the tiles were written, so the tiles aren't read again.
     output_pattern = output_pattern_list[0]
-    if cn.count <= 2:  # For local tests
-        processes = 1
-        uu.print_log(
-            "Checking for empty tiles of {0} pattern with {1} processors using light function...".format(output_pattern, processes))
-        pool = multiprocessing.Pool(processes)
-        pool.map(partial(uu.check_and_delete_if_empty_light, output_pattern=output_pattern), tile_id_list)
-        pool.close()
-        pool.join()
-    else:
-        processes = 58  # 50 processors = 620 GB peak; 55 = 640 GB; 58 = 650 GB (continues to increase very slowly several hundred tiles in)
-        uu.print_log("Checking for empty tiles of {0} pattern with {1} processors...".format(output_pattern, processes))
-        pool = multiprocessing.Pool(processes)
-        pool.map(partial(uu.check_and_delete_if_empty, output_pattern=output_pattern), tile_id_list)
-        pool.close()
-        pool.join()
+    uu.print_log("Checking for empty tiles of {} pattern...".format(output_pattern))
+    for tile_id in tile_id_list:
+        uu.check_and_delete_if_empty(tile_id, output_pattern)
 
 
     # If no_upload flag is not activated, output is uploaded
@@ -147,11 +136,14 @@ if __name__ == '__main__':
                         help='Date of run. Must be format YYYYMMDD.')
     parser.add_argument('--no-upload', '-nu', action='store_true',
                        help='Disables uploading of outputs to s3')
+    parser.add_argument('--streaming', '-st', action='store_true',
+                        help='Downloads, processes and uploads tiles one at a time instead of in whole-stage batches')
     args = parser.parse_args()
     sensit_type = args.model_type
     tile_id_list = args.tile_id_list
     run_date = args.run_date
     no_upload = args.no_upload
+    streaming = args.streaming
 
     # Disables upload to s3 if no AWS credentials are found in environment
     if not uu.check_aws_creds():
@@ -159,11 +151,13 @@ if __name__ == '__main__':
         uu.print_log("s3 credentials not found. Uploading to s3 disabled.")
 
     # Create the output log
-    uu.initiate_log(tile_id_list=tile_id_list, sensit_type=sensit_type, run_date=run_date, no_upload=no_upload)
+    uu.initiate_log(tile_id_list=tile_id_list, sensit_type=sensit_type, run_date=run_date, no_upload=no_upload,
+                    streaming=streaming)
 
     # Checks whether the sensitivity analysis and tile_id_list arguments are valid
     uu.check_sensit_type(sensit_type)
     tile_id_list = uu.tile_id_list_check(tile_id_list)
 
-    mp_model_extent(sensit_type=sensit_type, tile_id_list=tile_id_list, run_date=run_date, no_upload=no_upload)
+    mp_model_extent(sensit_type=sensit_type, tile_id_list=tile_id_list, run_date=run_date, no_upload=no_upload,
+                    streaming=streaming)
 
@@ -1,6 +1,10 @@
 from subprocess import Popen, PIPE, STDOUT, check_call
+import ctypes
 import datetime
+import numpy as np
 import rasterio
+from rasterio.windows import Window
+from concurrent.futures import ThreadPoolExecutor
 from shutil import copyfile
 import os
 import sys
@@ -8,30 +12,249 @@ sys.path.append('../')
 import constants_and_names as cn
 import universal_util as uu
 
-# Calls the c++ script to calculate gross emissions
+# The generic gross emissions shared library. Loaded once per process by load_emissions_library.
+emissions_library = None
+
+# Threads that evaluate parts of each window with the shared library (cn.c_emis_threads), as the .exe does with its
+# blocks of rows. ctypes releases the GIL during the library calls, so the parts are evaluated in parallel.
+emissions_library_executor = None
+
+# Output patterns of the generic gross emissions, in the order calc_gross_emissions_generic_block fills them
+emissions_generic_output_patterns = [cn.pattern_gross_emis_commod_biomass_soil,
+                                     cn.pattern_gross_emis_shifting_ag_biomass_soil,
+                                     cn.pattern_gross_emis_forestry_biomass_soil,
+                                     cn.pattern_gross_emis_wildfire_biomass_soil,
+                                     cn.pattern_gross_emis_urban_biomass_soil,
+                                     cn.pattern_gross_emis_no_driver_biomass_soil,
+                                     cn.pattern_gross_emis_all_gases_all_drivers_biomass_soil,
+                                     cn.pattern_gross_emis_co2_only_all_drivers_biomass_soil,
+                                     cn.pattern_gross_emis_non_co2_all_drivers_biomass_soil,
+                                     cn.pattern_gross_emis_nodes_biomass_soil]
+
+
+# Path of the compiled generic gross emissions shared library
+def emissions_library_path():
+
+    return os.path.join(cn.c_emis_compile_dst, cn.c_emis_generic_lib)
+
+
+# Loads the generic gross emissions shared library, if it has been compiled.
+# Each worker process loads it the first time it needs it and keeps it for the rest of its tiles.
+def load_emissions_library():
+
+    global emissions_library
+
+    if emissions_library is None:
+
+        emissions_library = ctypes.CDLL(emissions_library_path())
+
+        block = np.ctypeslib.ndpointer(dtype=np.float32, flags='C_CONTIGUOUS')
+        emissions_library.calc_gross_emissions_generic_block.argtypes = [ctypes.c_long] + [block] * 23
+        emissions_library.calc_gross_emissions_generic_block.restype = None
+        emissions_library.verify_emission_factors.argtypes = []
+        emissions_library.verify_emission_factors.restype = ctypes.c_int
+
+    return emissions_library
+
+
+# Names of the input tiles of the generic gross emissions, in the order calc_gross_emissions_generic_block takes them.
+# These are the same tiles that calc_gross_emissions_generic.cpp opens.
+def emissions_generic_input_names(tile_id, sensit_type, folder):
+
+    # Carbon pools
+    pool_patterns = [cn.pattern_AGC_emis_year, cn.pattern_BGC_emis_year]
+    if sensit_type != 'std':
+        pool_patterns = uu.alter_patterns(sensit_type, pool_patterns)
+    agc, bgc = ['{0}_{1}.tif'.format(tile_id, pattern) for pattern in pool_patterns]
+
+    other_pool_patterns = [cn.pattern_deadwood_emis_year_2000, cn.pattern_litter_emis_year_2000, cn.pattern_soil_C_emis_year_2000]
+    if sensit_type != 'std':
+        other_pool_patterns = uu.alter_patterns(sensit_type, other_pool_patterns)
+    deadwood, litter, soil = ['{0}_{1}.tif'.format(tile_id, pattern) for pattern in other_pool_patterns]
+
+    # Other inputs
+    if sensit_type == 'legal_Amazon_loss':
+        loss = '{0}_{1}.tif'.format(tile_id, cn.pattern_Brazil_annual_loss_processed)
+    else:
+        loss = '{0}_{1}.tif'.format(cn.pattern_loss, tile_id)
+
+    names = [agc, bgc,
+             '{0}_{1}.tif'.format(tile_id, cn.pattern_drivers),
+             loss,
+             '{0}_{1}.tif'.format(tile_id, cn.pattern_peat_mask),
+             '{0}_{1}.tif'.format(tile_id, cn.pattern_burn_year),
+             '{0}_{1}.tif'.format(tile_id, cn.pattern_ifl_primary),
+             '{0}_{1}.tif'.format(tile_id, cn.pattern_bor_tem_trop_processed),
+             '{0}_{1}.tif'.format(tile_id, cn.pattern_climate_zone),
+             deadwood, litter, soil,
+             '{0}_{1}.tif'.format(tile_id, cn.pattern_planted_forest_type_unmasked)]
+
+    return [os.path.join(folder, name) for name in names]
+
+
+# Runs the generic gross emissions decision tree on one window of the 13 inputs (in the order of
+# emissions_generic_input_names) and returns the 10 outputs (in the order of emissions_generic_output_patterns)
+def calc_emissions_window(input_windows):
+
+    global emissions_library_executor
+
+    library = load_emissions_library()
+
+    height, width = input_windows[0].shape
+
+    input_windows = [np.ascontiguousarray(input_window, dtype='float32') for input_window in input_windows]
+    output_windows = [np.empty((height, width), dtype='float32') for pattern in emissions_generic_output_patterns]
+
+    # The pixels of the window are split into one contiguous part per thread. Each pixel is evaluated on its own,
+    # so the parts can be evaluated in any order.
+    pixels = [window.reshape(-1) for window in input_windows + output_windows]
+    part_bounds = np.linspace(0, height * width, max(cn.c_emis_threads, 1) + 1).astype('int64')
+    parts = [(start, end) for start, end in zip(part_bounds[:-1], part_bounds[1:]) if end > start]
+
+    if len(parts) == 1:
+        library.calc_gross_emissions_generic_block(height * width, *pixels)
+        return output_windows
+
+    if emissions_library_executor is None:
+        emissions_library_executor = ThreadPoolExecutor(max_workers=cn.c_emis_threads)
+
+    futures = [emissions_library_executor.submit(library.calc_gross_emissions_generic_block, int(end - start),
+                                                 *[array[start:end] for array in pixels])
+               for start, end in parts]
+    for future in futures:
+        future.result()
+
+    return output_windows
+
+
+# Windows of cn.c_emis_block_rows rows of a tile, the blocks of rows that the .exe reads, evaluates and writes at a time
+def emissions_block_windows(src):
+
+    block_rows = max(cn.c_emis_block_rows, 1)
+
+    for idx, row in enumerate(range(0, src.height, block_rows)):
+        yield (idx, 0), Window(0, row, src.width, min(block_rows, src.height - row))
+
+
+# Calculates the generic gross emissions for a tile in this process with the shared library,
+# reading each window of the inputs once and writing the same 10 outputs as calc_gross_emissions_generic.exe.
+# Like the .exe, it works on blocks of cn.c_emis_block_rows rows, each evaluated on cn.c_emis_threads threads.
+def calc_emissions_generic_in_process(tile_id, sensit_type, folder):
+
+    output_patterns = emissions_generic_output_patterns
+    if sensit_type != 'std':
+        output_patterns = uu.alter_patterns(sensit_type, output_patterns)
+
+    input_names = emissions_generic_input_names(tile_id, sensit_type, folder)
+    input_srcs = [rasterio.open(name) for name in input_names]
+
+    # Loss pixels in each row of the tile. There are only emissions in rows with loss.
+    loss_row_counts = uu.read_row_counts(input_names[3], input_srcs[0].height)
+
+    # The outputs take the extent and cell size of the aboveground carbon tile, as in the C++
+    kwargs = input_srcs[0].meta
+    kwargs.update(
+        driver='GTiff',
+        count=1,
+        compress='lzw',
+        nodata=0,
+        dtype='float32'
+    )
+
+    windows = emissions_block_windows(input_srcs[0])
+
+    output_dsts = [rasterio.open('{0}_{1}.tif'.format(tile_id, pattern), 'w', **kwargs) for pattern in output_patterns]
+
+    window_buffers = uu.new_window_buffers()
+    window_writer = uu.new_window_writer()
+
+    # Windows without loss aren't read or written at all and are left as nodata in the outputs
+    windows = ((idx, window) for idx, window in windows if uu.window_has_data(loss_row_counts, window))
+
+    # The inputs of the next windows are read while a window is being calculated, and the outputs are written behind it
+    for idx, window in uu.prefetch_windows(windows, input_srcs, window_buffers):
+
+        input_windows = [uu.read_window(src, window, window_buffers) for src in input_srcs]
+
+        for dst, output_window in zip(output_dsts, calc_emissions_window(input_windows)):
+            uu.write_window_in_background(window_writer, dst, output_window, window)
+
+    uu.finish_window_writes(window_writer)
+
+    for dst in output_dsts:
+        dst.close()
+    for src in input_srcs:
+        src.close()
+
+
+# Checks the table of emission factors that the C++ looks up for each pixel against def_variables in equations.cpp,
+# using the compiled C++ that the gross emissions for this pool option and model type will run
+def verify_emission_factors(emitted_pools, sensit_type, no_upload):
+
+    uu.print_log("Checking emission factor table against def_variables...")
+
+    if (emitted_pools == 'biomass_soil') & (sensit_type not in ['no_shifting_ag', 'convert_to_grassland']) & \
+            os.path.exists(emissions_library_path()):
+        mismatches = load_emissions_library().verify_emission_factors()
+        uu.print_log("  {} mismatches between emission factor table and def_variables".format(mismatches))
+
+    else:
+        if emitted_pools == 'soil_only':
+            exe = '{0}/calc_gross_emissions_soil_only.exe'.format(cn.c_emis_compile_dst)
+        elif sensit_type in ['no_shifting_ag', 'convert_to_grassland']:
+            exe = '{0}/calc_gross_emissions_{1}.exe'.format(cn.c_emis_compile_dst, sensit_type)
+        else:
+            exe = '{0}/calc_gross_emissions_generic.exe'.format(cn.c_emis_compile_dst)
+
+        process = Popen([exe, '--verify-emission-factors'], stdout=PIPE, stderr=STDOUT)
+        output = process.communicate()[0]
+        for line in output.decode("utf-8").splitlines():
+            uu.print_log("  {}".format(line))
+        mismatches = process.returncode
+
+    if mismatches != 0:
+        uu.exception_log(no_upload, 'Emission factor table does not match def_variables')
+
+
+# Calls the c++ script to calculate gross emissions.
+# The generic gross emissions are calculated in this process with the shared library when it has been compiled;
+# otherwise calc_gross_emissions_generic.exe is run. Both use cn.c_emis_threads and cn.c_emis_block_rows.
 def calc_emissions(tile_id, emitted_pools, sensit_type, folder, no_upload):
 
     uu.print_log("Calculating gross emissions for", tile_id, "using", sensit_type, "model type...")
 
     start = datetime.datetime.now()
 
+    cmd = None
+
     # Runs the correct c++ script given the emitted_pools (biomass+soil or soil_only) and model type selected.
     # soil_only, no_shiftin_ag, and convert_to_grassland have special gross emissions C++ scripts.
     # The other sensitivity analyses and the standard model all use the same gross emissions C++ script.
     if (emitted_pools == 'soil_only') & (sensit_type == 'std'):
-        cmd = ['{0}/calc_gross_emissions_soil_only.exe'.format(cn.c_emis_compile_dst), tile_id, sensit_type, folder]
+        cmd = ['{0}/calc_gross_emissions_soil_only.exe'.format(cn.c_emis_compile_dst), tile_id, sensit_type, folder,
+               str(cn.c_emis_threads), str(cn.c_emis_block_rows)]
 
     elif (emitted_pools == 'biomass_soil') & (sensit_type in ['convert_to_grassland', 'no_shifting_ag']):
-        cmd = ['{0}/calc_gross_emissions_{1}.exe'.format(cn.c_emis_compile_dst, sensit_type), tile_id, sensit_type, folder]
+        cmd = ['{0}/calc_gross_emissions_{1}.exe'.format(cn.c_emis_compile_dst, sensit_type), tile_id, sensit_type, folder,
+               str(cn.c_emis_threads), str(cn.c_emis_block_rows)]
 
     # This C++ script has an extra argument that names the input carbon emitted_pools and output emissions correctly
     elif (emitted_pools == 'biomass_soil') & (sensit_type not in ['no_shifting_ag', 'convert_to_grassland']):
-        cmd = ['{0}/calc_gross_emissions_generic.exe'.format(cn.c_emis_compile_dst), tile_id, sensit_type, folder]
+        if os.path.exists(emissions_library_path()):
+            uu.print_log("  Using the generic gross emissions shared library in this process ({0} threads, {1}-row blocks)".format(
+                cn.c_emis_threads, cn.c_emis_block_rows))
+            calc_emissions_generic_in_process(tile_id, sensit_type, folder)
+        else:
+            uu.print_log("  Using calc_gross_emissions_generic.exe ({0} threads, {1}-row blocks)".format(
+                cn.c_emis_threads, cn.c_emis_block_rows))
+            cmd = ['{0}/calc_gross_emissions_generic.exe'.format(cn.c_emis_compile_dst), tile_id, sensit_type, folder,
+                   str(cn.c_emis_threads), str(cn.c_emis_block_rows)]
 
     else:
         uu.exception_log(no_upload, 'Pool and/or sensitivity analysis option not valid')
 
-    uu.log_subprocess_output_full(cmd)
+    if cmd is not None:
+        uu.log_subprocess_output_full(cmd)
 
 
     # Identifies which pattern to use for counting tile completion
@@ -52,15 +275,20 @@ def calc_emissions(tile_id, emitted_pools, sensit_type, folder, no_upload):
     uu.end_of_fx_summary(start, tile_id, pattern, no_upload)
 
 
+# Metadata tags for the gross emissions outputs
+def emissions_metadata_tags(sensit_type):
+
+    tags = uu.universal_metadata_tags(sensit_type)
+    tags.update(units='Mg CO2e/ha over model duration (2001-20{})'.format(cn.loss_years),
+                source='many data sources',
+                extent='Tree cover loss pixels within model extent (and tree cover loss driver, if applicable)')
+
+    return tags
+
+
 # Adds metadata tags to the output rasters
 def add_metadata_tags(tile_id, pattern, sensit_type):
 
-    # Adds metadata tags to output rasters
-    uu.add_universal_metadata_tags('{0}_{1}.tif'.format(tile_id, pattern), sensit_type)
+    uu.print_log("Adding metadata tags to", '{0}_{1}.tif'.format(tile_id, pattern))
 
-    cmd = ['gdal_edit.py', '-mo',
-           'units=Mg CO2e/ha over model duration (2001-20{})'.format(cn.loss_years),
-           '-mo', 'source=many data sources',
-           '-mo', 'extent=Tree cover loss pixels within model extent (and tree cover loss driver, if applicable)',
-           '{0}_{1}.tif'.format(tile_id, pattern)]
-    uu.log_subprocess_output_full(cmd)
+    uu.set_metadata_tags('{0}_{1}.tif'.format(tile_id, pattern), emissions_metadata_tags(sensit_type))
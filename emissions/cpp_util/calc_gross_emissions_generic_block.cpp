@@ -0,0 +1,893 @@
+// The per-pixel gross emissions decision tree for the standard model and the sensitivity analyses that use
+// the generic gross emissions script, applied to a block of pixels held in memory.
+// calc_gross_emissions_generic.cpp reads each row of its input tiles and passes it here, and this file is also
+// compiled on its own into a shared library that Python loads with ctypes and calls on windows it has already read:
+// c++ /usr/local/app/emissions/cpp_util/calc_gross_emissions_generic_block.cpp -o /usr/local/app/emissions/cpp_util/libcalc_gross_emissions_generic.so -O2 -shared -fPIC
+// All input and output buffers hold n float32 pixels. Inputs and outputs are in the same order as in
+// calc_gross_emissions_generic.cpp and in calculate_gross_emissions.py.
+
+
+#include <math.h>
+
+// These provide constants for the emissions equations and universal constants
+#include "flu_val.cpp"
+#include "equations.cpp"
+#include "constants.h"
+
+extern "C" void calc_gross_emissions_generic_block(long n,
+    const float *agc_data, const float *bgc_data, const float *drivermodel_data, const float *loss_data,
+    const float *peat_data, const float *burn_data, const float *ifl_primary_data, const float *ecozone_data,
+    const float *climate_data, const float *dead_data, const float *litter_data, const float *soil_data,
+    const float *plant_data,
+    float *out_data1, float *out_data2, float *out_data3, float *out_data4, float *out_data5, float *out_data6,
+    float *out_data10, float *out_data11, float *out_data12, float *out_data20)
+{
+    // Model constants
+    int model_years;    // How many loss years are in the model
+    model_years = constants::model_years;
+
+    int CH4_equiv;      // The CO2 equivalency (global warming potential) of CH4
+    CH4_equiv = constants::CH4_equiv;
+
+    int N2O_equiv;      // The CO2 equivalency (global warming potential) of N2O
+    N2O_equiv = constants::N2O_equiv;
+
+    float C_to_CO2;       // The conversion of carbon to CO2
+    C_to_CO2 = constants::C_to_CO2;
+
+    float biomass_to_c;    // Fraction of carbon in biomass
+    biomass_to_c = constants::biomass_to_c;
+
+    int tropical;       // The ecozone code for the tropics
+    tropical = constants::tropical;
+
+    int temperate;      // The ecozone code for the temperate zone
+    temperate = constants::temperate;
+
+    int boreal;         // The ecozone code for the boreal zone
+    boreal = constants::boreal;
+
+    int soil_emis_period;      // The number of years over which soil emissions are calculated (separate from model years)
+    soil_emis_period = constants::soil_emis_period;
+
+    long x;
+
+    for(x=0; x<n; x++)
+
+    // Everything from here down analyzes one pixel at a time
+	{
+
+        // Initializes each output raster at 0 (nodata value)
+		float outdata1 = 0;   // commodities, all gases
+		float outdata1a = 0;  // commodities, CO2 only
+		float outdata1b = 0;  // commodities, non-CO2
+		float outdata2 = 0;   // shifting ag., all gases
+		float outdata2a = 0;  // shifting ag., CO2 only
+		float outdata2b = 0;  // shifting ag., non-CO2
+		float outdata3 = 0;   // forestry, all gases
+		float outdata3a = 0;  // forestry, CO2 only
+		float outdata3b = 0;  // forestry, non-CO2
+		float outdata4 = 0;   // wildfire, all gases
+		float outdata4a = 0;  // wildfire, CO2 only
+		float outdata4b = 0;  // wildfire, non-CO2
+		float outdata5 = 0;   // urbanization, all gases
+		float outdata5a = 0;  // urbanization, CO2 only
+		float outdata5b = 0;  // urbanization, non-CO2
+		float outdata6 = 0;   // no driver, all gases
+		float outdata6a = 0;  // no driver, CO2 only
+		float outdata6b = 0;  // no driver, non-CO2
+		float outdata10 = 0;  // all drivers, all gases
+		float outdata11 = 0;  // all drivers, CO2 only
+		float outdata12 = 0;  // all drivers, non-CO2
+		float outdata20 = 0;  // flowchart node
+
+        // Only evaluates pixels that have loss and carbon. By definition, all pixels with carbon are in the model extent.
+		if (loss_data[x] > 0 && agc_data[x] > 0)
+        {
+
+            // From equations.cpp, a function called def_variables, we get back several constants
+            // based on several input rasters for that pixel. These are later used for calculating emissions.
+
+            // def_variables kept returning the same values for all pixels in a tile as the first pixel in the tile regardless of the inputs to the function;
+            // it was as if the returned values for the first pixel evaluated couldn't be overwritten.
+            // The first answer here told me how to solve that: https://stackoverflow.com/questions/51609816/return-float-array-from-a-function-c
+            float q[8];
+            // The constants are looked up in a table of def_variables' results for every combination of codes (equations.cpp).
+            def_variables_lookup(&q[0], ecozone_data[x], drivermodel_data[x], ifl_primary_data[x], climate_data[x], plant_data[x], loss_data[x]);
+
+			// The constants needed for calculating emissions
+			float Cf = q[0];            // Combustion factor
+			float Gef_CO2 = q[1];       // Emissions factor for CO2
+			float Gef_CH4 = q[2];       // Emissions factor for CH4
+			float Gef_N2O = q[3];       // Emissions factor for N2O
+			float peatburn_CO2_only = q[4];      // Emissions from burning peat, CO2 emissions only
+			float peatburn_non_CO2 = q[5];       // Emissions from burning peat, non-CO2 emissions only
+    		float peat_drain_total_CO2_only = q[6];      // Emissions from draining peat, CO2 emissions only
+    		float peat_drain_total_non_CO2 = q[7];      // Emissions from draining peat, non-CO2 emissions only
+
+            // Define and calculate several values used later
+			float non_soil_c;
+			non_soil_c = agc_data[x] + bgc_data[x] + dead_data[x] + litter_data[x];
+
+			float above_below_c;
+			above_below_c = agc_data[x] + bgc_data[x];
+
+			float Biomass_tCO2e_nofire_CO2_only;     // Emissions from biomass on pixels without fire- only emits CO2 (no non-CO2 option)
+			float Biomass_tCO2e_yesfire_CO2_only;    // Emissions from biomass on pixels with fire- only the CO2
+			float Biomass_tCO2e_yesfire_non_CO2;     // Emissions from biomass on pixels with fire- only the non-CO2 gases
+			float minsoil;                           // Emissions from mineral soil- all CO2
+			float flu;                               // Emissions fraction from mineral soil
+
+		    // Each driver is an output raster and has its own emissions model. outdata20 is the code for each
+            // combination of outputs. Defined in carbon-budget/emissions/node_codes.txt
+
+			// Emissions model for commodity-driven deforestation
+			if (drivermodel_data[x] == 1)
+			{
+				// For each driver, these values (or a subset of them) are necessary for calculating emissions.
+				Biomass_tCO2e_nofire_CO2_only = non_soil_c * C_to_CO2;
+				Biomass_tCO2e_yesfire_CO2_only = non_soil_c * C_to_CO2;
+				Biomass_tCO2e_yesfire_non_CO2 = ((non_soil_c / biomass_to_c) * Cf * Gef_CH4 * pow(10,-3) * CH4_equiv) + ((non_soil_c / biomass_to_c) * Cf * Gef_N2O * pow(10,-3) * N2O_equiv);
+				flu = flu_val(climate_data[x], ecozone_data[x]);
+				minsoil = ((soil_data[x]-(soil_data[x] * flu))/soil_emis_period) * (model_years-loss_data[x]);
+
+				if (peat_data[x] > 0) // Commodity, peat
+				{
+					if (burn_data[x] > 0) // Commodity, peat, burned
+					{
+						outdata1a = Biomass_tCO2e_yesfire_CO2_only + peat_drain_total_CO2_only + peatburn_CO2_only;
+						outdata1b = Biomass_tCO2e_yesfire_non_CO2 + peat_drain_total_non_CO2 + peatburn_non_CO2;
+						outdata20 = 10;
+					}
+					if (burn_data[x] == 0) // Commodity, peat, not burned
+					{
+						if (ecozone_data[x] == tropical) // Commodity, peat, not burned, tropical
+						{
+						    if (plant_data[x] >= 1) // Commodity, peat, not burned, tropical, plantation
+						    {
+						    	outdata1a = Biomass_tCO2e_nofire_CO2_only + peat_drain_total_CO2_only;
+						        outdata1b = 0 + peat_drain_total_non_CO2;
+						        outdata20 = 11;
+						    }
+						    if (plant_data[x] == 0)     // Commodity, peat, not burned, tropical, not plantation
+						    {
+						        outdata1a = Biomass_tCO2e_nofire_CO2_only;
+						        outdata1b = 0;
+						        outdata20 = 111;
+						    }
+						}
+                        if ((ecozone_data[x] == boreal) || (ecozone_data[x] == temperate))      // Commodity, peat, not burned, temperate/boreal
+						{
+						    outdata1a = Biomass_tCO2e_nofire_CO2_only + peat_drain_total_CO2_only;
+						    outdata1b = 0 + peat_drain_total_non_CO2;
+						    outdata20 = 12;
+						}
+					}
+				}
+				if (peat_data[x] == 0) // Commodity, not peat
+				{
+					if (burn_data[x] > 0) // Commodity, not peat, burned
+					{
+						if (ecozone_data[x] == tropical)   // Commodity, not peat, burned, tropical
+						{
+                            if (ifl_primary_data[x] == 1)   // Commodity, not peat, burned, tropical, IFL
+                            {
+                                if (plant_data[x] >= 1)     // Commodity, not peat, burned, tropical, IFL, plantation
+						        {
+						            outdata1a = Biomass_tCO2e_yesfire_CO2_only;
+						            outdata1b = Biomass_tCO2e_yesfire_non_CO2;
+						            outdata20 = 13;
+						        }
+						        if (plant_data[x] == 0)     // Commodity, not peat, burned, tropical, IFL, not plantation
+						        {
+						            outdata1a = Biomass_tCO2e_yesfire_CO2_only + minsoil;
+						            outdata1b = Biomass_tCO2e_yesfire_non_CO2;
+						            outdata20 = 131;
+						        }
+						    }
+						    if (ifl_primary_data[x] == 0)   // Commodity, not peat, burned, tropical, not IFL
+						    {
+                                if (plant_data[x] >= 1)     // Commodity, not peat, burned, tropical, not IFL, plantation
+						        {
+						            outdata1a = Biomass_tCO2e_yesfire_CO2_only;
+						            outdata1b = Biomass_tCO2e_yesfire_non_CO2;
+						            outdata20 = 14;
+ 						        }
+						        if (plant_data[x] == 0)     // Commodity, not peat, burned, tropical, not IFL, not plantation
+						        {
+						            outdata1a = Biomass_tCO2e_yesfire_CO2_only + minsoil;
+						            outdata1b = Biomass_tCO2e_yesfire_non_CO2;
+						            outdata20 = 141;
+						        }
+                            }
+						}
+						if (ecozone_data[x] == boreal)   // Commodity, not peat, burned, boreal
+						{
+                            outdata1a = Biomass_tCO2e_yesfire_CO2_only + minsoil;
+                            outdata1b = Biomass_tCO2e_yesfire_non_CO2;
+						    outdata20 = 15;
+						}
+						if (ecozone_data[x] == temperate)   // Commodity, not peat, burned, temperate
+						{
+						    if (plant_data[x] >= 1)     // Commodity, not peat, burned, temperate, plantation
+						    {
+						        outdata1a = Biomass_tCO2e_yesfire_CO2_only;
+						        outdata1b = Biomass_tCO2e_yesfire_non_CO2;
+						        outdata20 = 16;
+						    }
+						    if (plant_data[x] == 0)     // Commodity, not peat, burned, temperate, not plantation
+						    {
+						        outdata1a = Biomass_tCO2e_yesfire_CO2_only + minsoil;
+						        outdata1b = Biomass_tCO2e_yesfire_non_CO2;
+						        outdata20 = 161;
+						    }
+						}
+					}
+					if (burn_data[x] == 0) // Commodity, not peat, not burned
+					{
+						if (ecozone_data[x] == tropical)   // Commodity, not peat, not burned, tropical
+						{
+						    if (plant_data[x] >= 1)     // Commodity, not peat, not burned, tropical, plantation
+						    {
+						        outdata1a = Biomass_tCO2e_nofire_CO2_only;
+						        outdata1b = 0;
+						        outdata20 = 17;
+						    }
+						    if (plant_data[x] == 0)     // Commodity, not peat, not burned, tropical, not plantation
+						    {
+						        outdata1a = Biomass_tCO2e_nofire_CO2_only + minsoil;
+						        outdata1b = 0;
+						        outdata20 = 171;
+						    }
+						}
+						if (ecozone_data[x] == boreal)   // Commodity, not peat, not burned, boreal
+						{
+                            outdata1a = Biomass_tCO2e_nofire_CO2_only + minsoil;
+                            outdata1b = 0;
+                            outdata20 = 18;
+						}
+						if (ecozone_data[x] == temperate)   // Commodity, not peat, not burned, temperate
+						{
+						    if (plant_data[x] >= 1)     // Commodity, not peat, not burned, temperate, plantation
+						    {
+						        outdata1a = Biomass_tCO2e_nofire_CO2_only;
+						        outdata1b = 0;
+						        outdata20 = 19;
+						    }
+						    if (plant_data[x] == 0)     // Commodity, not peat, not burned, temperate, not plantation
+						    {
+						        outdata1a = Biomass_tCO2e_nofire_CO2_only + minsoil;
+						        outdata1b = 0;
+						        outdata20 = 191;
+
+						        ////QC code to get the values of the relevant variables at a particular pixel of interest (based on its values rather than its coordinates)
+                                //double total;
+                                //total = Biomass_tCO2e_yesfire_CO2_only + peat_drain_total_CO2_only + peatburn_CO2_only + Biomass_tCO2e_yesfire_non_CO2 + peat_drain_total_non_CO2 + peatburn_non_CO2;
+                                //if ((total < 715) && (total > 714) && (agc_data[x] = 26.25) && (soil_data[x] = 216) && (dead_data[x] = 1.44) && (litter_data[x] = 0.5328) && (burn_data[x] = 6))
+                                //{
+                                //    cout << "total: " << total << endl;
+                                //    cout << "Biomass_tCO2e_yesfire_CO2_only: " << Biomass_tCO2e_yesfire_CO2_only << endl;
+                                //    cout << "Biomass_tCO2e_yesfire_non_CO2: " << Biomass_tCO2e_yesfire_non_CO2 << endl;
+                                //    cout << "peat_drain_total_CO2_only: " << peat_drain_total_CO2_only << endl;
+                                //    cout << "peat_drain_total_non_CO2: " << peat_drain_total_non_CO2 << endl;
+                                //    cout << "peatburn_CO2_only: " << peatburn_CO2_only << endl;
+                                //    cout << "peatburn_non_CO2: " << peatburn_non_CO2 << endl;
+                                //    cout << "agc_data[x]: " << agc_data[x] << endl;
+                                //    cout << "Cf: " << Cf << endl;
+                                //    cout << "Gef_CO2: " << Gef_CO2 << endl;
+                                //    cout << "Gef_CH4: " << Gef_CH4 << endl;
+                                //    cout << "Gef_N2O: " << Gef_N2O << endl;
+                                //    cout << "" << endl;
+                                //}
+						    }
+						}
+					}
+				}
+				outdata1 = outdata1a + outdata1b;
+			}
+
+			// Emissions model for shifting agriculture (only difference is flu val)
+			else if (drivermodel_data[x] == 2)
+			{
+				Biomass_tCO2e_nofire_CO2_only = non_soil_c * C_to_CO2;
+				Biomass_tCO2e_yesfire_CO2_only = (non_soil_c * C_to_CO2);
+                Biomass_tCO2e_yesfire_non_CO2 = ((non_soil_c / biomass_to_c) * Cf * Gef_CH4 * pow(10,-3) * CH4_equiv) + ((non_soil_c / biomass_to_c) * Cf * Gef_N2O * pow(10,-3) * N2O_equiv);
+				float shiftag_flu;
+				shiftag_flu = 0.72;
+				minsoil = ((soil_data[x]-(soil_data[x] * shiftag_flu))/soil_emis_period) * (model_years-loss_data[x]);
+
+				if (peat_data[x] > 0) // Shifting ag, peat
+				{
+					if (burn_data[x] > 0) // Shifting ag, peat, burned
+					{
+						if ((ecozone_data[x] == boreal) || (ecozone_data[x] == temperate))      // Shifting ag, peat, burned, temperate/boreal
+						{
+						    outdata2a = Biomass_tCO2e_yesfire_CO2_only + peatburn_CO2_only;
+						    outdata2b = Biomass_tCO2e_yesfire_non_CO2 + peatburn_non_CO2;
+						    outdata20 = 20;
+						}
+						if (ecozone_data[x] == tropical)      // Shifting ag, peat, burned, tropical
+						{
+						    outdata2a = Biomass_tCO2e_yesfire_CO2_only + peat_drain_total_CO2_only + peatburn_non_CO2;
+						    outdata2b = Biomass_tCO2e_yesfire_non_CO2 + peat_drain_total_non_CO2 + peatburn_non_CO2;
+						    outdata20 = 21;
+						}
+					}
+					if (burn_data[x] == 0)// Shifting ag, peat, not burned
+					{
+						if ((ecozone_data[x] == boreal) || (ecozone_data[x] == temperate))      // Shifting ag, peat, not burned, temperate/boreal
+						{
+						    outdata2a = Biomass_tCO2e_nofire_CO2_only;
+						    outdata2b = 0;
+						    outdata20 = 22;
+						}
+						if (ecozone_data[x] == tropical)      // Shifting ag, peat, not burned, tropical
+						{
+						    if (plant_data[x] >= 1)     // Shifting ag, peat, not burned, tropical, plantation
+						    {
+						        outdata2a = Biomass_tCO2e_nofire_CO2_only + peat_drain_total_CO2_only;
+						        outdata2b = 0 + peat_drain_total_non_CO2;
+						        outdata20 = 23;
+						    }
+						    if (plant_data[x] == 0)     // Shifting ag, peat, not burned, tropical, not plantation
+						    {
+						        outdata2a = Biomass_tCO2e_nofire_CO2_only;
+						        outdata2b = 0;
+						        outdata20 = 231;
+						    }
+						}
+					}
+				}
+				if (peat_data[x] == 0)// Shifting ag, not peat
+				{
+					if (burn_data[x] > 0) // Shifting ag, not peat, burned
+					{
+						if (ecozone_data[x] == tropical)   // Shifting ag, not peat, burned, tropical
+						{
+                            if (ifl_primary_data[x] == 1)   // Shifting ag, not peat, burned, tropical, IFL
+                            {
+                                if (plant_data[x] >= 1)     // Shifting ag, not peat, burned, tropical, IFL, plantation
+						        {
+						            outdata2a = Biomass_tCO2e_yesfire_CO2_only;
+						            outdata2b = Biomass_tCO2e_yesfire_non_CO2;
+						            outdata20 = 24;
+						        }
+						        if (plant_data[x] == 0)     // Shifting ag, not peat, burned, tropical, IFL, not plantation
+						        {
+						            outdata2a = Biomass_tCO2e_yesfire_CO2_only + minsoil;
+						            outdata2b = Biomass_tCO2e_yesfire_non_CO2;
+						            outdata20 = 241;
+						        }
+						    }
+						    if (ifl_primary_data[x] == 0)   // Shifting ag, not peat, burned, tropical, not IFL
+						    {
+                                if (plant_data[x] >= 1)     // Shifting ag, not peat, burned, tropical, not IFL, plantation
+						        {
+						            outdata2a = Biomass_tCO2e_yesfire_CO2_only;
+						            outdata2b = Biomass_tCO2e_yesfire_non_CO2;
+						            outdata20 = 25;
+						        }
+						        if (plant_data[x] == 0)     // Shifting ag, not peat, burned, tropical, not IFL, not plantation
+						        {
+						            outdata2a = Biomass_tCO2e_yesfire_CO2_only + minsoil;
+						            outdata2b = Biomass_tCO2e_yesfire_non_CO2;
+						            outdata20 = 251;
+						        }
+                            }
+						}
+						if (ecozone_data[x] == boreal)   // Shifting ag, not peat, burned, boreal
+						{
+                            outdata2a = Biomass_tCO2e_yesfire_CO2_only + minsoil;
+                            outdata2b = Biomass_tCO2e_yesfire_non_CO2;
+						    outdata20 = 26;
+						}
+						if (ecozone_data[x] == temperate)   // Shifting ag, not peat, burned, temperate
+						{
+						    if (plant_data[x] >= 1)     // Shifting ag, not peat, burned, temperate, plantation
+						    {
+						        outdata2a = Biomass_tCO2e_yesfire_CO2_only;
+						        outdata2b = Biomass_tCO2e_yesfire_non_CO2;
+						        outdata20 = 27;
+						    }
+						    if (plant_data[x] == 0)     // Shifting ag, not peat, burned, temperate, not plantation
+						    {
+						        outdata2a = Biomass_tCO2e_yesfire_CO2_only + minsoil;
+						        outdata2b = Biomass_tCO2e_yesfire_non_CO2;
+						        outdata20 = 271;
+						    }
+						}
+					}
+					if (burn_data[x] == 0) // Shifting ag, not peat, not burned
+					{
+						if (ecozone_data[x] == tropical)   // Shifting ag, not peat, not burned, tropical
+						{
+						    if (plant_data[x] >= 1)     // Shifting ag, not peat, not burned, tropical, plantation
+						    {
+						        outdata2a = Biomass_tCO2e_nofire_CO2_only;
+						        outdata2b = 0;
+						        outdata20 = 28;
+						    }
+						    if (plant_data[x] == 0)     // Shifting ag, not peat, not burned, tropical, not plantation
+						    {
+						        outdata2a = Biomass_tCO2e_nofire_CO2_only + minsoil;
+						        outdata2b = 0;
+						        outdata20 = 281;
+
+//                                //QC code to get the values of the relevant variables at a particular pixel of interest (based on its values rather than its coordinates)
+//                                double total;
+//                                total = Biomass_tCO2e_nofire_CO2_only + minsoil;
+//                                double minsoil_pt1;
+//                                minsoil_pt1 = ((soil_data[x]-(soil_data[x] * shiftag_flu))/soil_emis_period);
+//                                double minsoil_pt2;
+//                                minsoil_pt2 = (model_years-loss_data[x]);
+////                              if ((total < 781) && (total > 780) && (agc_data[x] < 155) && (agc_data[x] > 154) && (loss_data[x] = 3) && (soil_data[x] = 135) && (drivermodel_data[x] == 2))
+////                                if ((x > 3525) && (x < 3530) && (total < 781) && (total > 780) && (agc_data[x] = 154.354538) && (loss_data[x] = 3) && (soil_data[x] = 135) && (drivermodel_data[x] == 2))
+//                                if ((x > 3526) && (x < 3528) && (y > 1555) && (y < 1559) && (drivermodel_data[x] == 2) && (loss_data[x] = 3))
+//                                {
+//                                    cout << "x: " << x << endl;
+//                                    cout << "y: " << y << endl;
+//                                    cout << "agc_data: " << agc_data[x] << endl;
+//                                    cout << "bgc_data: " << bgc_data[x] << endl;
+//                                    cout << "deadwood_data: " << dead_data[x] << endl;
+//                                    cout << "litter_data: " << litter_data[x] << endl;
+//                                    cout << "non_soil_C: " << non_soil_c << endl;
+//                                    cout << "C_to_CO2: " << C_to_CO2 << endl;
+//                                    cout << "Biomass_tCO2e_nofire_CO2_only: " << Biomass_tCO2e_nofire_CO2_only << endl;
+//                                    cout << "soil_data: " << soil_data[x] << endl;
+//                                    cout << "shiftag_flu: " << shiftag_flu << endl;
+//                                    cout << "minsoil_first_half: " << minsoil_pt1 << endl;
+//                                    cout << "loss_year: " << loss_data[x] << endl;
+//                                    cout << "minsoil_second_half: " << (model_years-loss_data[x]) << endl;
+//                                    cout << "minsoil: " << minsoil << endl;
+//                                    cout << "total: " << total << endl;
+//                                    cout << endl;
+//                                }
+						    }
+						}
+						if (ecozone_data[x] == boreal)   // Shifting ag, not peat, not burned, boreal
+						{
+                            outdata2a = Biomass_tCO2e_nofire_CO2_only + minsoil;
+                            outdata2b = 0;
+                            outdata20 = 29;
+						}
+						if (ecozone_data[x] == temperate)   // Shifting ag, not peat, not burned, temperate
+						{
+						    if (plant_data[x] >= 1)     // Shifting ag, not peat, not burned, temperate, plantation
+						    {
+						        outdata2a = Biomass_tCO2e_nofire_CO2_only;
+						        outdata2b = 0;
+						        outdata20 = 291;
+						    }
+						    if (plant_data[x] == 0)     // Shifting ag, not peat, not burned, temperate, not plantation
+						    {
+						        outdata2a = Biomass_tCO2e_nofire_CO2_only + minsoil;
+						        outdata2b = 0;
+						        outdata20 = 292;
+						    }
+						}
+					}
+				}
+			    outdata2 = outdata2a + outdata2b;
+			}
+
+			// Emissions model for forestry
+			else if (drivermodel_data[x] == 3)
+			{
+				Biomass_tCO2e_nofire_CO2_only = above_below_c * C_to_CO2;
+				Biomass_tCO2e_yesfire_CO2_only = ((agc_data[x] / biomass_to_c) * Cf * Gef_CO2 * pow(10, -3));
+                Biomass_tCO2e_yesfire_non_CO2 = ((agc_data[x] / biomass_to_c) * Cf * Gef_CH4 * pow(10, -3) * CH4_equiv) + ((agc_data[x] / biomass_to_c) * Cf * Gef_N2O * pow(10, -3) * N2O_equiv);
+
+				if (peat_data[x] > 0) // Forestry, peat
+				{
+					if (burn_data[x] > 0 ) // Forestry, peat, burned
+					{
+						outdata3a = Biomass_tCO2e_yesfire_CO2_only + peat_drain_total_CO2_only + peatburn_CO2_only;
+						outdata3b = Biomass_tCO2e_yesfire_non_CO2 + peat_drain_total_non_CO2 + peatburn_non_CO2;
+						outdata20 = 30;
+					}
+					if (burn_data[x] == 0 )  // Forestry, peat, not burned
+					{
+						if ((ecozone_data[x] == boreal) || (ecozone_data[x] == temperate))  // Forestry, peat, not burned, temperate/boreal
+						{
+							outdata3a = Biomass_tCO2e_nofire_CO2_only;
+							outdata3b = 0;
+							outdata20 = 31;
+						}
+						if (ecozone_data[x] == tropical)// Forestry, peat, not burned, tropical
+						{
+							if (plant_data[x] > 0)  // Forestry, peat, not burned, tropical, plantation
+							{
+								outdata3a = Biomass_tCO2e_nofire_CO2_only + peat_drain_total_CO2_only;
+								outdata3b = 0 + peat_drain_total_non_CO2;
+								outdata20 = 32;
+							}
+							if (plant_data[x] == 0)  // Forestry, peat, not burned, tropical, not plantation
+							{
+								outdata3a = Biomass_tCO2e_nofire_CO2_only;
+								outdata3b = 0;
+								outdata20 = 321;
+							}
+						}
+					}
+				}
+				else
+				{
+					if (burn_data[x] > 0) // Forestry, not peat, burned
+					{
+						outdata3a = Biomass_tCO2e_yesfire_CO2_only;
+						outdata3b = Biomass_tCO2e_yesfire_non_CO2;
+						outdata20 = 33;
+					}
+					if (burn_data[x] == 0) // Forestry, not peat, not burned
+					{
+						outdata3a = Biomass_tCO2e_nofire_CO2_only;
+						outdata3b = 0;
+						outdata20 = 34;
+					}
+				}
+				outdata3 = outdata3a + outdata3b;
+			}
+
+		    // Emissions model for wildfires
+		    else if (drivermodel_data[x] == 4)
+			{
+				Biomass_tCO2e_nofire_CO2_only = above_below_c * C_to_CO2;
+				Biomass_tCO2e_yesfire_CO2_only = ((agc_data[x] / biomass_to_c) * Cf * Gef_CO2 * pow(10, -3));
+				Biomass_tCO2e_yesfire_non_CO2 = ((agc_data[x] / biomass_to_c) * Cf * Gef_CH4 * pow(10, -3) * CH4_equiv) + ((agc_data[x] / biomass_to_c) * Cf * Gef_N2O * pow(10, -3) * N2O_equiv);
+
+				if (peat_data[x] > 0) // Wildfire, peat
+				{
+					if (burn_data[x] > 0) // Wildfire, peat, burned
+					{
+						outdata4a = Biomass_tCO2e_yesfire_CO2_only + peat_drain_total_CO2_only + peatburn_CO2_only;
+						outdata4b = Biomass_tCO2e_yesfire_non_CO2 + peat_drain_total_non_CO2 + peatburn_non_CO2;
+						outdata20 = 40;
+					}
+					if (burn_data[x] == 0) // Wildfire, peat, not burned
+					{
+						if ((ecozone_data[x] == boreal) || (ecozone_data[x] == temperate)) // Wildfire, peat, not burned, temperate/boreal
+						{
+							outdata4a = Biomass_tCO2e_nofire_CO2_only;
+							outdata4b = 0;
+							outdata20 = 41;
+						}
+						if (ecozone_data[x] == tropical) // Wildfire, peat, not burned, tropical
+						{
+					        if (plant_data[x] > 0)  // Wildfire, peat, not burned, tropical, plantation
+							{
+								outdata4a = Biomass_tCO2e_nofire_CO2_only + peat_drain_total_CO2_only;
+								outdata4b = 0 + peat_drain_total_non_CO2;
+								outdata20 = 42;
+							}
+							if (plant_data[x] == 0)  // Wildfire, peat, not burned, tropical, not plantation
+							{
+								outdata4a = Biomass_tCO2e_nofire_CO2_only;
+								outdata4b = 0;
+								outdata20 = 421;
+							}
+						}
+					}
+				}
+				else  // Wildfire, not peat
+				{
+					if (burn_data[x] > 0)  // Wildfire, not peat, burned
+					{
+						outdata4a = Biomass_tCO2e_yesfire_CO2_only;
+						outdata4b = Biomass_tCO2e_yesfire_non_CO2;
+						outdata20 = 43;
+					}
+					else  // Wildfire, not peat, not burned
+					{
+						outdata4a = Biomass_tCO2e_nofire_CO2_only;
+						outdata4b = 0;
+						outdata20 = 44;
+					}
+				}
+				outdata4 = outdata4a + outdata4b;
+			}
+
+		    // Emissions model for urbanization
+		    else if (drivermodel_data[x] == 5)
+			{
+				Biomass_tCO2e_nofire_CO2_only = non_soil_c * C_to_CO2;
+				Biomass_tCO2e_yesfire_CO2_only = (non_soil_c * C_to_CO2);
+				Biomass_tCO2e_yesfire_non_CO2 = ((non_soil_c / biomass_to_c) * Cf * Gef_CH4 * pow(10,-3) * CH4_equiv) + ((non_soil_c / biomass_to_c) * Cf * Gef_N2O * pow(10,-3) * N2O_equiv);
+				float urb_flu;
+				urb_flu = 0.8;
+				minsoil = ((soil_data[x]-(soil_data[x] * urb_flu))/soil_emis_period) * (model_years-loss_data[x]);
+
+                if (peat_data[x] > 0) // Urbanization, peat
+				{
+					if (burn_data[x] > 0) // Urbanization, peat, burned
+					{
+						outdata5a = Biomass_tCO2e_yesfire_CO2_only + peat_drain_total_CO2_only + peatburn_CO2_only;
+						outdata5b = Biomass_tCO2e_yesfire_non_CO2 + peat_drain_total_non_CO2 + peatburn_non_CO2;
+						outdata20 = 50;
+					}
+					if (burn_data[x] == 0) // Urbanization, peat, not burned
+					{
+						if (ecozone_data[x] == tropical) // Urbanization, peat, not burned, tropical
+						{
+						    if (plant_data[x] >= 1) // Urbanization, peat, not burned, tropical, plantation
+						    {
+						    	outdata5a = Biomass_tCO2e_nofire_CO2_only + peat_drain_total_CO2_only;
+						        outdata5b = 0 + peat_drain_total_non_CO2;
+						        outdata20 = 51;
+						    }
+						    if (plant_data[x] == 0)     // Urbanization, peat, not burned, tropical, not plantation
+						    {
+						        outdata5a = Biomass_tCO2e_nofire_CO2_only;
+						        outdata5b = 0;
+						        outdata20 = 511;
+						    }
+						}
+                        if ((ecozone_data[x] == boreal) || (ecozone_data[x] == temperate))      // Urbanization, peat, not burned, temperate/boreal
+						{
+						    outdata5a = Biomass_tCO2e_nofire_CO2_only + peat_drain_total_CO2_only;
+						    outdata5b = 0 + peat_drain_total_non_CO2;
+						    outdata20 = 52;
+						}
+					}
+				}
+				if (peat_data[x] == 0)// Urbanization, not peat
+				{
+					if (burn_data[x] > 0) // Urbanization, not peat, burned
+					{
+						if (ecozone_data[x] == tropical)   // Urbanization, not peat, burned, tropical
+						{
+                            if (ifl_primary_data[x] == 1)   // Urbanization, not peat, burned, tropical, IFL
+                            {
+                                if (plant_data[x] >= 1)     // Urbanization, not peat, burned, tropical, IFL, plantation
+						        {
+						            outdata5a = Biomass_tCO2e_yesfire_CO2_only;
+						            outdata5b = Biomass_tCO2e_yesfire_non_CO2;
+						            outdata20 = 53;
+						        }
+						        if (plant_data[x] == 0)     // Urbanization, not peat, burned, tropical, IFL, not plantation
+						        {
+						            outdata5a = Biomass_tCO2e_yesfire_CO2_only + minsoil;
+						            outdata5b = Biomass_tCO2e_yesfire_non_CO2;
+						            outdata20 = 531;
+						        }
+						    }
+						    if (ifl_primary_data[x] == 0)   // Urbanization, not peat, burned, tropical, not IFL
+						    {
+                                if (plant_data[x] >= 1)     // Urbanization, not peat, burned, tropical, not IFL, plantation
+						        {
+						            outdata5a = Biomass_tCO2e_yesfire_CO2_only;
+						            outdata5b = Biomass_tCO2e_yesfire_non_CO2;
+						            outdata20 = 54;
+						        }
+						        if (plant_data[x] == 0)     // Urbanization, not peat, burned, tropical, not IFL, not plantation
+						        {
+						            outdata5a = Biomass_tCO2e_yesfire_CO2_only + minsoil;
+						            outdata5b = Biomass_tCO2e_yesfire_non_CO2;
+						            outdata20 = 541;
+						        }
+                            }
+						}
+						if (ecozone_data[x] == boreal)   // Urbanization, not peat, burned, boreal
+						{
+                            outdata5a = Biomass_tCO2e_yesfire_CO2_only + minsoil;
+                            outdata5b = Biomass_tCO2e_yesfire_non_CO2;
+						    outdata20 = 55;
+						}
+						if (ecozone_data[x] == temperate)   // Urbanization, not peat, burned, temperate
+						{
+						    if (plant_data[x] >= 1)     // Urbanization, not peat, burned, temperate, plantation
+						    {
+						        outdata5a = Biomass_tCO2e_yesfire_CO2_only;
+						        outdata5b = Biomass_tCO2e_yesfire_non_CO2;
+						        outdata20 = 56;
+						    }
+						    if (plant_data[x] == 0)     // Urbanization, not peat, burned, temperate, not plantation
+						    {
+						        outdata5a = Biomass_tCO2e_yesfire_CO2_only + minsoil;
+						        outdata5b = Biomass_tCO2e_yesfire_non_CO2;
+						        outdata20 = 561;
+						    }
+						}
+					}
+					if (burn_data[x] == 0) // Urbanization, not peat, not burned
+					{
+						if (ecozone_data[x] == tropical)   // Urbanization, not peat, not burned, tropical
+						{
+						    if (plant_data[x] >= 1)     // Urbanization, not peat, not burned, tropical, plantation
+						    {
+						        outdata5a = Biomass_tCO2e_nofire_CO2_only;
+						        outdata5b = 0;
+						        outdata20 = 57;
+						    }
+						    if (plant_data[x] == 0)     // Urbanization, not peat, not burned, tropical, not plantation
+						    {
+						        outdata5a = Biomass_tCO2e_nofire_CO2_only + minsoil;
+						        outdata5b = 0;
+						        outdata20 = 571;
+						    }
+						}
+						if (ecozone_data[x] == boreal)   // Urbanization, not peat, not burned, boreal
+						{
+                            outdata5a = Biomass_tCO2e_nofire_CO2_only + minsoil;
+                            outdata5b = 0;
+                            outdata20 = 58;
+						}
+						if (ecozone_data[x] == temperate)   // Urbanization, not peat, not burned, temperate
+						{
+						    if (plant_data[x] >= 1)     // Urbanization, not peat, not burned, temperate, plantation
+						    {
+						        outdata5a = Biomass_tCO2e_nofire_CO2_only;
+						        outdata5b = 0;
+						        outdata20 = 59;
+						    }
+						    if (plant_data[x] == 0)     // Urbanization, not peat, not burned, temperate, not plantation
+						    {
+						        outdata5a = Biomass_tCO2e_nofire_CO2_only + minsoil;
+						        outdata5b = 0;
+						        outdata20 = 591;
+						    }
+						}
+					}
+				}
+				outdata5 = outdata5a + outdata5b;
+			}
+
+		    // Emissions for where there is no driver model.
+		    // Nancy said to make this the same as forestry.
+		    else
+			{
+				Biomass_tCO2e_nofire_CO2_only = above_below_c * C_to_CO2;
+				Biomass_tCO2e_yesfire_CO2_only = ((agc_data[x] / biomass_to_c) * Cf * Gef_CO2 * pow(10, -3));
+				Biomass_tCO2e_yesfire_non_CO2 = ((agc_data[x] / biomass_to_c) * Cf * Gef_CH4 * pow(10, -3) * CH4_equiv) + ((agc_data[x] / biomass_to_c) * Cf * Gef_N2O * pow(10, -3) * N2O_equiv);
+
+				if (peat_data[x] > 0) // No driver, peat
+				{
+					if (burn_data[x] > 0 ) // No driver, peat, burned
+					{
+						outdata6a = Biomass_tCO2e_yesfire_CO2_only + peat_drain_total_CO2_only + peatburn_CO2_only;
+						outdata6b = Biomass_tCO2e_yesfire_non_CO2 + peat_drain_total_non_CO2 + peatburn_non_CO2;
+						outdata20 = 60;
+					}
+					if (burn_data[x] == 0 )  // No driver, peat, not burned
+					{
+						if ((ecozone_data[x] == boreal) || (ecozone_data[x] == temperate))  // No driver, peat, not burned, temperate/boreal
+						{
+							outdata6a = Biomass_tCO2e_nofire_CO2_only;
+							outdata6b = 0;
+							outdata20 = 61;
+						}
+						if (ecozone_data[x] == tropical)// No driver, peat, not burned, tropical
+						{
+							if (plant_data[x] > 0)  // No driver, peat, not burned, tropical, plantation
+							{
+								outdata6a = Biomass_tCO2e_nofire_CO2_only + peat_drain_total_CO2_only;
+								outdata6b = 0 + peat_drain_total_non_CO2;
+								outdata20 = 62;
+							}
+							if (plant_data[x] == 0)  // No driver, peat, not burned, tropical, not plantation
+							{
+								outdata6a = Biomass_tCO2e_nofire_CO2_only;
+								outdata6b = 0;
+								outdata20 = 621;
+							}
+						}
+					}
+				}
+				else
+				{
+					if (burn_data[x] > 0) // No driver, not peat, burned
+					{
+						outdata6a = Biomass_tCO2e_yesfire_CO2_only;
+						outdata6b = Biomass_tCO2e_yesfire_non_CO2;
+						outdata20 = 63;
+					}
+					if (burn_data[x] == 0) // No driver, not peat, not burned
+					{
+						outdata6a = Biomass_tCO2e_nofire_CO2_only;
+						outdata6b = 0;
+						outdata20 = 64;
+					}
+				}
+				outdata6 = outdata6a + outdata6b;
+			}
+
+			// Write the value to the correct raster
+			if (drivermodel_data[x] == 1)  // Commodities
+			{
+				out_data1[x] = outdata1;
+				out_data2[x] = 0;
+				out_data3[x] = 0;
+				out_data4[x] = 0;
+				out_data5[x] = 0;
+				out_data6[x] = 0;
+			}
+			else if (drivermodel_data[x] == 2)  // Shifting ag
+			{
+				out_data1[x] = 0;
+				out_data2[x] = outdata2;
+				out_data3[x] = 0;
+				out_data4[x] = 0;
+				out_data5[x] = 0;
+				out_data6[x] = 0;
+			}
+			else if (drivermodel_data[x] == 3)  // Forestry
+			{
+				out_data1[x] = 0;
+				out_data2[x] = 0;
+				out_data3[x] = outdata3;
+				out_data4[x] = 0;
+				out_data5[x] = 0;
+				out_data6[x] = 0;
+			}
+			else if (drivermodel_data[x] == 4)  // Wildfire
+			{
+				out_data1[x] = 0;
+				out_data2[x] = 0;
+				out_data3[x] = 0;
+				out_data4[x] = outdata4;
+				out_data5[x] = 0;
+				out_data6[x] = 0;
+			}
+			else if (drivermodel_data[x] == 5)  // Urbanization
+			{
+				out_data1[x] = 0;
+				out_data2[x] = 0;
+				out_data3[x] = 0;
+				out_data4[x] = 0;
+				out_data5[x] = outdata5;
+				out_data6[x] = 0;
+			}
+			else                                // No driver
+			{
+				out_data1[x] = 0;
+				out_data2[x] = 0;
+				out_data3[x] = 0;
+				out_data4[x] = 0;
+				out_data5[x] = 0;
+				out_data6[x] = outdata6;
+			}
+				// Decision tree end node value stored in its raster
+				out_data20[x] = outdata20;
+
+
+				// Add up all drivers for a combined raster. Each pixel only has one driver
+				outdata10 = outdata1 + outdata2 + outdata3 + outdata4 + outdata5 + outdata6;
+				outdata11 = outdata1a + outdata2a + outdata3a + outdata4a + outdata5a + outdata6a;
+				outdata12 = outdata1b + outdata2b + outdata3b + outdata4b + outdata5b + outdata6b;
+
+				if (outdata10 == 0)
+				{
+					out_data10[x] = 0;
+					out_data11[x] = 0;
+					out_data12[x] = 0;
+				}
+				else{
+					out_data10[x] = outdata10;
+					out_data11[x] = outdata11;
+					out_data12[x] = outdata12;
+				}
+		}
+
+		// If pixel is not on loss and carbon, all output rasters get 0
+		else
+		{
+
+			out_data1[x] = 0;
+			out_data2[x] = 0;
+			out_data3[x] = 0;
+			out_data4[x] = 0;
+			out_data5[x] = 0;
+			out_data6[x] = 0;
+			out_data10[x] = 0;
+			out_data11[x] = 0;
+			out_data12[x] = 0;
+			out_data20[x] = 0;
+		}
+    }
+}
+
+
+// Checks the emission factor table against def_variables (equations.cpp). Returns the number of mismatches.
+extern "C" int verify_emission_factors()
+{
+    return verify_emission_factor_table();
+}
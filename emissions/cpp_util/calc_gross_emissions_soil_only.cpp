@@ -14,7 +14,7 @@
 // Because emissions are separately output for CO2 and non-CO2 gases (CH4 and N20), each model endpoint has a CO2-only and
 // a non-CO2 value. These are summed to create a total emissions (all gases) for each pixel.
 // Compile with:
-// c++ /usr/local/app/emissions/cpp_util/calc_gross_emissions_soil_only.cpp -o /usr/local/app/emissions/cpp_util/calc_gross_emissions_soil_only.exe -lgdal
+// c++ /usr/local/app/emissions/cpp_util/calc_gross_emissions_soil_only.cpp -o /usr/local/app/emissions/cpp_util/calc_gross_emissions_soil_only.exe -lgdal -pthread
 
 
 #include <iostream>
@@ -39,336 +39,52 @@
 #include "equations.cpp"
 #include "constants.h"
 
+// Reads the inputs and writes the outputs in blocks of rows on several threads
+#include "gross_emissions_io.cpp"
+
 using namespace std;
 
-//to compile:  c++ calc_gross_emissions.cpp -o calc_gross_emissions.exe -lgdal
-int main(int argc, char* argv[])
+// The per-pixel decision tree of the soil_only model, applied to n pixels.
+// Inputs and outputs are in the order of gross_emissions_block_function in gross_emissions_io.cpp.
+void calc_gross_emissions_soil_only_block(long n,
+    const float *agc_data, const float *bgc_data, const float *drivermodel_data, const float *loss_data,
+    const float *peat_data, const float *burn_data, const float *ifl_primary_data, const float *ecozone_data,
+    const float *climate_data, const float *dead_data, const float *litter_data, const float *soil_data,
+    const float *plant_data,
+    float *out_data1, float *out_data2, float *out_data3, float *out_data4, float *out_data5, float *out_data6,
+    float *out_data10, float *out_data11, float *out_data12, float *out_data20)
 {
-// If code is run other than <program name> <tile id> , it will raise this error.
-if (argc != 4){cout << "Use <program name> <tile id><sensit_type><folder>" << endl; return 1;}
+    // Model constants
+    int model_years;    // How many loss years are in the model
+    model_years = constants::model_years;
 
-// Input arguments
-string tile_id = argv[1];    // The tile id comes from the second argument. The first argument is the name of this code.
-string sensit_type = argv[2];   // For standard model or sensitivity analyses that use the standard emissions model.
-                             // Used to name the input carbon pool tiles and output gross emissions tiles.
-string infolder = argv[3];     // The folder which has all the input files
+    int CH4_equiv;      // The CO2 equivalency (global warming potential) of CH4
+    CH4_equiv = constants::CH4_equiv;
 
-cout << "Gross emissions C++ infolder:" << infolder << endl;
+    int N2O_equiv;      // The CO2 equivalency (global warming potential) of N2O
+    N2O_equiv = constants::N2O_equiv;
 
-// Model constants
-int model_years;    // How many loss years are in the model
-model_years = constants::model_years;
-string model_years_str;
-model_years_str = to_string(model_years);
-
-int CH4_equiv;      // The CO2 equivalency (global warming potential) of CH4
-CH4_equiv = constants::CH4_equiv;
-
-int N2O_equiv;      // The CO2 equivalency (global warming potential) of N2O
-N2O_equiv = constants::N2O_equiv;
+    float C_to_CO2;       // The conversion of carbon to CO2
+    C_to_CO2 = constants::C_to_CO2;
 
-float C_to_CO2;       // The conversion of carbon to CO2
-C_to_CO2 = constants::C_to_CO2;
+    float biomass_to_c;    // Fraction of carbon in biomass
+    biomass_to_c = constants::biomass_to_c;
 
-float biomass_to_c;    // Fraction of carbon in biomass
-biomass_to_c = constants::biomass_to_c;
+    int tropical;       // The ecozone code for the tropics
+    tropical = constants::tropical;
 
-int tropical;       // The ecozone code for the tropics
-tropical = constants::tropical;
+    int temperate;      // The ecozone code for the temperate zone
+    temperate = constants::temperate;
 
-int temperate;      // The ecozone code for the temperate zone
-temperate = constants::temperate;
+    int boreal;         // The ecozone code for the boreal zone
+    boreal = constants::boreal;
 
-int boreal;         // The ecozone code for the boreal zone
-boreal = constants::boreal;
-
-int soil_emis_period;      // The number of years over which soil emissions are calculated (separate from model years)
-soil_emis_period = constants::soil_emis_period;
-
-
-// Input files
-// Carbon pools use the standard names for this sensitivity analysis
-string agc_name = infolder + tile_id + constants::AGC_emis_year + ".tif";
-string bgc_name = infolder + tile_id + constants::BGC_emis_year + ".tif";
-string dead_name = infolder + tile_id + constants::deadwood_C_emis_year + ".tif";
-string litter_name = infolder + tile_id + constants::litter_C_emis_year + ".tif";
-string soil_name = infolder + tile_id + constants::soil_C_emis_year + ".tif";
+    int soil_emis_period;      // The number of years over which soil emissions are calculated (separate from model years)
+    soil_emis_period = constants::soil_emis_period;
 
-// Other inputs
-string loss_name = infolder + constants::lossyear + tile_id + ".tif";
-string burn_name = infolder + tile_id + constants::burnyear;
-string ecozone_name = infolder + tile_id + constants::fao_ecozones;
-string climate_name = infolder + tile_id + constants::climate_zones;
-string drivermodel_name = infolder + tile_id + constants::tcl_drivers;
-string peat_name = infolder + tile_id + constants::peat_mask;
-string ifl_primary_name = infolder + tile_id + constants::ifl_primary;
-string plant_name = infolder + tile_id + constants::plantation_type;
+    long x;
 
-// Output files: tonnes CO2/ha for each tree cover loss driver, their total, and the node for the decision tree
-// that determines emissions.
-// regex_replace from https://stackoverflow.com/a/41294178
-string out_name1_pre = constants::commod_emis;
-out_name1_pre = std::regex_replace(out_name1_pre, std::regex("biomass_soil"), "soil_only");
-string out_name1  = tile_id + out_name1_pre + model_years_str + ".tif";
-
-string out_name2_pre = constants::shifting_ag_emis;
-out_name2_pre = std::regex_replace(out_name2_pre, std::regex("biomass_soil"), "soil_only");
-string out_name2  = tile_id + out_name2_pre + model_years_str + ".tif";
-
-string out_name3_pre = constants::forestry_emis;
-out_name3_pre = std::regex_replace(out_name3_pre, std::regex("biomass_soil"), "soil_only");
-string out_name3  = tile_id + out_name3_pre + model_years_str + ".tif";
-
-string out_name4_pre = constants::wildfire_emis;
-out_name4_pre = std::regex_replace(out_name4_pre, std::regex("biomass_soil"), "soil_only");
-string out_name4  = tile_id + out_name4_pre + model_years_str + ".tif";
-
-string out_name5_pre = constants::urbanization_emis;
-out_name5_pre = std::regex_replace(out_name5_pre, std::regex("biomass_soil"), "soil_only");
-string out_name5  = tile_id + out_name5_pre + model_years_str + ".tif";
-
-string out_name6_pre = constants::no_driver_emis;
-out_name6_pre = std::regex_replace(out_name6_pre, std::regex("biomass_soil"), "soil_only");
-string out_name6  = tile_id + out_name6_pre + model_years_str + ".tif";
-
-string out_name10_pre = constants::all_gases_all_drivers_emis;
-out_name10_pre = std::regex_replace(out_name10_pre, std::regex("biomass_soil"), "soil_only");
-string out_name10 = tile_id + out_name10_pre + model_years_str + ".tif";
-
-string out_name11_pre = constants::CO2_only_all_drivers_emis;
-out_name11_pre = std::regex_replace(out_name11_pre, std::regex("biomass_soil"), "soil_only");
-string out_name11 = tile_id + out_name11_pre + model_years_str + ".tif";
-
-string out_name12_pre = constants::non_CO2_all_drivers_emis;
-out_name12_pre = std::regex_replace(out_name12_pre, std::regex("biomass_soil"), "soil_only");
-string out_name12 = tile_id + out_name12_pre + model_years_str + ".tif";
-
-string out_name20_pre = constants::decision_tree_all_drivers_emis;
-out_name20_pre = std::regex_replace(out_name20_pre, std::regex("biomass_soil"), "soil_only");
-string out_name20 = tile_id + out_name20_pre + model_years_str + ".tif";
-
-
-// Setting up the variables to hold the pixel location in x/y values
-int x, y;
-int xsize, ysize;
-double GeoTransform[6]; // Fetch the affine transformation coefficients
-double ulx, uly; double pixelsize;
-
-// Initialize GDAL for reading.
-// Each of these "INBAND" are later associated with the string variables defined above.
-GDALAllRegister();
-GDALDataset  *INGDAL1; GDALRasterBand  *INBAND1;
-GDALDataset  *INGDAL2; GDALRasterBand  *INBAND2;
-GDALDataset  *INGDAL3; GDALRasterBand  *INBAND3;
-GDALDataset  *INGDAL4; GDALRasterBand  *INBAND4;
-GDALDataset  *INGDAL5; GDALRasterBand  *INBAND5;
-GDALDataset  *INGDAL6; GDALRasterBand  *INBAND6;
-GDALDataset  *INGDAL7; GDALRasterBand  *INBAND7;
-GDALDataset  *INGDAL8; GDALRasterBand  *INBAND8;
-GDALDataset  *INGDAL9; GDALRasterBand  *INBAND9;
-GDALDataset  *INGDAL10; GDALRasterBand  *INBAND10;
-GDALDataset  *INGDAL11; GDALRasterBand  *INBAND11;
-GDALDataset  *INGDAL12; GDALRasterBand  *INBAND12;
-GDALDataset  *INGDAL13; GDALRasterBand  *INBAND13;
-
-//open file (string variables defined above) and assign it extent and projection
-INGDAL1 = (GDALDataset *) GDALOpen(agc_name.c_str(), GA_ReadOnly );
-INBAND1 = INGDAL1->GetRasterBand(1);
-
-INGDAL2 = (GDALDataset *) GDALOpen(bgc_name.c_str(), GA_ReadOnly );
-INBAND2 = INGDAL2->GetRasterBand(1);
-
-INGDAL3 = (GDALDataset *) GDALOpen(drivermodel_name.c_str(), GA_ReadOnly );
-INBAND3 = INGDAL3->GetRasterBand(1);
-
-INGDAL4 = (GDALDataset *) GDALOpen(loss_name.c_str(), GA_ReadOnly );
-INBAND4 = INGDAL4->GetRasterBand(1);
-
-INGDAL5 = (GDALDataset *) GDALOpen(peat_name.c_str(), GA_ReadOnly );
-INBAND5 = INGDAL5->GetRasterBand(1);
-
-INGDAL6 = (GDALDataset *) GDALOpen(burn_name.c_str(), GA_ReadOnly );
-INBAND6 = INGDAL6->GetRasterBand(1);
-
-INGDAL7 = (GDALDataset *) GDALOpen(ifl_primary_name.c_str(), GA_ReadOnly );
-INBAND7 = INGDAL7->GetRasterBand(1);
-
-INGDAL8 = (GDALDataset *) GDALOpen(ecozone_name.c_str(), GA_ReadOnly );
-INBAND8 = INGDAL8->GetRasterBand(1);
-
-INGDAL9 = (GDALDataset *) GDALOpen(climate_name.c_str(), GA_ReadOnly );
-INBAND9 = INGDAL9->GetRasterBand(1);
-
-INGDAL10 = (GDALDataset *) GDALOpen(dead_name.c_str(), GA_ReadOnly );
-INBAND10 = INGDAL10->GetRasterBand(1);
-
-INGDAL11 = (GDALDataset *) GDALOpen(litter_name.c_str(), GA_ReadOnly );
-INBAND11 = INGDAL11->GetRasterBand(1);
-
-INGDAL12 = (GDALDataset *) GDALOpen(soil_name.c_str(), GA_ReadOnly );
-INBAND12 = INGDAL12->GetRasterBand(1);
-
-INGDAL13 = (GDALDataset *) GDALOpen(plant_name.c_str(), GA_ReadOnly );
-INBAND13 = INGDAL13->GetRasterBand(1);
-
-// The rest of the code runs on the size of INBAND3. This can be changed.
-xsize=INBAND1->GetXSize();
-ysize=INBAND1->GetYSize();
-INGDAL1->GetGeoTransform(GeoTransform);
-
-ulx=GeoTransform[0];
-uly=GeoTransform[3];
-pixelsize=GeoTransform[1];
-
-// // Manually change this to test the script on a small part of the raster. This starts at top left of the tile.
-//xsize = 900;
-//ysize = 7900;
-
-// Print the raster size and resolution. Should be 40,000 x 40,000 and pixel size 0.00025.
-cout << "Gross emissions soil_only model C++ parameters: " << xsize <<", "<< ysize <<", "<< ulx <<", "<< uly << ", "<< pixelsize << endl;
-
-// Initialize GDAL for writing
-GDALDriver *OUTDRIVER;
-GDALDataset *OUTGDAL1;   // Commodities, all gases
-GDALDataset *OUTGDAL2;   // Shifting ag, all gases
-GDALDataset *OUTGDAL3;   // Forestry, all gases
-GDALDataset *OUTGDAL4;   // Wildfire, all gases
-GDALDataset *OUTGDAL5;   // Urbanization, all gases
-GDALDataset *OUTGDAL6;   // No driver, all gases
-GDALDataset *OUTGDAL10;  // All drivers, all gases
-GDALDataset *OUTGDAL11;  // All drivers, CO2 only
-GDALDataset *OUTGDAL12;  // All drivers, non-CO2
-GDALDataset *OUTGDAL20;  // Decision tree node
-
-GDALRasterBand *OUTBAND1;
-GDALRasterBand *OUTBAND2;
-GDALRasterBand *OUTBAND3;
-GDALRasterBand *OUTBAND4;
-GDALRasterBand *OUTBAND5;
-GDALRasterBand *OUTBAND6;
-GDALRasterBand *OUTBAND10;
-GDALRasterBand *OUTBAND11;
-GDALRasterBand *OUTBAND12;
-GDALRasterBand *OUTBAND20;
-
-OGRSpatialReference oSRS;
-char *OUTPRJ = NULL;
-char **papszOptions = NULL;
-papszOptions = CSLSetNameValue( papszOptions, "COMPRESS", "LZW" );
-OUTDRIVER = GetGDALDriverManager()->GetDriverByName("GTIFF");
-if( OUTDRIVER == NULL ) {cout << "no driver" << endl; exit( 1 );};
-oSRS.SetWellKnownGeogCS( "WGS84" );
-oSRS.exportToWkt( &OUTPRJ );
-double adfGeoTransform[6] = { ulx, pixelsize, 0, uly, 0, -1*pixelsize };
-
-// Commoditiy gross emissions
-OUTGDAL1 = OUTDRIVER->Create( out_name1.c_str(), xsize, ysize, 1, GDT_Float32, papszOptions );
-OUTGDAL1->SetGeoTransform(adfGeoTransform); OUTGDAL1->SetProjection(OUTPRJ);
-OUTBAND1 = OUTGDAL1->GetRasterBand(1);
-OUTBAND1->SetNoDataValue(0);
-
-// Shifting ag gross emissions
-OUTGDAL2 = OUTDRIVER->Create( out_name2.c_str(), xsize, ysize, 1, GDT_Float32, papszOptions );
-OUTGDAL2->SetGeoTransform(adfGeoTransform); OUTGDAL2->SetProjection(OUTPRJ);
-OUTBAND2 = OUTGDAL2->GetRasterBand(1);
-OUTBAND2->SetNoDataValue(0);
-
-// Forestry gross emissions
-OUTGDAL3 = OUTDRIVER->Create( out_name3.c_str(), xsize, ysize, 1, GDT_Float32, papszOptions );
-OUTGDAL3->SetGeoTransform(adfGeoTransform); OUTGDAL3->SetProjection(OUTPRJ);
-OUTBAND3 = OUTGDAL3->GetRasterBand(1);
-OUTBAND3->SetNoDataValue(0);
-
-// Wildfire gross emissions
-OUTGDAL4 = OUTDRIVER->Create( out_name4.c_str(), xsize, ysize, 1, GDT_Float32, papszOptions );
-OUTGDAL4->SetGeoTransform(adfGeoTransform); OUTGDAL4->SetProjection(OUTPRJ);
-OUTBAND4 = OUTGDAL4->GetRasterBand(1);
-OUTBAND4->SetNoDataValue(0);
-
-// Urbanization gross emissions
-OUTGDAL5 = OUTDRIVER->Create( out_name5.c_str(), xsize, ysize, 1, GDT_Float32, papszOptions );
-OUTGDAL5->SetGeoTransform(adfGeoTransform); OUTGDAL5->SetProjection(OUTPRJ);
-OUTBAND5 = OUTGDAL5->GetRasterBand(1);
-OUTBAND5->SetNoDataValue(0);
-
-// No driver gross emissions
-OUTGDAL6 = OUTDRIVER->Create( out_name6.c_str(), xsize, ysize, 1, GDT_Float32, papszOptions );
-OUTGDAL6->SetGeoTransform(adfGeoTransform); OUTGDAL6->SetProjection(OUTPRJ);
-OUTBAND6 = OUTGDAL6->GetRasterBand(1);
-OUTBAND6->SetNoDataValue(0);
-
-// All gases, all drivers combined
-OUTGDAL10 = OUTDRIVER->Create( out_name10.c_str(), xsize, ysize, 1, GDT_Float32, papszOptions );
-OUTGDAL10->SetGeoTransform(adfGeoTransform); OUTGDAL10->SetProjection(OUTPRJ);
-OUTBAND10 = OUTGDAL10->GetRasterBand(1);
-OUTBAND10->SetNoDataValue(0);
-
-// CO2 only, all drivers combined
-OUTGDAL11 = OUTDRIVER->Create( out_name11.c_str(), xsize, ysize, 1, GDT_Float32, papszOptions );
-OUTGDAL11->SetGeoTransform(adfGeoTransform); OUTGDAL11->SetProjection(OUTPRJ);
-OUTBAND11 = OUTGDAL11->GetRasterBand(1);
-OUTBAND11->SetNoDataValue(0);
-
-// Non-CO2, all drivers combined
-OUTGDAL12 = OUTDRIVER->Create( out_name12.c_str(), xsize, ysize, 1, GDT_Float32, papszOptions );
-OUTGDAL12->SetGeoTransform(adfGeoTransform); OUTGDAL12->SetProjection(OUTPRJ);
-OUTBAND12 = OUTGDAL12->GetRasterBand(1);
-OUTBAND12->SetNoDataValue(0);
-
-// Decision tree node
-OUTGDAL20 = OUTDRIVER->Create( out_name20.c_str(), xsize, ysize, 1, GDT_Float32, papszOptions );
-OUTGDAL20->SetGeoTransform(adfGeoTransform); OUTGDAL20->SetProjection(OUTPRJ);
-OUTBAND20 = OUTGDAL20->GetRasterBand(1);
-OUTBAND20->SetNoDataValue(0);
-
-
-// Read/write data
-// Inputs
-float agc_data[xsize];
-float bgc_data[xsize];
-float loss_data[xsize];
-float peat_data[xsize];
-float drivermodel_data[xsize];
-float burn_data[xsize];
-float ecozone_data[xsize];
-float soil_data[xsize];
-float climate_data[xsize];
-float dead_data[xsize];
-float litter_data[xsize];
-float ifl_primary_data[xsize];
-float plant_data[xsize];
-
-// Outputs
-float out_data1[xsize];
-float out_data2[xsize];
-float out_data3[xsize];
-float out_data4[xsize];
-float out_data5[xsize];
-float out_data6[xsize];
-float out_data10[xsize];
-float out_data11[xsize];
-float out_data12[xsize];
-float out_data20[xsize];
-
-// Loop over the y coordinates, then the x coordinates
-for (y=0; y<ysize; y++)
-{
-
-INBAND1->RasterIO(GF_Read, 0, y, xsize, 1, agc_data, xsize, 1, GDT_Float32, 0, 0);
-INBAND2->RasterIO(GF_Read, 0, y, xsize, 1, bgc_data, xsize, 1, GDT_Float32, 0, 0);
-INBAND3->RasterIO(GF_Read, 0, y, xsize, 1, drivermodel_data, xsize, 1, GDT_Float32, 0, 0);
-INBAND4->RasterIO(GF_Read, 0, y, xsize, 1, loss_data, xsize, 1, GDT_Float32, 0, 0);
-INBAND5->RasterIO(GF_Read, 0, y, xsize, 1, peat_data, xsize, 1, GDT_Float32, 0, 0);
-INBAND6->RasterIO(GF_Read, 0, y, xsize, 1, burn_data, xsize, 1, GDT_Float32, 0, 0);
-INBAND7->RasterIO(GF_Read, 0, y, xsize, 1, ifl_primary_data, xsize, 1, GDT_Float32, 0, 0);
-INBAND8->RasterIO(GF_Read, 0, y, xsize, 1, ecozone_data, xsize, 1, GDT_Float32, 0, 0);
-INBAND9->RasterIO(GF_Read, 0, y, xsize, 1, climate_data, xsize, 1, GDT_Float32, 0, 0);
-INBAND10->RasterIO(GF_Read, 0, y, xsize, 1, dead_data, xsize, 1, GDT_Float32, 0, 0);
-INBAND11->RasterIO(GF_Read, 0, y, xsize, 1, litter_data, xsize, 1, GDT_Float32, 0, 0);
-INBAND12->RasterIO(GF_Read, 0, y, xsize, 1, soil_data, xsize, 1, GDT_Float32, 0, 0);
-INBAND13->RasterIO(GF_Read, 0, y, xsize, 1, plant_data, xsize, 1, GDT_Float32, 0, 0);
-
-for(x=0; x<xsize; x++)
+    for(x=0; x<n; x++)
 
     // Everything from here down analyzes one pixel at a time
 	{
@@ -408,7 +124,8 @@ for(x=0; x<xsize; x++)
             // it was as if the returned values for the first pixel evaluated couldn't be overwritten.
             // The first answer here told me how to solve that: https://stackoverflow.com/questions/51609816/return-float-array-from-a-function-c
             float q[8];
-            def_variables(&q[0], ecozone_data[x], drivermodel_data[x], ifl_primary_data[x], climate_data[x], plant_data[x], loss_data[x]);
+            // The constants are looked up in a table of def_variables' results for every combination of codes (equations.cpp).
+            def_variables_lookup(&q[0], ecozone_data[x], drivermodel_data[x], ifl_primary_data[x], climate_data[x], plant_data[x], loss_data[x]);
 
 			// The constants needed for calculating emissions
 			float Cf = q[0];            // Combustion factor
@@ -1168,29 +885,104 @@ for(x=0; x<xsize; x++)
 			out_data20[x] = 0;
 		}
     }
-
-OUTBAND1->RasterIO( GF_Write, 0, y, xsize, 1, out_data1, xsize, 1, GDT_Float32, 0, 0 );
-OUTBAND2->RasterIO( GF_Write, 0, y, xsize, 1, out_data2, xsize, 1, GDT_Float32, 0, 0 );
-OUTBAND3->RasterIO( GF_Write, 0, y, xsize, 1, out_data3, xsize, 1, GDT_Float32, 0, 0 );
-OUTBAND4->RasterIO( GF_Write, 0, y, xsize, 1, out_data4, xsize, 1, GDT_Float32, 0, 0 );
-OUTBAND5->RasterIO( GF_Write, 0, y, xsize, 1, out_data5, xsize, 1, GDT_Float32, 0, 0 );
-OUTBAND6->RasterIO( GF_Write, 0, y, xsize, 1, out_data6, xsize, 1, GDT_Float32, 0, 0 );
-OUTBAND10->RasterIO( GF_Write, 0, y, xsize, 1, out_data10, xsize, 1, GDT_Float32, 0, 0 );
-OUTBAND11->RasterIO( GF_Write, 0, y, xsize, 1, out_data11, xsize, 1, GDT_Float32, 0, 0 );
-OUTBAND12->RasterIO( GF_Write, 0, y, xsize, 1, out_data12, xsize, 1, GDT_Float32, 0, 0 );
-OUTBAND20->RasterIO( GF_Write, 0, y, xsize, 1, out_data20, xsize, 1, GDT_Float32, 0, 0 );
 }
 
-GDALClose(INGDAL1);
-GDALClose((GDALDatasetH)OUTGDAL1);
-GDALClose((GDALDatasetH)OUTGDAL2);
-GDALClose((GDALDatasetH)OUTGDAL3);
-GDALClose((GDALDatasetH)OUTGDAL4);
-GDALClose((GDALDatasetH)OUTGDAL5);
-GDALClose((GDALDatasetH)OUTGDAL6);
-GDALClose((GDALDatasetH)OUTGDAL10);
-GDALClose((GDALDatasetH)OUTGDAL11);
-GDALClose((GDALDatasetH)OUTGDAL12);
-GDALClose((GDALDatasetH)OUTGDAL20);
-return 0;
+
+//to compile:  c++ calc_gross_emissions.cpp -o calc_gross_emissions.exe -lgdal -pthread
+int main(int argc, char* argv[])
+{
+// <program name> --verify-emission-factors checks the emission factor table against def_variables and exits
+if ((argc == 2) && (string(argv[1]) == "--verify-emission-factors")) {return verify_emission_factor_table() > 0;}
+
+// If code is run other than <program name> <tile id> , it will raise this error.
+if ((argc < 4) || (argc > 6)){cout << "Use <program name> <tile id><sensit_type><folder>[<threads>][<rows per block>]" << endl; return 1;}
+
+// Input arguments
+string tile_id = argv[1];    // The tile id comes from the second argument. The first argument is the name of this code.
+string sensit_type = argv[2];   // For standard model or sensitivity analyses that use the standard emissions model.
+                             // Used to name the input carbon pool tiles and output gross emissions tiles.
+string infolder = argv[3];     // The folder which has all the input files
+int threads = 1;              // Threads for evaluating pixels and compressing outputs. Optional; defaults to 1.
+if (argc > 4) threads = atoi(argv[4]);
+int block_rows = 1;           // Rows read, evaluated and written at a time. Optional; defaults to 1 (row by row).
+if (argc > 5) block_rows = atoi(argv[5]);
+
+cout << "Gross emissions C++ infolder:" << infolder << endl;
+
+// Model constants
+int model_years;    // How many loss years are in the model
+model_years = constants::model_years;
+string model_years_str;
+model_years_str = to_string(model_years);
+
+// Input files
+// Carbon pools use the standard names for this sensitivity analysis
+string agc_name = infolder + tile_id + constants::AGC_emis_year + ".tif";
+string bgc_name = infolder + tile_id + constants::BGC_emis_year + ".tif";
+string dead_name = infolder + tile_id + constants::deadwood_C_emis_year + ".tif";
+string litter_name = infolder + tile_id + constants::litter_C_emis_year + ".tif";
+string soil_name = infolder + tile_id + constants::soil_C_emis_year + ".tif";
+
+// Other inputs
+string loss_name = infolder + constants::lossyear + tile_id + ".tif";
+string burn_name = infolder + tile_id + constants::burnyear;
+string ecozone_name = infolder + tile_id + constants::fao_ecozones;
+string climate_name = infolder + tile_id + constants::climate_zones;
+string drivermodel_name = infolder + tile_id + constants::tcl_drivers;
+string peat_name = infolder + tile_id + constants::peat_mask;
+string ifl_primary_name = infolder + tile_id + constants::ifl_primary;
+string plant_name = infolder + tile_id + constants::plantation_type;
+
+// Output files: tonnes CO2/ha for each tree cover loss driver, their total, and the node for the decision tree
+// that determines emissions.
+// regex_replace from https://stackoverflow.com/a/41294178
+string out_name1_pre = constants::commod_emis;
+out_name1_pre = std::regex_replace(out_name1_pre, std::regex("biomass_soil"), "soil_only");
+string out_name1  = tile_id + out_name1_pre + model_years_str + ".tif";
+
+string out_name2_pre = constants::shifting_ag_emis;
+out_name2_pre = std::regex_replace(out_name2_pre, std::regex("biomass_soil"), "soil_only");
+string out_name2  = tile_id + out_name2_pre + model_years_str + ".tif";
+
+string out_name3_pre = constants::forestry_emis;
+out_name3_pre = std::regex_replace(out_name3_pre, std::regex("biomass_soil"), "soil_only");
+string out_name3  = tile_id + out_name3_pre + model_years_str + ".tif";
+
+string out_name4_pre = constants::wildfire_emis;
+out_name4_pre = std::regex_replace(out_name4_pre, std::regex("biomass_soil"), "soil_only");
+string out_name4  = tile_id + out_name4_pre + model_years_str + ".tif";
+
+string out_name5_pre = constants::urbanization_emis;
+out_name5_pre = std::regex_replace(out_name5_pre, std::regex("biomass_soil"), "soil_only");
+string out_name5  = tile_id + out_name5_pre + model_years_str + ".tif";
+
+string out_name6_pre = constants::no_driver_emis;
+out_name6_pre = std::regex_replace(out_name6_pre, std::regex("biomass_soil"), "soil_only");
+string out_name6  = tile_id + out_name6_pre + model_years_str + ".tif";
+
+string out_name10_pre = constants::all_gases_all_drivers_emis;
+out_name10_pre = std::regex_replace(out_name10_pre, std::regex("biomass_soil"), "soil_only");
+string out_name10 = tile_id + out_name10_pre + model_years_str + ".tif";
+
+string out_name11_pre = constants::CO2_only_all_drivers_emis;
+out_name11_pre = std::regex_replace(out_name11_pre, std::regex("biomass_soil"), "soil_only");
+string out_name11 = tile_id + out_name11_pre + model_years_str + ".tif";
+
+string out_name12_pre = constants::non_CO2_all_drivers_emis;
+out_name12_pre = std::regex_replace(out_name12_pre, std::regex("biomass_soil"), "soil_only");
+string out_name12 = tile_id + out_name12_pre + model_years_str + ".tif";
+
+string out_name20_pre = constants::decision_tree_all_drivers_emis;
+out_name20_pre = std::regex_replace(out_name20_pre, std::regex("biomass_soil"), "soil_only");
+string out_name20 = tile_id + out_name20_pre + model_years_str + ".tif";
+
+
+// Input and output tiles, in the order the decision tree takes them
+string input_names[] = {agc_name, bgc_name, drivermodel_name, loss_name, peat_name, burn_name, ifl_primary_name,
+                        ecozone_name, climate_name, dead_name, litter_name, soil_name, plant_name};
+string output_names[] = {out_name1, out_name2, out_name3, out_name4, out_name5, out_name6,
+                         out_name10, out_name11, out_name12, out_name20};
+
+// Reads, evaluates and writes the tile in blocks of rows (gross_emissions_io.cpp)
+return run_gross_emissions("soil_only", input_names, output_names, calc_gross_emissions_soil_only_block, threads, block_rows);
 }
@@ -2,6 +2,7 @@
 // These are basically found in the table preceding the emissions model decision trees.
 
 #include <map>
+#include <vector>
 #include <iostream>
 #include <stdlib.h>
 
@@ -317,4 +318,120 @@ void def_variables(float *q, int ecozone, int forestmodel_data, int ifl, int cli
     q[5] = peatburn_non_CO2;
     q[6] = peat_drain_total_CO2_only;
     q[7] = peat_drain_total_non_CO2;
-}
\ No newline at end of file
+}
+
+
+// def_variables only depends on small categorical codes (driver, ecozone, IFL, plantation) and the loss year,
+// so its results are computed once for every combination of codes into a dense table that the decision trees
+// look up for each pixel instead of walking the branches above.
+// Climate zone does not change any of the factors, so it is not part of the index.
+// Combinations of codes outside the table fall back to def_variables.
+const int emis_factor_drivers = 8;
+const int emis_factor_ecozones = 8;
+const int emis_factor_ifls = 2;
+const int emis_factor_plantations = 4;
+const int emis_factor_loss_years = 32;
+const int emis_factor_values = 8;
+
+// Position of a combination of codes in the emission factor table, or -1 if it is outside the table
+inline long emission_factor_index(int ecozone, int forestmodel_data, int ifl, int plant_data, int lossyr)
+{
+	if ((forestmodel_data < 0) || (forestmodel_data >= emis_factor_drivers) ||
+	    (ecozone < 0) || (ecozone >= emis_factor_ecozones) ||
+	    (ifl < 0) || (ifl >= emis_factor_ifls) ||
+	    (plant_data < 0) || (plant_data >= emis_factor_plantations) ||
+	    (lossyr < 0) || (lossyr >= emis_factor_loss_years))
+	{
+		return -1;
+	}
+
+	return ((((long) forestmodel_data * emis_factor_ecozones + ecozone) * emis_factor_ifls + ifl)
+	        * emis_factor_plantations + plant_data) * emis_factor_loss_years + lossyr;
+}
+
+// Fills the emission factor table from def_variables
+vector<float> build_emission_factor_table()
+{
+	vector<float> table((long) emis_factor_drivers * emis_factor_ecozones * emis_factor_ifls * emis_factor_plantations
+	                    * emis_factor_loss_years * emis_factor_values);
+
+	for (int driver = 0; driver < emis_factor_drivers; driver++)
+	for (int ecozone = 0; ecozone < emis_factor_ecozones; ecozone++)
+	for (int ifl = 0; ifl < emis_factor_ifls; ifl++)
+	for (int plant = 0; plant < emis_factor_plantations; plant++)
+	for (int lossyr = 0; lossyr < emis_factor_loss_years; lossyr++)
+	{
+		long i = emission_factor_index(ecozone, driver, ifl, plant, lossyr);
+		def_variables(&table[i * emis_factor_values], ecozone, driver, ifl, 0, plant, lossyr);
+	}
+
+	return table;
+}
+
+// The emission factor table. It is built the first time it is needed (once, even if several threads ask for it).
+const float *emission_factor_table()
+{
+	static const vector<float> table = build_emission_factor_table();
+	return table.data();
+}
+
+// Same arguments and results as def_variables, looked up in the emission factor table
+inline void def_variables_lookup(float *q, int ecozone, int forestmodel_data, int ifl, int climate, int plant_data, int lossyr)
+{
+	long i = emission_factor_index(ecozone, forestmodel_data, ifl, plant_data, lossyr);
+
+	if (i < 0)
+	{
+		def_variables(q, ecozone, forestmodel_data, ifl, climate, plant_data, lossyr);
+		return;
+	}
+
+	const float *factors = emission_factor_table() + i * emis_factor_values;
+	for (int k = 0; k < emis_factor_values; k++)
+	{
+		q[k] = factors[k];
+	}
+}
+
+// Checks the emission factor table against def_variables for every combination of codes in the table and
+// every climate zone code (plus codes just outside the table, which are not looked up).
+// Prints the result and returns the number of combinations that differ.
+int verify_emission_factor_table()
+{
+	int mismatches = 0;
+	long checked = 0;
+	float expected[emis_factor_values];
+	float looked_up[emis_factor_values];
+
+	for (int driver = -1; driver <= emis_factor_drivers; driver++)
+	for (int ecozone = -1; ecozone <= emis_factor_ecozones; ecozone++)
+	for (int ifl = -1; ifl <= emis_factor_ifls; ifl++)
+	for (int climate = 0; climate <= 13; climate++)
+	for (int plant = -1; plant <= emis_factor_plantations; plant++)
+	for (int lossyr = -1; lossyr <= emis_factor_loss_years; lossyr++)
+	{
+		def_variables(expected, ecozone, driver, ifl, climate, plant, lossyr);
+		def_variables_lookup(looked_up, ecozone, driver, ifl, climate, plant, lossyr);
+		checked++;
+
+		for (int k = 0; k < emis_factor_values; k++)
+		{
+			if (expected[k] != looked_up[k])
+			{
+				if (mismatches < 10)
+				{
+					cout << "Emission factor mismatch for driver " << driver << ", ecozone " << ecozone << ", ifl " << ifl
+					     << ", climate " << climate << ", plantation " << plant << ", loss year " << lossyr
+					     << ": factor " << k << " is " << looked_up[k] << " in the table and " << expected[k] << " in def_variables" << endl;
+				}
+				mismatches++;
+				break;
+			}
+		}
+	}
+
+	cout << "Emission factor table checked against def_variables for " << checked << " combinations of codes: "
+	     << mismatches << " mismatches" << endl;
+
+	return mismatches;
+}
@@ -0,0 +1,299 @@
+// Reads the 13 inputs of a gross emissions model, runs its per-pixel decision tree and writes the 10 outputs,
+// working on blocks of rows instead of one row at a time.
+// Inputs that are byte or 16-bit integer rasters (loss year, drivers, peat, ecozone, soil, etc.) are read in their
+// own data type and converted to float by the threads that evaluate them.
+// The rows of each block are split across the threads, and the outputs of a block are written (and compressed)
+// by a separate writer thread while the next block is read and evaluated.
+// With 1 thread and 1-row blocks this does the same work in the same order as the original row-by-row loop.
+// The loss year of each block is read first. Blocks without any loss have no emissions, so their other inputs
+// aren't read or evaluated and their outputs are written as 0 (nodata).
+// Included by each calc_gross_emissions_*.cpp, which must be compiled with -pthread.
+
+#include <vector>
+#include <thread>
+#include <string>
+#include <algorithm>
+#include <stdint.h>
+
+#include <gdal/gdal_priv.h>
+#include <gdal/cpl_conv.h>
+#include <gdal/ogr_spatialref.h>
+
+using namespace std;
+
+const int n_emissions_inputs = 13;
+const int n_emissions_outputs = 10;
+const int emissions_loss_input = 3;
+
+// The per-pixel decision tree of a gross emissions model, applied to n pixels.
+// Inputs: AGC, BGC, drivers, loss, peat, burn, IFL/primary, ecozone, climate, deadwood, litter, soil, plantation.
+// Outputs: commodities, shifting ag, forestry, wildfire, urbanization, no driver, all gases, CO2 only, non-CO2, node.
+typedef void (*gross_emissions_block_function)(long n,
+    const float *agc_data, const float *bgc_data, const float *drivermodel_data, const float *loss_data,
+    const float *peat_data, const float *burn_data, const float *ifl_primary_data, const float *ecozone_data,
+    const float *climate_data, const float *dead_data, const float *litter_data, const float *soil_data,
+    const float *plant_data,
+    float *out_data1, float *out_data2, float *out_data3, float *out_data4, float *out_data5, float *out_data6,
+    float *out_data10, float *out_data11, float *out_data12, float *out_data20);
+
+
+// The data type an input is read in: its own type if it is a byte or 16-bit integer raster, otherwise float
+GDALDataType emissions_read_type(GDALRasterBand *band)
+{
+    GDALDataType native = band->GetRasterDataType();
+
+    if ((native == GDT_Byte) || (native == GDT_UInt16) || (native == GDT_Int16))
+    {
+        return native;
+    }
+    return GDT_Float32;
+}
+
+
+// Converts n pixels of an input block, starting at pixel start, to float
+void emissions_input_to_float(const vector<uint8_t> &block, GDALDataType type, long start, long n, float *dst)
+{
+    long i;
+
+    if (type == GDT_Byte)
+    {
+        const uint8_t *src = block.data() + start;
+        for (i=0; i<n; i++) dst[i] = src[i];
+    }
+    else if (type == GDT_UInt16)
+    {
+        const uint16_t *src = (const uint16_t *) block.data() + start;
+        for (i=0; i<n; i++) dst[i] = src[i];
+    }
+    else if (type == GDT_Int16)
+    {
+        const int16_t *src = (const int16_t *) block.data() + start;
+        for (i=0; i<n; i++) dst[i] = src[i];
+    }
+    else
+    {
+        const float *src = (const float *) block.data() + start;
+        copy(src, src + n, dst);
+    }
+}
+
+
+// Whether any of the first n pixels of a block is above 0
+template <typename T>
+bool emissions_any_positive(const T *src, long n)
+{
+    long i;
+
+    for (i=0; i<n; i++)
+    {
+        if (src[i] > 0) return true;
+    }
+    return false;
+}
+
+
+// Whether any of the n pixels of a loss year block has loss
+bool emissions_block_has_loss(const vector<uint8_t> &block, GDALDataType type, long n)
+{
+    if (type == GDT_Byte) return emissions_any_positive(block.data(), n);
+    if (type == GDT_UInt16) return emissions_any_positive((const uint16_t *) block.data(), n);
+    if (type == GDT_Int16) return emissions_any_positive((const int16_t *) block.data(), n);
+    return emissions_any_positive((const float *) block.data(), n);
+}
+
+
+// Converts rows [row_start, row_end) of the input blocks to float and runs the decision tree on them
+void emissions_evaluate_rows(gross_emissions_block_function block_function,
+    const vector<uint8_t> *input_blocks, const GDALDataType *input_types, vector<float> *input_floats,
+    vector<float> *output_blocks, int xsize, int row_start, int row_end)
+{
+    long start = (long) row_start * xsize;
+    long n = (long) (row_end - row_start) * xsize;
+    int i;
+
+    if (n <= 0) return;
+
+    for (i=0; i<n_emissions_inputs; i++)
+    {
+        emissions_input_to_float(input_blocks[i], input_types[i], start, n, input_floats[i].data() + start);
+    }
+
+    block_function(n,
+        input_floats[0].data() + start, input_floats[1].data() + start, input_floats[2].data() + start,
+        input_floats[3].data() + start, input_floats[4].data() + start, input_floats[5].data() + start,
+        input_floats[6].data() + start, input_floats[7].data() + start, input_floats[8].data() + start,
+        input_floats[9].data() + start, input_floats[10].data() + start, input_floats[11].data() + start,
+        input_floats[12].data() + start,
+        output_blocks[0].data() + start, output_blocks[1].data() + start, output_blocks[2].data() + start,
+        output_blocks[3].data() + start, output_blocks[4].data() + start, output_blocks[5].data() + start,
+        output_blocks[6].data() + start, output_blocks[7].data() + start, output_blocks[8].data() + start,
+        output_blocks[9].data() + start);
+}
+
+
+// Writes one block of rows of every output
+void emissions_write_block(GDALRasterBand **out_bands, vector<float> *output_blocks, int xsize, int y, int rows)
+{
+    int i;
+
+    for (i=0; i<n_emissions_outputs; i++)
+    {
+        out_bands[i]->RasterIO(GF_Write, 0, y, xsize, rows, output_blocks[i].data(), xsize, rows, GDT_Float32, 0, 0);
+    }
+}
+
+
+// Calculates gross emissions for a tile with the given decision tree, threads and rows per block
+int run_gross_emissions(string model_name, const string *input_names, const string *output_names,
+    gross_emissions_block_function block_function, int threads, int block_rows)
+{
+    int i, t;
+    int xsize, ysize;
+    double GeoTransform[6]; // Fetch the affine transformation coefficients
+    double ulx, uly; double pixelsize;
+
+    if (threads < 1) threads = 1;
+    if (block_rows < 1) block_rows = 1;
+
+    // Initialize GDAL for reading
+    GDALAllRegister();
+    GDALDataset *in_gdal[n_emissions_inputs];
+    GDALRasterBand *in_bands[n_emissions_inputs];
+    GDALDataType input_types[n_emissions_inputs];
+
+    for (i=0; i<n_emissions_inputs; i++)
+    {
+        in_gdal[i] = (GDALDataset *) GDALOpen(input_names[i].c_str(), GA_ReadOnly );
+        if (in_gdal[i] == NULL) {cout << "could not open " << input_names[i] << endl; return 1;}
+        in_bands[i] = in_gdal[i]->GetRasterBand(1);
+        input_types[i] = emissions_read_type(in_bands[i]);
+    }
+
+    // The rest of the code runs on the size of the aboveground carbon tile
+    xsize=in_bands[0]->GetXSize();
+    ysize=in_bands[0]->GetYSize();
+    in_gdal[0]->GetGeoTransform(GeoTransform);
+
+    ulx=GeoTransform[0];
+    uly=GeoTransform[3];
+    pixelsize=GeoTransform[1];
+
+    block_rows = min(block_rows, ysize);
+
+    // Print the raster size and resolution. Should be 40,000 x 40,000 and pixel size 0.00025.
+    cout << "Gross emissions " << model_name << " model C++ parameters: " << xsize <<", "<< ysize <<", "<< ulx <<", "<< uly << ", "<< pixelsize << endl;
+    cout << "Gross emissions C++ threads and rows per block: " << threads << ", " << block_rows << endl;
+
+    // Initialize GDAL for writing.
+    // The outputs are compressed with the same number of threads as are used for evaluating the pixels.
+    GDALDriver *OUTDRIVER;
+    GDALDataset *out_gdal[n_emissions_outputs];
+    GDALRasterBand *out_bands[n_emissions_outputs];
+
+    OGRSpatialReference oSRS;
+    char *OUTPRJ = NULL;
+    char **papszOptions = NULL;
+    papszOptions = CSLSetNameValue( papszOptions, "COMPRESS", "LZW" );
+    papszOptions = CSLSetNameValue( papszOptions, "NUM_THREADS", to_string(threads).c_str() );
+    OUTDRIVER = GetGDALDriverManager()->GetDriverByName("GTIFF");
+    if( OUTDRIVER == NULL ) {cout << "no driver" << endl; exit( 1 );};
+    oSRS.SetWellKnownGeogCS( "WGS84" );
+    oSRS.exportToWkt( &OUTPRJ );
+    double adfGeoTransform[6] = { ulx, pixelsize, 0, uly, 0, -1*pixelsize };
+
+    for (i=0; i<n_emissions_outputs; i++)
+    {
+        out_gdal[i] = OUTDRIVER->Create( output_names[i].c_str(), xsize, ysize, 1, GDT_Float32, papszOptions );
+        out_gdal[i]->SetGeoTransform(adfGeoTransform); out_gdal[i]->SetProjection(OUTPRJ);
+        out_bands[i] = out_gdal[i]->GetRasterBand(1);
+        out_bands[i]->SetNoDataValue(0);
+    }
+
+    // Read/write data.
+    // Inputs are kept in the data type they are read in and converted to float row by row.
+    // There are two sets of output blocks: one being written by the writer thread and one being filled.
+    long block_pixels = (long) xsize * block_rows;
+    vector<uint8_t> input_blocks[n_emissions_inputs];
+    vector<float> input_floats[n_emissions_inputs];
+    vector<float> output_blocks[2][n_emissions_outputs];
+
+    for (i=0; i<n_emissions_inputs; i++)
+    {
+        input_blocks[i].resize(block_pixels * GDALGetDataTypeSizeBytes(input_types[i]));
+        input_floats[i].resize(block_pixels);
+    }
+    for (i=0; i<n_emissions_outputs; i++)
+    {
+        output_blocks[0][i].resize(block_pixels);
+        output_blocks[1][i].resize(block_pixels);
+    }
+
+    thread writer;
+    int y, rows, block_index;
+
+    // Loop over the blocks of rows
+    for (y=0, block_index=0; y<ysize; y+=block_rows, block_index++)
+    {
+        rows = min(block_rows, ysize - y);
+        vector<float> *outputs = output_blocks[block_index % 2];
+
+        in_bands[emissions_loss_input]->RasterIO(GF_Read, 0, y, xsize, rows, input_blocks[emissions_loss_input].data(),
+                                                 xsize, rows, input_types[emissions_loss_input], 0, 0);
+
+        // Blocks without loss have no emissions
+        if (!emissions_block_has_loss(input_blocks[emissions_loss_input], input_types[emissions_loss_input], (long) xsize * rows))
+        {
+            for (i=0; i<n_emissions_outputs; i++)
+            {
+                fill(outputs[i].begin(), outputs[i].begin() + (long) xsize * rows, 0.0f);
+            }
+
+            // The previous block must be written before this block is handed to the writer
+            if (writer.joinable()) writer.join();
+            writer = thread(emissions_write_block, out_bands, outputs, xsize, y, rows);
+            continue;
+        }
+
+        for (i=0; i<n_emissions_inputs; i++)
+        {
+            if (i == emissions_loss_input) continue;
+            in_bands[i]->RasterIO(GF_Read, 0, y, xsize, rows, input_blocks[i].data(), xsize, rows, input_types[i], 0, 0);
+        }
+
+        // Each thread evaluates a contiguous group of the block's rows
+        int row_threads = min(threads, rows);
+        int rows_per_thread = (rows + row_threads - 1) / row_threads;
+        vector<thread> evaluators;
+
+        for (t=1; t<row_threads; t++)
+        {
+            evaluators.push_back(thread(emissions_evaluate_rows, block_function, input_blocks, input_types, input_floats,
+                                        outputs, xsize, t * rows_per_thread, min(rows, (t + 1) * rows_per_thread)));
+        }
+        emissions_evaluate_rows(block_function, input_blocks, input_types, input_floats, outputs, xsize, 0, min(rows, rows_per_thread));
+
+        for (t=0; t<(int) evaluators.size(); t++)
+        {
+            evaluators[t].join();
+        }
+
+        // The previous block must be written before this block is handed to the writer
+        if (writer.joinable()) writer.join();
+        writer = thread(emissions_write_block, out_bands, outputs, xsize, y, rows);
+    }
+
+    if (writer.joinable()) writer.join();
+
+    for (i=0; i<n_emissions_inputs; i++)
+    {
+        GDALClose((GDALDatasetH)in_gdal[i]);
+    }
+    for (i=0; i<n_emissions_outputs; i++)
+    {
+        GDALClose((GDALDatasetH)out_gdal[i]);
+    }
+    CSLDestroy(papszOptions);
+    CPLFree(OUTPRJ);
+
+    return 0;
+}
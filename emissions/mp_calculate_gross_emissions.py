@@ -5,15 +5,21 @@ carbon pool values that go into the equation.
 Unlike all other flux model components, this one uses C++ to quickly iterate through every pixel in each tile.
 Before running the model, the C++ script must be compiled.
 From carbon-budget/emissions/, do:
-c++ /usr/local/app/emissions/cpp_util/calc_gross_emissions_generic.cpp -o /usr/local/app/emissions/cpp_util/calc_gross_emissions_generic.exe -lgdal
+c++ /usr/local/app/emissions/cpp_util/calc_gross_emissions_generic.cpp -o /usr/local/app/emissions/cpp_util/calc_gross_emissions_generic.exe -lgdal -pthread
 (for the standard model and some sensitivity analysis versions).
 calc_gross_emissions_generic.exe should appear in the directory.
+Alternatively, the generic decision tree can be compiled as a shared library that each worker loads once and runs
+on windows of the input tiles in its own process, without launching the .exe for every tile:
+c++ /usr/local/app/emissions/cpp_util/calc_gross_emissions_generic_block.cpp -o /usr/local/app/emissions/cpp_util/libcalc_gross_emissions_generic.so -O2 -shared -fPIC
+If libcalc_gross_emissions_generic.so is present, it is used instead of calc_gross_emissions_generic.exe.
 For the sensitivity analyses that use a different gross emissions C++ script (currently, soil_only, no_shifting_ag,
 and convert_to_grassland), do:
-c++ /usr/local/app/emissions/cpp_util/calc_gross_emissions_<sensit_type>.cpp -o /usr/local/app/emissions/cpp_util/calc_gross_emissions_<sensit_type>.exe -lgdal
+c++ /usr/local/app/emissions/cpp_util/calc_gross_emissions_<sensit_type>.cpp -o /usr/local/app/emissions/cpp_util/calc_gross_emissions_<sensit_type>.exe -lgdal -pthread
 Run by typing python mp_calculate_gross_emissions.py -p [POOL_OPTION] -t [MODEL_TYPE] -l [TILE_LIST] -d [RUN_DATE]
 The Python script will call the compiled C++ code as needed.
-The other C++ scripts (equations.cpp and flu_val.cpp) do not need to be compiled.
+The other C++ scripts (equations.cpp, flu_val.cpp and gross_emissions_io.cpp) do not need to be compiled.
+The compiled scripts read, evaluate and write each tile in blocks of rows on several threads
+(cn.c_emis_threads and cn.c_emis_block_rows).
 The --emitted_pools-to-use argument specifies whether to calculate gross emissions from biomass+soil or just from soil.
 The --model-type argument specifies whether the model run is a sensitivity analysis or standard run.
 Emissions from each driver (including loss that had no driver assigned) gets its own tile, as does all emissions combined.
@@ -115,7 +121,10 @@ def mp_calculate_gross_emissions(sensit_type, tile_id_list, emitted_pools, run_d
             else:
                 uu.exception_log(no_upload, 'Must compile {} model C++...'.format(sensit_type))
         else:
-            if os.path.exists('{0}/calc_gross_emissions_generic.exe'.format(cn.c_emis_compile_dst)):
+            if os.path.exists(calculate_gross_emissions.emissions_library_path()):
+                uu.print_log("C++ for generic emissions already compiled as a shared library. Using it instead of the .exe "
+                             "({0} threads, {1}-row blocks).".format(cn.c_emis_threads, cn.c_emis_block_rows))
+            elif os.path.exists('{0}/calc_gross_emissions_generic.exe'.format(cn.c_emis_compile_dst)):
                 uu.print_log("C++ for generic emissions already compiled.")
             else:
                 uu.exception_log(no_upload, 'Must compile generic emissions C++...')
@@ -153,6 +162,10 @@ def mp_calculate_gross_emissions(sensit_type, tile_id_list, emitted_pools, run_d
     else:
         uu.exception_log(no_upload, 'Pool and/or sensitivity analysis option not valid')
 
+    # Optionally checks the emission factors the C++ looks up for each pixel against the branching def_variables
+    if cn.c_emis_verify_factors:
+        calculate_gross_emissions.verify_emission_factors(emitted_pools, sensit_type, no_upload)
+
 
     # Downloads input files or entire directories, depending on how many tiles are in the tile_id_list, if AWS credentials are found
     if uu.check_aws_creds():
@@ -210,19 +223,11 @@ def mp_calculate_gross_emissions(sensit_type, tile_id_list, emitted_pools, run_d
     # Calculates gross emissions for each tile
     # count/4 uses about 390 GB on a r4.16xlarge spot machine.
     # processes=18 uses about 440 GB on an r4.16xlarge spot machine.
-    if cn.count == 96:
-        if sensit_type == 'biomass_swap':
-            processes = 15 # 15 processors = XXX GB peak
-        else:
-            processes = 19   # 17 = 650 GB peak; 18 = 677 GB peak; 19 = 716 GB peak
-    else:
-        processes = 9
-    uu.print_log('Gross emissions max processors=', processes)
-    pool = multiprocessing.Pool(processes)
-    pool.map(partial(calculate_gross_emissions.calc_emissions, emitted_pools=emitted_pools, sensit_type=sensit_type,
-                     folder=folder, no_upload=no_upload), tile_id_list)
-    pool.close()
-    pool.join()
+    # Tiles are admitted into the pool as long as their recorded peak memory (including the C++ subprocess) fits
+    # in the machine's memory budget
+    uu.memory_aware_map(partial(calculate_gross_emissions.calc_emissions, emitted_pools=emitted_pools, sensit_type=sensit_type,
+                                folder=folder, no_upload=no_upload),
+                        tile_id_list, 'gross_emissions')
 
     # # For single processor use
     # for tile in tile_id_list:
@@ -238,19 +243,9 @@ def mp_calculate_gross_emissions(sensit_type, tile_id_list, emitted_pools, run_d
 
         uu.print_log("Adding metadata tags for pattern {}".format(pattern))
 
-        if cn.count == 96:
-            processes = 75  # 45 processors = ~30 GB peak; 55 = XXX GB peak; 75 = XXX GB peak
-        else:
-            processes = 9
-        uu.print_log('Adding metadata tags max processors=', processes)
-        pool = multiprocessing.Pool(processes)
-        pool.map(partial(calculate_gross_emissions.add_metadata_tags, pattern=pattern, sensit_type=sensit_type),
-                 tile_id_list)
-        pool.close()
-        pool.join()
-
-        # for tile_id in tile_id_list:
-        #     calculate_gross_emissions.add_metadata_tags(tile_id, pattern, sensit_type)
+        # Tags are added in place in this process, so all the tiles of a pattern are tagged in one batch
+        uu.set_metadata_tags_on_set(['{0}_{1}.tif'.format(tile_id, pattern) for tile_id in tile_id_list],
+                                    calculate_gross_emissions.emissions_metadata_tags(sensit_type))
 
 
     # If no_upload flag is not activated, output is uploaded
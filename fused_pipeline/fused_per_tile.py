@@ -0,0 +1,551 @@
+'''
+Runs the per-pixel model stages from model extent through net flux for one tile as a single pass over the tile's windows.
+Each window of the input tiles is read once and flows through model extent, forest age category, IPCC default
+removal factors, removal factors for all forest types, gain year count, gross removals and carbon pools in memory.
+Only the final outputs are written, plus the intermediate outputs if save_intermediates is on.
+The carbon pools in the emissions year are written because the compiled gross emissions C++ reads them from disk;
+they are deleted after gross emissions and net flux are done unless save_intermediates is on.
+The window calculations are the stages' own (e.g., gain_year_count_all_forest_types.calculate_gain_year_count),
+so the fused pass and the stage-by-stage scripts don't drift apart.
+'''
+
+import datetime
+import numpy as np
+import os
+import rasterio
+import sys
+sys.path.append('../')
+import constants_and_names as cn
+import universal_util as uu
+sys.path.append(os.path.join(cn.docker_app,'emissions'))
+import calculate_gross_emissions
+sys.path.append(os.path.join(cn.docker_app,'analyses'))
+import net_flux
+sys.path.append(os.path.join(cn.docker_app,'data_prep'))
+import model_extent
+sys.path.append(os.path.join(cn.docker_app,'gain'))
+import forest_age_category_IPCC
+import annual_gain_rate_IPCC_defaults
+import annual_gain_rate_AGC_BGC_all_forest_types
+import gain_year_count_all_forest_types
+import gross_removals_all_forest_types
+sys.path.append(os.path.join(cn.docker_app,'carbon_pools'))
+import create_carbon_pools
+
+
+# Outputs of the fused pass that are always written.
+# Each entry is [output pattern, data type, units tag, source tag, extent tag].
+fused_final_outputs = {
+    'annual_gain_AGC_all_types': [cn.pattern_annual_gain_AGC_all_types, 'float32',
+                                  'megagrams aboveground carbon/ha/yr',
+                                  'Mangroves: IPCC wetlands supplement Table 4.4. Europe: Liz Goldman. Planted forests: Spatial Database of Planted Forests. USA: US FIA, via Rich Birdsey. Young natural forests: Cook-Patton et al. 2020. Old natural forests: IPCC Forests table 4.9',
+                                  'Full model extent'],
+    'cumul_gain_AGCO2_BGCO2_all_types': [cn.pattern_cumul_gain_AGCO2_BGCO2_all_types, 'float32',
+                                         'megagrams aboveground+belowground CO2/ha over entire model period',
+                                         'annual removal factors and gain year count',
+                                         'Full model extent']
+}
+
+# Outputs of the fused pass that are only written if intermediates are being saved
+fused_intermediate_outputs = {
+    'model_extent': [cn.pattern_model_extent, 'uint8',
+                     'unitless. 1 = in model extent. 0 = not in model extent',
+                     'Pixels with ((Hansen 2000 tree cover AND AGB2000) OR Hansen gain OR mangrove biomass 2000) NOT pre-2000 plantations',
+                     'Full model extent. This defines which pixels are included in the model.'],
+    'age_cat_IPCC': [cn.pattern_age_cat_IPCC, 'uint8',
+                     '1: young (<20 year) secondary forest; 2: old (>20 year) secondary forest; 3: primary forest or IFL',
+                     'Decision tree that uses Hansen gain and loss, IFL/primary forest extent, and aboveground biomass to assign an age category',
+                     'Full model extent'],
+    'annual_gain_AGB_IPCC_defaults': [cn.pattern_annual_gain_AGB_IPCC_defaults, 'float32',
+                                      'megagrams aboveground biomass (AGB or dry matter)/ha/yr',
+                                      'IPCC Guidelines 2019 refinement, forest section, Table 4.9',
+                                      'Full model extent, even though these rates will not be used over the full model extent'],
+    'annual_gain_BGB_IPCC_defaults': [cn.pattern_annual_gain_BGB_IPCC_defaults, 'float32',
+                                      'megagrams belowground biomass (AGB or dry matter)/ha/yr',
+                                      'IPCC Guidelines 2019 refinement, forest section, Table 4.9',
+                                      'Full model extent, even though these rates will not be used over the full model extent'],
+    'stdev_annual_gain_AGB_IPCC_defaults': [cn.pattern_stdev_annual_gain_AGB_IPCC_defaults, 'float32',
+                                            'standard deviation, in terms of megagrams aboveground biomass (AGB or dry matter)/ha/yr',
+                                            'IPCC Guidelines 2019 refinement, forest section, Table 4.9',
+                                            'Full model extent, even though these standard deviations will not be used over the full model extent'],
+    'removal_forest_type': [cn.pattern_removal_forest_type, 'uint8',
+                            '6: mangroves. 5: European-specific rates. 4: planted forests. 3: US-specific rates. 2: young (<20 year) secondary forests. 1: old (>20 year) secondary forests and primary forests. Priority goes to the highest number.',
+                            'Mangroves: IPCC wetlands supplement. Europe: Liz Goldman. Planted forests: Spatial Database of Planted Forests. USA: US FIA, via Rich Birdsey. Young natural forests: Cook-Patton et al. 2020. Old natural forests: IPCC Forests table 4.9',
+                            'Full model extent'],
+    'annual_gain_BGC_all_types': [cn.pattern_annual_gain_BGC_all_types, 'float32',
+                                  'megagrams belowground carbon/ha/yr',
+                                  'Mangroves: IPCC wetlands supplement Table 4.4. Europe: Liz Goldman. Planted forests: Spatial Database of Planted Forests. USA: US FIA, via Rich Birdsey. Young natural forests: Cook-Patton et al. 2020. Old natural forests: IPCC Forests table 4.9',
+                                  'Full model extent'],
+    'annual_gain_AGC_BGC_all_types': [cn.pattern_annual_gain_AGC_BGC_all_types, 'float32',
+                                      'megagrams aboveground + belowground carbon/ha/yr',
+                                      'Mangroves: IPCC wetlands supplement Table 4.4. Europe: Liz Goldman. Planted forests: Spatial Database of Planted Forests. USA: US FIA, via Rich Birdsey. Young natural forests: Cook-Patton et al. 2020. Old natural forests: IPCC Forests table 4.9',
+                                      'Full model extent'],
+    'stdev_annual_gain_AGC_all_types': [cn.pattern_stdev_annual_gain_AGC_all_types, 'float32',
+                                        'standard deviation for removal factor, in terms of megagrams aboveground carbon/ha/yr',
+                                        'Mangroves: IPCC wetlands supplement Table 4.4. Europe: Liz Goldman. Planted forests: Spatial Database of Planted Forests. USA: US FIA, via Rich Birdsey. Young natural forests: Cook-Patton et al. 2020. Old natural forests: IPCC Forests table 4.9',
+                                        'Full model extent'],
+    'gain_year_count': [cn.pattern_gain_year_count, 'uint8',
+                        'years',
+                        'Gain years are assigned based on the combination of Hansen loss and gain in each pixel. There are four combinations: neither loss nor gain, loss only, gain only, loss and gain.',
+                        'Full model extent'],
+    'cumul_gain_AGCO2_all_types': [cn.pattern_cumul_gain_AGCO2_all_types, 'float32',
+                                   'megagrams aboveground CO2/ha over entire model period',
+                                   'annual removal factors and gain year count',
+                                   'Full model extent'],
+    'cumul_gain_BGCO2_all_types': [cn.pattern_cumul_gain_BGCO2_all_types, 'float32',
+                                   'megagrams belowground CO2/ha over entire model period',
+                                   'annual removal factors and gain year count',
+                                   'Full model extent'],
+    'total_C_emis_year': [cn.pattern_total_C_emis_year, 'float32',
+                          'megagrams total carbon/ha',
+                          'AGC, BGC, deadwood, litter and soil carbon in the year of tree cover loss',
+                          'tree cover loss pixels within model extent']
+}
+
+# Carbon pools in the emissions year. These are handed to the gross emissions C++ on disk.
+fused_emis_year_pool_outputs = {
+    'AGC_emis_year': [cn.pattern_AGC_emis_year, 'float32',
+                      'megagrams aboveground carbon (AGC)/ha',
+                      'WHRC (if standard model) or JPL (if biomass_swap sensitivity analysis) and mangrove AGB (Simard et al. 2018). Gross removals added to AGC2000 to get AGC in loss year.',
+                      'tree cover loss pixels within model extent'],
+    'BGC_emis_year': [cn.pattern_BGC_emis_year, 'float32',
+                      'megagrams belowground carbon (BGC)/ha',
+                      'AGC in loss year with AGC:BGC for mangrove and non-mangrove forests applied.',
+                      'tree cover loss pixels within model extent'],
+    'deadwood_emis_year': [cn.pattern_deadwood_emis_year_2000, 'float32',
+                           'megagrams deadwood carbon/ha',
+                           'AGB2000 with AGB:deadwood carbon for mangrove and non-mangrove forests applied.',
+                           'tree cover loss pixels within model extent'],
+    'litter_emis_year': [cn.pattern_litter_emis_year_2000, 'float32',
+                         'megagrams litter carbon/ha',
+                         'AGB2000 with AGB:litter carbon for mangrove and non-mangrove forests applied.',
+                         'tree cover loss pixels within model extent'],
+    'soil_emis_year': [cn.pattern_soil_C_emis_year_2000, 'uint16',
+                       'megagrams soil carbon/ha',
+                       'Soil carbon 2000 in tree cover loss pixels',
+                       'tree cover loss pixels within model extent']
+}
+
+# Carbon pools in 2000. Written when carbon_pool_extent includes 2000.
+fused_2000_pool_outputs = {
+    'AGC_2000': [cn.pattern_AGC_2000, 'float32',
+                 'megagrams aboveground carbon (AGC)/ha',
+                 'WHRC (if standard model) or JPL (if biomass_swap sensitivity analysis) and mangrove AGB (Simard et al. 2018)',
+                 'aboveground biomass in 2000 (WHRC if standard model, JPL if biomass_swap sensitivity analysis) and mangrove AGB. Mangrove AGB has precedence.'],
+    'BGC_2000': [cn.pattern_BGC_2000, 'float32',
+                 'megagrams belowground carbon (BGC)/ha',
+                 'AGC2000 with AGC:BGC for mangrove and non-mangrove forests applied.',
+                 'aboveground biomass in 2000 and mangrove AGB. Mangrove AGB has precedence.'],
+    'deadwood_2000': [cn.pattern_deadwood_2000, 'float32',
+                      'megagrams deadwood carbon/ha',
+                      'AGB2000 with AGB:deadwood carbon for mangrove and non-mangrove forests applied.',
+                      'aboveground biomass in 2000 and mangrove AGB. Mangrove AGB has precedence.'],
+    'litter_2000': [cn.pattern_litter_2000, 'float32',
+                    'megagrams litter carbon/ha',
+                    'AGB2000 with AGB:litter carbon for mangrove and non-mangrove forests applied.',
+                    'aboveground biomass in 2000 and mangrove AGB. Mangrove AGB has precedence.'],
+    'total_C_2000': [cn.pattern_total_C_2000, 'float32',
+                     'megagrams total carbon/ha',
+                     'AGC, BGC, deadwood, litter and soil carbon in 2000',
+                     'aboveground biomass in 2000 and mangrove AGB, plus soil carbon']
+}
+
+
+# Names of the input tiles used anywhere in the fused pass. Creates the names even if the files don't exist.
+def fused_input_names(tile_id, sensit_type):
+
+    input_names = {
+        'mangrove_biomass_2000': '{0}_{1}.tif'.format(tile_id, cn.pattern_mangrove_biomass_2000),
+        'gain': '{0}_{1}.tif'.format(cn.pattern_gain, tile_id),
+        'plant_pre_2000': '{0}_{1}.tif'.format(tile_id, cn.pattern_plant_pre_2000),
+        'ifl_primary': uu.sensit_tile_rename(sensit_type, tile_id, cn.pattern_ifl_primary),
+        'cont_eco': uu.sensit_tile_rename(sensit_type, tile_id, cn.pattern_cont_eco_processed),
+        'mangrove_AGB': '{0}_{1}.tif'.format(tile_id, cn.pattern_annual_gain_AGB_mangrove),
+        'mangrove_BGB': '{0}_{1}.tif'.format(tile_id, cn.pattern_annual_gain_BGB_mangrove),
+        'mangrove_AGB_stdev': '{0}_{1}.tif'.format(tile_id, cn.pattern_stdev_annual_gain_AGB_mangrove),
+        'europe_AGC_BGC': uu.sensit_tile_rename(sensit_type, tile_id, cn.pattern_annual_gain_AGC_BGC_natrl_forest_Europe),
+        'europe_AGC_BGC_stdev': uu.sensit_tile_rename(sensit_type, tile_id, cn.pattern_stdev_annual_gain_AGC_BGC_natrl_forest_Europe),
+        'plantations_AGC_BGC': uu.sensit_tile_rename(sensit_type, tile_id, cn.pattern_annual_gain_AGC_BGC_planted_forest_unmasked),
+        'plantations_AGC_BGC_stdev': uu.sensit_tile_rename(sensit_type, tile_id, cn.pattern_stdev_annual_gain_AGC_BGC_planted_forest_unmasked),
+        'us_AGC_BGC': uu.sensit_tile_rename(sensit_type, tile_id, cn.pattern_annual_gain_AGC_BGC_natrl_forest_US),
+        'us_AGC_BGC_stdev': uu.sensit_tile_rename(sensit_type, tile_id, cn.pattern_stdev_annual_gain_AGC_BGC_natrl_forest_US),
+        'young_AGC': uu.sensit_tile_rename(sensit_type, tile_id, cn.pattern_annual_gain_AGC_natrl_forest_young),
+        'young_AGC_stdev': uu.sensit_tile_rename(sensit_type, tile_id, cn.pattern_stdev_annual_gain_AGC_natrl_forest_young),
+        'bor_tem_trop': uu.sensit_tile_rename(sensit_type, tile_id, cn.pattern_bor_tem_trop_processed),
+        'precip': uu.sensit_tile_rename(sensit_type, tile_id, cn.pattern_precip),
+        'elevation': uu.sensit_tile_rename(sensit_type, tile_id, cn.pattern_elevation),
+        'soil_C_2000': uu.sensit_tile_rename(sensit_type, tile_id, cn.pattern_soil_C_full_extent_2000)
+    }
+
+    # PRODES extent 2000 stands in for Hansen TCD in the legal_Amazon_loss sensitivity analysis
+    if sensit_type == 'legal_Amazon_loss':
+        input_names['tcd'] = '{0}_{1}.tif'.format(tile_id, cn.pattern_Brazil_forest_extent_2000_processed)
+    else:
+        input_names['tcd'] = '{0}_{1}.tif'.format(cn.pattern_tcd, tile_id)
+
+    # Biomass tile name depends on the sensitivity analysis
+    if sensit_type == 'biomass_swap':
+        input_names['biomass'] = '{0}_{1}.tif'.format(tile_id, cn.pattern_JPL_unmasked_processed)
+    else:
+        input_names['biomass'] = '{0}_{1}.tif'.format(tile_id, cn.pattern_WHRC_biomass_2000_unmasked)
+
+    # Loss tile name depends on the sensitivity analysis.
+    # The same loss tile is used by every stage in the fused pass.
+    if sensit_type == 'legal_Amazon_loss':
+        input_names['loss'] = '{0}_{1}.tif'.format(tile_id, cn.pattern_Brazil_annual_loss_processed)
+    elif sensit_type == 'Mekong_loss':
+        input_names['loss'] = '{0}_{1}.tif'.format(tile_id, cn.pattern_Mekong_loss_processed)
+    else:
+        input_names['loss'] = '{0}_{1}.tif'.format(cn.pattern_loss, tile_id)
+
+    return input_names
+
+
+# Creates an output tile for the fused pass and adds its metadata tags
+def open_fused_output(tile_id, key, output_info, kwargs, sensit_type):
+
+    pattern, dtype, units, source, extent = output_info
+
+    output_pattern_list = [pattern]
+    if sensit_type != 'std':
+        output_pattern_list = uu.alter_patterns(sensit_type, output_pattern_list)
+
+    kwargs.update(dtype=dtype)
+    dst = rasterio.open('{0}_{1}.tif'.format(tile_id, output_pattern_list[0]), 'w', **kwargs)
+
+    # Adds metadata tags to the output raster
+    uu.add_rasterio_tags(dst, sensit_type)
+    dst.update_tags(
+        units=units)
+    dst.update_tags(
+        source=source)
+    dst.update_tags(
+        extent=extent)
+
+    return dst
+
+
+# Runs model extent through gross removals and carbon pools for one tile in a single pass over its windows
+def fused_removals_and_carbon_pools(tile_id, age_gain_table_dict, IPCC_gain_table_dict, IPCC_stdev_table_dict,
+                                    mang_BGB_AGB_ratio, mang_deadwood_AGB_ratio, mang_litter_AGB_ratio,
+                                    carbon_pool_extent, sensit_type, save_intermediates):
+
+    # Whether the tile is in the tropics determines the age category decision tree
+    tropics = forest_age_category_IPCC.tile_in_tropics(tile_id)
+    uu.print_log("  Tile {} in tropics:".format(tile_id), tropics)
+
+    # Lookup arrays for the removal factor and carbon pool ratio dictionaries, as in the stages
+    age_gain_table_lookup = uu.lookup_table(age_gain_table_dict, dtype='float64')
+    age_category_table = forest_age_category_IPCC.age_category_lookup(tropics, sensit_type)
+    age_lookup = uu.lookup_table(annual_gain_rate_IPCC_defaults.age_dict, dtype='int32')
+    IPCC_gain_table_lookup = uu.lookup_table(IPCC_gain_table_dict, default=None)
+    IPCC_stdev_table_lookup = uu.lookup_table(IPCC_stdev_table_dict, default=None)
+    mang_BGB_AGB_lookup = uu.lookup_table(mang_BGB_AGB_ratio, default=None)
+    mang_deadwood_AGB_lookup = uu.lookup_table(mang_deadwood_AGB_ratio, default=None)
+    mang_litter_AGB_lookup = uu.lookup_table(mang_litter_AGB_ratio, default=None)
+    AGB_ratio_cube = np.array(cn.deadwood_litter_AGB_ratios, dtype='float64')
+
+    input_names = fused_input_names(tile_id, sensit_type)
+
+    uu.print_log("  Reading input files for {}...".format(tile_id))
+
+    # Tree cover density (or PRODES extent) is the template for the whole fused pass and must exist
+    tcd_src = rasterio.open(input_names['tcd'])
+
+    src = {}
+    for key, tile in input_names.items():
+        if key == 'tcd':
+            continue
+        src[key] = uu.open_optional_input(tile, tile_id)
+
+    # Removal factor sources are only used if all of their tiles exist, as in annual_gain_rate_AGC_BGC_all_forest_types
+    ipcc_exists = src['cont_eco'] is not None
+    young_exists = (src['young_AGC'] is not None) & (src['young_AGC_stdev'] is not None)
+    us_exists = (src['us_AGC_BGC'] is not None) & (src['us_AGC_BGC_stdev'] is not None) & (sensit_type != 'US_removals')
+    plantations_exists = (src['plantations_AGC_BGC'] is not None) & (src['plantations_AGC_BGC_stdev'] is not None)
+    europe_exists = (src['europe_AGC_BGC'] is not None) & (src['europe_AGC_BGC_stdev'] is not None)
+    mangrove_rate_exists = (src['mangrove_AGB'] is not None) & (src['mangrove_BGB'] is not None) & \
+                           (src['mangrove_AGB_stdev'] is not None)
+
+    # Emissions year carbon pools need loss pixels to exist
+    loss_exists = src['loss'] is not None
+    emis_year_pools = ('loss' in carbon_pool_extent) & loss_exists
+    pools_2000 = '2000' in carbon_pool_extent
+
+    # Grabs metadata about the tif, like its location/projection/cellsize
+    kwargs = tcd_src.meta
+
+    # Grabs the windows of the tile (stripes) so we can iterate over the entire tif without running out of memory
+    windows = tcd_src.block_windows(1)
+
+    # Updates kwargs for the output datasets
+    kwargs.update(
+        driver='GTiff',
+        count=1,
+        compress='lzw',
+        nodata=0
+    )
+
+    # Output tiles for this tile
+    dst = {}
+    for key, output_info in fused_final_outputs.items():
+        dst[key] = open_fused_output(tile_id, key, output_info, kwargs, sensit_type)
+    if save_intermediates:
+        for key, output_info in fused_intermediate_outputs.items():
+            if (key == 'total_C_emis_year') & (not emis_year_pools):
+                continue
+            dst[key] = open_fused_output(tile_id, key, output_info, kwargs, sensit_type)
+    if emis_year_pools:
+        for key, output_info in fused_emis_year_pool_outputs.items():
+            # Soil C in the emissions year is only created if there is soil C in 2000, as in create_soil_emis_extent.
+            # Otherwise, a blank tile is made for gross emissions.
+            if (key == 'soil_emis_year') & (src['soil_C_2000'] is None):
+                continue
+            dst[key] = open_fused_output(tile_id, key, output_info, kwargs, sensit_type)
+    if pools_2000:
+        for key, output_info in fused_2000_pool_outputs.items():
+            dst[key] = open_fused_output(tile_id, key, output_info, kwargs, sensit_type)
+
+    # Number of pixels in the model extent, to know whether the outputs for this tile are empty
+    extent_pixel_count = 0
+
+    uu.print_log("  Running fused model extent through carbon pools for {}".format(tile_id))
+
+    # Input windows are read into the same buffers for every window. Tiles that don't exist are read as shared windows of 0s.
+    window_buffers = uu.new_window_buffers()
+    window_writer = uu.new_window_writer()
+
+    # Inputs whose windows are read ahead of the window being calculated. Only the inputs that are used are read.
+    input_keys = ['mangrove_biomass_2000', 'gain', 'biomass', 'plant_pre_2000', 'loss', 'cont_eco', 'ifl_primary']
+    for exists, keys in [(young_exists, ['young_AGC', 'young_AGC_stdev']),
+                         (us_exists, ['us_AGC_BGC', 'us_AGC_BGC_stdev']),
+                         (plantations_exists, ['plantations_AGC_BGC', 'plantations_AGC_BGC_stdev']),
+                         (europe_exists, ['europe_AGC_BGC', 'europe_AGC_BGC_stdev']),
+                         (mangrove_rate_exists, ['mangrove_AGB', 'mangrove_BGB', 'mangrove_AGB_stdev']),
+                         (emis_year_pools or pools_2000, ['bor_tem_trop', 'precip', 'elevation', 'soil_C_2000'])]:
+        if exists:
+            input_keys.extend(keys)
+    input_srcs = [tcd_src] + [src[key] for key in input_keys]
+
+    # Iterates across the windows (1 pixel strips) of the input tiles while the next windows' inputs are read
+    for idx, window in uu.prefetch_windows(windows, input_srcs, window_buffers):
+
+        out = {}
+
+        tcd_window = uu.read_window(tcd_src, window, window_buffers)
+        mangrove_window = uu.read_window(src['mangrove_biomass_2000'], window, window_buffers, 'uint8')
+        gain_window = uu.read_window(src['gain'], window, window_buffers, 'uint8')
+        biomass_window = uu.read_window(src['biomass'], window, window_buffers, 'float32')
+        pre_2000_plantations_window = uu.read_window(src['plant_pre_2000'], window, window_buffers, 'uint8')
+        loss_window = uu.read_window(src['loss'], window, window_buffers, 'uint8')
+        cont_eco_window = uu.read_window(src['cont_eco'], window, window_buffers, 'uint8')
+        ifl_primary_window = uu.read_window(src['ifl_primary'], window, window_buffers, 'uint8')
+
+        # Outputs that the stages write as float32 are converted to float32 before the next stage uses them,
+        # so that the fused pass calculates with the same values that the stages read from disk.
+
+        ### Model extent (model_extent)
+
+        model_extent_window = model_extent.calculate_model_extent(tcd_window, biomass_window, mangrove_window, gain_window,
+                                                                  pre_2000_plantations_window, sensit_type)
+
+        extent_pixel_count += int(np.count_nonzero(model_extent_window))
+        out['model_extent'] = model_extent_window
+
+
+        ### Forest age category (forest_age_category_IPCC)
+
+        age_cat_window = forest_age_category_IPCC.calculate_age_category(
+            model_extent_window, loss_window, gain_window, ifl_primary_window, biomass_window, cont_eco_window,
+            age_gain_table_lookup, age_category_table, sensit_type)
+
+        out['age_cat_IPCC'] = age_cat_window
+
+
+        ### IPCC default removal factors (annual_gain_rate_IPCC_defaults)
+
+        ipcc_AGB_default_rate_window, ipcc_BGB_default_rate_window, ipcc_AGB_default_stdev_window = \
+            annual_gain_rate_IPCC_defaults.calculate_IPCC_default_rates(age_cat_window, cont_eco_window, age_lookup,
+                                                                        IPCC_gain_table_lookup, IPCC_stdev_table_lookup)
+        ipcc_AGB_default_rate_window = ipcc_AGB_default_rate_window.astype('float32')
+        ipcc_AGB_default_stdev_window = ipcc_AGB_default_stdev_window.astype('float32')
+
+        out['annual_gain_AGB_IPCC_defaults'] = ipcc_AGB_default_rate_window
+        out['annual_gain_BGB_IPCC_defaults'] = ipcc_BGB_default_rate_window
+        out['stdev_annual_gain_AGB_IPCC_defaults'] = ipcc_AGB_default_stdev_window
+
+
+        ### Removal factors for all forest types (annual_gain_rate_AGC_BGC_all_forest_types)
+
+        source_windows = {}
+        if ipcc_exists:
+            source_windows['ipcc_windows'] = (ipcc_AGB_default_rate_window, ipcc_AGB_default_stdev_window)
+        for exists, source, keys in [(young_exists, 'young_windows', ['young_AGC', 'young_AGC_stdev']),
+                                     (us_exists, 'us_windows', ['us_AGC_BGC', 'us_AGC_BGC_stdev']),
+                                     (plantations_exists, 'plantations_windows', ['plantations_AGC_BGC', 'plantations_AGC_BGC_stdev']),
+                                     (europe_exists, 'europe_windows', ['europe_AGC_BGC', 'europe_AGC_BGC_stdev']),
+                                     (mangrove_rate_exists, 'mangrove_windows', ['mangrove_AGB', 'mangrove_BGB', 'mangrove_AGB_stdev'])]:
+            if exists:
+                source_windows[source] = tuple(uu.read_window(src[key], window, window_buffers) for key in keys)
+
+        removal_forest_type_window, annual_gain_AGC_window, annual_gain_BGC_window, annual_gain_AGC_BGC_window, \
+        stdev_annual_gain_AGC_window = annual_gain_rate_AGC_BGC_all_forest_types.calculate_removal_factors(
+            window_buffers, window, model_extent_window, age_cat_window, sensit_type, **source_windows)
+
+        out['removal_forest_type'] = removal_forest_type_window
+        out['annual_gain_AGC_all_types'] = annual_gain_AGC_window
+        out['annual_gain_BGC_all_types'] = annual_gain_BGC_window
+        out['annual_gain_AGC_BGC_all_types'] = annual_gain_AGC_BGC_window
+        out['stdev_annual_gain_AGC_all_types'] = stdev_annual_gain_AGC_window
+
+
+        ### Gain year count (gain_year_count_all_forest_types)
+
+        gain_year_count_window = gain_year_count_all_forest_types.calculate_gain_year_count(
+            loss_window, gain_window, model_extent_window, sensit_type)
+
+        out['gain_year_count'] = gain_year_count_window
+
+
+        ### Gross removals (gross_removals_all_forest_types)
+
+        cumul_gain_AGCO2_window, cumul_gain_BGCO2_window, cumul_gain_AGCO2_BGCO2_window = \
+            gross_removals_all_forest_types.calculate_gross_removals(annual_gain_AGC_window, annual_gain_BGC_window,
+                                                                     gain_year_count_window)
+
+        out['cumul_gain_AGCO2_all_types'] = cumul_gain_AGCO2_window
+        out['cumul_gain_BGCO2_all_types'] = cumul_gain_BGCO2_window
+        out['cumul_gain_AGCO2_BGCO2_all_types'] = cumul_gain_AGCO2_BGCO2_window
+
+
+        ### Carbon pools (create_carbon_pools)
+
+        if emis_year_pools or pools_2000:
+
+            agc_2000_window = create_carbon_pools.calculate_AGC_2000(window_buffers, window, mangrove_window, biomass_window)
+            out['AGC_2000'] = agc_2000_window
+
+            # Mangrove BGB:AGB ratios of each pixel's continent-ecozone
+            BGB_AGB_ratio_window = uu.reclassify(cont_eco_window, mang_BGB_AGB_lookup, default=None)
+
+            # Deadwood and litter in 2000. Windows of tiles that don't exist are None, as in create_deadwood_litter.
+            deadwood_litter_windows = {}
+            for key in ['biomass', 'bor_tem_trop', 'elevation', 'precip', 'mangrove_biomass_2000']:
+                deadwood_litter_windows[key] = None
+                if src[key] is not None:
+                    deadwood_litter_windows[key] = uu.read_window(src[key], window, window_buffers)
+
+            deadwood_2000_window, litter_2000_window = create_carbon_pools.calculate_deadwood_litter_2000(
+                window_buffers, window, deadwood_litter_windows['biomass'], deadwood_litter_windows['bor_tem_trop'],
+                deadwood_litter_windows['elevation'], deadwood_litter_windows['precip'],
+                deadwood_litter_windows['mangrove_biomass_2000'], cont_eco_window,
+                AGB_ratio_cube, mang_deadwood_AGB_lookup, mang_litter_AGB_lookup)
+
+            out['deadwood_2000'] = deadwood_2000_window
+            out['litter_2000'] = litter_2000_window
+
+            soil_2000_window = uu.read_window(src['soil_C_2000'], window, window_buffers, 'uint16')
+
+            if pools_2000:
+                BGC_2000_window = create_carbon_pools.calculate_BGC(window_buffers, 'BGC_2000', window, agc_2000_window,
+                                                                    removal_forest_type_window, BGB_AGB_ratio_window)
+                out['BGC_2000'] = BGC_2000_window
+                out['total_C_2000'] = create_carbon_pools.calculate_total_C(
+                    window_buffers, 'total_C_2000', window, agc_2000_window, BGC_2000_window,
+                    deadwood_2000_window, litter_2000_window, soil_2000_window)
+
+            if emis_year_pools:
+
+                AGC_emis_year_window = create_carbon_pools.calculate_AGC_emis_year(
+                    window_buffers, window, agc_2000_window, loss_window, gain_window, removal_forest_type_window,
+                    annual_gain_AGC_window, cumul_gain_AGCO2_window)
+                BGC_emis_year_window = create_carbon_pools.calculate_BGC(window_buffers, 'BGC_emis_year', window,
+                                                                         AGC_emis_year_window, removal_forest_type_window,
+                                                                         BGB_AGB_ratio_window)
+                deadwood_emis_year_window = create_carbon_pools.calculate_emis_year_extent(AGC_emis_year_window, deadwood_2000_window)
+                litter_emis_year_window = create_carbon_pools.calculate_emis_year_extent(AGC_emis_year_window, litter_2000_window)
+
+                # Soil C in the emissions year is only created if there is soil C in 2000, as in create_soil_emis_extent
+                soil_emis_year_window = soil_2000_window
+                if src['soil_C_2000'] is not None:
+                    soil_emis_year_window = create_carbon_pools.calculate_soil_emis_year(AGC_emis_year_window, soil_2000_window)
+
+                out['AGC_emis_year'] = AGC_emis_year_window
+                out['BGC_emis_year'] = BGC_emis_year_window
+                out['deadwood_emis_year'] = deadwood_emis_year_window
+                out['litter_emis_year'] = litter_emis_year_window
+                out['soil_emis_year'] = soil_emis_year_window
+                out['total_C_emis_year'] = create_carbon_pools.calculate_total_C(
+                    window_buffers, 'total_C_emis_year', window, AGC_emis_year_window, BGC_emis_year_window,
+                    deadwood_emis_year_window, litter_emis_year_window, soil_emis_year_window)
+
+        # Writes the windows of the outputs being kept
+        for key, output_dst in dst.items():
+            uu.write_window_in_background(window_writer, output_dst, out[key], window)
+
+    uu.finish_window_writes(window_writer)
+
+    output_names = [output_dst.name for output_dst in dst.values()]
+
+    for output_dst in dst.values():
+        output_dst.close()
+
+    return extent_pixel_count, emis_year_pools, output_names
+
+
+# Runs the fused model for one tile: model extent through carbon pools in one pass, then gross emissions and net flux
+def fused_per_tile(tile_id, age_gain_table_dict, IPCC_gain_table_dict, IPCC_stdev_table_dict,
+                   mang_BGB_AGB_ratio, mang_deadwood_AGB_ratio, mang_litter_AGB_ratio,
+                   carbon_pool_extent, emitted_pools, emis_pattern_list, sensit_type, folder,
+                   save_intermediates, no_upload):
+
+    # Same as in model_extent.model_extent
+    os.chdir(cn.docker_base_dir)
+
+    uu.print_log("Running fused model stages for", tile_id)
+
+    # Start time
+    start = datetime.datetime.now()
+
+    extent_pixel_count, emis_year_pools, output_names = fused_removals_and_carbon_pools(
+        tile_id, age_gain_table_dict, IPCC_gain_table_dict, IPCC_stdev_table_dict,
+        mang_BGB_AGB_ratio, mang_deadwood_AGB_ratio, mang_litter_AGB_ratio,
+        carbon_pool_extent, sensit_type, save_intermediates)
+
+    # Tiles without any model extent have no outputs, as with check_and_delete_if_empty in mp_model_extent
+    if extent_pixel_count == 0:
+        uu.print_log("  No model extent in {}. Deleting its fused outputs.".format(tile_id))
+        for output_name in output_names:
+            os.remove(output_name)
+        return
+
+    if emis_year_pools:
+
+        # The C++ code expects certain tiles for every input 10x10, so dummy tiles are made for inputs that don't exist.
+        # They are listed in the blank tile textfile and deleted at the end of the run.
+        for pattern in [cn.pattern_planted_forest_type_unmasked, cn.pattern_peat_mask, cn.pattern_ifl_primary,
+                        cn.pattern_drivers, cn.pattern_bor_tem_trop_processed, cn.pattern_burn_year,
+                        cn.pattern_climate_zone, cn.pattern_soil_C_emis_year_2000]:
+            uu.make_blank_tile(tile_id, pattern, folder, sensit_type)
+
+        calculate_gross_emissions.calc_emissions(tile_id, emitted_pools, sensit_type, folder, no_upload)
+
+        for pattern in emis_pattern_list:
+            calculate_gross_emissions.add_metadata_tags(tile_id, pattern, sensit_type)
+
+    # Net flux is gross emissions minus gross removals
+    net_flux_pattern_list = [cn.pattern_net_flux]
+    if sensit_type != 'std':
+        net_flux_pattern_list = uu.alter_patterns(sensit_type, net_flux_pattern_list)
+    net_flux.net_calc(tile_id, net_flux_pattern_list[0], sensit_type, no_upload)
+
+    # The emissions year carbon pools were only written for the gross emissions C++
+    if emis_year_pools and not save_intermediates:
+        uu.print_log("  Deleting emissions year carbon pools for {}".format(tile_id))
+        for output_info in fused_emis_year_pool_outputs.values():
+            pool_tile = uu.sensit_tile_rename(sensit_type, tile_id, output_info[0])
+            if os.path.exists(pool_tile):
+                os.remove(pool_tile)
+
+    # Prints information about the tile that was just processed
+    uu.end_of_fx_summary(start, tile_id, cn.pattern_cumul_gain_AGCO2_BGCO2_all_types, no_upload)
@@ -0,0 +1,343 @@
+'''
+This script runs the per-pixel model stages from model extent through net flux tile by tile, rather than stage by stage.
+Each tile goes through model extent, forest age category, IPCC default removal factors, removal factors for all forest types,
+gain year count, gross removals, carbon pools, gross emissions and net flux before the next tile is started by that processor.
+Intermediate outputs are held in memory and only written if --save-intermediates is used, which removes the
+tile-sized writes and re-reads between stages.
+The carbon pools in the emissions year are still written for each tile because the gross emissions C++ reads them from disk.
+Each window is calculated with the same functions that the stages use when run separately through run_full_model.py.
+Run through run_full_model.py with --fused (-fu) or on its own:
+python mp_fused_per_tile.py -t std -l 00N_000E -ce loss -p biomass_soil -d 20229999
+'''
+
+import pandas as pd
+import argparse
+import os
+from functools import partial
+import sys
+sys.path.append('../')
+import constants_and_names as cn
+import universal_util as uu
+sys.path.append(os.path.join(cn.docker_app,'fused_pipeline'))
+import fused_per_tile
+sys.path.append(os.path.join(cn.docker_app,'carbon_pools'))
+import create_carbon_pools
+sys.path.append(os.path.join(cn.docker_app,'gain'))
+from mp_annual_gain_rate_IPCC_defaults import IPCC_default_removal_dicts
+
+def mp_fused_per_tile(sensit_type, tile_id_list, carbon_pool_extent, emitted_pools, run_date = None, no_upload = None,
+                      save_intermediates = None, streaming = None):
+
+    os.chdir(cn.docker_base_dir)
+
+    folder = cn.docker_base_dir
+
+    # Checks the validity of the carbon_pool_extent argument
+    if (carbon_pool_extent not in ['loss', '2000', 'loss,2000', '2000,loss']):
+        uu.exception_log(no_upload, "Invalid carbon_pool_extent input. Please choose loss, 2000, loss,2000 or 2000,loss.")
+
+    # Checks the validity of the emitted_pools argument
+    if (emitted_pools not in ['soil_only', 'biomass_soil']):
+        uu.exception_log(no_upload, 'Invalid pool input. Please choose soil_only or biomass_soil.')
+
+    # If a full model run is specified, the correct set of tiles for the particular script is listed.
+    # This is the same set of tiles as for model extent, since every later stage is limited to the model extent.
+    if tile_id_list == 'all':
+        # List of tiles to run in the model. Which biomass tiles to use depends on sensitivity analysis
+        if sensit_type == 'biomass_swap':
+            tile_id_list = uu.tile_list_s3(cn.JPL_processed_dir, sensit_type)
+        elif sensit_type == 'legal_Amazon_loss':
+            tile_id_list = uu.tile_list_s3(cn.Brazil_forest_extent_2000_processed_dir, sensit_type)
+        else:
+            tile_id_list = uu.create_combined_tile_list(cn.WHRC_biomass_2000_unmasked_dir,
+                                             cn.mangrove_biomass_2000_dir,
+                                             cn.gain_dir, cn.tcd_dir
+                                             )
+
+    uu.print_log(tile_id_list)
+    uu.print_log("There are {} tiles to process".format(str(len(tile_id_list))) + "\n")
+
+
+    # Files to download for this script. This is every input of the stages that are fused.
+    download_dict = {
+        cn.mangrove_biomass_2000_dir: [cn.pattern_mangrove_biomass_2000],
+        cn.gain_dir: [cn.pattern_gain],
+        cn.plant_pre_2000_processed_dir: [cn.pattern_plant_pre_2000],
+        cn.ifl_primary_processed_dir: [cn.pattern_ifl_primary],
+        cn.cont_eco_dir: [cn.pattern_cont_eco_processed],
+        cn.annual_gain_AGB_mangrove_dir: [cn.pattern_annual_gain_AGB_mangrove],
+        cn.annual_gain_BGB_mangrove_dir: [cn.pattern_annual_gain_BGB_mangrove],
+        cn.annual_gain_AGC_BGC_natrl_forest_Europe_dir: [cn.pattern_annual_gain_AGC_BGC_natrl_forest_Europe],
+        cn.annual_gain_AGC_BGC_planted_forest_unmasked_dir: [cn.pattern_annual_gain_AGC_BGC_planted_forest_unmasked],
+        cn.annual_gain_AGC_BGC_natrl_forest_US_dir: [cn.pattern_annual_gain_AGC_BGC_natrl_forest_US],
+        cn.annual_gain_AGC_natrl_forest_young_dir: [cn.pattern_annual_gain_AGC_natrl_forest_young],
+        cn.stdev_annual_gain_AGB_mangrove_dir: [cn.pattern_stdev_annual_gain_AGB_mangrove],
+        cn.stdev_annual_gain_AGC_BGC_natrl_forest_Europe_dir: [cn.pattern_stdev_annual_gain_AGC_BGC_natrl_forest_Europe],
+        cn.stdev_annual_gain_AGC_BGC_planted_forest_unmasked_dir: [cn.pattern_stdev_annual_gain_AGC_BGC_planted_forest_unmasked],
+        cn.stdev_annual_gain_AGC_BGC_natrl_forest_US_dir: [cn.pattern_stdev_annual_gain_AGC_BGC_natrl_forest_US],
+        cn.stdev_annual_gain_AGC_natrl_forest_young_dir: [cn.pattern_stdev_annual_gain_AGC_natrl_forest_young],
+        cn.bor_tem_trop_processed_dir: [cn.pattern_bor_tem_trop_processed],
+        cn.precip_processed_dir: [cn.pattern_precip],
+        cn.elevation_processed_dir: [cn.pattern_elevation],
+        cn.soil_C_full_extent_2000_dir: [cn.pattern_soil_C_full_extent_2000],
+        cn.peat_mask_dir: [cn.pattern_peat_mask],
+        cn.planted_forest_type_unmasked_dir: [cn.pattern_planted_forest_type_unmasked],
+        cn.drivers_processed_dir: [cn.pattern_drivers],
+        cn.climate_zone_processed_dir: [cn.pattern_climate_zone],
+        cn.burn_year_dir: [cn.pattern_burn_year]
+    }
+
+    if sensit_type == 'legal_Amazon_loss':
+        download_dict[cn.Brazil_forest_extent_2000_processed_dir] = [cn.pattern_Brazil_forest_extent_2000_processed]
+    else:
+        download_dict[cn.tcd_dir] = [cn.pattern_tcd]
+
+    # Adds the correct AGB tiles to the download dictionary depending on the model run
+    if sensit_type == 'biomass_swap':
+        download_dict[cn.JPL_processed_dir] = [cn.pattern_JPL_unmasked_processed]
+    else:
+        download_dict[cn.WHRC_biomass_2000_unmasked_dir] = [cn.pattern_WHRC_biomass_2000_unmasked]
+
+    # Adds the correct loss tile to the download dictionary depending on the model run
+    if sensit_type == 'legal_Amazon_loss':
+        download_dict[cn.Brazil_annual_loss_processed_dir] = [cn.pattern_Brazil_annual_loss_processed]
+    elif sensit_type == 'Mekong_loss':
+        download_dict[cn.Mekong_loss_processed_dir] = [cn.pattern_Mekong_loss_processed]
+    else:
+        download_dict[cn.loss_dir] = [cn.pattern_loss]
+
+
+    # Final outputs of the fused run, which are always uploaded.
+    # Intermediate outputs are only uploaded if they are being saved.
+    output_dir_list = [cn.annual_gain_AGC_all_types_dir, cn.cumul_gain_AGCO2_BGCO2_all_types_dir, cn.net_flux_dir]
+    output_pattern_list = [cn.pattern_annual_gain_AGC_all_types, cn.pattern_cumul_gain_AGCO2_BGCO2_all_types,
+                           cn.pattern_net_flux]
+
+    if save_intermediates:
+        output_dir_list = output_dir_list + [cn.model_extent_dir, cn.age_cat_IPCC_dir,
+                                             cn.annual_gain_AGB_IPCC_defaults_dir, cn.annual_gain_BGB_IPCC_defaults_dir,
+                                             cn.stdev_annual_gain_AGB_IPCC_defaults_dir, cn.removal_forest_type_dir,
+                                             cn.annual_gain_BGC_all_types_dir, cn.annual_gain_AGC_BGC_all_types_dir,
+                                             cn.stdev_annual_gain_AGC_all_types_dir, cn.gain_year_count_dir,
+                                             cn.cumul_gain_AGCO2_all_types_dir, cn.cumul_gain_BGCO2_all_types_dir]
+        output_pattern_list = output_pattern_list + [cn.pattern_model_extent, cn.pattern_age_cat_IPCC,
+                                                     cn.pattern_annual_gain_AGB_IPCC_defaults, cn.pattern_annual_gain_BGB_IPCC_defaults,
+                                                     cn.pattern_stdev_annual_gain_AGB_IPCC_defaults, cn.pattern_removal_forest_type,
+                                                     cn.pattern_annual_gain_BGC_all_types, cn.pattern_annual_gain_AGC_BGC_all_types,
+                                                     cn.pattern_stdev_annual_gain_AGC_all_types, cn.pattern_gain_year_count,
+                                                     cn.pattern_cumul_gain_AGCO2_all_types, cn.pattern_cumul_gain_BGCO2_all_types]
+
+        if 'loss' in carbon_pool_extent:
+            output_dir_list = output_dir_list + [cn.AGC_emis_year_dir, cn.BGC_emis_year_dir, cn.deadwood_emis_year_2000_dir,
+                                                 cn.litter_emis_year_2000_dir, cn.soil_C_emis_year_2000_dir, cn.total_C_emis_year_dir]
+            output_pattern_list = output_pattern_list + [cn.pattern_AGC_emis_year, cn.pattern_BGC_emis_year, cn.pattern_deadwood_emis_year_2000,
+                                                         cn.pattern_litter_emis_year_2000, cn.pattern_soil_C_emis_year_2000, cn.pattern_total_C_emis_year]
+
+    if '2000' in carbon_pool_extent:
+        output_dir_list = output_dir_list + [cn.AGC_2000_dir, cn.BGC_2000_dir, cn.deadwood_2000_dir,
+                                             cn.litter_2000_dir, cn.total_C_2000_dir]
+        output_pattern_list = output_pattern_list + [cn.pattern_AGC_2000, cn.pattern_BGC_2000, cn.pattern_deadwood_2000,
+                                                     cn.pattern_litter_2000, cn.pattern_total_C_2000]
+
+    # Gross emissions outputs. Must be in same order as output pattern directories.
+    if emitted_pools == 'biomass_soil':
+        emis_dir_list = [cn.gross_emis_commod_biomass_soil_dir,
+                         cn.gross_emis_shifting_ag_biomass_soil_dir,
+                         cn.gross_emis_forestry_biomass_soil_dir,
+                         cn.gross_emis_wildfire_biomass_soil_dir,
+                         cn.gross_emis_urban_biomass_soil_dir,
+                         cn.gross_emis_no_driver_biomass_soil_dir,
+                         cn.gross_emis_all_gases_all_drivers_biomass_soil_dir,
+                         cn.gross_emis_co2_only_all_drivers_biomass_soil_dir,
+                         cn.gross_emis_non_co2_all_drivers_biomass_soil_dir,
+                         cn.gross_emis_nodes_biomass_soil_dir]
+
+        emis_pattern_list = [cn.pattern_gross_emis_commod_biomass_soil,
+                             cn.pattern_gross_emis_shifting_ag_biomass_soil,
+                             cn.pattern_gross_emis_forestry_biomass_soil,
+                             cn.pattern_gross_emis_wildfire_biomass_soil,
+                             cn.pattern_gross_emis_urban_biomass_soil,
+                             cn.pattern_gross_emis_no_driver_biomass_soil,
+                             cn.pattern_gross_emis_all_gases_all_drivers_biomass_soil,
+                             cn.pattern_gross_emis_co2_only_all_drivers_biomass_soil,
+                             cn.pattern_gross_emis_non_co2_all_drivers_biomass_soil,
+                             cn.pattern_gross_emis_nodes_biomass_soil]
+    else:
+        emis_dir_list = [cn.gross_emis_commod_soil_only_dir,
+                         cn.gross_emis_shifting_ag_soil_only_dir,
+                         cn.gross_emis_forestry_soil_only_dir,
+                         cn.gross_emis_wildfire_soil_only_dir,
+                         cn.gross_emis_urban_soil_only_dir,
+                         cn.gross_emis_no_driver_soil_only_dir,
+                         cn.gross_emis_all_gases_all_drivers_soil_only_dir,
+                         cn.gross_emis_co2_only_all_drivers_soil_only_dir,
+                         cn.gross_emis_non_co2_all_drivers_soil_only_dir,
+                         cn.gross_emis_nodes_soil_only_dir]
+
+        emis_pattern_list = [cn.pattern_gross_emis_commod_soil_only,
+                             cn.pattern_gross_emis_shifting_ag_soil_only,
+                             cn.pattern_gross_emis_forestry_soil_only,
+                             cn.pattern_gross_emis_wildfire_soil_only,
+                             cn.pattern_gross_emis_urban_soil_only,
+                             cn.pattern_gross_emis_no_driver_soil_only,
+                             cn.pattern_gross_emis_all_gases_all_drivers_soil_only,
+                             cn.pattern_gross_emis_co2_only_all_drivers_soil_only,
+                             cn.pattern_gross_emis_non_co2_all_drivers_soil_only,
+                             cn.pattern_gross_emis_nodes_soil_only]
+
+    # Gross emissions are only calculated where there are emissions year carbon pools
+    if 'loss' in carbon_pool_extent:
+        output_dir_list = output_dir_list + emis_dir_list
+        output_pattern_list = output_pattern_list + emis_pattern_list
+
+
+    # Downloads input files or entire directories, depending on how many tiles are in the tile_id_list, if AWS credentials are found.
+    # In streaming mode, each tile's inputs are downloaded just before it is processed instead.
+    if uu.check_aws_creds() and not streaming:
+
+        for key, values in download_dict.items():
+            dir = key
+            pattern = values[0]
+            uu.s3_flexible_download(dir, pattern, cn.docker_base_dir, sensit_type, tile_id_list)
+
+
+    # If the model run isn't the standard one, the output directory and file names are changed
+    if sensit_type != 'std':
+        uu.print_log("Changing output directory and file name pattern based on sensitivity analysis")
+        output_dir_list = uu.alter_dirs(sensit_type, output_dir_list)
+        output_pattern_list = uu.alter_patterns(sensit_type, output_pattern_list)
+        emis_pattern_list = uu.alter_patterns(sensit_type, emis_pattern_list)
+
+    # A date can optionally be provided by the full model script or a run of this script.
+    # This replaces the date in constants_and_names.
+    if run_date is not None:
+        output_dir_list = uu.replace_output_dir_date(output_dir_list, run_date)
+
+
+    if uu.check_aws_creds():
+        # Table with IPCC Table 4.9 default gain rates and IPCC Wetland Supplement Table 4.4 mangrove ratios
+        cmd = ['aws', 's3', 'cp', os.path.join(cn.gain_spreadsheet_dir, cn.gain_spreadsheet), cn.docker_base_dir]
+        uu.log_subprocess_output_full(cmd)
+
+    pd.options.mode.chained_assignment = None
+
+    # Young forest removal factors by continent-ecozone, as in mp_forest_age_category_IPCC
+    gain_table = pd.read_excel("{}".format(cn.gain_spreadsheet),
+                               sheet_name = "natrl fores gain, for std model")
+    gain_table_simplified = gain_table.drop_duplicates(subset='gainEcoCon', keep='first')
+    age_gain_table_dict = pd.Series(gain_table_simplified.growth_secondary_less_20.values,index=gain_table_simplified.gainEcoCon).to_dict()
+    age_gain_table_dict[0] = 0
+
+    # Dictionaries of IPCC default removal factors and standard deviations by continent-ecozone-age code
+    IPCC_gain_table_dict, IPCC_stdev_table_dict = IPCC_default_removal_dicts(sensit_type)
+
+    # Mangrove belowground, deadwood and litter ratios by continent-ecozone, as in mp_create_carbon_pools
+    mang_gain_table = pd.read_excel("{}".format(cn.gain_spreadsheet),
+                                    sheet_name="mangrove gain, for model")
+    mang_gain_table_simplified = mang_gain_table.drop_duplicates(subset='gainEcoCon', keep='first')
+
+    mang_BGB_AGB_ratio = create_carbon_pools.mangrove_pool_ratio_dict(mang_gain_table_simplified,
+                                                                      cn.below_to_above_trop_dry_mang,
+                                                                      cn.below_to_above_trop_wet_mang,
+                                                                      cn.below_to_above_subtrop_mang)
+
+    mang_deadwood_AGB_ratio = create_carbon_pools.mangrove_pool_ratio_dict(mang_gain_table_simplified,
+                                                                           cn.deadwood_to_above_trop_dry_mang,
+                                                                           cn.deadwood_to_above_trop_wet_mang,
+                                                                           cn.deadwood_to_above_subtrop_mang)
+
+    mang_litter_AGB_ratio = create_carbon_pools.mangrove_pool_ratio_dict(mang_gain_table_simplified,
+                                                                         cn.litter_to_above_trop_dry_mang,
+                                                                         cn.litter_to_above_trop_wet_mang,
+                                                                         cn.litter_to_above_subtrop_mang)
+
+
+    # textfile that stores the names of the blank tiles that are created for the gross emissions C++.
+    # This will be iterated through to delete the tiles at the end of the script.
+    uu.create_blank_tile_txt()
+
+    fused_tile = partial(fused_per_tile.fused_per_tile, age_gain_table_dict=age_gain_table_dict,
+                         IPCC_gain_table_dict=IPCC_gain_table_dict, IPCC_stdev_table_dict=IPCC_stdev_table_dict,
+                         mang_BGB_AGB_ratio=mang_BGB_AGB_ratio, mang_deadwood_AGB_ratio=mang_deadwood_AGB_ratio,
+                         mang_litter_AGB_ratio=mang_litter_AGB_ratio, carbon_pool_extent=carbon_pool_extent,
+                         emitted_pools=emitted_pools, emis_pattern_list=emis_pattern_list, sensit_type=sensit_type,
+                         folder=folder, save_intermediates=save_intermediates, no_upload=no_upload)
+
+    # In streaming mode, inputs are downloaded, tiles processed and outputs uploaded tile by tile.
+    # Intermediate outputs that were deleted after the tile finished are skipped by the upload.
+    if streaming:
+        uu.streaming_map(fused_tile, tile_id_list, 'fused_per_tile', download_dict, output_dir_list, output_pattern_list,
+                         sensit_type, no_upload)
+        uu.list_and_delete_blank_tiles()
+        return
+
+    # Each processor holds all stages' windows for one tile at a time and then runs the gross emissions C++ on it.
+    # Tiles are admitted into the pool as long as their recorded peak memory fits in the machine's memory budget.
+    uu.memory_aware_map(fused_tile, tile_id_list, 'fused_per_tile')
+
+    # # For single processor use
+    # for tile_id in tile_id_list:
+    #     fused_per_tile.fused_per_tile(tile_id, age_gain_table_dict, IPCC_gain_table_dict, IPCC_stdev_table_dict,
+    #                                   mang_BGB_AGB_ratio, mang_deadwood_AGB_ratio, mang_litter_AGB_ratio,
+    #                                   carbon_pool_extent, emitted_pools, emis_pattern_list, sensit_type,
+    #                                   folder, save_intermediates, no_upload)
+
+    # Print the list of blank created tiles, delete the tiles, and delete their text file
+    uu.list_and_delete_blank_tiles()
+
+
+    # If no_upload flag is not activated, output is uploaded
+    if not no_upload:
+
+        for i in range(0, len(output_dir_list)):
+            uu.upload_final_set(output_dir_list[i], output_pattern_list[i])
+
+
+if __name__ == '__main__':
+
+    # The arguments for what kind of model run is being run (standard conditions or a sensitivity analysis) and
+    # the tiles to include
+    parser = argparse.ArgumentParser(
+        description='Runs model extent through net flux for each tile in one pass')
+    parser.add_argument('--model-type', '-t', required=True,
+                        help='{}'.format(cn.model_type_arg_help))
+    parser.add_argument('--tile_id_list', '-l', required=True,
+                        help='List of tile ids to use in the model. Should be of form 00N_110E or 00N_110E,00N_120E or all.')
+    parser.add_argument('--carbon_pool_extent', '-ce', required=True,
+                        help='Time period for which carbon emitted_pools should be calculated: loss, 2000, loss,2000, or 2000,loss')
+    parser.add_argument('--emitted-pools-to-use', '-p', required=True,
+                        help='Options are soil_only or biomass_soil. Former only considers emissions from soil. Latter considers emissions from biomass and soil.')
+    parser.add_argument('--run-date', '-d', required=False,
+                        help='Date of run. Must be format YYYYMMDD.')
+    parser.add_argument('--no-upload', '-nu', action='store_true',
+                       help='Disables uploading of outputs to s3')
+    parser.add_argument('--save-intermediates', '-si', action='store_true',
+                        help='Saves intermediate model outputs rather than deleting them to save storage')
+    parser.add_argument('--streaming', '-st', action='store_true',
+                        help='Downloads, processes and uploads tiles one at a time instead of in whole-stage batches')
+    args = parser.parse_args()
+    sensit_type = args.model_type
+    tile_id_list = args.tile_id_list
+    carbon_pool_extent = args.carbon_pool_extent
+    emitted_pools = args.emitted_pools_to_use
+    run_date = args.run_date
+    no_upload = args.no_upload
+    save_intermediates = args.save_intermediates
+    streaming = args.streaming
+
+    # Disables upload to s3 if no AWS credentials are found in environment
+    if not uu.check_aws_creds():
+        no_upload = True
+
+    # Create the output log
+    uu.initiate_log(tile_id_list=tile_id_list, sensit_type=sensit_type, run_date=run_date, no_upload=no_upload,
+                    save_intermediates=save_intermediates, carbon_pool_extent=carbon_pool_extent,
+                    emitted_pools=emitted_pools, fused=True, streaming=streaming)
+
+    # Checks whether the sensitivity analysis and tile_id_list arguments are valid
+    uu.check_sensit_type(sensit_type)
+    tile_id_list = uu.tile_id_list_check(tile_id_list)
+
+    mp_fused_per_tile(sensit_type=sensit_type, tile_id_list=tile_id_list, carbon_pool_extent=carbon_pool_extent,
+                      emitted_pools=emitted_pools, run_date=run_date, no_upload=no_upload,
+                      save_intermediates=save_intermediates, streaming=streaming)
@@ -67,6 +67,12 @@ def US_removal_rate_calc(tile_id, gain_table_group_region_age_dict, gain_table_g
         agc_bgc_stdev_dst.update_tags(
             extent='Continental USA. Applies to pixels for which an FIA region, FIA forest group, and Pan et al. forest age category are available or interpolated.')
 
+        # Lookup arrays of the removal factors and standard deviations for each group-region-age and group-region code
+        gain_table_group_region_age_lookup = uu.lookup_table(gain_table_group_region_age_dict)
+        gain_table_group_region_lookup = uu.lookup_table(gain_table_group_region_dict)
+        stdev_table_group_region_age_lookup = uu.lookup_table(stdev_table_group_region_age_dict)
+        stdev_table_group_region_lookup = uu.lookup_table(stdev_table_group_region_dict)
+
         # Iterates across the windows (1 pixel strips) of the input tile
         for idx, window in windows:
 
@@ -79,12 +85,9 @@ def US_removal_rate_calc(tile_id, gain_table_group_region_age_dict, gain_table_g
 
             ### For removal factors
 
-            # Creates empty windows (arrays) that will store gain rates. There are separate arrays for
-            # no Hansen gain pixels and for Hansen gain pixels. These are later combined.
+            # There are separate arrays of gain rates for no Hansen gain pixels and for Hansen gain pixels. These are later combined.
             # Pixels without and with Hansen gain are treated separately because gain pixels automatically get the youngest
             # removal rate, regardless of their age category.
-            agc_bgc_without_gain_pixel_window = np.zeros((window.height, window.width), dtype='float32')
-            agc_bgc_with_gain_pixel_window = np.zeros((window.height, window.width), dtype='float32')
 
             # Performs the same operation on the three rasters as is done on the values in the table in order to
             # make the codes (dictionary key) match. Then, combines the three rasters. These values now match the key values in the spreadsheet.
@@ -100,8 +103,7 @@ def US_removal_rate_calc(tile_id, gain_table_group_region_age_dict, gain_table_g
 
             # Applies the dictionary of group-region-age gain rates to the group-region-age numpy array to
             # get annual gain rates (Mg AGC+BGC/ha/yr) for each non-Hansen gain pixel
-            for key, value in gain_table_group_region_age_dict.items():
-                agc_bgc_without_gain_pixel_window[group_region_age_combined_window == key] = value
+            agc_bgc_without_gain_pixel_window = uu.reclassify(group_region_age_combined_window, gain_table_group_region_age_lookup)
 
 
             # This is for pixels with Hansen gain, so it assumes the age category is young and therefore only
@@ -120,8 +122,7 @@ def US_removal_rate_calc(tile_id, gain_table_group_region_age_dict, gain_table_g
 
             # Applies the dictionary of group-region gain rates to the group-region numpy array to
             # get annual gain rates (Mg AGC+BGC/ha/yr) for each pixel that doesn't have Hansen gain
-            for key, value in gain_table_group_region_dict.items():
-                agc_bgc_with_gain_pixel_window[group_region_combined_window == key] = value
+            agc_bgc_with_gain_pixel_window = uu.reclassify(group_region_combined_window, gain_table_group_region_lookup)
 
             # Pixels with Hansen gain fill in the pixels that don't have Hansen gain. Each pixel has a value in
             # one or neither of these arrays but not both of these arrays
@@ -133,22 +134,17 @@ def US_removal_rate_calc(tile_id, gain_table_group_region_age_dict, gain_table_g
 
             ### For removal factor standard deviation
 
-            # Creates empty windows (arrays) that will store stdev. There are separate arrays for
-            # no Hansen gain pixels and for Hansen gain pixels. These are later combined.
+            # There are separate arrays of stdev for no Hansen gain pixels and for Hansen gain pixels. These are later combined.
             # Pixels without and with Hansen gain are treated separately because gain pixels automatically get the youngest
             # removal rate stdev, regardless of their age category.
-            stdev_agc_bgc_without_gain_pixel_window = np.zeros((window.height, window.width), dtype='float32')
-            stdev_agc_bgc_with_gain_pixel_window = np.zeros((window.height, window.width), dtype='float32')
 
             # Applies the dictionary of group-region-age gain rates to the group-region-age numpy array to
             # get annual gain rates (Mg AGC+BGC/ha/yr) for each non-Hansen gain pixel
-            for key, value in stdev_table_group_region_age_dict.items():
-                stdev_agc_bgc_without_gain_pixel_window[group_region_age_combined_window == key] = value
+            stdev_agc_bgc_without_gain_pixel_window = uu.reclassify(group_region_age_combined_window, stdev_table_group_region_age_lookup)
 
             # Applies the dictionary of group-region gain rates to the group-region numpy array to
             # get annual gain rates (Mg AGC+BGC/ha/yr) for each pixel that doesn't have Hansen gain
-            for key, value in stdev_table_group_region_dict.items():
-                stdev_agc_bgc_with_gain_pixel_window[group_region_combined_window == key] = value
+            stdev_agc_bgc_with_gain_pixel_window = uu.reclassify(group_region_combined_window, stdev_table_group_region_lookup)
 
             # Pixels with Hansen gain fill in the pixels that don't have Hansen gain. Each pixel has a value in
             # one or neither of these arrays but not both of these arrays
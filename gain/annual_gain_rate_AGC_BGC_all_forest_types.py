@@ -8,6 +8,132 @@ sys.path.append('../')
 import constants_and_names as cn
 import universal_util as uu
 
+
+# Removal forest type, AGC and BGC removal factors, and AGC removal factor standard deviation for one window.
+# Each removal factor source's windows are given as a tuple of its rate (and, for mangroves, BGB rate) and standard
+# deviation windows, or None if the source isn't used for the tile. Sources are overlaid in priority order.
+# The outputs are window buffers (see uu.window_buffer), so they are overwritten by the next window.
+def calculate_removal_factors(window_buffers, window, model_extent_window, age_category_window, sensit_type,
+                              ipcc_windows=None, young_windows=None, us_windows=None, plantations_windows=None,
+                              europe_windows=None, mangrove_windows=None):
+
+    # Output rasters' windows
+    removal_forest_type_window = uu.window_buffer(window_buffers, 'removal_forest_type', window, 'uint8', fill=0)
+    annual_gain_AGC_all_forest_types_window = uu.window_buffer(window_buffers, 'annual_gain_AGC', window, 'float32', fill=0)
+    annual_gain_BGC_all_forest_types_window = uu.window_buffer(window_buffers, 'annual_gain_BGC', window, 'float32', fill=0)
+    stdev_annual_gain_AGC_all_forest_types_window = uu.window_buffer(window_buffers, 'stdev_annual_gain_AGC', window, 'float32', fill=0)
+
+    # Lowest priority
+    # Each source overlays its rates on the output windows in place where it has rates
+    # (see uu.evaluate_expression), so no new full-window arrays are made for each source.
+    if ipcc_windows is not None:
+        ipcc_AGB_default_rate_window, ipcc_AGB_default_stdev_window = ipcc_windows
+        has_rate = ipcc_AGB_default_rate_window != 0
+        # In no_primary_gain, the AGB_default_rate_window = 0, so primary forest pixels would not be
+        # assigned a removal forest type and therefore get exclude from the model later.
+        # That is incorrect, so using model_extent as the criterion instead allows the primary forest pixels
+        # that don't have rates under this sensitivity analysis to still be included in the model.
+        # Unfortunately, model_extent is slightly different from the IPCC rate extent (no IPCC rates where
+        # there is no ecozone information), but this is a very small difference and not worth worrying about.
+        if sensit_type == 'no_primary_gain':
+            uu.evaluate_expression('rank', out=removal_forest_type_window, where=model_extent_window != 0,
+                                   rank=cn.old_natural_rank)
+        else:
+            uu.evaluate_expression('rank', out=removal_forest_type_window, where=has_rate,
+                                   rank=cn.old_natural_rank)
+        uu.evaluate_expression('rate * biomass_to_c', out=annual_gain_AGC_all_forest_types_window, where=has_rate,
+                               rate=ipcc_AGB_default_rate_window, biomass_to_c=cn.biomass_to_c_non_mangrove)
+        uu.evaluate_expression('rate * biomass_to_c * below_to_above', out=annual_gain_BGC_all_forest_types_window, where=has_rate,
+                               rate=ipcc_AGB_default_rate_window, biomass_to_c=cn.biomass_to_c_non_mangrove,
+                               below_to_above=cn.below_to_above_non_mang)
+        uu.evaluate_expression('stdev * biomass_to_c', out=stdev_annual_gain_AGC_all_forest_types_window,
+                               where=ipcc_AGB_default_stdev_window != 0,
+                               stdev=ipcc_AGB_default_stdev_window, biomass_to_c=cn.biomass_to_c_non_mangrove)
+
+    if young_windows is not None: # young_AGC_rate_window uses > because of the weird NaN in the tiles. If != is used, the young rate NaN overwrites the IPCC arrays
+        young_AGC_rate_window, young_AGC_stdev_window = young_windows
+        # Using the > with the NaN results in non-fatal "RuntimeWarning: invalid value encountered in greater".
+        # This isn't actually a problem, so the "with" statement suppresses it, per https://stackoverflow.com/a/58026329/10839927
+        with np.errstate(invalid='ignore'):
+            has_rate = (young_AGC_rate_window > 0) & (age_category_window == 1)
+            uu.evaluate_expression('rank', out=removal_forest_type_window, where=has_rate,
+                                   rank=cn.young_natural_rank)
+            uu.evaluate_expression('rate', out=annual_gain_AGC_all_forest_types_window, where=has_rate,
+                                   rate=young_AGC_rate_window)
+            uu.evaluate_expression('rate * below_to_above', out=annual_gain_BGC_all_forest_types_window, where=has_rate,
+                                   rate=young_AGC_rate_window, below_to_above=cn.below_to_above_non_mang)
+            uu.evaluate_expression('stdev', out=stdev_annual_gain_AGC_all_forest_types_window,
+                                   where=(young_AGC_stdev_window > 0) & (age_category_window == 1),
+                                   stdev=young_AGC_stdev_window)
+
+    if sensit_type != 'US_removals':
+        if us_windows is not None:
+            us_AGC_BGC_rate_window, us_AGC_BGC_stdev_window = us_windows
+            has_rate = us_AGC_BGC_rate_window != 0
+            uu.evaluate_expression('rank', out=removal_forest_type_window, where=has_rate, rank=cn.US_rank)
+            uu.evaluate_expression('rate / (1 + below_to_above)', out=annual_gain_AGC_all_forest_types_window, where=has_rate,
+                                   rate=us_AGC_BGC_rate_window, below_to_above=cn.below_to_above_non_mang)
+            uu.evaluate_expression('rate - rate / (1 + below_to_above)', out=annual_gain_BGC_all_forest_types_window, where=has_rate,
+                                   rate=us_AGC_BGC_rate_window, below_to_above=cn.below_to_above_non_mang)
+            uu.evaluate_expression('stdev / (1 + below_to_above)', out=stdev_annual_gain_AGC_all_forest_types_window,
+                                   where=us_AGC_BGC_stdev_window != 0,
+                                   stdev=us_AGC_BGC_stdev_window, below_to_above=cn.below_to_above_non_mang)
+
+    if plantations_windows is not None:
+        plantations_AGC_BGC_rate_window, plantations_AGC_BGC_stdev_window = plantations_windows
+        has_rate = plantations_AGC_BGC_rate_window != 0
+        uu.evaluate_expression('rank', out=removal_forest_type_window, where=has_rate, rank=cn.planted_forest_rank)
+        uu.evaluate_expression('rate / (1 + below_to_above)', out=annual_gain_AGC_all_forest_types_window, where=has_rate,
+                               rate=plantations_AGC_BGC_rate_window, below_to_above=cn.below_to_above_non_mang)
+        uu.evaluate_expression('rate - rate / (1 + below_to_above)', out=annual_gain_BGC_all_forest_types_window, where=has_rate,
+                               rate=plantations_AGC_BGC_rate_window, below_to_above=cn.below_to_above_non_mang)
+        uu.evaluate_expression('stdev / (1 + below_to_above)', out=stdev_annual_gain_AGC_all_forest_types_window,
+                               where=plantations_AGC_BGC_stdev_window != 0,
+                               stdev=plantations_AGC_BGC_stdev_window, below_to_above=cn.below_to_above_non_mang)
+
+    if europe_windows is not None:
+        europe_AGC_BGC_rate_window, europe_AGC_BGC_stdev_window = europe_windows
+        has_rate = europe_AGC_BGC_rate_window != 0
+        uu.evaluate_expression('rank', out=removal_forest_type_window, where=has_rate, rank=cn.europe_rank)
+        uu.evaluate_expression('rate / (1 + below_to_above)', out=annual_gain_AGC_all_forest_types_window, where=has_rate,
+                               rate=europe_AGC_BGC_rate_window, below_to_above=cn.below_to_above_non_mang)
+        uu.evaluate_expression('rate - rate / (1 + below_to_above)', out=annual_gain_BGC_all_forest_types_window, where=has_rate,
+                               rate=europe_AGC_BGC_rate_window, below_to_above=cn.below_to_above_non_mang)
+        # NOTE: Nancy Harris thought that the European removal standard deviations were 2x too large,
+        # per email on 8/30/2020. Thus, simplest fix is to leave original tiles 2x too large and
+        # correct them only where composited with other stdev sources.
+        uu.evaluate_expression('(stdev / 2) / (1 + below_to_above)', out=stdev_annual_gain_AGC_all_forest_types_window,
+                               where=europe_AGC_BGC_stdev_window != 0,
+                               stdev=europe_AGC_BGC_stdev_window, below_to_above=cn.below_to_above_non_mang)
+
+    # Highest priority
+    if mangrove_windows is not None:
+        mangroves_AGB_rate_window, mangroves_BGB_rate_window, mangroves_AGB_stdev_window = mangrove_windows
+        has_rate = mangroves_AGB_rate_window != 0
+        uu.evaluate_expression('rank', out=removal_forest_type_window, where=has_rate, rank=cn.mangrove_rank)
+        uu.evaluate_expression('rate * biomass_to_c', out=annual_gain_AGC_all_forest_types_window, where=has_rate,
+                               rate=mangroves_AGB_rate_window, biomass_to_c=cn.biomass_to_c_mangrove)
+        uu.evaluate_expression('rate * biomass_to_c', out=annual_gain_BGC_all_forest_types_window,
+                               where=mangroves_BGB_rate_window != 0,
+                               rate=mangroves_BGB_rate_window, biomass_to_c=cn.biomass_to_c_mangrove)
+        uu.evaluate_expression('stdev * biomass_to_c', out=stdev_annual_gain_AGC_all_forest_types_window,
+                               where=mangroves_AGB_stdev_window != 0,
+                               stdev=mangroves_AGB_stdev_window, biomass_to_c=cn.biomass_to_c_mangrove)
+
+    # Masks outputs to model output extent
+    outside_model_extent = model_extent_window != 1
+    np.copyto(removal_forest_type_window, 0, where=outside_model_extent)
+    np.copyto(annual_gain_AGC_all_forest_types_window, 0, where=outside_model_extent)
+    np.copyto(annual_gain_BGC_all_forest_types_window, 0, where=outside_model_extent)
+    annual_gain_AGC_BGC_all_forest_types_window = uu.window_buffer(window_buffers, 'annual_gain_AGC_BGC', window, 'float32')
+    uu.evaluate_expression('AGC + BGC', out=annual_gain_AGC_BGC_all_forest_types_window,
+                           AGC=annual_gain_AGC_all_forest_types_window, BGC=annual_gain_BGC_all_forest_types_window)
+    np.copyto(stdev_annual_gain_AGC_all_forest_types_window, 0, where=outside_model_extent)
+
+    return removal_forest_type_window, annual_gain_AGC_all_forest_types_window, annual_gain_BGC_all_forest_types_window, \
+           annual_gain_AGC_BGC_all_forest_types_window, stdev_annual_gain_AGC_all_forest_types_window
+
+
 def annual_gain_rate_AGC_BGC_all_forest_types(tile_id, output_pattern_list, sensit_type, no_upload):
 
     uu.print_log("Mapping removal rate source and AGB and BGB removal rates:", tile_id)
@@ -51,6 +177,9 @@ def annual_gain_rate_AGC_BGC_all_forest_types(tile_id, output_pattern_list, sens
         # Grabs the windows of the tile (stripes) so we can iterate over the entire tif without running out of memory
         windows = model_extent_src.block_windows(1)
 
+        # Number of pixels in the model extent in each row. The outputs are masked to the model extent.
+        model_extent_row_counts = uu.read_row_counts(model_extent, model_extent_src.height)
+
         # Updates kwargs for the output dataset
         kwargs.update(
             driver='GTiff',
@@ -60,54 +189,28 @@ def annual_gain_rate_AGC_BGC_all_forest_types(tile_id, output_pattern_list, sens
         )
 
         # Checks whether there are mangrove or planted forest tiles. If so, they are opened.
-        try:
-            mangrove_AGB_src = rasterio.open(mangrove_AGB)
-            mangrove_BGB_src = rasterio.open(mangrove_BGB)
-            mangrove_AGB_stdev_src = rasterio.open(mangrove_AGB_stdev)
-            uu.print_log("    Mangrove tiles (AGB and BGB) for {}".format(tile_id))
-        except:
-            uu.print_log("    No mangrove tile for {}".format(tile_id))
-
-        try:
-            europe_AGC_BGC_src = rasterio.open(europe_AGC_BGC)
-            europe_AGC_BGC_stdev_src = rasterio.open(europe_AGC_BGC_stdev)
-            uu.print_log("    Europe removal factor tile for {}".format(tile_id))
-        except:
-            uu.print_log("    No Europe removal factor tile for {}".format(tile_id))
-
-        try:
-            plantations_AGC_BGC_src = rasterio.open(plantations_AGC_BGC)
-            plantations_AGC_BGC_stdev_src = rasterio.open(plantations_AGC_BGC_stdev)
-            uu.print_log("    Planted forest tile for {}".format(tile_id))
-        except:
-            uu.print_log("    No planted forest tile for {}".format(tile_id))
-
-        try:
-            us_AGC_BGC_src = rasterio.open(us_AGC_BGC)
-            us_AGC_BGC_stdev_src = rasterio.open(us_AGC_BGC_stdev)
-            uu.print_log("    US removal factor tile for {}".format(tile_id))
-        except:
-            uu.print_log("    No US removal factor tile for {}".format(tile_id))
-
-        try:
-            young_AGC_src = rasterio.open(young_AGC)
-            young_AGC_stdev_src = rasterio.open(young_AGC_stdev)
-            uu.print_log("    Young forest removal factor tile for {}".format(tile_id))
-        except:
-            uu.print_log("    No young forest removal factor tile for {}".format(tile_id))
-
-        try:
-            age_category_src = rasterio.open(age_category)
-            uu.print_log("    Age category tile for {}".format(tile_id))
-        except:
-            uu.print_log("    No age category tile for {}".format(tile_id))
-
-        try:
-            ipcc_AGB_default_src = rasterio.open(ipcc_AGB_default)
-            ipcc_AGB_default_stdev_src = rasterio.open(ipcc_AGB_default_stdev)
-            uu.print_log("    IPCC default removal rate tile for {}".format(tile_id))
-        except:
-            uu.print_log("    No IPCC default removal rate tile for {}".format(tile_id))
+        mangrove_AGB_src = uu.open_optional_input(mangrove_AGB, tile_id)
+        mangrove_BGB_src = uu.open_optional_input(mangrove_BGB, tile_id)
+        mangrove_AGB_stdev_src = uu.open_optional_input(mangrove_AGB_stdev, tile_id)
+        europe_AGC_BGC_src = uu.open_optional_input(europe_AGC_BGC, tile_id)
+        europe_AGC_BGC_stdev_src = uu.open_optional_input(europe_AGC_BGC_stdev, tile_id)
+        plantations_AGC_BGC_src = uu.open_optional_input(plantations_AGC_BGC, tile_id)
+        plantations_AGC_BGC_stdev_src = uu.open_optional_input(plantations_AGC_BGC_stdev, tile_id)
+        us_AGC_BGC_src = uu.open_optional_input(us_AGC_BGC, tile_id)
+        us_AGC_BGC_stdev_src = uu.open_optional_input(us_AGC_BGC_stdev, tile_id)
+        young_AGC_src = uu.open_optional_input(young_AGC, tile_id)
+        young_AGC_stdev_src = uu.open_optional_input(young_AGC_stdev, tile_id)
+        age_category_src = uu.open_optional_input(age_category, tile_id)
+        ipcc_AGB_default_src = uu.open_optional_input(ipcc_AGB_default, tile_id)
+        ipcc_AGB_default_stdev_src = uu.open_optional_input(ipcc_AGB_default_stdev, tile_id)
+
+        # Each removal factor source is only used if all of its tiles exist
+        mangrove_exists = (mangrove_AGB_src is not None) & (mangrove_BGB_src is not None) & (mangrove_AGB_stdev_src is not None)
+        europe_exists = (europe_AGC_BGC_src is not None) & (europe_AGC_BGC_stdev_src is not None)
+        plantations_exists = (plantations_AGC_BGC_src is not None) & (plantations_AGC_BGC_stdev_src is not None)
+        us_exists = (us_AGC_BGC_src is not None) & (us_AGC_BGC_stdev_src is not None)
+        young_exists = (young_AGC_src is not None) & (young_AGC_stdev_src is not None)
+        ipcc_exists = (ipcc_AGB_default_src is not None) & (ipcc_AGB_default_stdev_src is not None)
 
         # Opens the output tile, giving it the arguments of the input tiles
         removal_forest_type_dst = rasterio.open(removal_forest_type, 'w', **kwargs)
@@ -167,160 +270,84 @@ def annual_gain_rate_AGC_BGC_all_forest_types(tile_id, output_pattern_list, sens
 
         uu.print_log("  Creating removal model forest type tile, AGC removal factor tile, BGC removal factor tile, and AGC removal factor standard deviation tile for {}".format(tile_id))
 
-        # Iterates across the windows (1 pixel strips) of the input tile
-        for idx, window in windows:
-
-            model_extent_window = model_extent_src.read(1, window=window)
-
-            # Output rasters' windows
-            removal_forest_type_window = np.zeros((window.height, window.width), dtype='uint8')
-            annual_gain_AGC_all_forest_types_window = np.zeros((window.height, window.width), dtype='float32')
-            annual_gain_BGC_all_forest_types_window = np.zeros((window.height, window.width), dtype='float32')
-            stdev_annual_gain_AGC_all_forest_types_window = np.zeros((window.height, window.width), dtype='float32')
-
-            try:
-                age_category_window = age_category_src.read(1, window=window)
-            except:
-                age_category_window = np.zeros((window.height, window.width), dtype='uint8')
-
-            # Lowest priority
-            try:
-                ipcc_AGB_default_rate_window = ipcc_AGB_default_src.read(1, window=window)
-                ipcc_AGB_default_stdev_window = ipcc_AGB_default_stdev_src.read(1, window=window)
-                # In no_primary_gain, the AGB_default_rate_window = 0, so primary forest pixels would not be
-                # assigned a removal forest type and therefore get exclude from the model later.
-                # That is incorrect, so using model_extent as the criterion instead allows the primary forest pixels
-                # that don't have rates under this sensitivity analysis to still be included in the model.
-                # Unfortunately, model_extent is slightly different from the IPCC rate extent (no IPCC rates where
-                # there is no ecozone information), but this is a very small difference and not worth worrying about.
-                if sensit_type == 'no_primary_gain':
-                    removal_forest_type_window = np.where(model_extent_window != 0,
-                                                          cn.old_natural_rank,
-                                                          removal_forest_type_window).astype('uint8')
-                else:
-                    removal_forest_type_window = np.where(ipcc_AGB_default_rate_window != 0,
-                                                          cn.old_natural_rank,
-                                                          removal_forest_type_window).astype('uint8')
-                annual_gain_AGC_all_forest_types_window = np.where(ipcc_AGB_default_rate_window != 0,
-                                                                   ipcc_AGB_default_rate_window * cn.biomass_to_c_non_mangrove,
-                                                                   annual_gain_AGC_all_forest_types_window).astype('float32')
-                annual_gain_BGC_all_forest_types_window = np.where(ipcc_AGB_default_rate_window != 0,
-                                                                   ipcc_AGB_default_rate_window * cn.biomass_to_c_non_mangrove * cn.below_to_above_non_mang,
-                                                                   annual_gain_BGC_all_forest_types_window).astype('float32')
-                stdev_annual_gain_AGC_all_forest_types_window = np.where(ipcc_AGB_default_stdev_window != 0,
-                                                                   ipcc_AGB_default_stdev_window * cn.biomass_to_c_non_mangrove,
-                                                                   stdev_annual_gain_AGC_all_forest_types_window).astype('float32')
-            except:
-                pass
-
-            try: # young_AGC_rate_window uses > because of the weird NaN in the tiles. If != is used, the young rate NaN overwrites the IPCC arrays
-                young_AGC_rate_window = young_AGC_src.read(1, window=window)
-                young_AGC_stdev_window = young_AGC_stdev_src.read(1, window=window)
-                # Using the > with the NaN results in non-fatal "RuntimeWarning: invalid value encountered in greater".
-                # This isn't actually a problem, so the "with" statement suppresses it, per https://stackoverflow.com/a/58026329/10839927
-                with np.errstate(invalid='ignore'):
-                    removal_forest_type_window = np.where((young_AGC_rate_window > 0) & (age_category_window == 1),
-                                                          cn.young_natural_rank,
-                                                          removal_forest_type_window).astype('uint8')
-                    annual_gain_AGC_all_forest_types_window = np.where((young_AGC_rate_window > 0) & (age_category_window == 1),
-                                                                       young_AGC_rate_window,
-                                                                       annual_gain_AGC_all_forest_types_window).astype('float32')
-                    annual_gain_BGC_all_forest_types_window = np.where((young_AGC_rate_window > 0) & (age_category_window == 1),
-                                                                       young_AGC_rate_window * cn.below_to_above_non_mang,
-                                                                       annual_gain_BGC_all_forest_types_window).astype('float32')
-                    stdev_annual_gain_AGC_all_forest_types_window = np.where((young_AGC_stdev_window > 0) & (age_category_window == 1),
-                                                                       young_AGC_stdev_window,
-                                                                       stdev_annual_gain_AGC_all_forest_types_window).astype('float32')
-
-            except:
-                pass
-
-            if sensit_type != 'US_removals':
-                try:
-                    us_AGC_BGC_rate_window = us_AGC_BGC_src.read(1, window=window)
-                    us_AGC_BGC_stdev_window = us_AGC_BGC_stdev_src.read(1, window=window)
-                    removal_forest_type_window = np.where(us_AGC_BGC_rate_window != 0, cn.US_rank, removal_forest_type_window).astype('uint8')
-                    annual_gain_AGC_all_forest_types_window = np.where(us_AGC_BGC_rate_window != 0,
-                                                                       us_AGC_BGC_rate_window / (1 + cn.below_to_above_non_mang),
-                                                                       annual_gain_AGC_all_forest_types_window).astype('float32')
-                    annual_gain_BGC_all_forest_types_window = np.where(us_AGC_BGC_rate_window != 0,
-                                                                       (us_AGC_BGC_rate_window) -
-                                                                       (us_AGC_BGC_rate_window / (1 + cn.below_to_above_non_mang)),
-                                                                       annual_gain_BGC_all_forest_types_window).astype('float32')
-                    stdev_annual_gain_AGC_all_forest_types_window = np.where(us_AGC_BGC_stdev_window != 0,
-                                                                       us_AGC_BGC_stdev_window / (1 + cn.below_to_above_non_mang),
-                                                                       stdev_annual_gain_AGC_all_forest_types_window).astype('float32')
-                except:
-                    pass
-
-            try:
-                plantations_AGC_BGC_rate_window = plantations_AGC_BGC_src.read(1, window=window)
-                plantations_AGC_BGC_stdev_window = plantations_AGC_BGC_stdev_src.read(1, window=window)
-                removal_forest_type_window = np.where(plantations_AGC_BGC_rate_window != 0, cn.planted_forest_rank, removal_forest_type_window).astype('uint8')
-                annual_gain_AGC_all_forest_types_window = np.where(plantations_AGC_BGC_rate_window != 0,
-                                                                   plantations_AGC_BGC_rate_window / (1 + cn.below_to_above_non_mang),
-                                                                   annual_gain_AGC_all_forest_types_window).astype('float32')
-                annual_gain_BGC_all_forest_types_window = np.where(plantations_AGC_BGC_rate_window != 0,
-                                                                   (plantations_AGC_BGC_rate_window ) -
-                                                                   (plantations_AGC_BGC_rate_window / (1 + cn.below_to_above_non_mang)),
-                                                                   annual_gain_BGC_all_forest_types_window).astype('float32')
-                stdev_annual_gain_AGC_all_forest_types_window = np.where(plantations_AGC_BGC_stdev_window != 0,
-                                                                   plantations_AGC_BGC_stdev_window / (1 + cn.below_to_above_non_mang),
-                                                                   stdev_annual_gain_AGC_all_forest_types_window).astype('float32')
-            except:
-                pass
-
-            try:
-                europe_AGC_BGC_rate_window = europe_AGC_BGC_src.read(1, window=window)
-                europe_AGC_BGC_stdev_window = europe_AGC_BGC_stdev_src.read(1, window=window)
-                removal_forest_type_window = np.where(europe_AGC_BGC_rate_window != 0, cn.europe_rank, removal_forest_type_window).astype('uint8')
-                annual_gain_AGC_all_forest_types_window = np.where(europe_AGC_BGC_rate_window != 0,
-                                                                   europe_AGC_BGC_rate_window / (1 + cn.below_to_above_non_mang),
-                                                                   annual_gain_AGC_all_forest_types_window).astype('float32')
-                annual_gain_BGC_all_forest_types_window = np.where(europe_AGC_BGC_rate_window != 0,
-                                                                   (europe_AGC_BGC_rate_window) -
-                                                                   (europe_AGC_BGC_rate_window / (1 + cn.below_to_above_non_mang)),
-                                                                   annual_gain_BGC_all_forest_types_window).astype('float32')
-                # NOTE: Nancy Harris thought that the European removal standard deviations were 2x too large,
-                # per email on 8/30/2020. Thus, simplest fix is to leave original tiles 2x too large and
-                # correct them only where composited with other stdev sources.
-                stdev_annual_gain_AGC_all_forest_types_window = np.where(europe_AGC_BGC_stdev_window != 0,
-                                                                   (europe_AGC_BGC_stdev_window/2) / (1 + cn.below_to_above_non_mang),
-                                                                   stdev_annual_gain_AGC_all_forest_types_window).astype('float32')
-            except:
-                pass
-
-            # Highest priority
-            try:
-                mangroves_AGB_rate_window = mangrove_AGB_src.read(1, window=window)
-                mangroves_BGB_rate_window = mangrove_BGB_src.read(1, window=window)
-                mangroves_AGB_stdev_window = mangrove_AGB_stdev_src.read(1, window=window)
-                removal_forest_type_window = np.where(mangroves_AGB_rate_window != 0, cn.mangrove_rank, removal_forest_type_window).astype('uint8')
-                annual_gain_AGC_all_forest_types_window = np.where(mangroves_AGB_rate_window != 0,
-                                                                   mangroves_AGB_rate_window * cn.biomass_to_c_mangrove,
-                                                                   annual_gain_AGC_all_forest_types_window).astype('float32')
-                annual_gain_BGC_all_forest_types_window = np.where(mangroves_BGB_rate_window != 0,
-                                                                   mangroves_BGB_rate_window * cn.biomass_to_c_mangrove,
-                                                                   annual_gain_BGC_all_forest_types_window).astype('float32')
-                stdev_annual_gain_AGC_all_forest_types_window = np.where(mangroves_AGB_stdev_window != 0,
-                                                                   mangroves_AGB_stdev_window * cn.biomass_to_c_mangrove,
-                                                                   stdev_annual_gain_AGC_all_forest_types_window).astype('float32')
-            except:
-                pass
-
-            # Masks outputs to model output extent
-            removal_forest_type_window = np.where(model_extent_window == 1, removal_forest_type_window, 0)
-            annual_gain_AGC_all_forest_types_window = np.where(model_extent_window == 1, annual_gain_AGC_all_forest_types_window, 0)
-            annual_gain_BGC_all_forest_types_window = np.where(model_extent_window == 1, annual_gain_BGC_all_forest_types_window, 0)
-            annual_gain_AGC_BGC_all_forest_types_window = annual_gain_AGC_all_forest_types_window + annual_gain_BGC_all_forest_types_window
-            stdev_annual_gain_AGC_all_forest_types_window = np.where(model_extent_window == 1, stdev_annual_gain_AGC_all_forest_types_window, 0)
+        # Running statistics of the outputs, so that they don't have to be read again to check whether they have data
+        removal_forest_type_stats = uu.new_tile_stats()
+        annual_gain_AGC_all_forest_types_stats = uu.new_tile_stats()
+        annual_gain_BGC_all_forest_types_stats = uu.new_tile_stats()
+        annual_gain_AGC_BGC_all_forest_types_stats = uu.new_tile_stats()
+        stdev_annual_gain_AGC_all_forest_types_stats = uu.new_tile_stats()
+
+        # Input and output windows are read and calculated in the same buffers for every window
+        window_buffers = uu.new_window_buffers()
+        window_writer = uu.new_window_writer()
+
+        # Inputs whose windows are read ahead of the window being calculated. Only the inputs that are used are read.
+        input_srcs = [model_extent_src, age_category_src]
+        if ipcc_exists:
+            input_srcs.extend([ipcc_AGB_default_src, ipcc_AGB_default_stdev_src])
+        if young_exists:
+            input_srcs.extend([young_AGC_src, young_AGC_stdev_src])
+        if us_exists and sensit_type != 'US_removals':
+            input_srcs.extend([us_AGC_BGC_src, us_AGC_BGC_stdev_src])
+        if plantations_exists:
+            input_srcs.extend([plantations_AGC_BGC_src, plantations_AGC_BGC_stdev_src])
+        if europe_exists:
+            input_srcs.extend([europe_AGC_BGC_src, europe_AGC_BGC_stdev_src])
+        if mangrove_exists:
+            input_srcs.extend([mangrove_AGB_src, mangrove_BGB_src, mangrove_AGB_stdev_src])
+
+        # Windows without any pixels in the model extent are left as nodata in the outputs
+        windows = ((idx, window) for idx, window in windows if uu.window_has_data(model_extent_row_counts, window))
+
+        # Iterates across the windows (1 pixel strips) of the input tile while the next windows' inputs are read
+        for idx, window in uu.prefetch_windows(windows, input_srcs, window_buffers):
+
+            model_extent_window = uu.read_window(model_extent_src, window, window_buffers)
+
+            age_category_window = uu.read_window(age_category_src, window, window_buffers)
+
+            # Windows of the removal factor sources that are used
+            source_windows = {}
+            if ipcc_exists:
+                source_windows['ipcc_windows'] = (uu.read_window(ipcc_AGB_default_src, window, window_buffers),
+                                                  uu.read_window(ipcc_AGB_default_stdev_src, window, window_buffers))
+            if young_exists:
+                source_windows['young_windows'] = (uu.read_window(young_AGC_src, window, window_buffers),
+                                                   uu.read_window(young_AGC_stdev_src, window, window_buffers))
+            if us_exists and sensit_type != 'US_removals':
+                source_windows['us_windows'] = (uu.read_window(us_AGC_BGC_src, window, window_buffers),
+                                                uu.read_window(us_AGC_BGC_stdev_src, window, window_buffers))
+            if plantations_exists:
+                source_windows['plantations_windows'] = (uu.read_window(plantations_AGC_BGC_src, window, window_buffers),
+                                                         uu.read_window(plantations_AGC_BGC_stdev_src, window, window_buffers))
+            if europe_exists:
+                source_windows['europe_windows'] = (uu.read_window(europe_AGC_BGC_src, window, window_buffers),
+                                                    uu.read_window(europe_AGC_BGC_stdev_src, window, window_buffers))
+            if mangrove_exists:
+                source_windows['mangrove_windows'] = (uu.read_window(mangrove_AGB_src, window, window_buffers),
+                                                      uu.read_window(mangrove_BGB_src, window, window_buffers),
+                                                      uu.read_window(mangrove_AGB_stdev_src, window, window_buffers))
+
+            removal_forest_type_window, annual_gain_AGC_all_forest_types_window, annual_gain_BGC_all_forest_types_window, \
+            annual_gain_AGC_BGC_all_forest_types_window, stdev_annual_gain_AGC_all_forest_types_window = \
+                calculate_removal_factors(window_buffers, window, model_extent_window, age_category_window, sensit_type,
+                                          **source_windows)
 
             # Writes the outputs window to the output files
-            removal_forest_type_dst.write_band(1, removal_forest_type_window, window=window)
-            annual_gain_AGC_all_forest_types_dst.write_band(1, annual_gain_AGC_all_forest_types_window, window=window)
-            annual_gain_BGC_all_forest_types_dst.write_band(1, annual_gain_BGC_all_forest_types_window, window=window)
-            annual_gain_AGC_BGC_all_forest_types_dst.write_band(1, annual_gain_AGC_BGC_all_forest_types_window, window=window)
-            stdev_annual_gain_AGC_all_forest_types_dst.write_band(1, stdev_annual_gain_AGC_all_forest_types_window, window=window)
+            uu.write_window_in_background(window_writer, removal_forest_type_dst, removal_forest_type_window, window, removal_forest_type_stats)
+            uu.write_window_in_background(window_writer, annual_gain_AGC_all_forest_types_dst, annual_gain_AGC_all_forest_types_window, window, annual_gain_AGC_all_forest_types_stats)
+            uu.write_window_in_background(window_writer, annual_gain_BGC_all_forest_types_dst, annual_gain_BGC_all_forest_types_window, window, annual_gain_BGC_all_forest_types_stats)
+            uu.write_window_in_background(window_writer, annual_gain_AGC_BGC_all_forest_types_dst, annual_gain_AGC_BGC_all_forest_types_window, window, annual_gain_AGC_BGC_all_forest_types_stats)
+            uu.write_window_in_background(window_writer, stdev_annual_gain_AGC_all_forest_types_dst, stdev_annual_gain_AGC_all_forest_types_window, window, stdev_annual_gain_AGC_all_forest_types_stats)
+
+        uu.finish_window_writes(window_writer)
+
+        # Closes the outputs and saves their statistics
+        uu.write_tile_stats(removal_forest_type_dst, removal_forest_type_stats)
+        uu.write_tile_stats(annual_gain_AGC_all_forest_types_dst, annual_gain_AGC_all_forest_types_stats)
+        uu.write_tile_stats(annual_gain_BGC_all_forest_types_dst, annual_gain_BGC_all_forest_types_stats)
+        uu.write_tile_stats(annual_gain_AGC_BGC_all_forest_types_dst, annual_gain_AGC_BGC_all_forest_types_stats)
+        uu.write_tile_stats(stdev_annual_gain_AGC_all_forest_types_dst, stdev_annual_gain_AGC_all_forest_types_stats)
 
     # Prints information about the tile that was just processed
     uu.end_of_fx_summary(start, tile_id, cn.pattern_removal_forest_type, no_upload)
\ No newline at end of file
@@ -10,14 +10,43 @@ import universal_util as uu
 # Necessary to suppress a pandas error later on
 np.set_printoptions(threshold=np.nan)
 
-def annual_gain_rate(tile_id, sensit_type, gain_table_dict, stdev_table_dict, output_pattern_list, no_upload):
+# Converts the forest age category decision tree output values to the three age categories--
+# 10000: primary forest; 20000: secondary forest > 20 years; 30000: secondary forest <= 20 years
+# These are five digits so they can easily be added to the four digits of the continent-ecozone code to make unique codes
+# for each continent-ecozone-age combination.
+# The key in the dictionary is the forest age category decision tree endpoints.
+age_dict = {0: 0, 1: 10000, 2: 20000, 3: 30000}
+
+
+# IPCC default aboveground and belowground removal factors and aboveground removal factor standard deviations
+# for one window of the age category and continent-ecozone tiles.
+# The lookup arrays are of age_dict and of the removal factors and standard deviations of each continent-ecozone-age code.
+def calculate_IPCC_default_rates(age_cat_window, cont_eco_window, age_lookup, gain_table_lookup, stdev_table_lookup):
+
+    # Recodes the input forest age category array with 10 different decision tree end values into the 3 actual age categories
+    age_recode = uu.reclassify(age_cat_window, age_lookup)
+
+    # Adds the age category codes to the continent-ecozone codes to create an array of unique continent-ecozone-age codes
+    cont_eco_age = cont_eco_window + age_recode
+
+    ## Aboveground removal factors
+    # Applies the dictionary of continent-ecozone-age gain rates to the continent-ecozone-age array to
+    # get annual gain rates (metric tons aboveground biomass/yr) for each pixel
+    gain_rate_AGB = uu.reclassify(cont_eco_age, gain_table_lookup, default=None)
 
-    # Converts the forest age category decision tree output values to the three age categories--
-    # 10000: primary forest; 20000: secondary forest > 20 years; 30000: secondary forest <= 20 years
-    # These are five digits so they can easily be added to the four digits of the continent-ecozone code to make unique codes
-    # for each continent-ecozone-age combination.
-    # The key in the dictionary is the forest age category decision tree endpoints.
-    age_dict = {0: 0, 1: 10000, 2: 20000, 3: 30000}
+    ## Belowground removal factors
+    # Calculates belowground annual removal rates
+    gain_rate_BGB = gain_rate_AGB * cn.below_to_above_non_mang
+
+    ## Aboveground removal factor standard deviation
+    # Applies the dictionary of continent-ecozone-age gain rate standard deviations to the continent-ecozone-age array to
+    # get annual gain rate standard deviations (metric tons aboveground biomass/yr) for each pixel
+    gain_stdev_AGB = uu.reclassify(cont_eco_age, stdev_table_lookup, default=None)
+
+    return gain_rate_AGB, gain_rate_BGB, gain_stdev_AGB
+
+
+def annual_gain_rate(tile_id, sensit_type, gain_table_dict, stdev_table_dict, output_pattern_list, no_upload):
 
     uu.print_log("Processing:", tile_id)
 
@@ -95,55 +124,28 @@ def annual_gain_rate(tile_id, sensit_type, gain_table_dict, stdev_table_dict, ou
     dst_stdev_above.update_tags(
         extent='Full model extent, even though these standard deviations will not be used over the full model extent')
 
-    # Iterates across the windows (1 pixel strips) of the input tiles
-    for idx, window in windows:
-
-        # Creates a processing window for each input raster
-        try:
-            cont_eco_window = cont_eco_src.read(1, window=window)
-        except:
-            cont_eco_window = np.zeros((window.height, window.width), dtype='uint8')
+    # Lookup arrays for the age category codes and the removal factors and standard deviations of each
+    # continent-ecozone-age code. Codes without a removal factor keep their code, as when they were replaced key by key.
+    age_lookup = uu.lookup_table(age_dict, dtype='int32')
+    gain_table_lookup = uu.lookup_table(gain_table_dict, default=None)
+    stdev_table_lookup = uu.lookup_table(stdev_table_dict, default=None)
 
-        try:
-            age_cat_window = age_cat_src.read(1, window=window)
-        except:
-            age_cat_window = np.zeros((window.height, window.width), dtype='uint8')
+    # Input windows are read into the same buffers for every window
+    window_buffers = uu.new_window_buffers()
 
-        # Recodes the input forest age category array with 10 different decision tree end values into the 3 actual age categories
-        age_recode = np.vectorize(age_dict.get)(age_cat_window)
-
-        # Adds the age category codes to the continent-ecozone codes to create an array of unique continent-ecozone-age codes
-        cont_eco_age = cont_eco_window + age_recode
+    # Iterates across the windows (1 pixel strips) of the input tiles
+    for idx, window in windows:
 
-        ## Aboveground removal factors
-        # Converts the continent-ecozone array to float so that the values can be replaced with fractional gain rates
-        gain_rate_AGB = cont_eco_age.astype('float32')
+        # Creates a processing window for each input raster. Both tiles exist, since the tile is skipped otherwise.
+        cont_eco_window = uu.read_window(cont_eco_src, window, window_buffers)
+        age_cat_window = uu.read_window(age_cat_src, window, window_buffers)
 
-        # Applies the dictionary of continent-ecozone-age gain rates to the continent-ecozone-age array to
-        # get annual gain rates (metric tons aboveground biomass/yr) for each pixel
-        for key, value in gain_table_dict.items():
-            gain_rate_AGB[gain_rate_AGB == key] = value
+        gain_rate_AGB, gain_rate_BGB, gain_stdev_AGB = calculate_IPCC_default_rates(
+            age_cat_window, cont_eco_window, age_lookup, gain_table_lookup, stdev_table_lookup)
 
-        # Writes the output window to the output file
+        # Writes the output windows to the output files
         dst_above.write_band(1, gain_rate_AGB, window=window)
-
-        ## Belowground removal factors
-        # Calculates belowground annual removal rates
-        gain_rate_BGB = gain_rate_AGB * cn.below_to_above_non_mang
-
-        # Writes the output window to the output file
         dst_below.write_band(1, gain_rate_BGB, window=window)
-
-        ## Aboveground removal factor standard deviation
-        # Converts the continent-ecozone array to float so that the values can be replaced with fractional standard deviations
-        gain_stdev_AGB = cont_eco_age.astype('float32')
-
-        # Applies the dictionary of continent-ecozone-age gain rate standard deviations to the continent-ecozone-age array to
-        # get annual gain rate standard deviations (metric tons aboveground biomass/yr) for each pixel
-        for key, value in stdev_table_dict.items():
-            gain_stdev_AGB[gain_stdev_AGB == key] = value
-
-        # Writes the output window to the output file
         dst_stdev_above.write_band(1, gain_stdev_AGB, window=window)
 
     # Prints information about the tile that was just processed
@@ -88,6 +88,12 @@ def annual_gain_rate(tile_id, sensit_type, output_pattern_list, gain_above_dict,
     dst_stdev_above.update_tags(
         extent='Simard et al. 2018, based on Giri et al. 2011 (Global Ecol. Biogeogr.) mangrove extent')
 
+    # Lookup arrays of the removal factors and standard deviations for each continent-ecozone code.
+    # Codes without a removal factor keep their code, as when they were replaced key by key.
+    gain_above_lookup = uu.lookup_table(gain_above_dict, default=None)
+    gain_below_lookup = uu.lookup_table(gain_below_dict, default=None)
+    stdev_lookup = uu.lookup_table(stdev_dict, default=None)
+
     # Iterates across the windows (1 pixel strips) of the input tile
     for idx, window in windows:
 
@@ -95,14 +101,6 @@ def annual_gain_rate(tile_id, sensit_type, output_pattern_list, gain_above_dict,
         cont_eco = cont_eco_src.read(1, window=window)
         mangrove_AGB = mangrove_AGB_src.read(1, window=window)
 
-        # Converts the continent-ecozone array to float so that the values can be replaced with fractional gain rates.
-        # Creates two copies: one for aboveground gain and one for belowground gain.
-        # Creating only one copy of the cont_eco raster made it so that belowground gain rates weren't being
-        # written correctly for some reason.
-        cont_eco_above = cont_eco.astype('float32')
-        cont_eco_below = cont_eco.astype('float32')
-        cont_eco_stdev = cont_eco.astype('float32')
-
         # Reclassifies mangrove biomass to 1 or 0 to make a mask of mangrove pixels.
         # Ultimately, only these pixels (ones with mangrove biomass) will get values.
         mangrove_AGB[mangrove_AGB > 0] = 1
@@ -110,8 +108,7 @@ def annual_gain_rate(tile_id, sensit_type, output_pattern_list, gain_above_dict,
 
         # Applies the dictionary of continent-ecozone aboveground gain rates to the continent-ecozone array to
         # get annual aboveground gain rates (metric tons aboveground biomass/yr) for each pixel
-        for key, value in gain_above_dict.items():
-            cont_eco_above[cont_eco_above == key] = value
+        cont_eco_above = uu.reclassify(cont_eco, gain_above_lookup, default=None)
 
         # Masks out pixels without mangroves, leaving gain rates in only pixels with mangroves
         dst_above_data = cont_eco_above * mangrove_AGB
@@ -121,8 +118,7 @@ def annual_gain_rate(tile_id, sensit_type, output_pattern_list, gain_above_dict,
 
 
         # Same as above but for belowground gain rates
-        for key, value in gain_below_dict.items():
-            cont_eco_below[cont_eco_below == key] = value
+        cont_eco_below = uu.reclassify(cont_eco, gain_below_lookup, default=None)
 
         dst_below_data = cont_eco_below * mangrove_AGB
 
@@ -131,8 +127,7 @@ def annual_gain_rate(tile_id, sensit_type, output_pattern_list, gain_above_dict,
 
         # Applies the dictionary of continent-ecozone aboveground gain rate standard deviations to the continent-ecozone array to
         # get annual aboveground gain rate standard deviations (metric tons aboveground biomass/yr) for each pixel
-        for key, value in stdev_dict.items():
-            cont_eco_stdev[cont_eco_stdev == key] = value
+        cont_eco_stdev = uu.reclassify(cont_eco, stdev_lookup, default=None)
 
         # Masks out pixels without mangroves, leaving gain rates in only pixels with mangroves
         dst_stdev = cont_eco_stdev * mangrove_AGB
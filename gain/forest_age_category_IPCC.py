@@ -1,5 +1,4 @@
 import datetime
-import numpy as np
 import os
 import rasterio
 import logging
@@ -7,25 +6,116 @@ import sys
 sys.path.append('../')
 import constants_and_names as cn
 import universal_util as uu
+from functools import partial
 
-def forest_age_category(tile_id, gain_table_dict, pattern, sensit_type, no_upload):
+# Decision tree for assigning age categories, for every model version except the legal_Amazon_loss sensitivity analysis.
+# Code 1 = young (<20 years) secondary forest, code 2 = old (>20 year) secondary forest, code 3 = primary forest.
+# It's evaluated for every combination of the conditions once per tile to make the lookup array for classify_conditions.
+# old_biomass and young_biomass are whether the biomass is above or at most 20 years of secondary forest growth.
+# Neither is true for pixels without a biomass value (NaN), so loss-only pixels without biomass stay 0.
+def age_category(tropics, in_model_extent, no_gain, gain, loss, ifl_primary, old_biomass, young_biomass):
 
-    uu.print_log("Assigning forest age categories:", tile_id)
+    # model_extent ensures that there is both biomass and tree cover in 2000 OR mangroves OR tree cover gain
+    # WITHOUT pre-2000 plantations
+    if not in_model_extent:
+        return 0
 
-    # Start time
-    start = datetime.datetime.now()
+    if no_gain:
+
+        # No change pixels- no loss or gain
+        if not loss:
+            if tropics == 1 and ifl_primary:
+                return 3
+            return 2
+
+        # Loss-only pixels
+        if ifl_primary:
+            return 3
+        if old_biomass:
+            return 2
+        if young_biomass:
+            return 1
+        return 0
+
+    # Gain-only pixels and pixels with loss and gain (loss in any year).
+    # If there is gain, the pixel doesn't need biomass or canopy cover. It just needs to be outside of plantations and mangroves.
+    # The role of model_extent here is to exclude the pre-2000 plantations.
+    if gain:
+        return 1
+
+    return 0
+
+
+# Decision tree for assigning age categories in the legal_Amazon_loss sensitivity analysis, which has its own rules about age assignment
+def legal_Amazon_age_category(in_PRODES_extent, loss, gain):
+
+    if not in_PRODES_extent:
+        return 0
+
+    # Non-loss pixels (could have gain or not. Assuming that if within PRODES extent in 2000, there can't be
+    # gain, so it's a faulty detection. Thus, gain-only pixels are ignored and become part of no change.)
+    if not loss:
+        return 3  # primary forest
+
+    # Loss-and-gain pixels
+    if gain:
+        return 2  # young secondary forest
+
+    # Loss-only pixels
+    return 3  # primary forest
 
-    # Gets the bounding coordinates of each tile. Needed to determine if the tile is in the tropics (within 30 deg of the equator)
-    xmin, ymin, xmax, ymax = uu.coords(tile_id)
 
-    # Default value is that the tile is not in the tropics
-    tropics = 0
+# Whether a tile is in the tropics (within 30 deg of the equator): 1 if it is, 0 if it isn't
+def tile_in_tropics(tile_id):
+
+    # Gets the bounding coordinates of the tile
+    xmin, ymin, xmax, ymax = uu.coords(tile_id)
 
     # Criteria for assigning a tile to the tropics
     if (ymax > -30) & (ymax <= 30) :
+        return 1
+
+    return 0
+
+
+# Lookup array of the age category for every combination of the conditions of the decision tree for the model run
+def age_category_lookup(tropics, sensit_type):
+
+    if sensit_type != 'legal_Amazon_loss':
+        return uu.decision_tree_table(partial(age_category, tropics), 7)
+
+    return uu.decision_tree_table(legal_Amazon_age_category, 3)
+
+
+# Age category for one window of the input tiles, with the whole decision tree (see age_category and
+# legal_Amazon_age_category) applied to each pixel in one lookup. The conditions are evaluated once each.
+# gain_table_lookup has the <=20 year secondary forest growth rate of each continent-ecozone code.
+def calculate_age_category(model_extent_window, loss_window, gain_window, ifl_primary_window, biomass_window,
+                           cont_eco_window, gain_table_lookup, age_category_table, sensit_type):
+
+    # For legal_Amazon_loss sensitivity analysis
+    if sensit_type == 'legal_Amazon_loss':
+        return uu.classify_conditions([model_extent_window == 1, loss_window > 0, gain_window == 1], age_category_table)
+
+    # Creates a numpy array that has the <=20 year secondary forest growth rate x 20
+    # based on the continent-ecozone code of each pixel (the dictionary).
+    # This is used to assign pixels to the correct age category.
+    gain_20_years = uu.reclassify(cont_eco_window, gain_table_lookup)*20
+
+    return uu.classify_conditions([model_extent_window > 0, gain_window == 0, gain_window == 1,
+                                   loss_window > 0, ifl_primary_window == 1,
+                                   biomass_window > gain_20_years, biomass_window <= gain_20_years],
+                                  age_category_table)
+
 
-        tropics = 1
+def forest_age_category(tile_id, gain_table_dict, pattern, sensit_type, no_upload):
+
+    uu.print_log("Assigning forest age categories:", tile_id)
+
+    # Start time
+    start = datetime.datetime.now()
 
+    tropics = tile_in_tropics(tile_id)
     uu.print_log("  Tile {} in tropics:".format(tile_id), tropics)
 
     # Names of the input tiles
@@ -62,36 +152,15 @@ def forest_age_category(tile_id, gain_table_dict, pattern, sensit_type, no_uploa
         # Grabs the windows of the tile (stripes) so we can iterate over the entire tif without running out of memory
         windows = model_extent_src.block_windows(1)
 
+        # Number of pixels in the model extent in each row. Age categories are only assigned in the model extent.
+        model_extent_row_counts = uu.read_row_counts(model_extent, model_extent_src.height)
+
         # Opens the input tiles if they exist
-        try:
-            cont_eco_src = rasterio.open(cont_eco)
-            uu.print_log("   Continent-ecozone tile found for {}".format(tile_id))
-        except:
-            uu.print_log("   No continent-ecozone tile found for {}".format(tile_id))
-
-        try:
-            gain_src = rasterio.open(gain)
-            uu.print_log("   Gain tile found for {}".format(tile_id))
-        except:
-            uu.print_log("   No gain tile found for {}".format(tile_id))
-
-        try:
-            biomass_src = rasterio.open(biomass)
-            uu.print_log("   Biomass tile found for {}".format(tile_id))
-        except:
-            uu.print_log("   No biomass tile found for {}".format(tile_id))
-
-        try:
-            loss_src = rasterio.open(loss)
-            uu.print_log("   Loss tile found for {}".format(tile_id))
-        except:
-            uu.print_log("   No loss tile found for {}".format(tile_id))
-
-        try:
-            ifl_primary_src = rasterio.open(ifl_primary)
-            uu.print_log("   IFL-primary forest tile found for {}".format(tile_id))
-        except:
-            uu.print_log("   No IFL-primary forest tile found for {}".format(tile_id))
+        cont_eco_src = uu.open_optional_input(cont_eco, tile_id)
+        gain_src = uu.open_optional_input(gain, tile_id)
+        biomass_src = uu.open_optional_input(biomass, tile_id)
+        loss_src = uu.open_optional_input(loss, tile_id)
+        ifl_primary_src = uu.open_optional_input(ifl_primary, tile_id)
 
         # Updates kwargs for the output dataset
         kwargs.update(
@@ -116,93 +185,35 @@ def forest_age_category(tile_id, gain_table_dict, pattern, sensit_type, no_uploa
 
         uu.print_log("    Assigning IPCC age categories for", tile_id)
 
-        # Iterates across the windows (1 pixel strips) of the input tile
-        for idx, window in windows:
-
-            # Creates windows for each input raster. Only model_extent_src is guaranteed to exist
-            model_extent_window = model_extent_src.read(1, window=window)
-
-            try:
-                loss_window = loss_src.read(1, window=window)
-            except:
-                loss_window = np.zeros((window.height, window.width), dtype='uint8')
-
-            try:
-                gain_window = gain_src.read(1, window=window)
-            except:
-                gain_window = np.zeros((window.height, window.width), dtype='uint8')
-
-            try:
-                cont_eco_window = cont_eco_src.read(1, window=window)
-            except:
-                cont_eco_window = np.zeros((window.height, window.width), dtype='uint8')
-
-            try:
-                biomass_window = biomass_src.read(1, window=window)
-            except:
-                biomass_window = np.zeros((window.height, window.width), dtype='float32')
-
-            try:
-                ifl_primary_window = ifl_primary_src.read(1, window=window)
-            except:
-                ifl_primary_window = np.zeros((window.height, window.width), dtype='uint8')
+        # Lookup array of the <=20 year secondary forest growth rate for each continent-ecozone code
+        gain_table_lookup = uu.lookup_table(gain_table_dict, dtype='float64')
 
-            # Creates a numpy array that has the <=20 year secondary forest growth rate x 20
-            # based on the continent-ecozone code of each pixel (the dictionary).
-            # This is used to assign pixels to the correct age category.
-            gain_20_years = np.vectorize(gain_table_dict.get)(cont_eco_window)*20
+        # Lookup array of the age category for every combination of the decision tree's conditions
+        age_category_table = age_category_lookup(tropics, sensit_type)
 
-            # Create a 0s array for the output
-            dst_data = np.zeros((window.height, window.width), dtype='uint8')
+        # Input windows are read into the same buffers for every window
+        window_buffers = uu.new_window_buffers()
 
-            # Logic tree for assigning age categories begins here
-            # Code 1 = young (<20 years) secondary forest, code 2 = old (>20 year) secondary forest, code 3 = primary forest
-            # model_extent_window ensures that there is both biomass and tree cover in 2000 OR mangroves OR tree cover gain
-            # WITHOUT pre-2000 plantations
-
-            # For every model version except legal_Amazon_loss sensitivity analysis, which has its own rules about age assignment
-
-            if sensit_type != 'legal_Amazon_loss':
-                # No change pixels- no loss or gain
-                if tropics == 0:
-
-                    dst_data[np.where((model_extent_window > 0) & (gain_window == 0) & (loss_window == 0))] = 2
-
-                if tropics == 1:
-
-                    dst_data[np.where((model_extent_window > 0) & (gain_window == 0) & (loss_window == 0) & (ifl_primary_window != 1))] = 2
-                    dst_data[np.where((model_extent_window > 0) & (gain_window == 0) & (loss_window == 0) & (ifl_primary_window == 1))] = 3
-
-                # Loss-only pixels
-                dst_data[np.where((model_extent_window > 0) & (gain_window == 0) & (loss_window > 0) & (ifl_primary_window != 1) & (biomass_window <= gain_20_years))] = 1
-                dst_data[np.where((model_extent_window > 0) & (gain_window == 0) & (loss_window > 0) & (ifl_primary_window != 1) & (biomass_window > gain_20_years))] = 2
-                dst_data[np.where((model_extent_window > 0) & (gain_window == 0) & (loss_window > 0) & (ifl_primary_window ==1))] = 3
-
-                # Gain-only pixels
-                # If there is gain, the pixel doesn't need biomass or canopy cover. It just needs to be outside of plantations and mangroves.
-                # The role of model_extent_window here is to exclude the pre-2000 plantations.
-                dst_data[np.where((model_extent_window > 0) & (gain_window == 1) & (loss_window == 0))] = 1
-
-                # Pixels with loss and gain
-                # If there is gain with loss, the pixel doesn't need biomass or canopy cover. It just needs to be outside of plantations and mangroves.
-                # The role of model_extent_window here is to exclude the pre-2000 plantations.
-                dst_data[np.where((model_extent_window > 0) & (gain_window == 1) & (loss_window > (cn.gain_years)))] = 1
-                dst_data[np.where((model_extent_window > 0) & (gain_window == 1) & (loss_window > 0) & (loss_window <= (cn.gain_years/2)))] = 1
-                dst_data[np.where((model_extent_window > 0) & (gain_window == 1) & (loss_window > (cn.gain_years/2)) & (loss_window <= cn.gain_years))] = 1
-
-            # For legal_Amazon_loss sensitivity analysis
-            else:
-
-                # Non-loss pixels (could have gain or not. Assuming that if within PRODES extent in 2000, there can't be
-                # gain, so it's a faulty detection. Thus, gain-only pixels are ignored and become part of no change.)
-                dst_data[np.where((model_extent_window == 1) & (loss_window == 0))] = 3  # primary forest
-
-                # Loss-only pixels
-                dst_data[np.where((model_extent_window == 1) & (loss_window > 0) & (gain_window == 0))] = 3  # primary forest
-
-                # Loss-and-gain pixels
-                dst_data[np.where((model_extent_window == 1) & (loss_window > 0) & (gain_window == 1))] = 2  # young secondary forest
+        # Iterates across the windows (1 pixel strips) of the input tile
+        for idx, window in windows:
 
+            # Windows without any pixels in the model extent are left as nodata in the output
+            if not uu.window_has_data(model_extent_row_counts, window):
+                continue
+
+            # Creates windows for each input raster. Only model_extent_src is guaranteed to exist.
+            # Windows of tiles that don't exist are a shared array of 0s.
+            model_extent_window = uu.read_window(model_extent_src, window, window_buffers)
+            loss_window = uu.read_window(loss_src, window, window_buffers)
+            gain_window = uu.read_window(gain_src, window, window_buffers)
+            cont_eco_window = uu.read_window(cont_eco_src, window, window_buffers)
+            biomass_window = uu.read_window(biomass_src, window, window_buffers, 'float32')
+            ifl_primary_window = uu.read_window(ifl_primary_src, window, window_buffers)
+
+            # Logic tree for assigning age categories
+            dst_data = calculate_age_category(model_extent_window, loss_window, gain_window, ifl_primary_window,
+                                              biomass_window, cont_eco_window, gain_table_lookup, age_category_table,
+                                              sensit_type)
 
             # Writes the output window to the output
             dst.write_band(1, dst_data, window=window)
@@ -7,6 +7,20 @@ import constants_and_names as cn
 import universal_util as uu
 
 # Calculates cumulative aboveground carbon dioxide gain in mangroves
+# Aboveground, belowground and above+belowground gross removals for one window of the removal factor and gain year count tiles
+def calculate_gross_removals(gain_rate_AGC_window, gain_rate_BGC_window, gain_year_count_window):
+
+    # Converts the annual removal rate into gross removals
+    cumulative_gain_AGCO2_window = uu.evaluate_expression('rate * years * c_to_co2', rate=gain_rate_AGC_window,
+                                                          years=gain_year_count_window, c_to_co2=cn.c_to_co2)
+    cumulative_gain_BGCO2_window = uu.evaluate_expression('rate * years * c_to_co2', rate=gain_rate_BGC_window,
+                                                          years=gain_year_count_window, c_to_co2=cn.c_to_co2)
+    cumulative_gain_AGCO2_BGCO2_window = uu.evaluate_expression('AGCO2 + BGCO2', AGCO2=cumulative_gain_AGCO2_window,
+                                                                BGCO2=cumulative_gain_BGCO2_window)
+
+    return cumulative_gain_AGCO2_window, cumulative_gain_BGCO2_window, cumulative_gain_AGCO2_BGCO2_window
+
+
 def gross_removals_all_forest_types(tile_id, output_pattern_list, sensit_type, no_upload):
 
     uu.print_log("Calculating cumulative CO2 removals:", tile_id)
@@ -51,6 +65,9 @@ def gross_removals_all_forest_types(tile_id, output_pattern_list, sensit_type, n
     # Grabs the windows of the tile (stripes) to iterate over the entire tif without running out of memory
     windows = gain_rate_AGC_src.block_windows(1)
 
+    # Number of pixels in the model extent in each row. Gain years, and thus gross removals, are only in the model extent.
+    model_extent_row_counts = uu.model_extent_row_counts(tile_id, sensit_type, gain_rate_AGC_src.height)
+
     # Updates kwargs for the output dataset.
     kwargs.update(
         driver='GTiff',
@@ -86,23 +103,35 @@ def gross_removals_all_forest_types(tile_id, output_pattern_list, sensit_type, n
     cumulative_gain_AGCO2_BGCO2_dst.update_tags(
         extent='Full model extent')
 
+    # Running statistics of the outputs, so that they don't have to be read again to check whether they have data
+    cumulative_gain_AGCO2_stats = uu.new_tile_stats()
+    cumulative_gain_BGCO2_stats = uu.new_tile_stats()
+    cumulative_gain_AGCO2_BGCO2_stats = uu.new_tile_stats()
+
     # Iterates across the windows (1 pixel strips) of the input tiles
     for idx, window in windows:
 
+        # Windows without any pixels in the model extent are left as nodata in the outputs
+        if not uu.window_has_data(model_extent_row_counts, window):
+            continue
+
         # Creates a processing window for each input raster
         gain_rate_AGC_window = gain_rate_AGC_src.read(1, window=window)
         gain_rate_BGC_window = gain_rate_BGC_src.read(1, window=window)
         gain_year_count_window = gain_year_count_src.read(1, window=window)
 
-        # Converts the annual removal rate into gross removals
-        cumulative_gain_AGCO2_window = gain_rate_AGC_window * gain_year_count_window * cn.c_to_co2
-        cumulative_gain_BGCO2_window = gain_rate_BGC_window * gain_year_count_window * cn.c_to_co2
-        cumulative_gain_AGCO2_BGCO2_window = cumulative_gain_AGCO2_window + cumulative_gain_BGCO2_window
+        cumulative_gain_AGCO2_window, cumulative_gain_BGCO2_window, cumulative_gain_AGCO2_BGCO2_window = \
+            calculate_gross_removals(gain_rate_AGC_window, gain_rate_BGC_window, gain_year_count_window)
 
         # Writes the output windows to the output files
-        cumulative_gain_AGCO2_dst.write_band(1, cumulative_gain_AGCO2_window, window=window)
-        cumulative_gain_BGCO2_dst.write_band(1, cumulative_gain_BGCO2_window, window=window)
-        cumulative_gain_AGCO2_BGCO2_dst.write_band(1, cumulative_gain_AGCO2_BGCO2_window, window=window)
+        uu.write_window_with_stats(cumulative_gain_AGCO2_dst, cumulative_gain_AGCO2_window, window, cumulative_gain_AGCO2_stats)
+        uu.write_window_with_stats(cumulative_gain_BGCO2_dst, cumulative_gain_BGCO2_window, window, cumulative_gain_BGCO2_stats)
+        uu.write_window_with_stats(cumulative_gain_AGCO2_BGCO2_dst, cumulative_gain_AGCO2_BGCO2_window, window, cumulative_gain_AGCO2_BGCO2_stats)
+
+    # Closes the outputs and saves their statistics
+    uu.write_tile_stats(cumulative_gain_AGCO2_dst, cumulative_gain_AGCO2_stats)
+    uu.write_tile_stats(cumulative_gain_BGCO2_dst, cumulative_gain_BGCO2_stats)
+    uu.write_tile_stats(cumulative_gain_AGCO2_BGCO2_dst, cumulative_gain_AGCO2_BGCO2_stats)
 
 
     # Prints information about the tile that was just processed
@@ -10,7 +10,6 @@ The different removal rate inputs are in different units but all are standardize
 '''
 
 
-import multiprocessing
 from functools import partial
 import pandas as pd
 import datetime
@@ -24,7 +23,7 @@ import universal_util as uu
 sys.path.append(os.path.join(cn.docker_app,'gain'))
 import annual_gain_rate_AGC_BGC_all_forest_types
 
-def mp_annual_gain_rate_AGC_BGC_all_forest_types(sensit_type, tile_id_list, run_date = None, no_upload = None):
+def mp_annual_gain_rate_AGC_BGC_all_forest_types(sensit_type, tile_id_list, run_date = None, no_upload = None, streaming = None):
 
     os.chdir(cn.docker_base_dir)
 
@@ -67,8 +66,9 @@ def mp_annual_gain_rate_AGC_BGC_all_forest_types(sensit_type, tile_id_list, run_
                            cn.pattern_annual_gain_AGC_BGC_all_types, cn.pattern_stdev_annual_gain_AGC_all_types]
 
 
-    # Downloads input files or entire directories, depending on how many tiles are in the tile_id_list, if AWS credentials are found
-    if uu.check_aws_creds():
+    # Downloads input files or entire directories, depending on how many tiles are in the tile_id_list, if AWS credentials are found.
+    # In streaming mode, each tile's inputs are downloaded just before it is processed instead.
+    if uu.check_aws_creds() and not streaming:
 
         for key, values in download_dict.items():
             dir = key
@@ -88,44 +88,31 @@ def mp_annual_gain_rate_AGC_BGC_all_forest_types(sensit_type, tile_id_list, run_
         output_dir_list = uu.replace_output_dir_date(output_dir_list, run_date)
 
 
+    # In streaming mode, inputs are downloaded, tiles processed, empty outputs deleted and outputs uploaded tile by tile
+    if streaming:
+        uu.streaming_map(partial(annual_gain_rate_AGC_BGC_all_forest_types.annual_gain_rate_AGC_BGC_all_forest_types,
+                                 output_pattern_list=output_pattern_list, sensit_type=sensit_type, no_upload=no_upload),
+                         tile_id_list, 'annual_removals_all_forest_types', download_dict, output_dir_list, output_pattern_list,
+                         sensit_type, no_upload, check_empty=True)
+        return
+
     # This configuration of the multiprocessing call is necessary for passing multiple arguments to the main function
     # It is based on the example here: http://spencerimp.blogspot.com/2015/12/python-multiprocess-with-multiple.html
-    if cn.count == 96:
-        if sensit_type == 'biomass_swap':
-            processes = 13
-        else:
-            processes = 17  # 30 processors > 740 GB peak; 18 = >740 GB peak; 16 = 660 GB peak; 17 = >680 GB peak
-    else:
-        processes = 2
-    uu.print_log('Removal factor processors=', processes)
-    pool = multiprocessing.Pool(processes)
-    pool.map(partial(annual_gain_rate_AGC_BGC_all_forest_types.annual_gain_rate_AGC_BGC_all_forest_types,
-                     output_pattern_list=output_pattern_list, sensit_type=sensit_type, no_upload=no_upload), tile_id_list)
-    pool.close()
-    pool.join()
+    # Tiles are admitted into the pool as long as their recorded peak memory fits in the machine's memory budget
+    uu.memory_aware_map(partial(annual_gain_rate_AGC_BGC_all_forest_types.annual_gain_rate_AGC_BGC_all_forest_types,
+                                output_pattern_list=output_pattern_list, sensit_type=sensit_type, no_upload=no_upload),
+                        tile_id_list, 'annual_removals_all_forest_types')
 
     # # For single processor use
     # for tile_id in tile_id_list:
     #     annual_gain_rate_AGC_BGC_all_forest_types.annual_gain_rate_AGC_BGC_all_forest_types(tile_id, sensit_type, no_upload)
 
-    # Checks the gross removals outputs for tiles with no data
+    # Checks the removal factor outputs for tiles with no data.
+    # This uses the statistics saved while the tiles were written, so the tiles aren't read again.
     for output_pattern in output_pattern_list:
-        if cn.count <= 2:  # For local tests
-            processes = 1
-            uu.print_log("Checking for empty tiles of {0} pattern with {1} processors using light function...".format(
-                output_pattern, processes))
-            pool = multiprocessing.Pool(processes)
-            pool.map(partial(uu.check_and_delete_if_empty_light, output_pattern=output_pattern), tile_id_list)
-            pool.close()
-            pool.join()
-        else:
-            processes = 55  # 50 processors = XXX GB peak
-            uu.print_log(
-                "Checking for empty tiles of {0} pattern with {1} processors...".format(output_pattern, processes))
-            pool = multiprocessing.Pool(processes)
-            pool.map(partial(uu.check_and_delete_if_empty, output_pattern=output_pattern), tile_id_list)
-            pool.close()
-            pool.join()
+        uu.print_log("Checking for empty tiles of {} pattern...".format(output_pattern))
+        for tile_id in tile_id_list:
+            uu.check_and_delete_if_empty(tile_id, output_pattern)
 
 
     # If no_upload flag is not activated, output is uploaded
@@ -149,11 +136,14 @@ if __name__ == '__main__':
                         help='Date of run. Must be format YYYYMMDD.')
     parser.add_argument('--no-upload', '-nu', action='store_true',
                        help='Disables uploading of outputs to s3')
+    parser.add_argument('--streaming', '-st', action='store_true',
+                        help='Downloads, processes and uploads tiles one at a time instead of in whole-stage batches')
     args = parser.parse_args()
     sensit_type = args.model_type
     tile_id_list = args.tile_id_list
     run_date = args.run_date
     no_upload = args.no_upload
+    streaming = args.streaming
 
     # Disables upload to s3 if no AWS credentials are found in environment
     if not uu.check_aws_creds():
@@ -161,12 +151,14 @@ if __name__ == '__main__':
         uu.print_log("s3 credentials not found. Uploading to s3 disabled.")
 
     # Create the output log
-    uu.initiate_log(tile_id_list=tile_id_list, sensit_type=sensit_type, run_date=run_date, no_upload=no_upload)
+    uu.initiate_log(tile_id_list=tile_id_list, sensit_type=sensit_type, run_date=run_date, no_upload=no_upload,
+                    streaming=streaming)
 
     # Checks whether the sensitivity analysis and tile_id_list arguments are valid
     uu.check_sensit_type(sensit_type)
     tile_id_list = uu.tile_id_list_check(tile_id_list)
 
     mp_annual_gain_rate_AGC_BGC_all_forest_types(sensit_type=sensit_type, tile_id_list=tile_id_list,
-                                                 run_date=run_date, no_upload=no_upload)
+                                                 run_date=run_date, no_upload=no_upload,
+                                                 streaming=streaming)
 
@@ -15,7 +15,6 @@ You can think of this as the IPCC default rate that would be applied if no other
 The belowground removal rates are purely the aboveground removal rates with the above:below ratio applied to them.
 '''
 
-import multiprocessing
 from functools import partial
 import argparse
 import pandas as pd
@@ -31,61 +30,12 @@ import annual_gain_rate_IPCC_defaults
 
 os.chdir(cn.docker_base_dir)
 
-def mp_annual_gain_rate_IPCC_defaults(sensit_type, tile_id_list, run_date = None, no_upload = None):
+# Creates the dictionaries of IPCC default removal factors and removal factor standard deviations,
+# keyed by continent-ecozone-age code. Used by this script and by the fused per-tile pipeline.
+def IPCC_default_removal_dicts(sensit_type):
 
-    os.chdir(cn.docker_base_dir)
     pd.options.mode.chained_assignment = None
 
-
-    # If a full model run is specified, the correct set of tiles for the particular script is listed
-    if tile_id_list == 'all':
-        # List of tiles to run in the model
-        tile_id_list = uu.tile_list_s3(cn.model_extent_dir, sensit_type)
-
-    uu.print_log(tile_id_list)
-    uu.print_log("There are {} tiles to process".format(str(len(tile_id_list))) + "\n")
-
-
-    # Files to download for this script.
-    download_dict = {
-        cn.age_cat_IPCC_dir: [cn.pattern_age_cat_IPCC],
-        cn.cont_eco_dir: [cn.pattern_cont_eco_processed]
-    }
-
-
-    # List of output directories and output file name patterns
-    output_dir_list = [cn.annual_gain_AGB_IPCC_defaults_dir, cn.annual_gain_BGB_IPCC_defaults_dir, cn.stdev_annual_gain_AGB_IPCC_defaults_dir]
-    output_pattern_list = [cn.pattern_annual_gain_AGB_IPCC_defaults, cn.pattern_annual_gain_BGB_IPCC_defaults, cn.pattern_stdev_annual_gain_AGB_IPCC_defaults]
-
-
-    # If the model run isn't the standard one, the output directory and file names are changed
-    if sensit_type != 'std':
-        uu.print_log("Changing output directory and file name pattern based on sensitivity analysis")
-        output_dir_list = uu.alter_dirs(sensit_type, output_dir_list)
-        output_pattern_list = uu.alter_patterns(sensit_type, output_pattern_list)
-
-    # A date can optionally be provided by the full model script or a run of this script.
-    # This replaces the date in constants_and_names.
-    if run_date is not None:
-        output_dir_list = uu.replace_output_dir_date(output_dir_list, run_date)
-
-
-    # Downloads input files or entire directories, depending on how many tiles are in the tile_id_list, if AWS credentials are found
-    if uu.check_aws_creds():
-
-        for key, values in download_dict.items():
-            dir = key
-            pattern = values[0]
-            uu.s3_flexible_download(dir, pattern, cn.docker_base_dir, sensit_type, tile_id_list)
-
-
-    if uu.check_aws_creds():
-
-        # Table with IPCC Table 4.9 default gain rates
-        cmd = ['aws', 's3', 'cp', os.path.join(cn.gain_spreadsheet_dir, cn.gain_spreadsheet), cn.docker_base_dir]
-        uu.log_subprocess_output_full(cmd)
-
-
     ### To make the removal factor dictionaries
 
     # Special removal rate table for no_primary_gain sensitivity analysis: primary forests and IFLs have removal rate of 0
@@ -196,23 +146,85 @@ def mp_annual_gain_rate_IPCC_defaults(sensit_type, tile_id_list, run_date = None
     # Converts all the keys (continent-ecozone-age codes) to float type
     stdev_table_dict = {float(key): value for key, value in stdev_table_dict.items()}
 
+    return gain_table_dict, stdev_table_dict
+
+
+def mp_annual_gain_rate_IPCC_defaults(sensit_type, tile_id_list, run_date = None, no_upload = None, streaming = None):
+
+    os.chdir(cn.docker_base_dir)
+    pd.options.mode.chained_assignment = None
+
+
+    # If a full model run is specified, the correct set of tiles for the particular script is listed
+    if tile_id_list == 'all':
+        # List of tiles to run in the model
+        tile_id_list = uu.tile_list_s3(cn.model_extent_dir, sensit_type)
+
+    uu.print_log(tile_id_list)
+    uu.print_log("There are {} tiles to process".format(str(len(tile_id_list))) + "\n")
+
+
+    # Files to download for this script.
+    download_dict = {
+        cn.age_cat_IPCC_dir: [cn.pattern_age_cat_IPCC],
+        cn.cont_eco_dir: [cn.pattern_cont_eco_processed]
+    }
+
+
+    # List of output directories and output file name patterns
+    output_dir_list = [cn.annual_gain_AGB_IPCC_defaults_dir, cn.annual_gain_BGB_IPCC_defaults_dir, cn.stdev_annual_gain_AGB_IPCC_defaults_dir]
+    output_pattern_list = [cn.pattern_annual_gain_AGB_IPCC_defaults, cn.pattern_annual_gain_BGB_IPCC_defaults, cn.pattern_stdev_annual_gain_AGB_IPCC_defaults]
+
+
+    # If the model run isn't the standard one, the output directory and file names are changed
+    if sensit_type != 'std':
+        uu.print_log("Changing output directory and file name pattern based on sensitivity analysis")
+        output_dir_list = uu.alter_dirs(sensit_type, output_dir_list)
+        output_pattern_list = uu.alter_patterns(sensit_type, output_pattern_list)
+
+    # A date can optionally be provided by the full model script or a run of this script.
+    # This replaces the date in constants_and_names.
+    if run_date is not None:
+        output_dir_list = uu.replace_output_dir_date(output_dir_list, run_date)
+
+
+    # Downloads input files or entire directories, depending on how many tiles are in the tile_id_list, if AWS credentials are found.
+    # In streaming mode, each tile's inputs are downloaded just before it is processed instead.
+    if uu.check_aws_creds() and not streaming:
+
+        for key, values in download_dict.items():
+            dir = key
+            pattern = values[0]
+            uu.s3_flexible_download(dir, pattern, cn.docker_base_dir, sensit_type, tile_id_list)
+
+
+    if uu.check_aws_creds():
+
+        # Table with IPCC Table 4.9 default gain rates
+        cmd = ['aws', 's3', 'cp', os.path.join(cn.gain_spreadsheet_dir, cn.gain_spreadsheet), cn.docker_base_dir]
+        uu.log_subprocess_output_full(cmd)
+
+
+    # Dictionaries of IPCC default removal factors and standard deviations by continent-ecozone-age code
+    gain_table_dict, stdev_table_dict = IPCC_default_removal_dicts(sensit_type)
+
+
+    # In streaming mode, inputs are downloaded, tiles processed and outputs uploaded tile by tile
+    if streaming:
+        uu.streaming_map(partial(annual_gain_rate_IPCC_defaults.annual_gain_rate, sensit_type=sensit_type,
+                                 gain_table_dict=gain_table_dict, stdev_table_dict=stdev_table_dict,
+                                 output_pattern_list=output_pattern_list, no_upload=no_upload),
+                         tile_id_list, 'annual_removals_IPCC', download_dict, output_dir_list, output_pattern_list,
+                         sensit_type, no_upload)
+        return
 
     # This configuration of the multiprocessing call is necessary for passing multiple arguments to the main function
     # It is based on the example here: http://spencerimp.blogspot.com/2015/12/python-multiprocess-with-multiple.html
-    if cn.count == 96:
-        if sensit_type == 'biomass_swap':
-            processes = 24 # 24 processors = 590 GB peak
-        else:
-            processes = 30  # 30 processors = 725 GB peak
-    else:
-        processes = 2
-    uu.print_log('Annual gain rate natural forest max processors=', processes)
-    pool = multiprocessing.Pool(processes)
-    pool.map(partial(annual_gain_rate_IPCC_defaults.annual_gain_rate, sensit_type=sensit_type,
-                     gain_table_dict=gain_table_dict, stdev_table_dict=stdev_table_dict,
-                     output_pattern_list=output_pattern_list, no_upload=no_upload), tile_id_list)
-    pool.close()
-    pool.join()
+    # Tiles are admitted into the pool as long as their recorded peak memory fits in the machine's memory budget
+    uu.memory_aware_map(partial(annual_gain_rate_IPCC_defaults.annual_gain_rate, sensit_type=sensit_type,
+                                gain_table_dict=gain_table_dict, stdev_table_dict=stdev_table_dict,
+                                output_pattern_list=output_pattern_list, no_upload=no_upload),
+                        tile_id_list, 'annual_removals_IPCC')
 
     # # For single processor use
     # for tile_id in tile_id_list:
@@ -242,11 +254,14 @@ if __name__ == '__main__':
                         help='Date of run. Must be format YYYYMMDD.')
     parser.add_argument('--no-upload', '-nu', action='store_true',
                        help='Disables uploading of outputs to s3')
+    parser.add_argument('--streaming', '-st', action='store_true',
+                        help='Downloads, processes and uploads tiles one at a time instead of in whole-stage batches')
     args = parser.parse_args()
     sensit_type = args.model_type
     tile_id_list = args.tile_id_list
     run_date = args.run_date
     no_upload = args.no_upload
+    streaming = args.streaming
 
     # Disables upload to s3 if no AWS credentials are found in environment
     if not uu.check_aws_creds():
@@ -254,10 +269,12 @@ if __name__ == '__main__':
         uu.print_log("s3 credentials not found. Uploading to s3 disabled.")
 
     # Create the output log
-    uu.initiate_log(tile_id_list=tile_id_list, sensit_type=sensit_type, run_date=run_date, no_upload=no_upload)
+    uu.initiate_log(tile_id_list=tile_id_list, sensit_type=sensit_type, run_date=run_date, no_upload=no_upload,
+                    streaming=streaming)
 
     # Checks whether the sensitivity analysis and tile_id_list arguments are valid
     uu.check_sensit_type(sensit_type)
     tile_id_list = uu.tile_id_list_check(tile_id_list)
 
-    mp_annual_gain_rate_IPCC_defaults(sensit_type=sensit_type, tile_id_list=tile_id_list, run_date=run_date, no_upload=no_upload)
\ No newline at end of file
+    mp_annual_gain_rate_IPCC_defaults(sensit_type=sensit_type, tile_id_list=tile_id_list, run_date=run_date, no_upload=no_upload,
+                                      streaming=streaming)
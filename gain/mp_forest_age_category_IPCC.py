@@ -12,7 +12,6 @@ You can think of the output from this script as being the age category if IPCC T
 '''
 
 
-import multiprocessing
 from functools import partial
 import pandas as pd
 import datetime
@@ -26,7 +25,7 @@ import universal_util as uu
 sys.path.append(os.path.join(cn.docker_app,'gain'))
 import forest_age_category_IPCC
 
-def mp_forest_age_category_IPCC(sensit_type, tile_id_list, run_date = None, no_upload = None):
+def mp_forest_age_category_IPCC(sensit_type, tile_id_list, run_date = None, no_upload = None, streaming = None):
 
     os.chdir(cn.docker_base_dir)
 
@@ -67,8 +66,9 @@ def mp_forest_age_category_IPCC(sensit_type, tile_id_list, run_date = None, no_u
     output_pattern_list = [cn.pattern_age_cat_IPCC]
 
 
-    # Downloads input files or entire directories, depending on how many tiles are in the tile_id_list, if AWS credentials are found
-    if uu.check_aws_creds():
+    # Downloads input files or entire directories, depending on how many tiles are in the tile_id_list, if AWS credentials are found.
+    # In streaming mode, each tile's inputs are downloaded just before it is processed instead.
+    if uu.check_aws_creds() and not streaming:
 
         for key, values in download_dict.items():
             dir = key
@@ -111,23 +111,20 @@ def mp_forest_age_category_IPCC(sensit_type, tile_id_list, run_date = None, no_u
     # Creates a single filename pattern to pass to the multiprocessor call
     pattern = output_pattern_list[0]
 
+    # In streaming mode, inputs are downloaded, tiles processed and outputs uploaded tile by tile
+    if streaming:
+        uu.streaming_map(partial(forest_age_category_IPCC.forest_age_category, gain_table_dict=gain_table_dict,
+                                 pattern=pattern, sensit_type=sensit_type, no_upload=no_upload),
+                         tile_id_list, 'forest_age_category_IPCC', download_dict, output_dir_list, output_pattern_list,
+                         sensit_type, no_upload)
+        return
+
     # This configuration of the multiprocessing call is necessary for passing multiple arguments to the main function
     # It is based on the example here: http://spencerimp.blogspot.com/2015/12/python-multiprocess-with-multiple.html
-    # With processes=30, peak usage was about 350 GB using WHRC AGB.
-    # processes=26 maxes out above 480 GB for biomass_swap, so better to use fewer than that.
-    if cn.count == 96:
-        if sensit_type == 'biomass_swap':
-            processes = 32 # 32 processors = 610 GB peak
-        else:
-            processes = 42 # 30 processors=460 GB peak; 36 = 550 GB peak; 40 = XXX GB peak
-    else:
-        processes = 2
-    uu.print_log('Natural forest age category max processors=', processes)
-    pool = multiprocessing.Pool(processes)
-    pool.map(partial(forest_age_category_IPCC.forest_age_category, gain_table_dict=gain_table_dict,
-                     pattern=pattern, sensit_type=sensit_type, no_upload=no_upload), tile_id_list)
-    pool.close()
-    pool.join()
+    # Tiles are admitted into the pool as long as their recorded peak memory fits in the machine's memory budget
+    uu.memory_aware_map(partial(forest_age_category_IPCC.forest_age_category, gain_table_dict=gain_table_dict,
+                                pattern=pattern, sensit_type=sensit_type, no_upload=no_upload),
+                        tile_id_list, 'forest_age_category_IPCC')
 
     # # For single processor use
     # for tile_id in tile_id_list:
@@ -154,11 +151,14 @@ if __name__ == '__main__':
                         help='Date of run. Must be format YYYYMMDD.')
     parser.add_argument('--no-upload', '-nu', action='store_true',
                        help='Disables uploading of outputs to s3')
+    parser.add_argument('--streaming', '-st', action='store_true',
+                        help='Downloads, processes and uploads tiles one at a time instead of in whole-stage batches')
     args = parser.parse_args()
     sensit_type = args.model_type
     tile_id_list = args.tile_id_list
     run_date = args.run_date
     no_upload = args.no_upload
+    streaming = args.streaming
 
     # Disables upload to s3 if no AWS credentials are found in environment
     if not uu.check_aws_creds():
@@ -166,11 +166,13 @@ if __name__ == '__main__':
         uu.print_log("s3 credentials not found. Uploading to s3 disabled.")
 
     # Create the output log
-    uu.initiate_log(tile_id_list=tile_id_list, sensit_type=sensit_type, run_date=run_date, no_upload=no_upload)
+    uu.initiate_log(tile_id_list=tile_id_list, sensit_type=sensit_type, run_date=run_date, no_upload=no_upload,
+                    streaming=streaming)
 
     # Checks whether the sensitivity analysis and tile_id_list arguments are valid
     uu.check_sensit_type(sensit_type)
     tile_id_list = uu.tile_id_list_check(tile_id_list)
 
-    mp_forest_age_category_IPCC(sensit_type=sensit_type, tile_id_list=tile_id_list, run_date=run_date, no_upload=no_upload)
+    mp_forest_age_category_IPCC(sensit_type=sensit_type, tile_id_list=tile_id_list, run_date=run_date, no_upload=no_upload,
+                                streaming=streaming)
 
@@ -7,7 +7,6 @@ That is the final gross removals for the entire model.
 Note that gross removals from this script are reported as positive values.
 '''
 
-import multiprocessing
 import argparse
 import os
 import datetime
@@ -19,7 +18,7 @@ import universal_util as uu
 sys.path.append(os.path.join(cn.docker_app,'gain'))
 import gross_removals_all_forest_types
 
-def mp_gross_removals_all_forest_types(sensit_type, tile_id_list, run_date = None, no_upload = True):
+def mp_gross_removals_all_forest_types(sensit_type, tile_id_list, run_date = None, no_upload = True, streaming = None):
 
     os.chdir(cn.docker_base_dir)
 
@@ -49,14 +48,19 @@ def mp_gross_removals_all_forest_types(sensit_type, tile_id_list, run_date = Non
     output_pattern_list = [cn.pattern_cumul_gain_AGCO2_all_types, cn.pattern_cumul_gain_BGCO2_all_types, cn.pattern_cumul_gain_AGCO2_BGCO2_all_types]
 
 
-    # Downloads input files or entire directories, depending on how many tiles are in the tile_id_list, if AWS credentials are found
-    if uu.check_aws_creds():
+    # Downloads input files or entire directories, depending on how many tiles are in the tile_id_list, if AWS credentials are found.
+    # In streaming mode, each tile's inputs are downloaded just before it is processed instead.
+    if uu.check_aws_creds() and not streaming:
 
         for key, values in download_dict.items():
             dir = key
             pattern = values[0]
             uu.s3_flexible_download(dir, pattern, cn.docker_base_dir, sensit_type, tile_id_list)
 
+    # Only the row counts of the model extent tiles are needed, for skipping windows without any pixels in the model extent
+    if uu.check_aws_creds():
+        uu.download_row_counts(cn.model_extent_dir, cn.pattern_model_extent, sensit_type, tile_id_list)
+
 
     # If the model run isn't the standard one, the output directory and file names are changed
     if sensit_type != 'std':
@@ -70,43 +74,30 @@ def mp_gross_removals_all_forest_types(sensit_type, tile_id_list, run_date = Non
         output_dir_list = uu.replace_output_dir_date(output_dir_list, run_date)
 
 
+    # In streaming mode, inputs are downloaded, tiles processed, empty outputs deleted and outputs uploaded tile by tile
+    if streaming:
+        uu.streaming_map(partial(gross_removals_all_forest_types.gross_removals_all_forest_types, output_pattern_list=output_pattern_list,
+                                 sensit_type=sensit_type, no_upload=no_upload),
+                         tile_id_list, 'gross_removals_all_forest_types', download_dict, output_dir_list, output_pattern_list,
+                         sensit_type, no_upload, check_empty=True)
+        return
+
     # Calculates gross removals
-    if cn.count == 96:
-        if sensit_type == 'biomass_swap':
-            processes = 18
-        else:
-            processes = 22   # 50 processors > 740 GB peak; 25 = >740 GB peak; 15 = 490 GB peak; 20 = 590 GB peak; 22 = 710 GB peak
-    else:
-        processes = 2
-    uu.print_log('Gross removals max processors=', processes)
-    pool = multiprocessing.Pool(processes)
-    pool.map(partial(gross_removals_all_forest_types.gross_removals_all_forest_types, output_pattern_list=output_pattern_list,
-                     sensit_type=sensit_type, no_upload=no_upload), tile_id_list)
-    pool.close()
-    pool.join()
+    # Tiles are admitted into the pool as long as their recorded peak memory fits in the machine's memory budget
+    uu.memory_aware_map(partial(gross_removals_all_forest_types.gross_removals_all_forest_types, output_pattern_list=output_pattern_list,
+                                sensit_type=sensit_type, no_upload=no_upload),
+                        tile_id_list, 'gross_removals_all_forest_types')
 
     # # For single processor use
     # for tile_id in tile_id_list:
     #     gross_removals_all_forest_types.gross_removals_all_forest_types(tile_id, output_pattern_list, sensit_type, no_upload)
 
-    # Checks the gross removals outputs for tiles with no data
+    # Checks the gross removals outputs for tiles with no data.
+    # This uses the statistics saved while the tiles were written, so the tiles aren't read again.
     for output_pattern in output_pattern_list:
-        if cn.count <= 2:  # For local tests
-            processes = 1
-            uu.print_log("Checking for empty tiles of {0} pattern with {1} processors using light function...".format(
-                output_pattern, processes))
-            pool = multiprocessing.Pool(processes)
-            pool.map(partial(uu.check_and_delete_if_empty_light, output_pattern=output_pattern), tile_id_list)
-            pool.close()
-            pool.join()
-        else:
-            processes = 55  # 55 processors = 670 GB peak
-            uu.print_log(
-                "Checking for empty tiles of {0} pattern with {1} processors...".format(output_pattern, processes))
-            pool = multiprocessing.Pool(processes)
-            pool.map(partial(uu.check_and_delete_if_empty, output_pattern=output_pattern), tile_id_list)
-            pool.close()
-            pool.join()
+        uu.print_log("Checking for empty tiles of {} pattern...".format(output_pattern))
+        for tile_id in tile_id_list:
+            uu.check_and_delete_if_empty(tile_id, output_pattern)
 
     # If no_upload flag is not activated, output is uploaded
     if not no_upload:
@@ -129,11 +120,14 @@ if __name__ == '__main__':
                         help='Date of run. Must be format YYYYMMDD.')
     parser.add_argument('--no-upload', '-nu', action='store_true',
                        help='Disables uploading of outputs to s3')
+    parser.add_argument('--streaming', '-st', action='store_true',
+                        help='Downloads, processes and uploads tiles one at a time instead of in whole-stage batches')
     args = parser.parse_args()
     sensit_type = args.model_type
     tile_id_list = args.tile_id_list
     run_date = args.run_date
     no_upload = args.no_upload
+    streaming = args.streaming
 
     # Disables upload to s3 if no AWS credentials are found in environment
     if not uu.check_aws_creds():
@@ -141,10 +135,12 @@ if __name__ == '__main__':
         uu.print_log("s3 credentials not found. Uploading to s3 disabled.")
 
     # Create the output log
-    uu.initiate_log(tile_id_list=tile_id_list, sensit_type=sensit_type, run_date=run_date, no_upload=no_upload)
+    uu.initiate_log(tile_id_list=tile_id_list, sensit_type=sensit_type, run_date=run_date, no_upload=no_upload,
+                    streaming=streaming)
 
     # Checks whether the sensitivity analysis and tile_id_list arguments are valid
     uu.check_sensit_type(sensit_type)
     tile_id_list = uu.tile_id_list_check(tile_id_list)
 
-    mp_gross_removals_all_forest_types(sensit_type=sensit_type, tile_id_list=tile_id_list, run_date=run_date, no_upload=no_upload)
\ No newline at end of file
+    mp_gross_removals_all_forest_types(sensit_type=sensit_type, tile_id_list=tile_id_list, run_date=run_date, no_upload=no_upload,
+                                       streaming=streaming)
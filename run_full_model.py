@@ -1,7 +1,7 @@
 '''
 git clone https://github.com/wri/carbon-budget
 spotutil new r4.16xlarge dgibbs_wri --disk_size 1024
-c++ /usr/local/app/emissions/cpp_util/calc_gross_emissions_generic.cpp -o /usr/local/app/emissions/cpp_util/calc_gross_emissions_generic.exe -lgdal
+c++ /usr/local/app/emissions/cpp_util/calc_gross_emissions_generic.cpp -o /usr/local/app/emissions/cpp_util/calc_gross_emissions_generic.exe -lgdal -pthread
 python run_full_model.py -t std -s forest_age_category_natrl_forest -r false -d 20209999 -l 00N_000E -ce loss -p biomass_soil -tcd 30 -ln "This is a log note"
 python run_full_model.py -t std -s all -r -d 20200327 -l all -ce loss -p biomass_soil -tcd 30 -ma true -pl true -ln "This is a log note"
 
@@ -31,6 +31,7 @@ from emissions.mp_calculate_gross_emissions import mp_calculate_gross_emissions
 from analyses.mp_net_flux import mp_net_flux
 from analyses.mp_aggregate_results_to_4_km import mp_aggregate_results_to_4_km
 from analyses.mp_create_supplementary_outputs import mp_create_supplementary_outputs
+from fused_pipeline.mp_fused_per_tile import mp_fused_per_tile
 
 def main ():
 
@@ -59,7 +60,7 @@ def main ():
     parser.add_argument('--emitted-pools-to-use', '-p', required=False,
                         help='Options are soil_only or biomass_soil. Former only considers emissions from soil. Latter considers emissions from biomass and soil.')
     parser.add_argument('--tcd-threshold', '-tcd', required=False,
-                        help='Tree cover density threshold above which pixels will be included in the aggregation.')
+                        help='Tree cover density threshold above which pixels will be included in the aggregation. Should be 0 or one of the bins in constants_and_names.aggreg_tcd_bins.')
     parser.add_argument('--std-net-flux-aggreg', '-sagg', required=False,
                         help='The s3 standard model net flux aggregated tif, for comparison with the sensitivity analysis map')
     parser.add_argument('--mangroves', '-ma', action='store_true',
@@ -72,6 +73,10 @@ def main ():
                         help='Saves intermediate model outputs rather than deleting them to save storage')
     parser.add_argument('--log-note', '-ln', required=False,
                         help='Note to include in log header about model run.')
+    parser.add_argument('--fused', '-fu', action='store_true',
+                        help='Runs model_extent through net_flux tile by tile in one pass instead of stage by stage. Requires all of those stages.')
+    parser.add_argument('--streaming', '-st', action='store_true',
+                        help='Downloads, processes and uploads tiles one at a time in the per-tile stages instead of in whole-stage batches')
     args = parser.parse_args()
 
     sensit_type = args.model_type
@@ -90,6 +95,8 @@ def main ():
     no_upload = args.no_upload
     save_intermediates = args.save_intermediates
     log_note = args.log_note
+    fused = args.fused
+    streaming = args.streaming
 
     # Start time for script
     script_start = datetime.datetime.now()
@@ -104,7 +111,8 @@ def main ():
                     save_intermediates=save_intermediates,
                     stage_input=stage_input, run_through=run_through, carbon_pool_extent=carbon_pool_extent,
                     emitted_pools=emitted_pools, thresh=thresh, std_net_flux=std_net_flux,
-                    include_mangroves=include_mangroves, include_us=include_us, log_note=log_note)
+                    include_mangroves=include_mangroves, include_us=include_us, log_note=log_note, fused=fused,
+                    streaming=streaming)
 
 
     # Checks the validity of the model stage arguments. If either one is invalid, the script ends.
@@ -142,7 +150,8 @@ def main ():
                 else:
                     uu.exception_log(no_upload, 'Must compile standard {} model C++...'.format(sensit_type))
             else:
-                if os.path.exists('{0}/calc_gross_emissions_generic.exe'.format(cn.c_emis_compile_dst)):
+                if os.path.exists('{0}/calc_gross_emissions_generic.exe'.format(cn.c_emis_compile_dst)) or \
+                        os.path.exists(os.path.join(cn.c_emis_compile_dst, cn.c_emis_generic_lib)):
                     uu.print_log("C++ for generic emissions already compiled.")
                 else:
                     uu.exception_log(no_upload, 'Must compile generic emissions C++...')
@@ -156,10 +165,25 @@ def main ():
         else:
             uu.exception_log(no_upload, 'Pool and/or sensitivity analysis option not valid for gross emissions')
 
-    # Checks whether the canopy cover argument is valid up front.
+    # Stages that are run together, tile by tile, when the fused option is used
+    fused_stages = ['model_extent', 'forest_age_category_IPCC', 'annual_removals_IPCC',
+                    'annual_removals_all_forest_types', 'gain_year_count', 'gross_removals_all_forest_types',
+                    'carbon_pools', 'gross_emissions', 'net_flux']
+
+    # Checks that the fused option is only used when all of the stages it replaces are being run
+    if fused:
+        if not set(fused_stages).issubset(actual_stages):
+            uu.exception_log(no_upload, 'Fused option requires all of these stages to be run:', fused_stages)
+        else:
+            pass
+
+    # Checks whether the canopy cover argument is valid up front, so that the model doesn't fail at the aggregate stage.
+    # The aggregation can only use 0 or the tree cover density bins of its histograms.
     if 'aggregate' in actual_stages:
         if thresh < 0 or thresh > 99:
             uu.exception_log(no_upload, 'Invalid tcd. Please provide an integer between 0 and 99.')
+        elif thresh != 0 and thresh not in cn.aggreg_tcd_bins:
+            uu.exception_log(no_upload, 'Invalid tcd {0}. Please provide 0 or one of the tree cover density bins {1}.'.format(thresh, cn.aggreg_tcd_bins))
         else:
             pass
 
@@ -281,13 +305,30 @@ def main ():
         uu.print_log(":::::Processing time for annual_gain_rate_us:", elapsed_time, "\n")
 
 
+    # Runs model extent through net flux tile by tile. The fused stages are then removed from the stages to run.
+    if fused:
+
+        uu.print_log(":::::Running model extent through net flux tile by tile")
+        start = datetime.datetime.now()
+
+        mp_fused_per_tile(sensit_type, tile_id_list, carbon_pool_extent, emitted_pools, run_date=run_date,
+                          no_upload=no_upload, save_intermediates=save_intermediates, streaming=streaming)
+
+        actual_stages = [stage for stage in actual_stages if stage not in fused_stages]
+
+        end = datetime.datetime.now()
+        elapsed_time = end - start
+        uu.check_storage()
+        uu.print_log(":::::Processing time for fused stages:", elapsed_time, "\n", "\n")
+
+
     # Creates model extent tiles
     if 'model_extent' in actual_stages:
 
         uu.print_log(":::::Creating tiles of model extent")
         start = datetime.datetime.now()
 
-        mp_model_extent(sensit_type, tile_id_list, run_date=run_date, no_upload=no_upload)
+        mp_model_extent(sensit_type, tile_id_list, run_date=run_date, no_upload=no_upload, streaming=streaming)
 
         end = datetime.datetime.now()
         elapsed_time = end - start
@@ -301,7 +342,7 @@ def main ():
         uu.print_log(":::::Creating tiles of forest age categories for IPCC removal rates")
         start = datetime.datetime.now()
 
-        mp_forest_age_category_IPCC(sensit_type, tile_id_list, run_date=run_date, no_upload=no_upload)
+        mp_forest_age_category_IPCC(sensit_type, tile_id_list, run_date=run_date, no_upload=no_upload, streaming=streaming)
 
         end = datetime.datetime.now()
         elapsed_time = end - start
@@ -315,7 +356,7 @@ def main ():
         uu.print_log(":::::Creating tiles of annual aboveground and belowground removal rates using IPCC defaults")
         start = datetime.datetime.now()
 
-        mp_annual_gain_rate_IPCC_defaults(sensit_type, tile_id_list, run_date=run_date, no_upload=no_upload)
+        mp_annual_gain_rate_IPCC_defaults(sensit_type, tile_id_list, run_date=run_date, no_upload=no_upload, streaming=streaming)
 
         end = datetime.datetime.now()
         elapsed_time = end - start
@@ -328,7 +369,7 @@ def main ():
         uu.print_log(":::::Creating tiles of annual aboveground and belowground removal rates for all forest types")
         start = datetime.datetime.now()
 
-        mp_annual_gain_rate_AGC_BGC_all_forest_types(sensit_type, tile_id_list, run_date=run_date, no_upload=no_upload)
+        mp_annual_gain_rate_AGC_BGC_all_forest_types(sensit_type, tile_id_list, run_date=run_date, no_upload=no_upload, streaming=streaming)
 
         end = datetime.datetime.now()
         elapsed_time = end - start
@@ -390,7 +431,7 @@ def main ():
         uu.print_log(":::::Creating gross removals for all forest types combined (above + belowground) tiles'")
         start = datetime.datetime.now()
 
-        mp_gross_removals_all_forest_types(sensit_type, tile_id_list, run_date=run_date, no_upload=no_upload)
+        mp_gross_removals_all_forest_types(sensit_type, tile_id_list, run_date=run_date, no_upload=no_upload, streaming=streaming)
 
         end = datetime.datetime.now()
         elapsed_time = end - start
@@ -534,7 +575,7 @@ def main ():
         uu.print_log(":::::Creating net flux tiles")
         start = datetime.datetime.now()
 
-        mp_net_flux(sensit_type, tile_id_list, run_date=run_date, no_upload=no_upload)
+        mp_net_flux(sensit_type, tile_id_list, run_date=run_date, no_upload=no_upload, streaming=streaming)
 
         end = datetime.datetime.now()
         elapsed_time = end - start
@@ -572,17 +613,6 @@ def main ():
     # Converts gross emissions, gross removals and net flux from per hectare rasters to per pixel rasters
     if 'create_supplementary_outputs' in actual_stages:
 
-        if not save_intermediates:
-
-            uu.print_log(":::::Deleting rewindowed tiles")
-            tiles_to_delete = []
-            tiles_to_delete.extend(glob.glob('*rewindow*tif'))
-            uu.print_log("  Deleting", len(tiles_to_delete), "tiles...")
-
-            for tile_to_delete in tiles_to_delete:
-                os.remove(tile_to_delete)
-            uu.print_log(":::::Deleted unneeded tiles")
-
         uu.check_storage()
 
         uu.print_log(":::::Creating supplementary versions of main model outputs (forest extent, per pixel)")
@@ -1,4 +1,3 @@
-import numpy as np
 import datetime
 import rasterio
 import os
@@ -9,6 +8,30 @@ import constants_and_names as cn
 import universal_util as uu
 
 
+# Decision tree for the forest age category in the legal Amazon.
+# It's evaluated for every combination of the conditions once per tile to make the lookup array for classify_conditions.
+def legal_Amazon_age_category(biomass, in_PRODES_extent, loss, gain, mangrove, plantation):
+
+    # Pixels in mangroves or planted forests don't get an age category
+    if mangrove or plantation:
+        return 0
+
+    # Loss-and-gain pixels
+    if in_PRODES_extent and gain and loss:
+        return 8   # young secondary forest
+
+    if biomass and in_PRODES_extent:
+
+        # Loss-only pixels
+        if loss:
+            return 6   # primary forest
+
+        # No change pixels (no loss or gain)
+        return 3   # primary forest
+
+    return 0
+
+
 def legal_Amazon_forest_age_category(tile_id, sensit_type, output_pattern):
     # Start time
     start = datetime.datetime.now()
@@ -35,17 +58,8 @@ def legal_Amazon_forest_age_category(tile_id, sensit_type, output_pattern):
         biomass_src = rasterio.open(biomass)
 
         # Checks whether there are mangrove or planted forest tiles. If so, they are opened.
-        try:
-            plantations_src = rasterio.open(plantations)
-            uu.print_log("    Planted forest tile found for {}".format(tile_id))
-        except:
-            uu.print_log("    No planted forest tile for {}".format(tile_id))
-
-        try:
-            mangroves_src = rasterio.open(mangroves)
-            uu.print_log("    Mangrove tile found for {}".format(tile_id))
-        except:
-            uu.print_log("    No mangrove tile for {}".format(tile_id))
+        plantations_src = uu.open_optional_input(plantations, tile_id)
+        mangroves_src = uu.open_optional_input(mangroves, tile_id)
 
         # Updates kwargs for the output dataset
         kwargs.update(
@@ -58,34 +72,27 @@ def legal_Amazon_forest_age_category(tile_id, sensit_type, output_pattern):
         # Opens the output tile, giving it the arguments of the input tiles
         dst = rasterio.open('{0}_{1}.tif'.format(tile_id, output_pattern), 'w', **kwargs)
 
-        # Iterates across the windows (1 pixel strips) of the input tile
-        for idx, window in windows:
-
-            # Creates windows for each input raster
-            loss_window = loss_src.read(1, window=window)
-            gain_window = gain_src.read(1, window=window)
-            extent_window = extent_src.read(1, window=window)
-            biomass_window = biomass_src.read(1, window=window)
-
-            # Create a 0s array for the output
-            dst_data = np.zeros((window.height, window.width), dtype='uint8')
+        # Lookup array of the age category for every combination of the decision tree's conditions
+        age_category_table = uu.decision_tree_table(legal_Amazon_age_category, 6)
 
-            # No change pixels (no loss or gain)
-            dst_data[np.where((biomass_window > 0) & (extent_window == 1) & (loss_window == 0))] = 3  # primary forest
+        # Input windows are read into the same buffers for every window
+        window_buffers = uu.new_window_buffers()
 
-            # Loss-only pixels
-            dst_data[np.where((biomass_window > 0) & (extent_window == 1) & (loss_window > 0))] = 6   # primary forest
-
-            # Loss-and-gain pixels
-            dst_data[np.where((extent_window == 1) & (gain_window == 1) & (loss_window > 0))] = 8   # young secondary forest
-
-            if os.path.exists(mangroves):
-                mangroves_window = mangroves_src.read(1, window=window)
-                dst_data = np.ma.masked_where(mangroves_window != 0, dst_data).filled(0).astype('uint8')
+        # Iterates across the windows (1 pixel strips) of the input tile
+        for idx, window in windows:
 
-            if os.path.exists(plantations):
-                plantations_window = plantations_src.read(1, window=window)
-                dst_data = np.ma.masked_where(plantations_window != 0, dst_data).filled(0).astype('uint8')
+            # Creates windows for each input raster. Windows of mangrove and planted forest tiles that don't exist
+            # are a shared array of 0s.
+            loss_window = uu.read_window(loss_src, window, window_buffers)
+            gain_window = uu.read_window(gain_src, window, window_buffers)
+            extent_window = uu.read_window(extent_src, window, window_buffers)
+            biomass_window = uu.read_window(biomass_src, window, window_buffers)
+            mangroves_window = uu.read_window(mangroves_src, window, window_buffers)
+            plantations_window = uu.read_window(plantations_src, window, window_buffers)
+
+            # Assigns the age category of each pixel with the whole decision tree (see legal_Amazon_age_category) in one lookup
+            dst_data = uu.classify_conditions([biomass_window > 0, extent_window == 1, loss_window > 0, gain_window == 1,
+                                               mangroves_window != 0, plantations_window != 0], age_category_table)
 
             # Writes the output window to the output
             dst.write_band(1, dst_data, window=window)
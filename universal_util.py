@@ -6,18 +6,29 @@ import constants_and_names as cn
 import datetime
 import rasterio
 import logging
+import logging.handlers
+import atexit
 import csv
 from shutil import copyfile
 import os
 import multiprocessing
 from multiprocessing.pool import Pool
-from functools import partial
+from functools import partial, lru_cache
+import ast
+import operator
 from shutil import copy
 import re
-import pandas as pd
+import numpy as np
 from osgeo import gdal
 import time
-from random import seed
+import json
+import resource
+import hashlib
+import fcntl
+import threading
+import boto3.s3.transfer
+import botocore.config
+from concurrent.futures import ThreadPoolExecutor
 from random import random
 
 # Prints the date as YYYYmmdd_hhmmss
@@ -26,35 +37,129 @@ date_today = d.strftime('%Y_%m_%d')
 date_time_today = d.strftime('%Y%m%d_%h%m%s') # for Linux
 # date_time_today = d.strftime('%Y%m%d_%H%M%S') # for Windows
 
+# Log lines from all processes of the model run go through this queue to one listener thread in the process that
+# created the log, which is the only writer of the log file. A shipper thread in that process uploads the log to s3.
+log_queue = None
+log_listener = None
+log_shipper = None
+log_shipper_pid = None
+log_ship_event = threading.Event()
+log_shipper_stop = threading.Event()
+log_lines_since_upload = 0
+
+
 # Uploads the output log to the designated s3 folder
+def ship_log():
+
+    global log_lines_since_upload
+
+    log_lines_since_upload = 0
+
+    s3_upload(os.path.join(cn.docker_app, cn.model_log), os.path.join(cn.model_log_dir, cn.model_log), report=False)
+
+
+# Counts the lines written to the log file and asks for an upload once enough have been written.
+# Used as a filter on the log file handler, so it's run by the listener thread for every line.
+def count_log_line(record):
+
+    global log_lines_since_upload
+
+    log_lines_since_upload += 1
+
+    if log_lines_since_upload >= cn.log_upload_lines:
+        log_ship_event.set()
+
+    return True
+
+
+# Uploads the log whenever it is asked to or the upload interval has passed, if anything has been written since the
+# last upload. Many lines are thus uploaded together instead of the whole log being uploaded after each tile.
+def ship_log_in_background():
+
+    while not log_shipper_stop.is_set():
+
+        log_ship_event.wait(cn.log_upload_interval)
+        log_ship_event.clear()
+
+        if log_lines_since_upload > 0:
+            try:
+                ship_log()
+            except:
+                print("LOG: Error uploading log. Will try again at the next upload.")
+
+
+# Writes any log lines still in the queue and uploads the final log. Run when the model run exits.
+def stop_log_shipper():
+
+    global log_listener, log_shipper
+
+    if log_listener is None:
+        return
+
+    log_listener.stop()
+    log_listener = None
+
+    if log_shipper is not None:
+        log_shipper_stop.set()
+        log_ship_event.set()
+        log_shipper.join()
+        log_shipper = None
+
+        try:
+            ship_log()
+        except:
+            print("LOG: Error uploading final log")
+
+
+# Asks for the output log to be uploaded to s3.
+# In the process that created the log, this wakes the shipper thread rather than uploading the log itself.
+# Processes running tiles don't ask for anything: their log lines reach the log file through the log queue and are
+# uploaded with the next batch. Without a shipper (e.g., if the log wasn't created), the log is uploaded right away.
 def upload_log():
 
-    # Builds a slightly variable delay into the log uploading so that a ton of log uploads at once don't overwhelm s3
-    seed()
-    lag = random()*2
-    time.sleep(lag)
+    if log_shipper is None:
+        ship_log()
 
-    cmd = ['aws', 's3', 'cp', os.path.join(cn.docker_app, cn.model_log), cn.model_log_dir, '--quiet']
-    check_call(cmd)
+    elif os.getpid() == log_shipper_pid:
+        log_ship_event.set()
 
 
 # Creates the log with a starting line
 def initiate_log(tile_id_list=None, sensit_type=None, run_date=None, no_upload=None,
                  save_intermediates=None, stage_input=None, run_through=None, carbon_pool_extent=None,
                  emitted_pools=None, thresh=None, std_net_flux=None,
-                 include_mangroves=None, include_us=None, log_note=None):
+                 include_mangroves=None, include_us=None, log_note=None, fused=None,
+                 streaming=None):
+
+    global log_queue, log_listener, log_shipper, log_shipper_pid
 
     # For some reason, logging gets turned off when AWS credentials aren't provided.
     # This restores logging without AWS credentials.
-    if not check_aws_creds():
-        # https://stackoverflow.com/a/49202811
-        for handler in logging.root.handlers[:]:
-            logging.root.removeHandler(handler)
+    # https://stackoverflow.com/a/49202811
+    for handler in logging.root.handlers[:]:
+        logging.root.removeHandler(handler)
 
-    logging.basicConfig(filename=os.path.join(cn.docker_app, cn.model_log),
-                        format='%(levelname)s @ %(asctime)s: %(message)s',
-                        datefmt='%Y/%m/%d %I:%M:%S %p',
-                        level=logging.INFO)
+    # Only the listener thread writes to the log file. Everything logged in this process or in the processes it starts
+    # (which inherit the root logger and the queue) is put on the queue.
+    log_file_handler = logging.FileHandler(os.path.join(cn.docker_app, cn.model_log))
+    log_file_handler.setFormatter(logging.Formatter(fmt='%(levelname)s @ %(asctime)s: %(message)s',
+                                                    datefmt='%Y/%m/%d %I:%M:%S %p'))
+    log_file_handler.addFilter(count_log_line)
+
+    log_queue = multiprocessing.Queue()
+    log_listener = logging.handlers.QueueListener(log_queue, log_file_handler)
+    log_listener.start()
+
+    logging.root.addHandler(logging.handlers.QueueHandler(log_queue))
+    logging.root.setLevel(logging.INFO)
+
+    # If no_upload flag is not activated, the log is uploaded in the background
+    if not no_upload:
+        log_shipper_pid = os.getpid()
+        log_shipper = threading.Thread(target=ship_log_in_background, daemon=True)
+        log_shipper.start()
+
+    atexit.register(stop_log_shipper)
 
     logging.info("Log notes: {}".format(log_note))
     logging.info("Model version: {}".format(cn.version))
@@ -73,6 +178,8 @@ def initiate_log(tile_id_list=None, sensit_type=None, run_date=None, no_upload=N
     logging.info("Do not upload anything to s3: {}".format(no_upload))
     logging.info("AWS credentials supplied: {}".format(check_aws_creds()))
     logging.info("Save intermediate outputs: {}".format(save_intermediates))
+    logging.info("Run model extent through net flux tile by tile (fused): {}".format(fused))
+    logging.info("Download, process and upload tiles one at a time (streaming): {}".format(streaming))
     logging.info("AWS ec2 instance type and AMI ID:")
 
     # https://stackoverflow.com/questions/13735051/how-to-capture-curl-output-to-a-file
@@ -238,6 +345,233 @@ def check_storage():
                  "; Percent storage used:", percent_storage_used)
 
 
+# Gets how much memory is available on the machine, in GB
+def available_memory_gb():
+
+    with open('/proc/meminfo') as meminfo:
+        for line in meminfo:
+            if line.startswith('MemAvailable:'):
+                return int(line.split()[1]) / 1024 / 1024
+
+
+# Reads the recorded peak memory per tile for each model stage. Returns an empty dictionary if there is no profile yet.
+def read_memory_profile():
+
+    try:
+        with open(os.path.join(cn.docker_base_dir, cn.memory_profile)) as profile:
+            return json.load(profile)
+    except:
+        return {}
+
+
+# Records the peak memory per tile for a model stage
+def write_memory_profile(stage, peak_gb):
+
+    memory_profile = read_memory_profile()
+    memory_profile[stage] = peak_gb
+
+    with open(os.path.join(cn.docker_base_dir, cn.memory_profile), 'w') as profile:
+        json.dump(memory_profile, profile, indent=4, sort_keys=True)
+
+
+# Runs a function on one tile and returns the peak memory (GB) of the process that ran it, including any
+# subprocesses it launched (e.g., gdal commands or the gross emissions C++).
+# Each tile is run in a fresh process (maxtasksperchild=1 in memory_aware_map), so this is the peak for that tile.
+def run_and_measure_tile(func, tile_id):
+
+    func(tile_id)
+
+    # ru_maxrss is in KB on Linux
+    peak_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+    return tile_id, peak_kb / 1024 / 1024
+
+
+# Runs a function on every tile in the list, admitting tiles into the pool only while the sum of their expected peak
+# memory stays under the memory budget (a fraction of the available memory on the machine when the stage starts).
+# The available memory is also read again before each tile is admitted, and a tile is only admitted if its expected
+# peak fits in that fraction of it, so memory taken since the stage started (e.g., by downloads) is accounted for.
+# The expected peak for a tile is a high percentile (cn.memory_peak_percentile) of the peaks measured so far in this run,
+# so that one unusually large tile doesn't lower the number of tiles run at once for the rest of the stage.
+# Until a few tiles (cn.memory_peak_min_tiles) have finished, the peak recorded for the stage in the last run is
+# expected if it's larger. If there is no recorded peak for the stage, the first tile is run by itself to measure it.
+# The expected peak at the end of the stage is recorded for the next run.
+# Tiles are collected as they finish (the pool's callbacks wake this process), rather than by polling.
+# This replaces hand-tuned processor counts, so stages use as many processors as fit in memory on any machine.
+# Optionally, tile_ready(tile_id) says whether the next tile can start (e.g., whether its inputs have been downloaded)
+# and tile_done(tile_id) is run in this process after each tile finishes (e.g., to upload its outputs).
+# If a tile raises an error, the other tiles are stopped and the error is raised.
+def memory_aware_map(func, tile_id_list, stage, max_processes=None, tile_ready=None, tile_done=None):
+
+    if max_processes is None:
+        max_processes = cn.count
+
+    memory_budget = available_memory_gb() * cn.memory_budget_fraction
+    recorded_peak = read_memory_profile().get(stage)
+    tile_peak = recorded_peak
+
+    if tile_peak is None:
+        print_log("No recorded peak memory for {}. Running first tile alone to measure it.".format(stage))
+    else:
+        print_log("Recorded peak memory for {0}: {1:.1f} GB per tile; memory budget: {2:.1f} GB; up to {3} tiles at once".format(
+            stage, tile_peak, memory_budget, min(max_processes, max(1, int(memory_budget // tile_peak)))))
+
+    tiles_to_run = list(tile_id_list)
+    running = {}
+    measured_peaks = []
+
+    # The (tile id, peak memory) of tiles that have finished, or the error of a tile that failed, added by the
+    # pool's callbacks. The condition wakes this process when one is added.
+    finished = []
+    tile_finished = threading.Condition()
+
+    def collect_tile(outcome):
+        with tile_finished:
+            finished.append(outcome)
+            tile_finished.notify()
+
+    pool = multiprocessing.Pool(max_processes, maxtasksperchild=1)
+
+    try:
+
+        while tiles_to_run or running:
+
+            with tile_finished:
+                outcomes = list(finished)
+                del finished[:]
+
+            # Collects finished tiles. Raises any error from a tile, like pool.map does.
+            for outcome in outcomes:
+                if isinstance(outcome, BaseException):
+                    raise outcome
+                tile_id, peak_gb = outcome
+                del running[tile_id]
+                measured_peaks.append(peak_gb)
+                tile_peak = float(np.percentile(measured_peaks, cn.memory_peak_percentile))
+                if (len(measured_peaks) < cn.memory_peak_min_tiles) and (recorded_peak is not None):
+                    tile_peak = max(tile_peak, recorded_peak)
+                print_log("  Peak memory for {0} {1}: {2:.1f} GB".format(stage, tile_id, peak_gb))
+                if tile_done is not None:
+                    tile_done(tile_id)
+
+            # Admits tiles while they fit in the memory budget. A tile is always admitted if nothing else is running.
+            # Without a peak for the stage yet, a tile is expected to use the whole budget.
+            waiting_for_inputs = False
+            while tiles_to_run and len(running) < max_processes:
+
+                expected_peak = tile_peak if tile_peak is not None else memory_budget
+
+                if running and (sum(running.values()) + expected_peak > memory_budget):
+                    break
+
+                # Memory that has been taken since the stage started (e.g., by downloads or the page cache)
+                if running and (expected_peak > available_memory_gb() * cn.memory_budget_fraction):
+                    break
+
+                if tile_ready is not None and not tile_ready(tiles_to_run[0]):
+                    waiting_for_inputs = True
+                    break
+
+                tile_id = tiles_to_run.pop(0)
+                pool.apply_async(run_and_measure_tile, (func, tile_id), callback=collect_tile, error_callback=collect_tile)
+                running[tile_id] = expected_peak
+
+            # Waits for a tile to finish. Inputs becoming ready don't wake this process, so while the next tile is
+            # waiting for its inputs, whether they're ready is checked again every cn.memory_aware_input_wait seconds.
+            with tile_finished:
+                if not finished and (tiles_to_run or running):
+                    tile_finished.wait(cn.memory_aware_input_wait if waiting_for_inputs else None)
+
+    # Stops the tiles that are still running if a tile raised an error (or the run was interrupted)
+    except:
+        pool.terminate()
+        raise
+
+    else:
+        pool.close()
+
+    finally:
+        pool.join()
+
+    if measured_peaks:
+        write_memory_profile(stage, tile_peak)
+        print_log("Peak memory per tile for {0}: {1:.1f} GB ({2}th percentile), {3:.1f} GB (largest)".format(
+            stage, tile_peak, cn.memory_peak_percentile, max(measured_peaks)))
+
+
+# Runs a function on every tile in the list while streaming its inputs and outputs, rather than downloading all inputs
+# for all tiles first and uploading all outputs at the end.
+# The inputs of the next few tiles (cn.stream_prefetch_tiles) are downloaded in the background while tiles are processed.
+# A tile starts as soon as its inputs are on the spot machine and there is memory for it (see memory_aware_map).
+# When a tile finishes, its outputs are uploaded in the background and its inputs are removed from the tile folder
+# and evicted from the tile cache, since no later tile in the stage uses them, so that disk use stays at about the
+# inputs of the tiles being processed and prefetched. Only inputs placed from the tile cache are removed;
+# inputs made on the spot machine by earlier stages are kept.
+# download_dict is the same {s3 directory: [pattern]} dictionary the stage would otherwise download up front.
+# If check_empty is True, each output is checked for data and deleted if empty before it is uploaded.
+def streaming_map(func, tile_id_list, stage, download_dict, output_dir_list, output_pattern_list, sensit_type,
+                  no_upload, check_empty=False):
+
+    download_executor = ThreadPoolExecutor(max_workers=cn.stream_prefetch_tiles)
+    upload_executor = ThreadPoolExecutor(max_workers=cn.s3_concurrent_tiles)
+    downloads = {}
+    uploads = []
+
+    # Downloads all inputs for one tile through the tile cache
+    def download_tile_inputs(tile_id):
+        for source_dir, patterns in download_dict.items():
+            s3_file_download('{0}{1}'.format(source_dir, tile_name(tile_id, patterns[0])), cn.docker_base_dir, sensit_type)
+
+    # Starts prefetching inputs for this tile and the next few, and says whether this tile's inputs are ready
+    def tile_ready(tile_id):
+        position = tile_id_list.index(tile_id)
+        for next_tile_id in tile_id_list[position:position + cn.stream_prefetch_tiles]:
+            if next_tile_id not in downloads:
+                downloads[next_tile_id] = download_executor.submit(download_tile_inputs, next_tile_id)
+
+        if not downloads[tile_id].done():
+            return False
+
+        # Raises any error from downloading the inputs
+        downloads[tile_id].result()
+        return True
+
+    # Checks an output for data (if needed) and uploads it
+    def upload_output(tile_id, upload_dir, pattern):
+        if check_empty:
+            check_and_delete_if_empty(tile_id, pattern)
+        output = tile_name(tile_id, pattern)
+        if os.path.exists(output) and not no_upload:
+            for local_file, s3_path in [(output, os.path.join(upload_dir, output))] + row_counts_transfers(output, upload_dir):
+                s3_upload(local_file, s3_path)
+
+    # Uploads the outputs of a finished tile in the background and removes its inputs from the tile folder and cache
+    def tile_done(tile_id):
+        for upload_dir, pattern in zip(output_dir_list, output_pattern_list):
+            uploads.append(upload_executor.submit(upload_output, tile_id, upload_dir, pattern))
+
+        for source_dir, patterns in download_dict.items():
+            input_tile = tile_name(tile_id, patterns[0])
+            for local_tile in [input_tile, '{0}_{1}.tif'.format(input_tile[:-4], sensit_type)]:
+                remove_placed_tile(local_tile, evict=True)
+
+        del downloads[tile_id]
+
+    memory_aware_map(func, tile_id_list, stage, tile_ready=tile_ready, tile_done=tile_done)
+
+    # Waits for the remaining uploads. Raises any error from them.
+    for upload in uploads:
+        upload.result()
+
+    download_executor.shutdown()
+    upload_executor.shutdown()
+
+    # Uploads the log once the stage's outputs are all uploaded, as upload_final_set does
+    if not no_upload:
+        upload_log()
+
+
 # Gets the tile id from the full tile name using a regular expression
 def get_tile_id(tile_name):
 
@@ -271,6 +605,110 @@ def get_tile_dir(tile):
     return tile_dir
 
 
+# In-memory inventory of s3 folders, so that each folder is listed once rather than at every tile list, tile count
+# and tile existence check. Keyed by s3 folder, with the time it was listed and {object name: (size, ETag, last modified)}
+# for the objects directly in the folder (not in its subfolders).
+s3_inventory_cache = {}
+s3_inventory_lock = threading.Lock()
+
+
+# Lists the objects directly in an s3 folder, one page of up to 1000 objects per request
+def list_s3_folder(source):
+
+    bucket, prefix = split_s3_path(source)
+    if prefix and not prefix.endswith('/'):
+        prefix = prefix + '/'
+
+    paginator = s3_client().get_paginator('list_objects_v2')
+
+    inventory = {}
+
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter='/'):
+        for s3_object in page.get('Contents', []):
+            inventory[s3_object['Key'][len(prefix):]] = (s3_object['Size'], s3_object['ETag'], s3_object['LastModified'])
+
+    return inventory
+
+
+# Inventory of an s3 folder. The folder is only listed again once its listing is older than cn.s3_inventory_ttl.
+def s3_inventory(source):
+
+    folder = source if source.endswith('/') else source + '/'
+
+    with s3_inventory_lock:
+        cached = s3_inventory_cache.get(folder)
+
+    if cached is not None and time.time() - cached[0] < cn.s3_inventory_ttl:
+        return cached[1]
+
+    inventory = list_s3_folder(folder)
+
+    with s3_inventory_lock:
+        s3_inventory_cache[folder] = (time.time(), inventory)
+
+    return inventory
+
+
+# Inventories of several s3 folders, listed at the same time. Each folder is only listed once.
+def s3_inventories(sources):
+
+    with ThreadPoolExecutor(max_workers=cn.s3_concurrent_tiles) as executor:
+        inventories = dict(zip(set(sources), executor.map(s3_inventory, set(sources))))
+
+    return [inventories[source] for source in sources]
+
+
+# Drops an s3 folder from the inventory, e.g., after a tile has been uploaded to it
+def invalidate_s3_inventory(s3_path):
+
+    folder = s3_path.rsplit('/', 1)[0] + '/'
+
+    with s3_inventory_lock:
+        s3_inventory_cache.pop(folder, None)
+
+
+# Size and ETag of an s3 object, or None if it isn't on s3.
+# Comes from the inventory of its folder if the object is in it, so most checks of whether a tile exists
+# don't need a request. Objects that aren't in the inventory (e.g., ones uploaded since it was listed) are checked on s3.
+def s3_object_info(s3_path):
+
+    folder, name = s3_path.rsplit('/', 1)
+
+    entry = s3_inventory(folder).get(name)
+    if entry is not None:
+        return entry[0], entry[1]
+
+    bucket, key = split_s3_path(s3_path)
+
+    try:
+        head = s3_client().head_object(Bucket=bucket, Key=key)
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] not in ["404", "NoSuchKey"]:
+            print_log("  Some other error occurred while looking for {0}: {1}".format(s3_path, e))
+        return None
+
+    return head['ContentLength'], head['ETag']
+
+
+# Tile ids of the tifs in an inventory.
+# For gain, tcd, pixel area and loss tiles, which have the tile_id after the pattern, any tif is counted.
+# For other tiles, only tifs that end with the pattern (if one is given) are counted.
+def inventory_tile_ids(inventory, pattern=None):
+
+    tile_ids = []
+
+    for name in inventory:
+
+        if pattern is None or pattern in [cn.pattern_gain, cn.pattern_tcd, cn.pattern_pixel_area, cn.pattern_loss]:
+            if name.endswith('.tif'):
+                tile_ids.append(get_tile_id(name))
+
+        elif name.endswith('{}.tif'.format(pattern)):
+            tile_ids.append(get_tile_id(name))
+
+    return tile_ids
+
+
 # Lists the tiles in a folder in s3
 def tile_list_s3(source, sensit_type='std'):
 
@@ -285,92 +723,26 @@ def tile_list_s3(source, sensit_type='std'):
 
     print_log('\n' + "Creating list of tiles in", new_source)
 
-    ## For an s3 folder in a bucket using AWSCLI
-    # Captures the list of the files in the folder
-    out = Popen(['aws', 's3', 'ls', new_source], stdout=PIPE, stderr=STDOUT)
-    stdout, stderr = out.communicate()
-
-    # Writes the output string to a text file for easier interpretation
-    biomass_tiles = open(os.path.join(cn.docker_tmp, 'tiles.txt'), "wb")
-    biomass_tiles.write(stdout)
-    biomass_tiles.close()
-
-    file_list = []
+    # The standard folder is listed at the same time in case the sensitivity folder is empty
+    new_inventory, inventory = s3_inventories([new_source, source])
 
-    # Iterates through the text file to get the names of the tiles and appends them to list
-    with open(os.path.join(cn.docker_tmp, 'tiles.txt'), 'r') as tile:
-        for line in tile:
-            num = len(line.strip('\n').split(" "))
-            tile_name = line.strip('\n').split(" ")[num - 1]
-
-            # Only tifs will be in the tile list
-            if '.tif' in tile_name:
-
-                tile_id = get_tile_id(tile_name)
-                file_list.append(tile_id)
+    file_list = inventory_tile_ids(new_inventory)
 
     if len(file_list) > 0:
 
         return file_list
 
-    # In case the change of directories to look for sensitivity versions yields an empty folder.
-    # This could be done better by using boto3 to check the potential s3 folders for files upfront but I couldn't figure
-    # out how to do that.
+    # In case the change of directories to look for sensitivity versions yields an empty folder
     print_log('\n' + "Creating list of tiles in", source)
 
-    ## For an s3 folder in a bucket using AWSCLI
-    # Captures the list of the files in the folder
-    out = Popen(['aws', 's3', 'ls', source], stdout=PIPE, stderr=STDOUT)
-    stdout, stderr = out.communicate()
-
-    # Writes the output string to a text file for easier interpretation
-    biomass_tiles = open(os.path.join(cn.docker_tmp, 'tiles.txt'), "wb")
-    biomass_tiles.write(stdout)
-    biomass_tiles.close()
-
-    file_list = []
-
-    # Iterates through the text file to get the names of the tiles and appends them to list
-    with open(os.path.join(cn.docker_tmp, 'tiles.txt'), 'r') as tile:
-        for line in tile:
-            num = len(line.strip('\n').split(" "))
-            tile_name = line.strip('\n').split(" ")[num - 1]
-
-            # Only tifs will be in the tile list
-            if '.tif' in tile_name:
-                tile_id = get_tile_id(tile_name)
-                file_list.append(tile_id)
-
-    return file_list
+    return inventory_tile_ids(inventory)
 
 
 # Lists the tiles on the spot machine
 def tile_list_spot_machine(source, pattern):
 
-    ## For an s3 folder in a bucket using AWSCLI
-    # Captures the list of the files in the folder
-    out = Popen(['ls', source], stdout=PIPE, stderr=STDOUT)
-    stdout, stderr = out.communicate()
-
-    # Writes the output string to a text file for easier interpretation
-    tiles = open(os.path.join(cn.docker_tmp, 'tiles.txt'), "wb")
-    tiles.write(stdout)
-    tiles.close()
-
-    file_list = []
-
-    # Iterates through the text file to get the names of the tiles and appends them to list
-    with open(os.path.join(cn.docker_tmp, 'tiles.txt'), 'r') as tile:
-        for line in tile:
-            num = len(line.strip('\n').split(" "))
-            tile_name = line.strip('\n').split(" ")[num - 1]
-
-            # Only files with the specified pattern will be in the tile list
-            if pattern in tile_name:
-
-                file_list.append(tile_name)
-
-    return file_list
+    # Only files with the specified pattern will be in the tile list
+    return sorted([tile_name for tile_name in os.listdir(source) if pattern in tile_name])
 
 
 # Creates a list of all tiles found in either two or three s3 folders and removes duplicates from the list
@@ -393,221 +765,234 @@ def create_combined_tile_list(set1, set2, set3=None, sensit_type='std'):
         source = cn.annual_gain_AGC_BGC_natrl_forest_US_dir
         tile_list = tile_list_s3(source, sensit_type='std')
         return tile_list
-    elif sensit_type == 'std':
-        set1 = set1
-        set2 = set2
-    else:
+    elif sensit_type != 'std':
         set1 = set1.replace('standard', sensit_type)
         set2 = set2.replace('standard', sensit_type)
+        if set3 != None:
+            set3 = set3.replace('standard', sensit_type)
 
+    tile_sets = [set1, set2] if set3 == None else [set1, set2, set3]
 
-    out = Popen(['aws', 's3', 'ls', set1], stdout=PIPE, stderr=STDOUT)
-    stdout, stderr = out.communicate()
-    # Writes the output string to a text file for easier interpretation
-    set1_tiles = open("set1.txt", "wb")
-    set1_tiles.write(stdout)
-    set1_tiles.close()
+    # The first two folders fall back to their standard versions if there are no sensitivity tiles in them
+    if sensit_type == 'std':
+        fallback_sets = [set1, set2]
+    else:
+        fallback_sets = [tile_set.replace(sensit_type, 'standard') for tile_set in [set1, set2]]
+
+    # Lists all the folders (and the folders they may fall back to) at the same time
+    inventories = dict(zip(tile_sets + fallback_sets, s3_inventories(tile_sets + fallback_sets)))
+
+    all_tiles = []
 
-    out = Popen(['aws', 's3', 'ls', set2], stdout=PIPE, stderr=STDOUT)
-    stdout2, stderr2 = out.communicate()
-    # Writes the output string to a text file for easier interpretation
-    set2_tiles = open("set2.txt", "wb")
-    set2_tiles.write(stdout2)
-    set2_tiles.close()
+    for i, tile_set in enumerate(tile_sets):
 
-    # Empty lists for filling with biomass tile ids
-    file_list_set1 = []
-    file_list_set2 = []
+        file_list = inventory_tile_ids(inventories[tile_set])
 
-    # Iterates through the first text file to get the names of the tiles and appends them to list
-    with open("set1.txt", 'r') as tile:
+        if i < 2 and len(file_list) <= 1:
+            print_log("There are 0 tiles in {}. Looking for alternative tile set...".format(tile_set))
+            tile_set = fallback_sets[i]
+            print_log("  Looking for alternative tile set in {}".format(tile_set))
+            file_list = inventory_tile_ids(inventories[tile_set])
 
-        for line in tile:
-            num = len(line.strip('\n').split(" "))
-            tile_name = line.strip('\n').split(" ")[num - 1]
+        print_log("There are {} tiles in {}. Using this tile set.".format(len(file_list), tile_set))
 
-            # Only tifs will be in the tile list
-            if '.tif' in tile_name:
+        all_tiles = all_tiles + file_list
 
-                tile_id = get_tile_id(tile_name)
-                file_list_set1.append(tile_id)
+    # Tile list with tiles found in multiple lists removed, in tile id order
+    return sorted(set(all_tiles))
 
-    # Iterates through the second text file to get the names of the tiles and appends them to list
-    with open("set2.txt", 'r') as tile:
 
-        for line in tile:
-            num = len(line.strip('\n').split(" "))
-            tile_name = line.strip('\n').split(" ")[num - 1]
+# Counts the number of tiles in a folder in s3
+def count_tiles_s3(source, pattern=None):
 
-            # Only tifs will be in the tile list
-            if '.tif' in tile_name:
+    # Count of tiles (ends in *tif)
+    return len(inventory_tile_ids(s3_inventory(source), pattern))
 
-                tile_id = get_tile_id(tile_name)
-                file_list_set2.append(tile_id)
 
-    if len(file_list_set1) > 1:
-        print_log("There are {} tiles in {}. Using this tile set.".format(len(file_list_set1), set1))
-    else:
-        print_log("There are 0 tiles in {}. Looking for alternative tile set...".format(set1))
-        set1 = set1.replace(sensit_type, 'standard')
-        print_log("  Looking for alternative tile set in {}".format(set1))
 
-        out = Popen(['aws', 's3', 'ls', set1], stdout=PIPE, stderr=STDOUT)
-        stdout, stderr = out.communicate()
-        # Writes the output string to a text file for easier interpretation
-        set1_tiles = open("set1.txt", "wb")
-        set1_tiles.write(stdout)
-        set1_tiles.close()
+# Name of a tile of a given type
+def tile_name(tile_id, pattern):
 
-        # Empty lists for filling with biomass tile ids
-        file_list_set1 = []
+    # For tiles that do not have the tile_id first
+    if pattern in [cn.pattern_gain, cn.pattern_tcd, cn.pattern_pixel_area, cn.pattern_loss]:
+        return '{0}_{1}.tif'.format(pattern, tile_id)
 
-        # Iterates through the first text file to get the names of the tiles and appends them to list
-        with open("set1.txt", 'r') as tile:
+    # For every other type of tile
+    return '{0}_{1}.tif'.format(tile_id, pattern)
 
-            for line in tile:
-                num = len(line.strip('\n').split(" "))
-                tile_name = line.strip('\n').split(" ")[num - 1]
 
-                # Only tifs will be in the tile list
-                if '.tif' in tile_name:
-                    tile_id = get_tile_id(tile_name)
-                    file_list_set1.append(tile_id)
+# Compiles a dictionary of integer codes (e.g., continent-ecozone codes) and their values (e.g., removal factors)
+# into a lookup array, where the value for each code is at the index of that code.
+# Codes that aren't in the dictionary get the default value. If the default is None, they keep their own code as
+# their value, as when the values in an array are replaced key by key (array[array == key] = value).
+def lookup_table(code_dict, default=0, dtype='float32'):
 
-        print_log("There are {} tiles in {}. Using this tile set.".format(len(file_list_set1), set1))
+    codes = np.array([int(key) for key in code_dict.keys()], dtype='int64')
 
-    if len(file_list_set2) > 1:
-        print_log("There are {} tiles in {}. Using this tile set.".format(len(file_list_set2), set2))
+    if default is None:
+        table = np.arange(codes.max() + 1).astype(dtype)
     else:
-        print_log("There are 0 tiles in {}. Looking for alternative tile set.".format(set2))
-        set2 = set2.replace(sensit_type, 'standard')
-        print_log("  Looking for alternative tile set in {}".format(set2))
+        table = np.full(codes.max() + 1, default, dtype=dtype)
 
-        out = Popen(['aws', 's3', 'ls', set2], stdout=PIPE, stderr=STDOUT)
-        stdout2, stderr2 = out.communicate()
-        # Writes the output string to a text file for easier interpretation
-        set2_tiles = open("set2.txt", "wb")
-        set2_tiles.write(stdout2)
-        set2_tiles.close()
+    table[codes] = np.array(list(code_dict.values()), dtype=dtype)
 
-        file_list_set2 = []
+    return table
 
-        # Iterates through the second text file to get the names of the tiles and appends them to list
-        with open("set2.txt", 'r') as tile:
 
-            for line in tile:
-                num = len(line.strip('\n').split(" "))
-                tile_name = line.strip('\n').split(" ")[num - 1]
+# Reclassifies an array of codes with a lookup array made by lookup_table in a single gather,
+# rather than one pass over the array for each code.
+# Codes beyond the end of the lookup array (or negative) get the default value, or keep their code if the default is None.
+def reclassify(codes, table, default=0):
 
-                # Only tifs will be in the tile list
-                if '.tif' in tile_name:
-                    tile_id = get_tile_id(tile_name)
-                    file_list_set2.append(tile_id)
+    codes = codes.astype('int64', copy=False)
 
-        print_log("There are {} tiles in {}. Using this tile set.".format(len(file_list_set2), set2))
+    in_table = (codes >= 0) & (codes < table.size)
+    values = table[np.where(in_table, codes, 0)]
 
-    # If there's a third folder supplied, iterates through that
-    if set3 != None:
+    if default is None:
+        return np.where(in_table, values, codes.astype(table.dtype))
 
-        print_log("Third set of tiles input. Adding to first two sets of tiles...")
+    return np.where(in_table, values, np.array(default, dtype=table.dtype))
 
-        if sensit_type == 'std':
-            set3 = set3
-        else:
-            set3 = set3.replace('standard', sensit_type)
 
-        out = Popen(['aws', 's3', 'ls', set3], stdout=PIPE, stderr=STDOUT)
-        stdout3, stderr3 = out.communicate()
-        # Writes the output string to a text file for easier interpretation
-        set3_tiles = open("set3.txt", "wb")
-        set3_tiles.write(stdout3)
-        set3_tiles.close()
+# Lookup array for a decision tree over up to 8 true/false conditions, for use with classify_conditions.
+# rule is called with one bool for each condition (in the order the conditions will be given to classify_conditions)
+# for every combination of the conditions, and returns the class for that combination.
+def decision_tree_table(rule, n_conditions, dtype='uint8'):
 
-        file_list_set3 = []
+    table = np.zeros(2 ** n_conditions, dtype=dtype)
 
-        # Iterates through the text file to get the names of the tiles and appends them to list
-        with open("set3.txt", 'r') as tile:
+    for code in range(2 ** n_conditions):
+        table[code] = rule(*[bool((code >> bit) & 1) for bit in range(n_conditions)])
 
-            for line in tile:
-                num = len(line.strip('\n').split(" "))
-                tile_name = line.strip('\n').split(" ")[num - 1]
+    return table
 
-                # Only tifs will be in the tile list
-                if '.tif' in tile_name:
-                    tile_id = get_tile_id(tile_name)
-                    file_list_set3.append(tile_id)
 
-        print_log("There are {} tiles in {}".format(len(file_list_set3), set3))
+# Classifies pixels by a decision tree in one pass: the conditions (boolean arrays) of each pixel are packed into
+# the bits of one code and the code is looked up in an array made by decision_tree_table.
+# This replaces a series of array[np.where(condition & condition & ...)] = class statements, each of which
+# rebuilds the same conditions over the whole window.
+def classify_conditions(conditions, table):
 
-    # Combines both tile lists
-    all_tiles = file_list_set1 + file_list_set2
+    code = np.zeros(conditions[0].shape, dtype='uint8')
 
-    # If a third directory is supplied, the tiles from that list are added to the list from the first two
-    if set3 != None:
+    for bit, condition in enumerate(conditions):
+        code |= condition.view('uint8') << bit
 
-        all_tiles = all_tiles + file_list_set3
+    return table[code]
 
-    # Tile list with tiles found in multiple lists removed, so now duplicates are gone
-    unique_tiles = list(set(all_tiles))
 
-    # Converts the set to a pandas dataframe to put the tiles in the correct order
-    df = pd.DataFrame(unique_tiles, columns=['tile_id'])
-    df = df.sort_values(by=['tile_id'])
+# Operators that evaluate_expression supports, the ufuncs that apply them to arrays
+# and the Python operators that apply them to scalars
+expression_ufuncs = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.true_divide}
+expression_scalar_operators = {np.add: operator.add, np.subtract: operator.sub, np.multiply: operator.mul,
+                               np.true_divide: operator.truediv}
 
-    # Converts the pandas dataframe to a Python list
-    unique_tiles_ordered_list = df.tile_id.tolist()
 
-    # Removes the text files with the lists of tiles
-    set_txt = glob.glob("set*.txt")
-    for i in set_txt:
-        os.remove(i)
+# Parses an arithmetic expression of operand names, numbers, +, -, *, / and parentheses into nested tuples:
+# ('name', name), ('number', value) or (ufunc, left, right).
+# Each expression is only parsed once per process.
+@lru_cache(maxsize=None)
+def parse_expression(expression):
 
-    return unique_tiles_ordered_list
+    return parse_expression_node(ast.parse(expression, mode='eval').body)
 
 
-# Counts the number of tiles in a folder in s3
-def count_tiles_s3(source, pattern=None):
+def parse_expression_node(node):
 
-    ## For an s3 folder in a bucket using AWSCLI
-    # Captures the list of the files in the folder
-    out = Popen(['aws', 's3', 'ls', source], stdout=PIPE, stderr=STDOUT)
-    stdout, stderr = out.communicate()
-
-    # Writes the output string to a text file for easier interpretation
-    tile_list_name = "tiles.txt"
-    tile_file = open(os.path.join(cn.docker_tmp, tile_list_name), "wb")
-    tile_file.write(stdout)
-    tile_file.close()
-
-    file_list = []
-
-    # Iterates through the text file to get the names of the tiles and appends them to list
-    with open(os.path.join(cn.docker_tmp, tile_list_name), 'r') as tile:
-        for line in tile:
-            num = len(line.strip('\n').split(" "))
-            tile_name = line.strip('\n').split(" ")[num - 1]
-
-            # For gain, tcd, and pixel area tiles, which have the tile_id after the the pattern
-            if pattern in [cn.pattern_gain, cn.pattern_tcd, cn.pattern_pixel_area, cn.pattern_loss]:
-                if tile_name.endswith('.tif'):
-                    tile_id = get_tile_id(tile_name)
-                    file_list.append(tile_id)
-
-            # If the counted tiles have to have a specific pattern
-            elif pattern != None:
-                if tile_name.endswith('{}.tif'.format(pattern)):
-                    tile_id = get_tile_id(tile_name)
-                    file_list.append(tile_id)
-
-            # If the counted tiles just have to be tifs
-            else:
-                if tile_name.endswith('.tif'):
-                    tile_id = get_tile_id(tile_name)
-                    file_list.append(tile_id)
+    if isinstance(node, ast.BinOp) and type(node.op) in expression_ufuncs:
+        return (expression_ufuncs[type(node.op)], parse_expression_node(node.left), parse_expression_node(node.right))
+
+    if isinstance(node, ast.Name):
+        return ('name', node.id)
+
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return ('number', node.value)
+
+    raise ValueError('Unsupported expression element: {}'.format(ast.dump(node)))
+
+
+# A stand-in for the value of part of an expression: the value itself if it doesn't involve any arrays
+# (so that it's calculated in Python, as it would be in a normal expression), or a one-pixel array of the
+# dtype numpy would give that part of the expression.
+def expression_sample(node, operands):
+
+    if node[0] == 'name':
+        operand = operands[node[1]]
+        return np.ones(1, dtype=operand.dtype) if isinstance(operand, np.ndarray) else operand
+
+    if node[0] == 'number':
+        return node[1]
+
+    left = expression_sample(node[1], operands)
+    right = expression_sample(node[2], operands)
+
+    if not isinstance(left, np.ndarray) and not isinstance(right, np.ndarray):
+        return expression_scalar_operators[node[0]](left, right)
+
+    with np.errstate(all='ignore'):
+        return np.ones(1, dtype=node[0](left, right).dtype)
 
-    # Count of tiles (ends in *tif)
-    return len(file_list)
 
+# Evaluates part of an expression, writing the result of its last operator into target if target has the right dtype
+# and otherwise into a new array. Returns the operand itself for names and numbers.
+def evaluate_expression_node(node, target, shape, where, operands):
+
+    if node[0] == 'name':
+        return operands[node[1]]
+
+    if node[0] == 'number':
+        return node[1]
+
+    sample = expression_sample(node, operands)
+
+    # Parts of the expression without arrays are calculated in Python
+    if not isinstance(sample, np.ndarray):
+        return sample
+
+    if target is None or target.dtype != sample.dtype:
+        target = np.empty(shape, dtype=sample.dtype)
+
+    # The left side can be calculated in this part's output array, since each pixel of the output only depends
+    # on the same pixel of the sides. The right side can, too, if the left side doesn't need it.
+    left = evaluate_expression_node(node[1], target, shape, where, operands)
+    right = evaluate_expression_node(node[2], None if left is target else target, shape, where, operands)
+
+    node[0](left, right, out=target, where=where)
+
+    return target
+
+
+# Evaluates an arithmetic expression of arrays and scalars (e.g., 'in_window * pixel_area_window / m2_per_ha')
+# with one ufunc per operator writing into output arrays, rather than a new full-size array for each operator.
+# Operators are applied in the same order and with the same dtypes as in the same expression written with numpy arrays,
+# so the results are identical. Only the pixels where `where` is True are calculated and written to out;
+# the other pixels of out are left as they are, so successive calls can overlay values in priority order.
+# If out isn't given, it's created with 0s and the expression's dtype.
+# Results are cast to the dtype of out, as with astype().
+def evaluate_expression(expression, out=None, where=True, **operands):
+
+    tree = parse_expression(expression)
+
+    arrays = [operand for operand in operands.values() if isinstance(operand, np.ndarray)]
+    if isinstance(where, np.ndarray):
+        arrays.append(where)
+    shape = np.broadcast(*arrays).shape if len(arrays) > 1 else arrays[0].shape
+
+    sample = expression_sample(tree, operands)
+
+    if out is None:
+        out = np.zeros(shape, dtype=np.asarray(sample).dtype)
+
+    # Intermediate results can't be written into out if out is also one of the operands
+    target = None if any(np.shares_memory(out, array) for array in arrays) else out
+
+    result = evaluate_expression_node(tree, target, shape, where, operands)
+
+    if result is not out:
+        np.copyto(out, result, casting='unsafe', where=where)
+
+    return out
 
 
 # Gets the bounding coordinates of a tile
@@ -644,10 +1029,7 @@ def s3_flexible_download(source_dir, pattern, dest, sensit_type, tile_id_list):
 
         # Creates a full download name (path and file)
         for tile_id in tile_id_list:
-            if pattern in [cn.pattern_gain, cn.pattern_tcd, cn.pattern_pixel_area, cn.pattern_loss]:   # For tiles that do not have the tile_id first
-                source = '{0}{1}_{2}.tif'.format(source_dir, pattern, tile_id)
-            else:  # For every other type of tile
-                source = '{0}{1}_{2}.tif'.format(source_dir, tile_id, pattern)
+            source = '{0}{1}'.format(source_dir, tile_name(tile_id, pattern))
 
             s3_file_download(source, dest, sensit_type)
 
@@ -660,19 +1042,10 @@ def s3_flexible_download(source_dir, pattern, dest, sensit_type, tile_id_list):
 # Source=source file on s3
 # dest=where to download onto spot machine
 # sensit_type = whether the model is standard or a sensitivity analysis model run
+# Each tile goes through the local tile cache, so tiles already on the spot machine with the same ETag and size
+# as on s3 are not downloaded again and only missing or changed tiles are downloaded.
 def s3_folder_download(source, dest, sensit_type, pattern = None):
 
-    # The number of tiles with the given pattern on the spot machine.
-    # Special cases are below.
-    local_tile_count = len(glob.glob('*{}*.tif'.format(pattern)))
-
-    # For tile types that have the tile_id after the pattern
-    if pattern in [cn.pattern_gain, cn.pattern_tcd, cn.pattern_pixel_area, cn.pattern_loss]:
-
-        local_tile_count = len(glob.glob('{}*.tif'.format(pattern)))
-
-    print_log("There are", local_tile_count, "tiles on the spot machine with the pattern", pattern)
-
     # Changes the path to download from based on the sensitivity analysis being run and whether that particular input
     # has a sensitivity analysis path on s3
     if sensit_type != 'std':
@@ -686,73 +1059,26 @@ def s3_folder_download(source, dest, sensit_type, pattern = None):
         s3_count_sens = count_tiles_s3(source_sens)
         print_log("There are", s3_count_sens, "tiles in sensitivity analysis folder", source_sens, "with the pattern", pattern)
 
-        # Counts how many tiles are in the standard model source s3 folder
-        s3_count_std = count_tiles_s3(source)
-        print_log("There are", s3_count_std, "tiles in standard model folder", source, "with the pattern", pattern)
-
-        # Decides which source folder to use the count from: standard model or sensitivity analysis.
-        # If there are sensitivity analysis tiles, that source folder should be used.
-        # Otherwise, the standard folder should be used.
-        if s3_count_sens != 0:
-            s3_count = s3_count_sens
-            source_final = source_sens
-        else:
-            s3_count = s3_count_std
-            source_final = source
-
-        # If there are as many tiles on the spot machine with the relevant pattern as there are on s3, no tiles are downloaded
-        if local_tile_count == s3_count:
-            print_log("Tiles with pattern", pattern, "are already on spot machine. Not downloading.", '\n')
-            return
-
         # If there appears to be a full set of tiles in the sensitivity analysis folder (7 is semi arbitrary),
-        # the sensitivity folder is downloaded
-        if s3_count > 7:
-
-            print_log("Source directory used:", source_final)
-
-            cmd = ['aws', 's3', 'cp', source_final, dest, '--recursive', '--exclude', '*tiled/*',
-                   '--exclude', '*geojason', '--exclude', '*vrt', '--exclude', '*csv', '--no-progress']
-            log_subprocess_output_full(cmd)
-
-            print_log('\n')
-
+        # the sensitivity folder is downloaded.
         # If there are fewer than 7 files in the sensitivity folder (i.e., either folder doesn't exist or it just has
         # a few test tiles), the standard folder is downloaded.
         # This can happen despite it being a sensitivity run because this input file type doesn't have a sensitivity version
         # for this date.
+        if s3_count_sens > 7:
+            source_final = source_sens
         else:
-
-            print_log("Source directory used:", source)
-
-            cmd = ['aws', 's3', 'cp', source, dest, '--recursive', '--exclude', '*tiled/*',
-                   '--exclude', '*geojason', '--exclude', '*vrt', '--exclude', '*csv', '--no-progress']
-            log_subprocess_output_full(cmd)
-
-            print_log('\n')
+            source_final = source
 
     # For the standard model, the standard folder is downloaded.
     else:
+        source_final = source
 
-        # Counts how many tiles are in the source s3 folder
-        s3_count = count_tiles_s3(source, pattern=pattern)
-        print_log("There are", s3_count, "tiles at", source, "with the pattern", pattern)
+    print_log("Source directory used:", source_final)
 
-        # If there are as many tiles on the spot machine with the relevant pattern as there are on s3, no tiles are downloaded
-        if local_tile_count == s3_count:
-            print_log("Tiles with pattern", pattern, "are already on spot machine. Not downloading.", '\n')
-            return
-
-        print_log("Tiles with pattern", pattern, "are not on spot machine. Downloading...")
-
-        cmd = ['aws', 's3', 'cp', source, dest, '--recursive', '--exclude', '*tiled/*',
-               '--exclude', '*geojason', '--exclude', '*vrt', '--exclude', '*csv', '--no-progress']
-
-        # cmd = ['aws', 's3', 'cp', source, dest, '--recursive',
-        #        '--exclude', '*', '--include', '{}'.format(pattern), '--no-progress']
-        log_subprocess_output_full(cmd)
+    s3_cached_folder_download(source_final, dest)
 
-        print_log('\n')
+    print_log('\n')
 
 
 # Downloads individual tiles from s3
@@ -761,8 +1087,6 @@ def s3_folder_download(source, dest, sensit_type, pattern = None):
 # sensit_type = whether the model is standard or a sensitivity analysis model run
 def s3_file_download(source, dest, sensit_type):
 
-    s3 = boto3.resource('s3')
-
     # Retrieves the s3 directory and name of the tile from the full path name
     dir = get_tile_dir(source)
     file_name = get_tile_name(source)
@@ -770,130 +1094,476 @@ def s3_file_download(source, dest, sensit_type):
     # Changes the file to download based on the sensitivity analysis being run and whether that particular input
     # has a sensitivity analysis path on s3.
     # Files that have standard and sensitivity analysis variants are handled differently from ones without variants
-    # Hierarchy for getting tiles (start with #1, end with #4):
-    # 1. Use sensitivity tile if already downloaded
-    # 2. Download sensitivity if it exists
-    # 3. Use standard tile if already downloaded
-    # 4. Download standard tile if it exists
+    # Hierarchy for getting tiles (start with #1, end with #2):
+    # 1. Use sensitivity tile, from s3 (through the tile cache) or made on the spot machine
+    # 2. Use standard tile, from s3 (through the tile cache) or made on the spot machine
     if sensit_type != 'std' and 'standard' in dir:
 
         # Creates directory and file names according to sensitivity analysis type
         dir_sens = dir.replace('standard', sensit_type)
         file_name_sens = file_name[:-4] + '_' + sensit_type + '.tif'
 
-        # Doesn't download the tile if sensitivity version is already on the spot machine
-        print_log("Option 1: Checking if {} is already on spot machine...".format(file_name_sens))
-        if os.path.exists(file_name_sens):
-            print_log("  Option 1 success:", file_name_sens, "already downloaded" + "\n")
+        print_log("Option 1: Checking for sensitivity analysis tile {0}/{1}...".format(dir_sens[15:], file_name_sens))
+        if s3_cached_file_download('{0}/{1}'.format(dir_sens, file_name_sens), dest):
+            print_log("  Option 1 success: Sensitivity analysis tile {0}/{1} is on spot machine".format(dir_sens, file_name_sens) + "\n")
             return
         else:
-            print_log("  Option 1 failure: {0} is not already on spot machine.".format(file_name_sens))
-            print_log("Option 2: Checking for sensitivity analysis tile {0}/{1} on s3...".format(dir_sens[15:], file_name_sens))
-
-        # If not already downloaded, first tries to download the sensitivity analysis version
-        try:
-            # Determines which bucket to check
-            if 'gfw-data-lake' in source:
-                bucket = 'gfw-data-lake'
-                folder = source[19:]
-            else:
-                bucket = 'gfw2-data'
-                folder = source[15:]
-            s3.Object(bucket, '{0}/{1}'.format(folder, file_name_sens)).load()
-            cmd = ['aws', 's3', 'cp', '{0}/{1}'.format(dir_sens, file_name_sens), dest, '--only-show-errors']
-            log_subprocess_output_full(cmd)
-            print_log("  Option 2 success: Sensitivity analysis tile {0}/{1} found on s3 and downloaded".format(dir_sens, file_name_sens))
-            print_log("")
-            return
-        except botocore.exceptions.ClientError as e:
-            if e.response['Error']['Code'] == "404":
-                print_log("  Option 2 failure: Tile {0}/{1} not found on s3. Looking for standard model source...".format(dir_sens, file_name_sens))
-            else:
-                print_log("  Option 2 failure: Some other error occurred while looking for {0}/{1}".format(dir_sens, file_name_sens))
+            print_log("  Option 1 failure: Tile {0}/{1} not found. Looking for standard model source...".format(dir_sens, file_name_sens))
 
-        # Next option is to use standard version of tile if on spot machine.
+        # Next option is to use standard version of tile.
         # This can happen despite it being a sensitivity run because this input file doesn't have a sensitivity version
         # for this date.
-        print_log("Option 3: Checking if standard version {} is already on spot machine...".format(file_name))
-        if os.path.exists(file_name):
-            print_log("  Option 3 success:", file_name, "already downloaded" + "\n")
+        # If this doesn't work, no variant of this tile was found.
+        print_log("Option 2: Checking for standard version {}...".format(source))
+        if s3_cached_file_download(source, dest):
+            print_log("  Option 2 success: Standard tile {} is on spot machine".format(source) + "\n")
             return
         else:
-            print_log("  Option 3 failure: {} is not already on spot machine. ".format(file_name))
-            print_log("Option 4: Looking for standard version of {} to download...".format(file_name))
-
-        # If not already downloaded, final optionis to try to download the standard version of the tile.
-        # If this doesn't work, the script throws a fatal error because no variant of this tile was found.
-        try:
-            # Determines which bucket to check
-            if 'gfw-data-lake' in source:
-                bucket = 'gfw-data-lake'
-                folder = source[19:]
-            else:
-                bucket = 'gfw2-data'
-                folder = source[15:]
-            # Based on https://www.thetopsites.net/article/50187246.shtml#:~:text=Fastest%20way%20to%20find%20out,does%20not%20exist%22%20if%20s3.
-            s3.Object(bucket, folder).load()
-            cmd = ['aws', 's3', 'cp', source, dest, '--only-show-errors']
-            log_subprocess_output_full(cmd)
-            print_log("  Option 4 success: Standard tile {} found on s3 and downloaded".format(source))
-            print_log("")
-            return
-        except botocore.exceptions.ClientError as e:
-            if e.response['Error']['Code'] == "404":
-                print_log("  Option 4 failure: Tile {0} not found on s3. Tile not found but it seems it should be. Check file paths and names.".format(source))
-            else:
-                print_log("  Option 4 failure: Some other error occurred while looking for {0}".format(source))
-            print_log("")
+            print_log("  Option 2 failure: Tile {0} not found. Tile not found but it seems it should be. Check file paths and names.".format(source) + "\n")
 
     # If not a sensitivity run or a tile type without sensitivity analysis variants, the standard file is downloaded
     else:
-        print_log("Option 1: Checking if {} is already on spot machine...".format(file_name))
-        if os.path.exists(os.path.join(dest, file_name)):
-            print_log("  Option 1 success:", os.path.join(dest, file_name), "already downloaded" + "\n")
+        source = os.path.join(dir, file_name)
+
+        print_log("Option 1: Checking for tile {}...".format(source))
+        if s3_cached_file_download(source, dest):
+            print_log("  Option 1 success: Tile {} is on spot machine".format(source) + "\n")
             return
         else:
-            print_log("  Option 1 failure: {0} is not already on spot machine.".format(file_name))
-            print_log("Option 2: Checking for tile {} on s3...".format(source))
+            print_log("  Option 1 failure: Tile {0} not found. Tile not found but it seems it should be. Check file paths and names.".format(source) + "\n")
 
-        source = os.path.join(dir, file_name)
+
+# s3 client shared by all transfers in this process, with a connection pool large enough for all transfer threads.
+# botocore's own retries are turned off (in the pinned botocore, max_attempts counts retries after the first request)
+# so that failed requests are only retried by the backoff loop in s3_transfer.
+# Clients can't be shared across processes, so each process (e.g., each pool worker) makes its own.
+s3_clients = {}
+def s3_client():
+
+    if os.getpid() not in s3_clients:
+        config = botocore.config.Config(max_pool_connections=cn.s3_part_threads * cn.s3_concurrent_tiles,
+                                        retries={'max_attempts': 0})
+        s3_clients[os.getpid()] = boto3.session.Session().client('s3', config=config)
+
+    return s3_clients[os.getpid()]
+
+
+# Multipart settings for s3 transfers. Tiles larger than the threshold are downloaded as parallel ranged GETs
+# and uploaded as parallel multipart uploads.
+def s3_transfer_config():
+
+    return boto3.s3.transfer.TransferConfig(multipart_threshold=cn.s3_multipart_mb * 1024 * 1024,
+                                            multipart_chunksize=cn.s3_multipart_mb * 1024 * 1024,
+                                            max_concurrency=cn.s3_part_threads, use_threads=True)
+
+
+# Runs an s3 transfer, retrying with exponential backoff (plus some jitter so that many processes don't retry at once)
+# if the whole transfer fails. Reports the throughput of the transfer.
+def s3_transfer(transfer_fx, local_file, s3_path, direction, report):
+
+    for attempt in range(cn.s3_transfer_attempts):
+
+        start = time.time()
 
         try:
-            # Determines which bucket to check
-            if 'gfw-data-lake' in source:
-                bucket = 'gfw-data-lake'
-                folder = source[19:]
-            else:
-                bucket = 'gfw2-data'
-                folder = source[15:]
-            # Based on https://www.thetopsites.net/article/50187246.shtml#:~:text=Fastest%20way%20to%20find%20out,does%20not%20exist%22%20if%20s3.
-            s3.Object(bucket, folder).load()
-            cmd = ['aws', 's3', 'cp', source, dest, '--only-show-errors']
-            log_subprocess_output_full(cmd)
-            print_log("  Option 2 success: Tile {} found on s3 and downloaded".format(source) + "\n")
-            print_log("")
-            return
-        except botocore.exceptions.ClientError as e:
-            if e.response['Error']['Code'] == "404":
-                print_log("  Option 2 failure: Tile {0} not found on s3. Tile not found but it seems it should be. Check file paths and names.".format(source) + "\n")
-            else:
-                print_log("  Option 2 failure: Some other error occurred while looking for {0}".format(source) + "\n")
+            transfer_fx()
+            break
+        except Exception as e:
+            if attempt == cn.s3_transfer_attempts - 1:
+                print_log("  {0} of {1} failed after {2} attempts: {3}".format(direction, s3_path, cn.s3_transfer_attempts, e))
+                raise
+            wait = 2 ** attempt + random()
+            print_log("  {0} of {1} failed ({2}). Retrying in {3:.1f} seconds...".format(direction, s3_path, e, wait))
+            time.sleep(wait)
+
+    elapsed = max(time.time() - start, 0.001)
+    size_mb = os.path.getsize(local_file) / 1024 / 1024
+
+    if report:
+        print_log("  {0} {1}: {2:.0f} MB in {3:.1f} s ({4:.0f} MB/s)".format(direction, s3_path, size_mb, elapsed, size_mb / elapsed))
+
+    return size_mb
+
+
+# Downloads an s3 object to a local file
+def s3_download(s3_path, local_file, report=True):
+
+    bucket, key = split_s3_path(s3_path)
+
+    return s3_transfer(lambda: s3_client().download_file(bucket, key, local_file, Config=s3_transfer_config()),
+                       local_file, s3_path, 'Download', report)
+
+
+# Uploads a local file to an s3 path (including the file name)
+def s3_upload(local_file, s3_path, report=True):
+
+    bucket, key = split_s3_path(s3_path)
+
+    size_mb = s3_transfer(lambda: s3_client().upload_file(local_file, bucket, key, Config=s3_transfer_config()),
+                          local_file, s3_path, 'Upload', report)
+
+    # The folder's listing no longer includes everything in it
+    invalidate_s3_inventory(s3_path)
+
+    return size_mb
+
+
+# Runs a set of downloads or uploads, several at once, and reports the overall throughput.
+# transfers is a list of (source, destination) pairs for the transfer function (s3_download or s3_upload).
+# All transfers are attempted even if some fail. The failures are then listed and an error is raised,
+# so that an incomplete set isn't taken for a complete one.
+def s3_transfer_set(transfer_fx, transfers):
+
+    start = time.time()
+
+    with ThreadPoolExecutor(max_workers=cn.s3_concurrent_tiles) as executor:
+        results = [(transfer, executor.submit(transfer_fx, transfer[0], transfer[1])) for transfer in transfers]
+
+    sizes_mb = []
+    failures = []
+    for transfer, result in results:
+        try:
+            sizes_mb.append(result.result())
+        except Exception as e:
+            failures.append((transfer, e))
+
+    elapsed = max(time.time() - start, 0.001)
+    print_log("  Transferred {0} files ({1:.0f} MB) in {2:.1f} s ({3:.0f} MB/s)".format(
+        len(sizes_mb), sum(sizes_mb), elapsed, sum(sizes_mb) / elapsed))
+
+    if failures:
+        for transfer, e in failures:
+            print_log("  Failed to transfer {0} to {1}: {2}".format(transfer[0], transfer[1], e))
+        raise RuntimeError("{0} of {1} transfers failed".format(len(failures), len(transfers)))
+
+
+# Splits an s3 path into its bucket and key
+def split_s3_path(s3_path):
+
+    bucket, key = s3_path.replace('s3://', '', 1).split('/', 1)
+
+    return bucket, key
+
+
+# Name of the cached copy of an s3 object. Any change to the object on s3 changes its ETag or size and thus its cache name.
+def tile_cache_key(bucket, key, etag, size):
+
+    return hashlib.sha1('{0}/{1}|{2}|{3}'.format(bucket, key, etag.strip('"'), size).encode()).hexdigest()
+
+
+# Runs a function on the tile cache manifest while holding a lock on it, so that processes and runs sharing
+# the cache don't overwrite each other's changes. The function gets the manifest dictionary and can modify it.
+# The manifest has the cached tiles ('tiles'), keyed by cache key, with the s3 path, ETag, size and last use of each,
+# and the files placed in the tile folder from the cache ('placed'), keyed by path (see record_tile_placement).
+def update_tile_cache_manifest(update_fx):
+
+    os.makedirs(cn.tile_cache_dir, exist_ok=True)
+    manifest_path = os.path.join(cn.tile_cache_dir, cn.tile_cache_manifest)
+
+    with open('{}.lock'.format(manifest_path), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        try:
+            with open(manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+        except:
+            manifest = {}
+
+        # Manifests from before placements were recorded only have the cached tiles
+        if 'tiles' not in manifest:
+            manifest = {'tiles': manifest, 'placed': {}}
+
+        output = update_fx(manifest)
+
+        # Writes to a temporary file first so that an interrupted write doesn't corrupt the manifest
+        with open('{}.tmp'.format(manifest_path), 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace('{}.tmp'.format(manifest_path), manifest_path)
+
+        fcntl.flock(lock, fcntl.LOCK_UN)
+
+    return output
+
+
+# Evicts the least recently used tiles until the cache is under its maximum size.
+# Tiles that are also linked into the tile folder only free space once the tile folder copy is deleted, too.
+# keep is the cache key of a tile that must not be evicted.
+def evict_tile_cache(manifest, keep):
+
+    max_bytes = cn.tile_cache_max_gb * 1024 * 1024 * 1024
+    cached_tiles = manifest['tiles']
+    cache_bytes = sum(entry['size'] for entry in cached_tiles.values())
+
+    for cache_key in sorted(cached_tiles, key=lambda cached: cached_tiles[cached]['last_used']):
+
+        if cache_bytes <= max_bytes:
+            break
+
+        # The tile that was just added is kept even if it alone is larger than the cache
+        if cache_key == keep:
+            continue
+
+        try:
+            os.remove(os.path.join(cn.tile_cache_dir, '{}.tif'.format(cache_key)))
+        except FileNotFoundError:
+            pass
+
+        cache_bytes = cache_bytes - cached_tiles[cache_key]['size']
+        print_log("  Evicted {} from tile cache".format(cached_tiles[cache_key]['s3_path']))
+        del cached_tiles[cache_key]
+
+
+# Inode, size and modification time of a file in the tile folder. A file that has been replaced or rewritten since
+# it was placed from the tile cache (e.g., by a model stage) no longer has the identity recorded when it was placed.
+def file_identity(local_file):
+
+    file_stat = os.stat(local_file)
+
+    return [file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns]
+
+
+# Records in the manifest that a file in the tile folder was placed from a cached tile,
+# with the s3 object's ETag and size and the file's identity
+def record_tile_placement(manifest, local_file, s3_path, etag, size, cache_key):
+
+    manifest['placed'][os.path.abspath(local_file)] = {'s3_path': s3_path, 'etag': etag.strip('"'), 'size': size,
+                                                       'cache_key': cache_key, 'identity': file_identity(local_file)}
+
+
+# The manifest's record of a file in the tile folder, if the file is still the one that was placed from the tile cache.
+# Otherwise (e.g., the file was made on the spot machine or has been changed since it was placed), None.
+def tile_placement(manifest, local_file):
+
+    placement = manifest['placed'].get(os.path.abspath(local_file))
+
+    if placement is None:
+        return None
+
+    # Records of files that have been deleted or changed since they were placed are dropped
+    if not os.path.exists(local_file) or placement['identity'] != file_identity(local_file):
+        del manifest['placed'][os.path.abspath(local_file)]
+        return None
+
+    return placement
+
+
+# Removes a file that was placed from the tile cache from the tile folder. Files made on the spot machine are kept.
+# With evict, the cached tile it was placed from is also removed from the cache, unless another placed file still uses
+# it, so that the disk space is actually freed (a hard-linked tile's space is only freed once all its links are gone).
+# Returns whether the file was removed.
+def remove_placed_tile(local_file, evict=False):
+
+    def remove(manifest):
+
+        placement = tile_placement(manifest, local_file)
+        if placement is None:
+            return False
+
+        os.remove(local_file)
+        del manifest['placed'][os.path.abspath(local_file)]
+
+        cache_key = placement['cache_key']
+        still_placed = any(other['cache_key'] == cache_key for other in manifest['placed'].values())
+
+        if evict and cache_key in manifest['tiles'] and not still_placed:
+            try:
+                os.remove(os.path.join(cn.tile_cache_dir, '{}.tif'.format(cache_key)))
+            except FileNotFoundError:
+                pass
+            print_log("  Evicted {} from tile cache".format(manifest['tiles'][cache_key]['s3_path']))
+            del manifest['tiles'][cache_key]
+
+        return True
+
+    return update_tile_cache_manifest(remove)
+
+
+# ETag that s3 has for an object with the contents of a local file, for checking files that weren't placed from the
+# tile cache against s3. Objects uploaded in parts have the MD5 of their parts' MD5s, followed by the number of parts.
+# The part size is the one (of this model's and the aws cli's) that gives the same number of parts as the ETag.
+# Returns None if the part size can't be worked out.
+def local_etag(local_file, etag):
+
+    etag = etag.strip('"')
+    size = os.path.getsize(local_file)
+
+    if '-' not in etag:
+        part_size = max(size, 1)
+    else:
+        part_count = int(etag.split('-')[1])
+        part_sizes = [part_mb * 1024 * 1024 for part_mb in [cn.s3_multipart_mb, 8]
+                      if -(-size // (part_mb * 1024 * 1024)) == part_count]
+        if not part_sizes:
+            return None
+        part_size = part_sizes[0]
+
+    part_md5s = []
+    with open(local_file, 'rb') as local:
+        for part in iter(lambda: local.read(part_size), b''):
+            part_md5s.append(hashlib.md5(part).digest())
+
+    if '-' not in etag:
+        return part_md5s[0].hex() if part_md5s else hashlib.md5(b'').hexdigest()
+
+    return '{0}-{1}'.format(hashlib.md5(b''.join(part_md5s)).hexdigest(), len(part_md5s))
+
+
+# Puts an s3 object on the spot machine through the tile cache.
+# A local file is only used as is if it's still the file that was placed from the cache for the current ETag and size
+# of the object, or if it has the object's size and ETag (e.g., it was made by an earlier model stage in this run and
+# uploaded). Anything else (e.g., a stale or partial file from an earlier run) is replaced.
+# The object is downloaded into the cache (if it isn't already there) and hard-linked into place.
+# Downloads go to a temporary name and are only renamed once complete, so a partial download is never used.
+# Returns whether the current version of the object is on the spot machine afterwards.
+def place_cached_tile(bucket, key, etag, size, local_file):
+
+    s3_path = 's3://{0}/{1}'.format(bucket, key)
+    cache_key = tile_cache_key(bucket, key, etag, size)
+    cache_file = os.path.join(cn.tile_cache_dir, '{}.tif'.format(cache_key))
+
+    if os.path.exists(local_file):
+
+        placement = update_tile_cache_manifest(lambda manifest: tile_placement(manifest, local_file))
+
+        if placement is not None and placement['cache_key'] == cache_key:
+            print_log("  {} already on spot machine and current with s3".format(local_file))
+            def touch(manifest):
+                if cache_key in manifest['tiles']:
+                    manifest['tiles'][cache_key]['last_used'] = time.time()
+            update_tile_cache_manifest(touch)
+            return True
+
+        # Out-of-date files are removed before the download, so that they aren't used if the download fails
+        if placement is not None:
+            print_log("  {} on spot machine is stale. Replacing it with current version from s3.".format(local_file))
+            remove_placed_tile(local_file)
+
+        elif os.path.getsize(local_file) == size and local_etag(local_file, etag) == etag.strip('"'):
+            print_log("  {} already on spot machine and matches s3. Using it.".format(local_file))
+            return True
+
+        else:
+            print_log("  {} on spot machine doesn't match s3. Replacing it with current version from s3.".format(local_file))
+            os.remove(local_file)
+
+    # Downloads the object into the cache if it isn't there already
+    if not os.path.exists(cache_file) or os.path.getsize(cache_file) != size:
+
+        os.makedirs(cn.tile_cache_dir, exist_ok=True)
+        partial_file = '{0}.{1}.partial'.format(cache_file, os.getpid())
+
+        try:
+            s3_download(s3_path, partial_file)
+        except Exception as e:
+            print_log("  Error downloading {0}: {1}".format(s3_path, e))
+
+        if not os.path.exists(partial_file) or os.path.getsize(partial_file) != size:
+            if os.path.exists(partial_file):
+                os.remove(partial_file)
+            print_log("  Download of {} incomplete. Not using it.".format(s3_path))
+            return False
+
+        os.replace(partial_file, cache_file)
+
+    # Records the tile in the manifest and evicts old tiles if the cache is too large
+    def add_to_manifest(manifest):
+        manifest['tiles'][cache_key] = {'s3_path': s3_path, 'etag': etag.strip('"'), 'size': size, 'last_used': time.time()}
+        evict_tile_cache(manifest, cache_key)
+    update_tile_cache_manifest(add_to_manifest)
+
+    # Links the cached tile into place under a temporary name and then renames it, so the tile appears all at once.
+    # Copies it if the cache is on a different volume than the tile folder.
+    tmp_local_file = '{0}.{1}.partial'.format(local_file, os.getpid())
+    try:
+        os.link(cache_file, tmp_local_file)
+    except OSError:
+        copyfile(cache_file, tmp_local_file)
+    os.replace(tmp_local_file, local_file)
+
+    update_tile_cache_manifest(lambda manifest: record_tile_placement(manifest, local_file, s3_path, etag, size, cache_key))
+
+    return True
+
+
+# Downloads a single s3 object onto the spot machine through the tile cache.
+# Returns True if the tile is on the spot machine afterwards: the current version from s3 or the cache, or a tile that
+# was made locally and isn't on s3. Returns False if it isn't on s3 and isn't on the spot machine, or if it couldn't
+# be downloaded (in which case any out-of-date copy on the spot machine has been removed).
+def s3_cached_file_download(source, dest):
+
+    bucket, key = split_s3_path(source)
+    local_file = os.path.join(dest, os.path.basename(key))
+
+    object_info = s3_object_info(source)
+
+    if object_info is None:
+        if os.path.exists(local_file):
+            print_log("  {} not on s3 but already on spot machine. Using it.".format(local_file))
+            return True
+        return False
+
+    size, etag = object_info
+
+    return place_cached_tile(bucket, key, etag, size, local_file)
+
+
+# Downloads all tifs in an s3 folder onto the spot machine through the tile cache.
+# Only tiles that are missing or changed on s3 are downloaded.
+def s3_cached_folder_download(source, dest):
+
+    bucket, prefix = split_s3_path(source)
+
+    paginator = s3_client().get_paginator('list_objects_v2')
+
+    tiles = []
+
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for s3_object in page.get('Contents', []):
+
+            key = s3_object['Key']
+
+            # Same files as were excluded from the recursive aws s3 cp of the folder
+            if not key.endswith('.tif') or 'tiled/' in key:
+                continue
+
+            local_file = os.path.join(dest, key[len(prefix):].lstrip('/'))
+            if os.path.dirname(local_file) != dest.rstrip('/'):
+                os.makedirs(os.path.dirname(local_file), exist_ok=True)
+
+            tiles.append((bucket, key, s3_object['ETag'], s3_object['Size'], local_file))
+
+    # Several tiles are placed at once. The manifest lock keeps their cache updates from colliding.
+    with ThreadPoolExecutor(max_workers=cn.s3_concurrent_tiles) as executor:
+        placed = list(executor.map(lambda tile: place_cached_tile(*tile), tiles))
+
+    for tile, tile_placed in zip(tiles, placed):
+        if not tile_placed:
+            print_log("  Failed to download s3://{0}/{1}".format(tile[0], tile[1]))
+
 
 # Uploads all tiles of a pattern to specified location
 def upload_final_set(upload_dir, pattern):
 
     print_log("Uploading tiles with pattern {0} to {1}".format(pattern, upload_dir))
 
-    cmd = ['aws', 's3', 'cp', cn.docker_base_dir, upload_dir, '--exclude', '*', '--include', '*{}*tif'.format(pattern),
-           '--recursive', '--no-progress']
+    tiles = glob.glob(os.path.join(cn.docker_base_dir, '*{}*tif'.format(pattern)))
+    transfers = [(tile, os.path.join(upload_dir, os.path.basename(tile))) for tile in tiles]
+
+    # Row counts saved for the tiles (e.g., model extent) are uploaded next to them
+    for tile in tiles:
+        transfers += row_counts_transfers(tile, upload_dir)
+
+    # Any failed upload stops the model after the rest of the set has been uploaded
     try:
-        log_subprocess_output_full(cmd)
+        s3_transfer_set(s3_upload, transfers)
         print_log("  Upload of tiles with {} pattern complete!".format(pattern))
     except:
         print_log("Error uploading output tile(s)")
+        raise
 
-    # Uploads the log as each model output tile set is finished
-    upload_log()
+    # Uploads the log as each model output tile set is finished, including when uploading the set failed
+    finally:
+        upload_log()
 
 
 # Uploads tile to specified location
@@ -902,10 +1572,9 @@ def upload_final(upload_dir, tile_id, pattern):
     file = '{}_{}.tif'.format(tile_id, pattern)
 
     print_log("Uploading {}".format(file))
-    cmd = ['aws', 's3', 'cp', file, upload_dir, '--no-progress']
 
     try:
-        log_subprocess_output_full(cmd)
+        s3_upload(file, os.path.join(upload_dir, file))
     except:
         print_log("Error uploading output tile")
 
@@ -935,16 +1604,419 @@ def check_and_delete_if_empty_light(tile_id, output_pattern):
     # os.remove("{0}{1}.aux.xml".format(cn.docker_base_dir, tile_name))
 
 
-# This version of checking for data in a tile is more robust
-def check_for_data(tile):
-    with rasterio.open(tile) as img:
-        msk = img.read_masks(1).astype(bool)
-    if msk[msk].size == 0:
-        # print_log("Tile {} is empty".format(tile))
+# Running statistics of the values written to a tile: the number of pixels with data (i.e., not NoData, as in the
+# tile's mask), the number of NaN pixels among them, and the min, max and sum of the other pixels with data
+def new_tile_stats():
+
+    return {'valid': 0, 'nan': 0, 'min': None, 'max': None, 'sum': 0.0}
+
+
+# Adds the values of an array (e.g., a window of a tile) to a tile's running statistics
+def update_tile_stats(stats, array, nodata):
+
+    if nodata is None:
+        data = array.ravel()
+    elif np.isnan(nodata):
+        data = array[~np.isnan(array)]
+    else:
+        data = array[array != nodata]
+
+    stats['valid'] += int(data.size)
+
+    if data.dtype.kind == 'f':
+        nan = np.isnan(data)
+        nan_count = int(np.count_nonzero(nan))
+        if nan_count > 0:
+            stats['nan'] += nan_count
+            data = data[~nan]
+
+    if data.size > 0:
+        data_min = data.min().item()
+        data_max = data.max().item()
+        stats['min'] = data_min if stats['min'] is None else min(stats['min'], data_min)
+        stats['max'] = data_max if stats['max'] is None else max(stats['max'], data_max)
+        stats['sum'] += float(data.sum(dtype='float64'))
+
+    return stats
+
+
+# Writes a window of a band 1 output tile and adds it to the tile's running statistics.
+# The window is converted to the tile's data type first so that the statistics are of the values in the tile.
+def write_window_with_stats(dst, array, window, stats):
+
+    array = array.astype(dst.dtypes[0], copy=False)
+    dst.write_band(1, array, window=window)
+    update_tile_stats(stats, array, dst.nodata)
+
+
+# Where the running statistics of a tile are saved
+def tile_stats_file(tile):
+
+    return os.path.join(cn.tile_sidecar_dir, '{}.json'.format(os.path.basename(tile)))
+
+
+# Closes an output tile and saves its running statistics
+def write_tile_stats(dst, stats):
+
+    dst.close()
+
+    os.makedirs(cn.tile_sidecar_dir, exist_ok=True)
+
+    with open(tile_stats_file(dst.name), 'w') as stats_file:
+        json.dump(stats, stats_file)
+
+
+# Running statistics of a tile, or None if there aren't any or the tile has been changed since they were saved
+def read_tile_stats(tile):
+
+    stats_file = tile_stats_file(tile)
+
+    if not os.path.exists(stats_file) or os.path.getmtime(stats_file) < os.path.getmtime(tile):
+        return None
+
+    with open(stats_file) as stats:
+        return json.load(stats)
+
+
+# Deletes a tile and its running statistics
+def delete_tile_and_stats(tile):
+
+    os.remove(tile)
+
+    if os.path.exists(tile_stats_file(tile)):
+        os.remove(tile_stats_file(tile))
+
+
+# Where the number of pixels with data in each row of a tile is saved
+def row_counts_file(tile):
+
+    return os.path.join(cn.tile_sidecar_dir, '{}.row_counts.npy'.format(os.path.basename(tile)))
+
+
+# Saves the number of pixels with data in each row of a tile, e.g., while the tile is being written.
+# Saved under a temporary name and then renamed so that row counts are never read while they're half-written.
+def write_row_counts(tile, row_counts):
+
+    os.makedirs(cn.tile_sidecar_dir, exist_ok=True)
+
+    counts_file = row_counts_file(tile)
+    temp_file = '{}.tmp.npy'.format(counts_file[:-len('.npy')])
+    np.save(temp_file, row_counts)
+    os.replace(temp_file, counts_file)
+
+
+# Number of pixels with data (not 0) in each row of a tile, e.g., loss pixels in a loss tile or
+# pixels in the model extent in a model extent tile. Stages use these to skip windows without any data.
+# If the row counts weren't saved when the tile was written, they're counted by reading the tile one block
+# at a time the first time they're needed and saved, so later stages that use the same tile don't read it again.
+# They're counted again if the tile has changed since they were saved.
+# Returns None if the tile doesn't exist or doesn't have the given number of rows,
+# in which case every window is treated as having data.
+def read_row_counts(tile, height=None):
+
+    if not os.path.exists(tile):
+        return None
+
+    if not row_counts_current(tile):
+        write_row_counts(tile, count_rows_with_data(tile))
+
+    return load_row_counts(tile, height)
+
+
+# Whether the row counts saved for a tile on the spot machine were saved since the tile was last changed
+def row_counts_current(tile):
+
+    counts_file = row_counts_file(tile)
+
+    return os.path.exists(counts_file) and os.path.getmtime(counts_file) >= os.path.getmtime(tile)
+
+
+# Loads the saved row counts of a tile. Returns None if they don't have the given number of rows.
+def load_row_counts(tile, height=None):
+
+    row_counts = np.load(row_counts_file(tile))
+
+    if (height is not None) and (len(row_counts) != height):
+        print_log("  {0} doesn't have {1} rows. Not using its row counts.".format(tile, height))
+        return None
+
+    return row_counts
+
+
+# Reads a tile one block at a time and counts the pixels with data in each row
+def count_rows_with_data(tile):
+
+    with rasterio.open(tile) as src:
+
+        row_counts = np.zeros(src.height, dtype='int32')
+
+        for idx, window in src.block_windows(1):
+            row_counts[window.row_off:window.row_off + window.height] += np.count_nonzero(src.read(1, window=window), axis=1)
+
+    print_log("  {0} of {1} rows of {2} have data".format(np.count_nonzero(row_counts), len(row_counts), os.path.basename(tile)))
+
+    return row_counts
+
+
+# Row counts of the model extent tile of a tile. Outputs that are limited to the model extent have nothing in windows
+# with no model extent pixels.
+# Uses the model extent tile if it's on the spot machine or, if it isn't, the row counts downloaded
+# with download_row_counts. Returns None if there are neither, in which case every window is treated as having data.
+def model_extent_row_counts(tile_id, sensit_type, height=None):
+
+    for tile in ['{0}_{1}_{2}.tif'.format(tile_id, cn.pattern_model_extent, sensit_type),
+                 tile_name(tile_id, cn.pattern_model_extent)]:
+
+        if os.path.exists(tile):
+            return read_row_counts(tile, height)
+
+        if os.path.exists(row_counts_file(tile)):
+            return load_row_counts(tile, height)
+
+    print_log("  No model extent tile or row counts for {}. Not skipping any windows.".format(tile_id))
+
+    return None
+
+
+# Where the row counts of a tile are kept on s3: next to the tile, in the same folder
+def s3_row_counts_path(s3_dir, tile):
+
+    return os.path.join(s3_dir, os.path.basename(row_counts_file(tile)))
+
+
+# Uploads of the row counts saved for a tile, if they're current, so that later stages can skip windows without
+# downloading the tile itself (see download_row_counts). An empty list if the tile has no current row counts.
+def row_counts_transfers(tile, upload_dir):
+
+    if not row_counts_current(tile):
+        return []
+
+    return [(row_counts_file(tile), s3_row_counts_path(upload_dir, tile))]
+
+
+# Downloads the row counts of a set of tiles from s3 (uploaded next to the tiles by upload_final_set or streaming_map)
+# instead of the tiles themselves, for stages that only need the row counts to skip windows (e.g., model extent).
+# Follows the same order as s3_file_download: sensitivity analysis tile first (if there can be one), then standard tile.
+# Tiles that are already on the spot machine use their own row counts, so theirs aren't downloaded.
+# Tiles without row counts on s3 (e.g., ones made before row counts were uploaded) have any row counts left
+# on the spot machine from earlier runs removed, so that every window is processed for them.
+def download_row_counts(source_dir, pattern, sensit_type, tile_id_list):
+
+    print_log("Downloading row counts of tiles in {}".format(source_dir))
+
+    os.makedirs(cn.tile_sidecar_dir, exist_ok=True)
+
+    transfers = []
+
+    for tile_id in tile_id_list:
+
+        local_tiles = [tile_name(tile_id, pattern)]
+        if sensit_type != 'std' and 'standard' in source_dir:
+            local_tiles.insert(0, '{0}_{1}.tif'.format(local_tiles[0][:-4], sensit_type))
+            source_dirs = [source_dir.replace('standard', sensit_type), source_dir]
+        else:
+            source_dirs = [source_dir]
+
+        if any(os.path.exists(local_tile) for local_tile in local_tiles):
+            continue
+
+        for local_tile in local_tiles:
+            if os.path.exists(row_counts_file(local_tile)):
+                os.remove(row_counts_file(local_tile))
+
+        for local_tile, s3_dir in zip(local_tiles, source_dirs):
+            if s3_object_info(s3_row_counts_path(s3_dir, local_tile)) is not None:
+                transfers.append((s3_row_counts_path(s3_dir, local_tile), row_counts_file(local_tile)))
+                break
+        else:
+            print_log("  No row counts on s3 for {0} {1}. Not skipping any windows for it.".format(tile_id, pattern))
+
+    s3_transfer_set(partial(s3_download, report=False), transfers)
+
+
+# Whether a window has any pixels with data according to a tile's row counts. Without row counts, every window may.
+def window_has_data(row_counts, window):
+
+    if row_counts is None:
         return True
+
+    return row_counts[window.row_off:window.row_off + window.height].any()
+
+
+# Opens an input tile that may not exist for a tile id (e.g., mangrove biomass). Returns None if the tile doesn't exist,
+# in which case read_window reads its windows as 0s.
+def open_optional_input(tile, tile_id):
+
+    try:
+        src = rasterio.open(tile)
+        print_log("  {0} found for {1}".format(tile, tile_id))
+        return src
+    except:
+        print_log("  No {0} found for {1}".format(tile, tile_id))
+        return None
+
+
+# Window of 0s of a given shape and dtype for inputs that don't exist. It's shared by all windows and inputs
+# with the same shape and dtype, is read-only and only takes up the memory of one value.
+@lru_cache(maxsize=None)
+def zero_window(shape, dtype):
+
+    return np.broadcast_to(np.zeros(1, dtype=dtype), shape)
+
+
+# Empty set of window buffers that read_window reuses from window to window, one per input and window shape
+def new_window_buffers():
+
+    return {}
+
+
+# Reads band 1 of a window of an input tile into one of a set of reusable window buffers, rather than into
+# a new array for every window. Inputs that don't exist (src is None) are read as the shared zero window of dtype.
+# The array that's returned is overwritten when the same input is next read with the same buffers, so anything that
+# keeps a window beyond the window it's processing must copy it, and windows must not be changed in place.
+def read_window(src, window, buffers, dtype='uint8'):
+
+    shape = (window.height, window.width)
+
+    if src is None:
+        return zero_window(shape, np.dtype(dtype))
+
+    # Windows of inputs that prefetch_windows has already read for this window
+    if 'prefetched' in buffers and buffers['prefetched'][0] is window and src.name in buffers['prefetched'][1]:
+        return buffers['prefetched'][1][src.name]
+
+    key = (src.name, shape)
+    if key not in buffers:
+        buffers[key] = np.empty(shape, dtype=src.dtypes[0])
+
+    return src.read(1, window=window, out=buffers[key])
+
+
+# Reusable array from a set of window buffers for calculating a window of an output in (e.g., with
+# evaluate_expression's out), rather than a new array for every window. Unless a fill value is given,
+# it still has the values of the last window it was used for, so all of its pixels have to be calculated.
+def window_buffer(buffers, name, window, dtype, fill=None):
+
+    key = (name, (window.height, window.width), np.dtype(dtype))
+    if key not in buffers:
+        buffers[key] = np.empty(key[1], dtype=key[2])
+
+    if fill is not None:
+        buffers[key].fill(fill)
+
+    return buffers[key]
+
+
+# Iterates over the (idx, window) pairs of a tile (e.g., from block_windows) while the inputs of the next few windows
+# (cn.window_prefetch_windows) are read on a small pool of threads (cn.window_read_threads), so that reading and
+# decompressing inputs overlaps with calculating the current window. GDAL doesn't hold the GIL while it reads.
+# When a window is yielded, all the inputs (srcs) that exist have been read for it, and read_window with the same
+# buffers returns those windows instead of reading them again. Each window of inputs is in its own set of buffers,
+# which is reused once the stage has moved on to the next window, as with read_window.
+# Each input is read by one thread at a time, since a rasterio dataset can't be read from several threads at once.
+def prefetch_windows(windows, srcs, buffers):
+
+    srcs = [src for src in srcs if src is not None]
+    src_locks = {src.name: threading.Lock() for src in srcs}
+    window_sets = [new_window_buffers() for i in range(cn.window_prefetch_windows + 1)]
+    read_executor = ThreadPoolExecutor(max_workers=cn.window_read_threads)
+    pending = []
+
+    # Reads a window of an input into the window's set of buffers
+    def read_input(src, window, window_set):
+        with src_locks[src.name]:
+            return src.name, read_window(src, window, window_set)
+
+    # Starts reading all inputs for a window
+    def start_reads(count, idx, window):
+        window_set = window_sets[count % len(window_sets)]
+        pending.append((idx, window, [read_executor.submit(read_input, src, window, window_set) for src in srcs]))
+
+    # Waits for the inputs of the oldest window being read and makes them available to read_window.
+    # Raises any error from reading them.
+    def finish_reads():
+        idx, window, reads = pending.pop(0)
+        buffers['prefetched'] = (window, dict(read.result() for read in reads))
+        return idx, window
+
+    try:
+        for count, (idx, window) in enumerate(windows):
+            start_reads(count, idx, window)
+            if len(pending) > cn.window_prefetch_windows:
+                yield finish_reads()
+
+        while pending:
+            yield finish_reads()
+
+    # Also runs if the stage stops iterating early, so that no reads are still running when the inputs are closed
+    finally:
+        for idx, window, reads in pending:
+            for read in reads:
+                read.cancel()
+        read_executor.shutdown(wait=True)
+        buffers.pop('prefetched', None)
+
+
+# Empty set of background writes for write_window_in_background
+def new_window_writer():
+
+    return {'executors': {}, 'pending': []}
+
+
+# Writes a window of a band 1 output tile on a background thread, so that compressing and writing it overlaps with
+# calculating the next windows. Each output has its own thread, so its windows are written in order.
+# The window is copied (converted to the tile's data type) first, so the array can be reused right away
+# (e.g., a window_buffer). If the tile's running statistics are given, the window is added to them,
+# as in write_window_with_stats. At most cn.window_write_queue windows wait to be written at a time.
+def write_window_in_background(writer, dst, array, window, stats=None):
+
+    array = np.array(array, dtype=dst.dtypes[0])
+
+    if dst.name not in writer['executors']:
+        writer['executors'][dst.name] = ThreadPoolExecutor(max_workers=1)
+
+    if stats is None:
+        write = writer['executors'][dst.name].submit(dst.write_band, 1, array, window=window)
     else:
-        # print_log("Tile {} is not empty".format(tile))
-        return False
+        write = writer['executors'][dst.name].submit(write_window_with_stats, dst, array, window, stats)
+
+    writer['pending'].append(write)
+
+    while len(writer['pending']) > cn.window_write_queue:
+        writer['pending'].pop(0).result()
+
+
+# Waits for all background writes to finish. Must be called before the output tiles are closed.
+# Raises any error from writing them.
+def finish_window_writes(writer):
+
+    try:
+        for write in writer['pending']:
+            write.result()
+
+    finally:
+        for executor in writer['executors'].values():
+            executor.shutdown(wait=True)
+        writer['pending'] = []
+
+
+# This version of checking for data in a tile is more robust.
+# Returns True if the tile has no data.
+# If the tile's running statistics were saved when it was written, they're used instead of reading the tile.
+# Otherwise, the tile's mask is read one block at a time, stopping at the first block with data,
+# rather than the mask for the whole tile being read at once.
+def check_for_data(tile):
+
+    stats = read_tile_stats(tile)
+    if stats is not None:
+        return stats['valid'] == 0
+
+    with rasterio.open(tile) as img:
+        for idx, window in img.block_windows(1):
+            if img.read_masks(1, window=window).any():
+                return False
+
+    return True
 
 
 def check_and_delete_if_empty(tile_id, output_pattern):
@@ -961,7 +2033,7 @@ def check_and_delete_if_empty(tile_id, output_pattern):
 
     if no_data:
         print_log("  No data found in {}. Deleting tile...".format(tile_name))
-        os.remove(tile_name)
+        delete_tile_and_stats(tile_name)
     else:
         print_log("  Data found in {}. Keeping tile to copy to s3...".format(tile_name))
 
@@ -1148,7 +2220,7 @@ def list_and_delete_blank_tiles():
 
 
 # Reformats the patterns for the 10x10 degree model output tiles for the aggregated output names
-def name_aggregated_output(pattern, thresh, sensit_type):
+def name_aggregated_output(pattern, thresh, sensit_type, resolution_name='0_4deg'):
 
     out_pattern = re.sub('ha_', '', pattern)
     # print out_pattern
@@ -1168,7 +2240,10 @@ def name_aggregated_output(pattern, thresh, sensit_type):
     # print sensit_type
     # print date_formatted
 
-    out_name = '{0}_tcd{1}_{2}_{3}_{4}'.format(out_pattern, thresh, cn.pattern_aggreg, sensit_type, date_formatted)
+    # The resolution in the name, e.g., 0_4deg for 0.04x0.04 degrees
+    aggreg_pattern = cn.pattern_aggreg.replace('0_4deg', resolution_name, 1)
+
+    out_name = '{0}_tcd{1}_{2}_{3}_{4}'.format(out_pattern, thresh, aggreg_pattern, sensit_type, date_formatted)
 
     # print out_name
 
@@ -1333,45 +2408,80 @@ def replace_output_dir_date(output_dir_list, run_date):
 
 
 # Adds various metadata tags to the raster
-def add_rasterio_tags(output_dst, sensit_type):
-
-    # based on https://rasterio.readthedocs.io/en/latest/topics/tags.html
+# Metadata tags that go on every model output written with rasterio
+def model_metadata_tags(sensit_type):
 
     if sensit_type == 'std':
         sensit_type = 'standard model'
 
-    output_dst.update_tags(
-        model_version=cn.version)
-    output_dst.update_tags(
-        date_created=date_today)
-    output_dst.update_tags(
-        model_type=sensit_type)
-    output_dst.update_tags(
-        originator='Global Forest Watch at the World Resources Institute')
-    output_dst.update_tags(
-        citation='Harris et al. 2021 Nature Climate Change https://www.nature.com/articles/s41558-020-00976-6')
-    output_dst.update_tags(
-        model_year_range='2001 through 20{}'.format(cn.loss_years)
-    )
+    return {'model_version': cn.version,
+            'date_created': date_today,
+            'model_type': sensit_type,
+            'originator': 'Global Forest Watch at the World Resources Institute',
+            'citation': 'Harris et al. 2021 Nature Climate Change https://www.nature.com/articles/s41558-020-00976-6',
+            'model_year_range': '2001 through 20{}'.format(cn.loss_years)}
+
+
+def add_rasterio_tags(output_dst, sensit_type):
+
+    # based on https://rasterio.readthedocs.io/en/latest/topics/tags.html
+    output_dst.update_tags(**model_metadata_tags(sensit_type))
 
     return output_dst
 
 
+# Metadata tags that go on every model output tagged after it was written
+def universal_metadata_tags(sensit_type):
+
+    return {'model_version': cn.version,
+            'date_created': date_today,
+            'model_type': sensit_type,
+            'originator': 'Global Forest Watch at the World Resources Institute',
+            'model_year_range': '2001 through 20{}'.format(cn.loss_years)}
+
+
+# Adds metadata tags to an existing raster in place, through the GDAL bindings rather than a gdal_edit.py process.
+# Tags that are already on the raster are kept unless they're replaced. Optionally sets the NoData value, too.
+# Returns False if the raster couldn't be opened (e.g., it doesn't exist).
+def set_metadata_tags(output_raster, tags, nodata=None):
+
+    dataset = gdal.Open(output_raster, gdal.GA_Update)
+
+    if dataset is None:
+        print_log("  Could not open {} to add metadata tags".format(output_raster))
+        return False
+
+    for key, value in tags.items():
+        dataset.SetMetadataItem(key, str(value))
+
+    if nodata is not None:
+        dataset.GetRasterBand(1).SetNoDataValue(nodata)
+
+    # Closing the dataset writes the tags
+    dataset = None
+
+    return True
+
+
+# Adds the same metadata tags to a set of rasters, e.g., one output type for all tiles
+def set_metadata_tags_on_set(output_rasters, tags):
+
+    print_log("Adding metadata tags to {} rasters".format(len(output_rasters)))
+
+    for output_raster in output_rasters:
+        set_metadata_tags(output_raster, tags)
+
+
 def add_universal_metadata_tags(output_raster, sensit_type):
 
     print_log("Adding universal metadata tags to", output_raster)
 
-    cmd = ['gdal_edit.py', '-mo', 'model_version={}'.format(cn.version),
-           '-mo', 'date_created={}'.format(date_today),
-           '-mo', 'model_type={}'.format(sensit_type),
-           '-mo', 'originator=Global Forest Watch at the World Resources Institute',
-           '-mo', 'model_year_range=2001 through 20{}'.format(cn.loss_years),
-           output_raster]
-    log_subprocess_output_full(cmd)
+    set_metadata_tags(output_raster, universal_metadata_tags(sensit_type))
 
 
 # Adds metadata tags to raster.
 # Certain tags are included for all rasters, while other tags can be customized for each input set.
+# metadata_list has the dataset-specific tags as 'key=value' strings.
 def add_metadata_tags(tile_id, output_pattern, sensit_type, metadata_list):
 
     output_raster = '{0}_{1}.tif'.format(tile_id, output_pattern)
@@ -1379,16 +2489,11 @@ def add_metadata_tags(tile_id, output_pattern, sensit_type, metadata_list):
     print_log("Adding metadata tags to", output_raster)
 
     # Universal metadata tags
-    cmd = ['gdal_edit.py', '-mo', 'model_version={}'.format(cn.version),
-           '-mo', 'date_created={}'.format(date_today),
-           '-mo', 'model_type={}'.format(sensit_type),
-           '-mo', 'originator=Global Forest Watch at the World Resources Institute',
-           '-mo', 'model_year_range=2001 through 20{}'.format(cn.loss_years)]
+    tags = universal_metadata_tags(sensit_type)
 
     # Metadata tags specifically for this dataset
     for metadata in metadata_list:
-        cmd += ['-mo', metadata]
-
-    cmd += [output_raster]
+        key, value = metadata.split('=', 1)
+        tags[key] = value
 
-    log_subprocess_output_full(cmd)
\ No newline at end of file
+    set_metadata_tags(output_raster, tags)